@@ -0,0 +1,544 @@
+# benchmarks/desempenho.py - Benchmarks dos níveis com comparação contra referências em JSON
+#
+# Micro-benchmarks (um subprocesso por grupo, sem estado compartilhado):
+#   protocolo   codificação/decodificação dos quadros de 52 bytes
+#   registro    registrar_log_* (CSV) e registros binários nos escritores em grupo
+#   cauda       leitura da cauda dos dados brutos (ler_cauda_linhas e cauda
+#               inicial dos seguidores) em arquivos de --tamanhos-mb
+#   analise     tempo de um ciclo de analisar_e_registrar com amostras novas
+#   yaml        leitura e escrita (atômica) do configuracoes.yaml
+#   dashboard   latência das rotas do Flask pelo test client (fria e com cache)
+# Macro-benchmark:
+#   pipeline    init.py (três processos) recebendo uplinks de uma frota
+#               simulada (nivel1_2/simulador.py) em localhost: perda e
+#               latência até o armazenamento, tempo de pacote e de ciclo
+#
+# Tudo roda em uma cópia temporária do projeto (sem os dados), com a
+# configuração ajustada: os arquivos e as portas reais não são tocados. Os
+# resultados podem ser salvos como referência (--salvar, em
+# benchmarks/referencias/<maquina>.json); cada execução é comparada com a
+# referência e termina com código 1 se alguma medida piorar além da
+# tolerância. Referências só são comparáveis na mesma máquina.
+#
+# Exemplos:
+#   python benchmarks/desempenho.py --salvar
+#   python benchmarks/desempenho.py --grupos protocolo,registro
+#   python benchmarks/desempenho.py --grupos cauda --tamanhos-mb 1,10,100,1000,10000
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import signal
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+DIR_RAIZ = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DIR_REFERENCIAS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'referencias')
+
+GRUPOS = ('protocolo', 'registro', 'cauda', 'analise', 'yaml', 'dashboard', 'pipeline')
+TOLERANCIA_PADRAO = 0.15     # piora relativa aceita antes de acusar regressão
+TAMANHOS_PADRAO_MB = (1, 10, 100)
+IGNORAR_NA_COPIA = ('*.csv', '*.csv.*', '*.bin', '*.bin.*', '*.gz', '*.idx', '*.shm', '*.sock', '*.lock',
+                    'metricas_*.json', 'perfis', '__pycache__', '.git', 'benchmarks', 'Firmware_Socket_UDP')
+
+MENOR = 'menor'   # melhor quando diminui (tempos)
+MAIOR = 'maior'   # melhor quando aumenta (vazões)
+
+
+# --- Medição ---
+def medir(funcao, operacoes=1, repeticoes=7, aquecimento=1):
+    """Mediana do tempo por operação (s) de 'repeticoes' execuções de funcao(), que faz 'operacoes' operações."""
+    for _ in range(aquecimento):
+        funcao()
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        funcao()
+        tempos.append((time.perf_counter() - inicio) / operacoes)
+    return statistics.median(tempos)
+
+
+def resultado(valor, unidade, melhor=MENOR, folga=0.0):
+    """'folga': piora absoluta sempre aceita (resolução da medida), para valores perto de zero."""
+    return {'valor': valor, 'unidade': unidade, 'melhor': melhor, 'folga': folga}
+
+
+def us(segundos):
+    return resultado(segundos * 1e6, 'us/op')
+
+
+def ms(segundos):
+    return resultado(segundos * 1e3, 'ms')
+
+
+@contextlib.contextmanager
+def silencio():
+    """Descarta os prints dos níveis durante a medição."""
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+
+
+# --- Área de trabalho ---
+def porta_livre(tipo=socket.SOCK_DGRAM):
+    with socket.socket(socket.AF_INET, tipo) as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def portas_consecutivas(quantidade):
+    """Primeira de 'quantidade' portas UDP livres consecutivas."""
+    while True:
+        inicio = porta_livre()
+        if inicio + quantidade >= 65535:
+            continue
+        sockets = []
+        try:
+            for porta in range(inicio, inicio + quantidade):
+                s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sockets.append(s)
+                s.bind(('127.0.0.1', porta))
+            return inicio
+        except OSError:
+            continue
+        finally:
+            for s in sockets:
+                s.close()
+
+
+def preparar_copia(destino):
+    """Copia o projeto sem os dados e devolve o caminho do configuracoes.yaml da cópia."""
+    shutil.copytree(DIR_RAIZ, destino, ignore=shutil.ignore_patterns(*IGNORAR_NA_COPIA))
+    return os.path.join(destino, 'nivel4', 'configuracoes.yaml')
+
+
+def ajustar_config(caminho, modificar):
+    import yaml
+    with open(caminho, encoding='utf-8') as f:
+        dados = yaml.safe_load(f) or {}
+    modificar(dados)
+    with open(caminho, 'w', encoding='utf-8') as f:
+        yaml.dump(dados, f, default_flow_style=False, sort_keys=False)
+
+
+def importar_niveis(raiz):
+    for nivel in ('nivel4', 'nivel3', 'nivel5', 'nivel6'):
+        caminho = os.path.join(raiz, nivel)
+        if caminho not in sys.path: sys.path.insert(0, caminho)
+
+
+def preencher_brutos(raiz, config, linhas):
+    """Dados brutos sintéticos (CSV) com 'linhas' amostras de 4 nós, terminando agora."""
+    from telemetria import caminhos_dados
+    caminhos = caminhos_dados(config)
+    agora = time.time()
+    with open(caminhos['rede'], 'w', encoding='utf-8') as rede, \
+            open(caminhos['aplicacao'], 'w', encoding='utf-8') as app:
+        rede.write("Timestamp,RSSI_Downlink,Status,No,RSSI_Uplink,RTT_ms,Seq_Down\n")
+        app.write("Timestamp,Luminosidade,No\n")
+        for i in range(linhas):
+            ts = datetime.fromtimestamp(agora - (linhas - i) * 0.1).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+            no = 1 + i % 4
+            rede.write(f"{ts},{-60 - i % 20:.2f},Sucesso,{no},,{1 + i % 7:.2f},{i % 256}\n")
+            app.write(f"{ts},{400 + i % 300},{no}\n")
+    return caminhos
+
+
+# --- Micro-benchmarks (rodam no subprocesso do grupo) ---
+def grupo_protocolo(raiz, args):
+    from protocolo import CodificadorDownlink, RSSI_DBM, codificar_uplink, decodificar_uplink
+    n = 20000
+    quadros = [bytes(codificar_uplink(1 + i % 8, i, i % 1024, rssi_dl=i % 256)) for i in range(1024)]
+    visoes = [memoryview(q) for q in quadros]
+    codificador = CodificadorDownlink()
+
+    def decodificar():
+        for i in range(n):
+            p = decodificar_uplink(visoes[i & 1023])
+            RSSI_DBM[p.rssi_dl]
+    return {
+        'protocolo.decodificar_uplink': us(medir(decodificar, n)),
+        'protocolo.codificar_downlink': us(medir(lambda: [codificador.codificar(i % 8, i % 256, 500, 200)
+                                                         for i in range(n)], n)),
+        'protocolo.codificar_uplink': us(medir(lambda: [codificar_uplink(1, i, i % 1024) for i in range(n)], n)),
+    }
+
+
+def grupo_registro(raiz, args):
+    from base import registrar_log_aplicacao, registrar_log_rede, CABECALHO_APLICACAO, CABECALHO_REDE
+    from registro import criar_escritor
+    from armazenamento_binario import EscritorBinario
+    diretorio = tempfile.mkdtemp(dir=os.path.join(raiz, 'nivel4'))
+    n = 20000
+    rede = criar_escritor(os.path.join(diretorio, 'rede.csv'), CABECALHO_REDE)
+    app = criar_escritor(os.path.join(diretorio, 'aplicacao.csv'), CABECALHO_APLICACAO)
+    binario = EscritorBinario(os.path.join(diretorio, 'dados.bin'))
+    ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+
+    # Inclui a descarga: o custo de disco é dividido entre as linhas, como no gateway
+    def csv_rede():
+        for i in range(n):
+            registrar_log_rede(rede, ts, "-61.50", 'Sucesso', 1 + i % 8, -70.0, 0.0042, i % 256)
+        rede.descarregar()
+
+    def csv_aplicacao():
+        for i in range(n):
+            registrar_log_aplicacao(app, ts, i % 1024, 1 + i % 8)
+        app.descarregar()
+
+    def registros_binarios():
+        agora_ms = time.time() * 1000
+        for i in range(n):
+            binario.registrar(agora_ms + i, 1 + i % 8, -61.5, i % 1024, 0, i % 256, i, 'Sucesso', -70.0, 0.0042)
+        binario.descarregar()
+    try:
+        return {'registro.csv_rede': us(medir(csv_rede, n, repeticoes=5)),
+                'registro.csv_aplicacao': us(medir(csv_aplicacao, n, repeticoes=5)),
+                'registro.binario': us(medir(registros_binarios, n, repeticoes=5))}
+    finally:
+        for escritor in (rede, app, binario):
+            escritor.fechar()
+        shutil.rmtree(diretorio, ignore_errors=True)
+
+
+def _arquivo_com_tamanho(caminho, tamanho_mb, cabecalho, linha):
+    """Cria o CSV dobrando o conteúdo até 'tamanho_mb' (rápido mesmo para vários GB)."""
+    alvo = int(tamanho_mb * 1024 * 1024)
+    bloco = (linha * max(1, (1024 * 1024) // len(linha))).encode()
+    with open(caminho, 'wb') as f:
+        f.write(cabecalho.encode())
+        escrito = len(cabecalho)
+        while escrito < alvo:
+            parte = bloco[:alvo - escrito] if alvo - escrito < len(bloco) else bloco
+            # Corta sempre em fim de linha
+            parte = parte[:parte.rfind(b'\n') + 1] or bloco
+            f.write(parte)
+            escrito += len(parte)
+
+
+def grupo_cauda(raiz, args):
+    from telemetria import ler_cauda_linhas, SeguidorCSV
+    resultados = {}
+    diretorio = tempfile.mkdtemp(dir=os.path.join(raiz, 'nivel4'))
+    linha = f"{datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]},512,3\n"
+    try:
+        for tamanho in args.tamanhos_mb:
+            caminho = os.path.join(diretorio, f'aplicacao_{tamanho}mb.csv')
+            _arquivo_com_tamanho(caminho, tamanho, "Timestamp,Luminosidade,No\n", linha)
+            rotulo = f"{tamanho:g}mb"
+            resultados[f'cauda.ler_cauda_linhas_1000.{rotulo}'] = ms(medir(lambda: ler_cauda_linhas(caminho, 1000)))
+
+            def seguidor():
+                s = SeguidorCSV(caminho, 'aplicacao', 1000)
+                s.novas_amostras()
+                s.fechar()
+            resultados[f'cauda.seguidor_inicial_1000.{rotulo}'] = ms(medir(seguidor))
+            os.remove(caminho)
+    finally:
+        shutil.rmtree(diretorio, ignore_errors=True)
+    return resultados
+
+
+def grupo_analise(raiz, args):
+    import analise
+    config = analise.carregar_configuracoes()
+    caminhos = preencher_brutos(raiz, config, 100000)
+    with silencio():
+        motor = analise.MotorAnalise(config)
+        analise.analisar_e_registrar(motor)    # consome a cauda inicial
+
+    novas = 1000   # amostras novas por fluxo a cada ciclo (~1 ciclo de uma frota grande)
+    ts = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    bloco_rede = ''.join(f"{ts},{-60 - i % 20:.2f},Sucesso,{1 + i % 4},,{1 + i % 7:.2f},{i % 256}\n"
+                         for i in range(novas))
+    bloco_app = ''.join(f"{ts},{400 + i % 300},{1 + i % 4}\n" for i in range(novas))
+    tempos = []
+    try:
+        for _ in range(10):
+            with open(caminhos['rede'], 'a', encoding='utf-8') as f:
+                f.write(bloco_rede)
+            with open(caminhos['aplicacao'], 'a', encoding='utf-8') as f:
+                f.write(bloco_app)
+            with silencio():
+                inicio = time.perf_counter()
+                analise.analisar_e_registrar(motor)
+                tempos.append(time.perf_counter() - inicio)
+        with silencio():
+            inicio = time.perf_counter()
+            analise.analisar_e_registrar(motor)
+            ocioso = time.perf_counter() - inicio
+    finally:
+        motor.fechar()
+    return {'analise.ciclo_1000_amostras': ms(statistics.median(tempos)), 'analise.ciclo_sem_amostras': ms(ocioso)}
+
+
+def grupo_yaml(raiz, args):
+    from configuracao import ConfiguracaoCompartilhada, salvar_yaml_seguro, descongelar
+    caminho = os.path.join(raiz, 'nivel4', 'configuracoes.yaml')
+    configuracao = ConfiguracaoCompartilhada(caminho, usar_inotify=False)
+    dados = descongelar(configuracao.obter())
+    contador = [0]
+
+    def modificar(d):
+        contador[0] += 1
+        d.setdefault('nivel6', {})['limiar_atencao'] = 200 + contador[0] % 100
+    with silencio():
+        resultados = {'yaml.carregar': ms(medir(configuracao.recarregar, repeticoes=21)),
+                      'yaml.obter_em_cache': us(medir(lambda: [configuracao.obter() for _ in range(10000)], 10000)),
+                      'yaml.salvar': ms(medir(lambda: salvar_yaml_seguro(caminho, dados), repeticoes=21)),
+                      'yaml.atualizar': ms(medir(lambda: configuracao.atualizar(modificar), repeticoes=21))}
+    configuracao.fechar()
+    return resultados
+
+
+def grupo_dashboard(raiz, args):
+    try:
+        import flask  # noqa: F401
+    except ImportError:
+        return {'_ignorado': 'flask não instalado'}
+    os.chdir(os.path.join(raiz, 'nivel6'))
+    with silencio():
+        from configuracao import obter_configuracao
+        preencher_brutos(raiz, obter_configuracao(os.path.join(raiz, 'nivel4', 'configuracoes.yaml')).obter(), 100000)
+        import app as webapp
+    cliente = webapp.app.test_client()
+    rotas = {'luminosidade': '/api/luminosidade', 'luminosidade_binario': '/api/luminosidade?formato=binario&pontos=1000',
+             'estatisticas': '/api/estatisticas',
+             'historico_24h': '/api/historico?fluxo=aplicacao&pontos=1000', 'metrics': '/metrics'}
+    resultados = {}
+    for nome, rota in rotas.items():
+        with silencio():
+            inicio = time.perf_counter()
+            resposta = cliente.get(rota)
+            resultados[f'dashboard.{nome}.fria'] = ms(time.perf_counter() - inicio)
+            if resposta.status_code >= 500:
+                raise RuntimeError(f"{rota} respondeu {resposta.status_code}")
+            resultados[f'dashboard.{nome}.quente'] = ms(medir(lambda: [cliente.get(rota) for _ in range(50)], 50))
+    return resultados
+
+
+MICRO = {'protocolo': grupo_protocolo, 'registro': grupo_registro, 'cauda': grupo_cauda,
+         'analise': grupo_analise, 'yaml': grupo_yaml, 'dashboard': grupo_dashboard}
+
+
+def executar_grupo_interno(args):
+    """Modo --interno: roda um grupo na cópia indicada e imprime o JSON na última linha."""
+    importar_niveis(args.raiz)
+    resultados = MICRO[args.interno](args.raiz, args)
+    sys.stdout.flush()
+    print(json.dumps(resultados))
+
+
+def executar_micro(grupo, raiz, args):
+    comando = [sys.executable, os.path.abspath(__file__), '--interno', grupo, '--raiz', raiz,
+               '--tamanhos-mb', ','.join(f'{t:g}' for t in args.tamanhos_mb)]
+    processo = subprocess.run(comando, cwd=raiz, capture_output=True, text=True)
+    if processo.returncode != 0:
+        raise RuntimeError(processo.stderr.strip().splitlines()[-1] if processo.stderr.strip() else
+                           f"código {processo.returncode}")
+    return json.loads(processo.stdout.strip().splitlines()[-1])
+
+
+# --- Macro-benchmark ---
+def executar_pipeline(raiz, args):
+    """init.py com a frota simulada enviando uplinks por --duracao segundos."""
+    caminho_config = os.path.join(raiz, 'nivel4', 'configuracoes.yaml')
+    porta_base = porta_livre()
+    porta_nos = portas_consecutivas(args.nos)
+
+    def modificar(dados):
+        dados['nivel1'].update(ip='127.0.0.1', porta=porta_base,
+                               nos=[{'id': 1 + i, 'ip': '127.0.0.1', 'porta': porta_nos + i} for i in range(args.nos)])
+        dados['nivel3']['ligado'] = True
+        dados['nivel4']['formato'] = 'binario'   # guarda (nó, seq_up) para casar os uplinks
+        dados['nivel5'].update(ativado=True, intervalo_analise_s=1)
+        dados.setdefault('perfil', {})['ligado'] = False
+    ajustar_config(caminho_config, modificar)
+
+    registro = os.path.join(raiz, 'envios.bin')
+    simulador = os.path.join(DIR_RAIZ, 'nivel1_2', 'simulador.py')
+    saida = open(os.path.join(raiz, 'pipeline.log'), 'w')
+    env = dict(os.environ, TWSN_PERFIL='')
+    init = subprocess.Popen([sys.executable, '-u', 'init.py'], cwd=raiz, stdout=saida, stderr=subprocess.STDOUT,
+                            env=env, start_new_session=True)
+    try:
+        time.sleep(args.aquecimento)
+        frota = subprocess.run([sys.executable, simulador, 'frota', '--nos', str(args.nos),
+                                '--porta-inicial', str(porta_nos), '--base-porta', str(porta_base),
+                                '--taxa', str(args.taxa), '--duracao', str(args.duracao),
+                                '--relatorio-s', str(args.duracao + 1), '--registro', registro],
+                               capture_output=True, text=True)
+        if frota.returncode != 0:
+            raise RuntimeError(f"simulador: {frota.stderr.strip()}")
+        time.sleep(args.aquecimento)   # o gateway descarrega os buffers e o nivel5 fecha um ciclo
+    finally:
+        # SIGINT no grupo: o init.py encerra os filhos como no Ctrl+C e os buffers vão para o disco
+        os.killpg(init.pid, signal.SIGINT)
+        try:
+            init.wait(15)
+        except subprocess.TimeoutExpired:
+            os.killpg(init.pid, signal.SIGKILL)
+        saida.close()
+
+    importar_niveis(raiz)
+    sys.path.insert(0, os.path.join(DIR_RAIZ, 'nivel1_2'))
+    from simulador import medir_latencia
+    from metricas import ler_publicadas
+    latencia = medir_latencia(registro, os.path.join(raiz, 'nivel4', 'dados_brutos.bin'))
+    if latencia is None:
+        raise RuntimeError(f"nenhum uplink chegou ao armazenamento (veja {os.path.join(raiz, 'pipeline.log')})")
+    resultados = {
+        'pipeline.vazao_armazenada': resultado(latencia['armazenados'] / args.duracao, 'pacotes/s', MAIOR),
+        'pipeline.perda': resultado(latencia['perda_pct'], '%', folga=0.5),
+        # O armazenamento guarda o instante com resolução de 1 ms
+        'pipeline.latencia_armazenamento.p50': resultado(latencia['p50_ms'], 'ms', folga=1.0),
+        'pipeline.latencia_armazenamento.p99': resultado(latencia['p99_ms'], 'ms', folga=1.0),
+    }
+    # Médias dos histogramas publicados pelos processos (ainda legíveis logo após o encerramento)
+    medias = {'twsn_processamento_pacote_segundos': ('pipeline.processamento_pacote', 1e6, 'us/op'),
+              'twsn_ciclo_analise_segundos': ('pipeline.ciclo_analise', 1e3, 'ms')}
+    for retrato in ler_publicadas(os.path.join(raiz, 'nivel4')):
+        for familia in retrato['familias']:
+            if familia['nome'] in medias:
+                series = familia['series']
+                total = sum(serie['total'] for serie in series)
+                if total:
+                    nome, escala, unidade = medias[familia['nome']]
+                    resultados[nome] = resultado(sum(serie['soma'] for serie in series) / total * escala, unidade)
+    return resultados
+
+
+# --- Referências ---
+def maquina():
+    return {'nome': platform.node() or 'local', 'sistema': platform.platform(), 'python': platform.python_version(),
+            'cpus': os.cpu_count(), 'processador': platform.processor() or platform.machine()}
+
+
+def commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DIR_RAIZ, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def comparar(resultados, referencia, tolerancia):
+    """[(nome, atual, referência, variação relativa, regressão?)] das medidas presentes nas duas execuções."""
+    linhas = []
+    for nome, atual in sorted(resultados.items()):
+        anterior = referencia.get('resultados', {}).get(nome)
+        if anterior is None:
+            linhas.append((nome, atual, None, None, False))
+            continue
+        diferenca = atual['valor'] - anterior['valor']
+        piora = diferenca if atual.get('melhor', MENOR) == MENOR else -diferenca
+        variacao = diferenca / abs(anterior['valor']) if anterior['valor'] else None
+        regressao = piora > atual.get('folga', 0.0) and (variacao is None or piora / abs(anterior['valor']) > tolerancia)
+        linhas.append((nome, atual, anterior, variacao, regressao))
+    return linhas
+
+
+def imprimir(linhas):
+    print(f"\n{'medida':52s} {'atual':>14s} {'referência':>14s} {'variação':>9s}")
+    for nome, atual, anterior, variacao, regressao in linhas:
+        texto_ref = f"{anterior['valor']:.3f}" if anterior else '-'
+        texto_var = f"{variacao * 100:+.1f}%" if variacao is not None else ''
+        print(f"{nome:52s} {atual['valor']:10.3f} {atual['unidade']:>3s} {texto_ref:>14s} {texto_var:>9s}"
+              + ("  REGRESSÃO" if regressao else ""))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks do projeto com comparação contra referências em JSON.")
+    parser.add_argument('--grupos', default=','.join(GRUPOS), help=f"lista separada por vírgulas de {', '.join(GRUPOS)}")
+    parser.add_argument('--referencia', help="JSON de referência (padrão: benchmarks/referencias/<maquina>.json)")
+    parser.add_argument('--salvar', action='store_true', help="grava os resultados como a nova referência")
+    parser.add_argument('--saida', help="grava também os resultados desta execução neste JSON")
+    parser.add_argument('--tolerancia', type=float, default=TOLERANCIA_PADRAO,
+                        help="piora relativa aceita (0.15 = 15%%) antes de acusar regressão")
+    parser.add_argument('--tamanhos-mb', default=','.join(str(t) for t in TAMANHOS_PADRAO_MB),
+                        help="tamanhos dos arquivos do grupo 'cauda' (ex.: 1,10,100,1000,10000 vai até 10 GB)")
+    parser.add_argument('--nos', type=int, default=20, help="nós simulados no pipeline")
+    parser.add_argument('--taxa', type=float, default=20.0, help="uplinks espontâneos por segundo por nó no pipeline")
+    parser.add_argument('--duracao', type=float, default=20.0, help="segundos de tráfego no pipeline")
+    parser.add_argument('--aquecimento', type=float, default=3.0, help="segundos antes e depois do tráfego")
+    parser.add_argument('--manter', action='store_true', help="não apaga a cópia temporária do projeto")
+    parser.add_argument('--interno', choices=tuple(MICRO), help=argparse.SUPPRESS)
+    parser.add_argument('--raiz', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.tamanhos_mb = [float(t) for t in args.tamanhos_mb.split(',') if t.strip()]
+
+    if args.interno:
+        executar_grupo_interno(args)
+        return
+
+    grupos = [g.strip() for g in args.grupos.split(',') if g.strip()]
+    desconhecidos = [g for g in grupos if g not in GRUPOS]
+    if desconhecidos:
+        parser.error(f"grupos desconhecidos: {', '.join(desconhecidos)}")
+
+    resultados, falhas = {}, {}
+    temporario = tempfile.mkdtemp(prefix='twsn_bench_')
+    try:
+        for grupo in grupos:
+            # Uma cópia limpa por grupo: os dados de um não influenciam o outro
+            raiz = os.path.join(temporario, grupo)
+            preparar_copia(raiz)
+            print(f"[{grupo}] executando...", flush=True)
+            inicio = time.monotonic()
+            try:
+                medidas = executar_pipeline(raiz, args) if grupo == 'pipeline' else executar_micro(grupo, raiz, args)
+            except Exception as e:
+                falhas[grupo] = str(e)
+                print(f"[{grupo}] ERRO: {e}")
+                continue
+            if '_ignorado' in medidas:
+                print(f"[{grupo}] ignorado: {medidas['_ignorado']}")
+                continue
+            resultados.update(medidas)
+            print(f"[{grupo}] {len(medidas)} medidas em {time.monotonic() - inicio:.1f}s")
+    finally:
+        if args.manter:
+            print(f"Cópia mantida em {temporario}")
+        else:
+            shutil.rmtree(temporario, ignore_errors=True)
+
+    execucao = {'versao': 1, 'data': datetime.now().isoformat(timespec='seconds'), 'commit': commit_atual(),
+                'maquina': maquina(), 'tolerancia': args.tolerancia, 'resultados': resultados}
+    caminho_referencia = args.referencia or os.path.join(DIR_REFERENCIAS, f"{maquina()['nome']}.json")
+    referencia = {}
+    if os.path.exists(caminho_referencia):
+        with open(caminho_referencia, encoding='utf-8') as f:
+            referencia = json.load(f)
+        print(f"\nReferência: {caminho_referencia} (commit {referencia.get('commit')}, {referencia.get('data')})")
+    linhas = comparar(resultados, referencia, args.tolerancia)
+    imprimir(linhas)
+
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            json.dump(execucao, f, indent=2)
+    if args.salvar:
+        # Mantém as medidas de grupos que não rodaram agora
+        execucao['resultados'] = {**referencia.get('resultados', {}), **resultados}
+        os.makedirs(os.path.dirname(os.path.abspath(caminho_referencia)), exist_ok=True)
+        with open(caminho_referencia, 'w', encoding='utf-8') as f:
+            json.dump(execucao, f, indent=2)
+        print(f"\nReferência salva em {caminho_referencia}")
+
+    regressoes = [linha[0] for linha in linhas if linha[4]]
+    if regressoes:
+        print(f"\n{len(regressoes)} regressões acima de {args.tolerancia:.0%}: {', '.join(regressoes)}")
+    if falhas:
+        print(f"\nGrupos com erro: {', '.join(f'{g} ({e})' for g, e in falhas.items())}")
+    sys.exit(1 if regressoes or falhas else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,32 @@
-# init.py (Versão Simplificada e Estável)
+# init.py - Inicializa o gateway (nivel3), a análise (nivel5) e o dashboard (nivel6)
+#
+# Dois modos:
+#   python init.py              um processo por nível (padrão). Um filho que
+#                               morre é reiniciado sozinho, com espera crescente
+#                               entre as tentativas; os outros continuam rodando.
+#   python init.py --unificado  os três níveis em um único processo (uma thread
+#                               cada). As amostras do gateway chegam à análise e
+#                               ao dashboard pelo barramento em memória
+#                               (nivel4/barramento.py), sem verificar os arquivos,
+#                               e a configuração é um único objeto compartilhado.
+#
+#   --perfil [amostragem|cprofile] liga o perfil contínuo (nivel4/perfil.py) em
+#                               todos os níveis; perfis sob demanda com SIGUSR2
+#                               ao processo ou POST /api/perfil no dashboard.
 
+import argparse
 import subprocess
 import sys
 import os
+import threading
 import time
 
 # --- Bloco de Compatibilidade de Cores para Windows ---
 if sys.platform == "win32":
     os.system('')
 
+DIR_RAIZ = os.path.dirname(os.path.abspath(__file__))
+
 # --- Configuração dos Scripts a Serem Executados ---
 SCRIPTS = [
     {
@@ -33,70 +51,201 @@ SCRIPTS = [
 
 RESET_COLOR = "\033[0m"
 
-def main():
-    processes = []
-    print("=" * 50)
-    print("INICIANDO TODOS OS SCRIPTS DO PROJETO...")
-    print("Pressione Ctrl+C para encerrar todos os processos.")
-    print("=" * 50)
+# Reinício dos filhos: a espera dobra a cada queda (até o máximo) e volta ao
+# valor inicial quando o filho fica de pé por TEMPO_ESTAVEL_S
+ESPERA_INICIAL_S = 1.0
+ESPERA_MAXIMA_S = 60.0
+TEMPO_ESTAVEL_S = 60.0
 
-    for script_info in SCRIPTS:
-        script_path = script_info["path"]
-        script_name = script_info["name"]
-        script_color = script_info["color"]
-        script_cwd = script_info["cwd"]
-        
-        full_script_path = os.path.join(script_cwd, script_path)
-        if not os.path.exists(full_script_path):
-            print(f"{script_color}[{script_name}]{RESET_COLOR} ERRO: Script não encontrado em '{full_script_path}'. Pulando.")
-            continue
-            
-        print(f"{script_color}[{script_name}]{RESET_COLOR} Iniciando script em '{script_cwd}'...")
 
+class Filho:
+    """Um nível supervisionado: processo (modo padrão) ou thread (modo unificado)."""
+
+    def __init__(self, info, iniciar):
+        self.info = info
+        self._iniciar = iniciar
+        self.execucao = None
+        self.espera = ESPERA_INICIAL_S
+        self.proxima_tentativa = 0.0
+        self.iniciado_em = 0.0
+        self.reinicios = 0
+
+    @property
+    def prefixo(self):
+        return f"{self.info['color']}[{self.info['name']}]{RESET_COLOR}"
+
+    def em_execucao(self):
+        if self.execucao is None:
+            return False
+        if isinstance(self.execucao, subprocess.Popen):
+            return self.execucao.poll() is None
+        return self.execucao.is_alive()
+
+    def iniciar(self):
         try:
-            # A flag "-u" (unbuffered) ainda é uma boa prática para garantir que a saída não fique presa.
-            command = [sys.executable, "-u", script_path]
-
-            # Esta é a parte crucial: sem stdout/stderr=PIPE, os scripts filhos
-            # imprimirão diretamente no terminal, evitando o bloqueio do buffer.
-            process = subprocess.Popen(
-                command,
-                cwd=script_cwd
-            )
-            processes.append((process, script_name, script_color))
-            
+            self.execucao = self._iniciar()
+            self.iniciado_em = time.monotonic()
         except Exception as e:
-            print(f"{script_color}[{script_name}]{RESET_COLOR} ERRO ao iniciar o script: {e}")
+            print(f"{self.prefixo} ERRO ao iniciar: {e}")
+            self.execucao = None
+            self._agendar_reinicio(time.monotonic())
 
-    # Loop para monitorar e aguardar o encerramento
+    def _agendar_reinicio(self, agora):
+        print(f"{self.prefixo} Nova tentativa em {self.espera:.1f}s.")
+        self.proxima_tentativa = agora + self.espera
+        self.espera = min(self.espera * 2, ESPERA_MAXIMA_S)
+
+    def verificar(self, agora):
+        """Reinicia o filho se ele caiu e a espera já passou."""
+        if self.em_execucao():
+            if agora - self.iniciado_em >= TEMPO_ESTAVEL_S:
+                self.espera = ESPERA_INICIAL_S
+            return
+        if self.execucao is not None:
+            codigo = self.execucao.poll() if isinstance(self.execucao, subprocess.Popen) else None
+            print(f"\n{self.prefixo} ATENÇÃO: encerrou" + (f" com código {codigo}." if codigo is not None else "."))
+            self.execucao = None
+            self._agendar_reinicio(agora)
+        elif agora >= self.proxima_tentativa:
+            self.reinicios += 1
+            print(f"{self.prefixo} Reiniciando (tentativa {self.reinicios})...")
+            self.iniciar()
+
+
+def supervisionar(filhos):
+    """Acompanha os filhos até o Ctrl+C (ou SIGTERM), reiniciando os que caírem."""
     try:
         while True:
-            for p, name, color in processes:
-                if p.poll() is not None:
-                    print(f"\n{color}[{name}]{RESET_COLOR} ATENÇÃO: O processo encerrou com código {p.poll()}. Encerrando tudo.")
-                    # Encerra tudo se um processo morrer para evitar estado inconsistente
-                    raise KeyboardInterrupt
-            time.sleep(2)
-
+            agora = time.monotonic()
+            for filho in filhos:
+                filho.verificar(agora)
+            time.sleep(0.5)
     except KeyboardInterrupt:
         print("\n" + "=" * 50)
         print("Recebido sinal de interrupção (Ctrl+C). Encerrando todos os scripts...")
-        
-        for process, name, color in reversed(processes): # Encerra na ordem inversa
-            if process.poll() is None: # Se ainda estiver rodando
-                print(f"{color}[{name}]{RESET_COLOR} Enviando sinal de encerramento...")
-                process.terminate()
-        
-        # Aguarda um pouco para os processos terminarem
-        time.sleep(2)
-        
-        for process, name, color in processes:
-            if process.poll() is None:
-                print(f"{color}[{name}]{RESET_COLOR} Processo não encerrou, forçando (kill)...")
-                process.kill()
-                
-        print("Todos os scripts foram encerrados.")
-        print("=" * 50)
+
+
+# --- Modo padrão: um processo por nível ---
+def executar_processos():
+    filhos = []
+    for script_info in SCRIPTS:
+        full_script_path = os.path.join(DIR_RAIZ, script_info["cwd"], script_info["path"])
+        if not os.path.exists(full_script_path):
+            print(f"{script_info['color']}[{script_info['name']}]{RESET_COLOR} ERRO: Script não encontrado em '{full_script_path}'. Pulando.")
+            continue
+
+        # Sem stdout/stderr=PIPE, os scripts filhos imprimem direto no terminal,
+        # evitando o bloqueio do buffer; "-u" garante que a saída não fique presa.
+        def iniciar(info=script_info):
+            return subprocess.Popen([sys.executable, "-u", info["path"]], cwd=os.path.join(DIR_RAIZ, info["cwd"]))
+
+        filho = Filho(script_info, iniciar)
+        print(f"{filho.prefixo} Iniciando script em '{script_info['cwd']}'...")
+        filho.iniciar()
+        filhos.append(filho)
+
+    supervisionar(filhos)
+
+    for filho in reversed(filhos): # Encerra na ordem inversa
+        if filho.em_execucao():
+            print(f"{filho.prefixo} Enviando sinal de encerramento...")
+            filho.execucao.terminate()
+
+    # Aguarda um pouco para os processos terminarem
+    limite = time.monotonic() + 2
+    for filho in filhos:
+        if filho.em_execucao():
+            try:
+                filho.execucao.wait(max(0.0, limite - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                print(f"{filho.prefixo} Processo não encerrou, forçando (kill)...")
+                filho.execucao.kill()
+
+
+# --- Modo unificado: um processo, uma thread por nível ---
+def executar_unificado():
+    for caminho in [os.path.join(DIR_RAIZ, 'nivel4')] + [os.path.join(DIR_RAIZ, info["cwd"]) for info in SCRIPTS]:
+        if caminho not in sys.path: sys.path.insert(0, caminho)
+    from configuracao import obter_configuracao
+    from registro import fechar_todos
+    from telemetria import COLUNAS, abrir_fonte, caminhos_dados
+    from metricas import obter_metricas
+    from perfil import obter_perfilador
+    import barramento
+
+    # O barramento é instalado antes de importar os níveis: o dashboard se
+    # registra nele na importação e os seguidores passam a ser filas em memória
+    config = obter_configuracao(os.path.join(DIR_RAIZ, 'nivel4', 'configuracoes.yaml')).obter()
+    barramento_processo = barramento.Barramento()
+    if config:
+        barramento_processo.carregar_historico(abrir_fonte(config), COLUNAS)
+        # Um único registro de métricas para os três níveis, publicado como 'unificado'
+        obter_metricas().iniciar_exportacao(caminhos_dados(config)['dir'], 'unificado')
+    # Um perfilador para os três níveis, com os arquivos marcados como 'unificado'
+    obter_perfilador().iniciar(obter_configuracao(os.path.join(DIR_RAIZ, 'nivel4', 'configuracoes.yaml')), 'unificado')
+    barramento.instalar(barramento_processo)
+
+    import base
+    import analise
+    import app as webapp
+
+    parar = threading.Event()
+    servidor = webapp.criar_servidor()
+    alvos = {'base.py': lambda: base.main(parar), 'analise.py': lambda: analise.main(parar),
+             'app.py': servidor.serve_forever}
+
+    filhos = []
+    for script_info in SCRIPTS:
+        def iniciar(info=script_info):
+            thread = threading.Thread(target=alvos[info["path"]], name=info["cwd"], daemon=True)
+            thread.start()
+            return thread
+        filho = Filho(script_info, iniciar)
+        print(f"{filho.prefixo} Iniciando no processo unificado...")
+        filho.iniciar()
+        filhos.append(filho)
+
+    supervisionar(filhos)
+
+    parar.set()
+    servidor.shutdown()
+    for filho in filhos:
+        if filho.em_execucao():
+            filho.execucao.join(5)
+            if filho.execucao.is_alive():
+                print(f"{filho.prefixo} Thread não encerrou a tempo.")
+    fechar_todos()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inicializa os níveis 3, 5 e 6 do projeto.")
+    parser.add_argument('--unificado', action='store_true',
+                        help="executa os três níveis em um único processo, com as amostras passando em memória")
+    parser.add_argument('--perfil', nargs='?', const='amostragem', choices=('amostragem', 'cprofile'),
+                        help="liga o perfil contínuo em todos os níveis (padrão: amostragem), "
+                             "independente da seção 'perfil' do configuracoes.yaml")
+    args = parser.parse_args()
+    if args.perfil:
+        # Herdada pelos processos filhos; lida pelo nivel4/perfil.py
+        os.environ['TWSN_PERFIL'] = args.perfil
+
+    # SIGTERM (ex.: systemd) encerra como o Ctrl+C
+    sys.path.insert(0, os.path.join(DIR_RAIZ, 'nivel4'))
+    from registro import instalar_encerramento_gracioso
+    instalar_encerramento_gracioso()
+
+    print("=" * 50)
+    print("INICIANDO TODOS OS SCRIPTS DO PROJETO" + (" (PROCESSO ÚNICO)..." if args.unificado else "..."))
+    print("Pressione Ctrl+C para encerrar todos os processos.")
+    print("=" * 50)
+
+    if args.unificado:
+        executar_unificado()
+    else:
+        executar_processos()
+
+    print("Todos os scripts foram encerrados.")
+    print("=" * 50)
 
 if __name__ == "__main__":
     main()
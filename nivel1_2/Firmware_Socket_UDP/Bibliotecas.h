@@ -10,6 +10,14 @@
 // --- Instância UDP ---
 WiFiUDP Udp;
 
+// --- Endereço do nó na frota ---
+// Precisa ser igual ao 'id' do nó em nivel1.nos do configuracoes.yaml: o gateway
+// envia o downlink com esse ID no byte 8 e o nó descarta quadros de outro ID.
+// Altere aqui antes de gravar cada placa ou compile com -DID_NO=<id> (1 a 255).
+#ifndef ID_NO
+#define ID_NO 1
+#endif
+
 // --- Definições de Pinos ---
 #define LED_verde D4
 #define LED_amarelo D7
@@ -35,7 +43,7 @@ const long interval = 500;
 
 // --- Variáveis Globais de Configuração e Estado (Definição Direta) ---
 unsigned int localPort = 8888;
-String newHostname = "SENSOR001";
+String newHostname = "SENSOR" + String(1000 + ID_NO).substring(1); // SENSOR001, SENSOR002, ...
 unsigned long tempo_ip = 0;
 unsigned long previousMillis = 0;
 
@@ -43,7 +51,7 @@ bool TX_ledblink = false;
 bool RX_ledblink = false;
 
 int Contador_mac = 0;
-byte My_address = 1;
+byte My_address = ID_NO;
 int pkt_counter_up = 0;
 
 // Estado da Aplicação
@@ -7,7 +7,7 @@
 
 void Net_initialize() // Função de inicialização da camada de Rede
 {
-  My_address = 1; // Define o endereço do sensor
+  My_address = ID_NO; // Define o endereço do sensor (ID_NO em Bibliotecas.h)
 }
 
 void Net_receive()  // Função de recepção de pacote da Camada de Rede
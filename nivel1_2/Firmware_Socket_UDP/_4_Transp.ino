@@ -24,7 +24,8 @@ void Transp_send()// Função de envio de pacote da Camada de Transporte
   byte byte14 = pkt_counter_up / 256;  // MSB do contador de pacotes de uplink
   byte byte15 = pkt_counter_up % 256;  // LSB do contador de pacotes de uplink
   
-  // Pacote_TX[12] e Pacote_TX[13] poderiam ser um echo do contador de downlink (Pacote_RX[12/13])
+  // Eco do contador de downlink: a base casa esta resposta com o pedido (RTT, perdas e duplicados)
+  Pacote_TX[12] = Pacote_RX[12];
   Pacote_TX[14] = byte14;
   Pacote_TX[15] = byte15;
   
@@ -0,0 +1,402 @@
+# nivel1_2/simulador.py - Frota simulada de nós sensores e captura/reprodução do tráfego UDP
+#
+# Fala o mesmo protocolo de 52 bytes do Firmware_Socket_UDP (ver
+# nivel3/protocolo.py), para testar a base (nivel3) sem as placas ESP:
+#
+#   frota       N nós virtuais em localhost; cada um responde ao downlink da
+#               base como o firmware (aplica os limiares, acende os LEDs) e,
+#               opcionalmente, envia uplinks por conta própria a uma taxa fixa.
+#               Formas de onda de luminosidade/RSSI, jitter, perda, duplicação
+#               e atraso de resposta são configuráveis. As respostas ecoam o
+#               contador de downlink (byte 12), como o _4_Transp.ino.
+#   gravar      relé UDP entre a base e um nó real que grava cada quadro
+#               (com instante e sentido) em um arquivo de captura.
+#   reproduzir  reenvia os uplinks de uma captura para a base, em 1x ou acelerado.
+#   latencia    compara os uplinks enviados pela frota (--registro) com o
+#               armazenamento binário do nivel4 (no, seq_up -> timestamp).
+#
+# Exemplo: python simulador.py frota --nos 20 --porta-inicial 9100 --imprimir-config
+
+import argparse
+import heapq
+import math
+import os
+import random
+import selectors
+import socket
+import struct
+import sys
+import time
+
+dir_atual = os.path.dirname(os.path.abspath(__file__))
+for caminho in (os.path.join(dir_atual, '..', 'nivel3'), os.path.join(dir_atual, '..', 'nivel4')):
+    caminho = os.path.abspath(caminho)
+    if caminho not in sys.path: sys.path.insert(0, caminho)
+from registro import instalar_encerramento_gracioso
+from protocolo import TAMANHO_PACOTE, codificar_uplink, rssi_codigo, ESTRUTURA_DOWNLINK, CAMPOS_DOWNLINK
+
+# --- Arquivo de captura ---
+# Cabeçalho de 16 bytes seguido de registros fixos de 64 bytes:
+# instante (epoch, float64), sentido (0 = downlink base->nó, 1 = uplink nó->base), quadro.
+MAGICO_CAPTURA = b'TWSNCAP1'
+CABECALHO_CAPTURA = struct.Struct('<8sII')          # mágico, versão, tamanho do registro
+REGISTRO_CAPTURA = struct.Struct(f'<dB7x{TAMANHO_PACOTE}s')
+DOWNLINK, UPLINK = 0, 1
+
+# Registro de uplinks enviados pela frota, para medir a latência até o nivel4
+REGISTRO_ENVIO = struct.Struct('<dHH')              # instante, nó, seq_up
+
+CAMPOS_DL = [nome for nome, _d, _t in sorted(CAMPOS_DOWNLINK, key=lambda c: c[1])]
+
+
+# --- Formas de onda ---
+def forma_de_onda(especificacao):
+    """
+    'constante:V', 'senoide:MEDIA:AMPLITUDE:PERIODO_S', 'aleatoria:MIN:MAX' ou
+    'degrau:BAIXO:ALTO:PERIODO_S'. Retorna uma função do tempo (s).
+    """
+    nome, *parametros = especificacao.split(':')
+    p = [float(x) for x in parametros]
+    if nome == 'constante':
+        return lambda t: p[0]
+    if nome == 'senoide':
+        return lambda t: p[0] + p[1] * math.sin(2 * math.pi * t / p[2])
+    if nome == 'aleatoria':
+        return lambda t: random.uniform(p[0], p[1])
+    if nome == 'degrau':
+        return lambda t: p[1] if int(t / p[2]) % 2 else p[0]
+    raise ValueError(f"Forma de onda desconhecida: '{especificacao}'.")
+
+
+# --- Nó virtual ---
+class NoVirtual:
+    """Imita as camadas do firmware para um nó: limiares, LEDs, contadores e RSSI."""
+
+    def __init__(self, id_no, sock, luminosidade, rssi_medio, sombreamento, fase):
+        self.id = id_no
+        self.sock = sock
+        self.luminosidade = luminosidade
+        self.rssi_medio = rssi_medio
+        self.sombreamento = sombreamento
+        self.fase = fase
+        self.limiar_amarelo, self.limiar_vermelho = 500, 200   # padrões do Bibliotecas.h
+        self.seq_up = 0
+        self.contador_mac = 0
+        self.ultimo_seq_down = 0
+        self.base = None
+        self.buffer = bytearray(TAMANHO_PACOTE)
+        self.downlinks = self.uplinks = self.perdidos = self.duplicados = 0
+
+    def receber_downlink(self, dados, remetente):
+        campos = dict(zip(CAMPOS_DL, ESTRUTURA_DOWNLINK.unpack_from(dados)))
+        if campos['destino'] != self.id % 256:
+            return False
+        self.base = remetente
+        self.downlinks += 1
+        self.contador_mac += 10
+        self.ultimo_seq_down = campos['seq_down']
+        # App_receive: limiar 0 mantém o valor atual
+        if campos['limiar_atencao'] > 0: self.limiar_amarelo = campos['limiar_atencao']
+        if campos['limiar_critico'] > 0: self.limiar_vermelho = campos['limiar_critico']
+        return True
+
+    def montar_uplink(self, agora, seq_down=0):
+        luminosidade = max(0, min(1023, int(self.luminosidade(agora + self.fase))))
+        verde = luminosidade > self.limiar_amarelo
+        amarelo = not verde and luminosidade > self.limiar_vermelho
+        vermelho = not verde and not amarelo
+        rssi = self.rssi_medio + random.gauss(0, self.sombreamento) if self.sombreamento else self.rssi_medio
+        # Canal simétrico com sombreamento independente em cada sentido (o byte 0 é medido pela base no Radiuino)
+        rssi_ul = self.rssi_medio + random.gauss(0, self.sombreamento) if self.sombreamento else self.rssi_medio
+        self.seq_up = (self.seq_up + 1) % 65536
+        self.uplinks += 1
+        return codificar_uplink(self.id, self.seq_up, luminosidade, rssi_dl=rssi_codigo(rssi), rssi_ul=rssi_codigo(rssi_ul),
+                                led_verde=verde, led_amarelo=amarelo, led_vermelho=vermelho, buzzer=vermelho,
+                                seq_down=seq_down, destino=0, contador_mac=self.contador_mac, buffer=self.buffer)
+
+
+class Frota:
+    """N nós virtuais atendidos por um único loop de eventos (selectors + fila de envios agendados)."""
+
+    def __init__(self, args):
+        self.args = args
+        self.seletor = selectors.DefaultSelector()
+        self.nos = []
+        self.agenda = []          # heap de (instante, contador, no, tipo, seq_down)
+        self._contador = 0
+        self.inicio = time.monotonic()
+        self.registro_envio = open(args.registro, 'ab') if args.registro else None
+        luminosidade = forma_de_onda(args.luminosidade)
+        base = (args.base_ip, args.base_porta)
+        for i in range(args.nos):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            sock.bind((args.ip, args.porta_inicial + i))
+            sock.setblocking(False)
+            no = NoVirtual(args.id_inicial + i, sock, luminosidade, args.rssi, args.sombreamento,
+                           fase=random.uniform(0, 1000) if args.fases_aleatorias else 0.0)
+            no.base = base
+            self.seletor.register(sock, selectors.EVENT_READ, no)
+            self.nos.append(no)
+            if args.taxa > 0:
+                self._agendar(time.monotonic() + random.uniform(0, 1 / args.taxa), no, 'espontaneo')
+
+    def _agendar(self, instante, no, tipo):
+        self._contador += 1
+        # Respostas levam o contador do downlink que as gerou (o nó pode receber outro antes de responder)
+        seq_down = no.ultimo_seq_down if tipo == 'resposta' else 0
+        heapq.heappush(self.agenda, (instante, self._contador, no, tipo, seq_down))
+
+    def _atraso(self):
+        return max(0.0, self.args.atraso_ms / 1000 + random.uniform(-1, 1) * self.args.jitter_ms / 1000)
+
+    def _enviar(self, no, seq_down=0):
+        if random.random() < self.args.perda:
+            no.perdidos += 1
+            return
+        agora = time.time()
+        quadro = no.montar_uplink(agora, seq_down)
+        try:
+            no.sock.sendto(quadro, no.base)
+            if random.random() < self.args.duplicacao:
+                no.sock.sendto(quadro, no.base)
+                no.duplicados += 1
+        except OSError as e:
+            print(f"Nó {no.id}: erro ao enviar: {e}")
+            return
+        if self.registro_envio:
+            self.registro_envio.write(REGISTRO_ENVIO.pack(agora, no.id, no.seq_up))
+
+    def executar(self, duracao):
+        self.inicio = ultimo_relatorio = time.monotonic()
+        fim = self.inicio + duracao if duracao else None
+        while fim is None or time.monotonic() < fim:
+            agora = time.monotonic()
+            while self.agenda and self.agenda[0][0] <= agora:
+                _instante, _c, no, tipo, seq_down = heapq.heappop(self.agenda)
+                self._enviar(no, seq_down)
+                if tipo == 'espontaneo':
+                    self._agendar(agora + 1 / self.args.taxa + random.uniform(-1, 1) * self.args.jitter_ms / 1000,
+                                  no, 'espontaneo')
+            timeout = min(max(self.agenda[0][0] - time.monotonic(), 0), 1.0) if self.agenda else 1.0
+            for chave, _eventos in self.seletor.select(timeout):
+                no = chave.data
+                while True:
+                    try:
+                        dados, remetente = no.sock.recvfrom(1024)
+                    except (BlockingIOError, ConnectionResetError):
+                        break
+                    # Phy_receive: quadros com menos de 52 bytes são ignorados
+                    if len(dados) >= TAMANHO_PACOTE and no.receber_downlink(dados, remetente):
+                        self._agendar(time.monotonic() + self._atraso(), no, 'resposta')
+            if agora - ultimo_relatorio >= self.args.relatorio_s:
+                self.relatorio()
+                ultimo_relatorio = agora
+        self.relatorio()
+
+    def relatorio(self):
+        decorrido = max(time.monotonic() - self.inicio, 1e-9)
+        downlinks = sum(no.downlinks for no in self.nos)
+        uplinks = sum(no.uplinks for no in self.nos)
+        perdidos = sum(no.perdidos for no in self.nos)
+        duplicados = sum(no.duplicados for no in self.nos)
+        print(f"[{decorrido:7.1f}s] {len(self.nos)} nós | downlinks {downlinks} ({downlinks / decorrido:.1f}/s) | "
+              f"uplinks {uplinks} ({uplinks / decorrido:.1f}/s) | perdidos (simulado) {perdidos} | "
+              f"duplicados (simulado) {duplicados}")
+
+    def fechar(self):
+        for no in self.nos:
+            self.seletor.unregister(no.sock)
+            no.sock.close()
+        self.seletor.close()
+        if self.registro_envio:
+            self.registro_envio.close()
+
+
+def imprimir_config(args):
+    """Trecho de 'nivel1.nos' para o configuracoes.yaml da base."""
+    print("nivel1:\n  nos:")
+    for i in range(args.nos):
+        print(f"  - id: {args.id_inicial + i}\n    ip: {args.ip}\n    porta: {args.porta_inicial + i}")
+
+
+# --- Captura e reprodução ---
+def _abrir_captura(caminho):
+    novo = not os.path.exists(caminho) or os.path.getsize(caminho) == 0
+    f = open(caminho, 'ab')
+    if novo:
+        f.write(CABECALHO_CAPTURA.pack(MAGICO_CAPTURA, 1, REGISTRO_CAPTURA.size))
+    return f
+
+
+def ler_captura(caminho):
+    """Gera (instante, sentido, quadro) de um arquivo de captura."""
+    with open(caminho, 'rb') as f:
+        magico, _versao, tamanho = CABECALHO_CAPTURA.unpack(f.read(CABECALHO_CAPTURA.size))
+        if magico != MAGICO_CAPTURA or tamanho != REGISTRO_CAPTURA.size:
+            raise ValueError(f"'{caminho}' não é uma captura TwinSEN.")
+        while True:
+            dados = f.read(tamanho)
+            if len(dados) < tamanho:
+                return
+            yield REGISTRO_CAPTURA.unpack(dados)
+
+
+def gravar(args):
+    """
+    Relé entre a base e um nó real: configure na base o endereço do relé
+    (--escuta) no lugar do nó; cada quadro é repassado e gravado.
+    """
+    rele_base = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rele_base.bind((args.escuta_ip, args.escuta_porta))
+    rele_no = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rele_no.bind(('', 0))
+    no_real = (args.no_ip, args.no_porta)
+    seletor = selectors.DefaultSelector()
+    seletor.register(rele_base, selectors.EVENT_READ, DOWNLINK)
+    seletor.register(rele_no, selectors.EVENT_READ, UPLINK)
+    endereco_base, total = None, 0
+    print(f"Gravando {args.escuta_ip}:{args.escuta_porta} <-> {no_real[0]}:{no_real[1]} em '{args.arquivo}'.")
+    with _abrir_captura(args.arquivo) as f:
+        try:
+            while True:
+                for chave, _eventos in seletor.select(1.0):
+                    dados, remetente = chave.fileobj.recvfrom(1024)
+                    if chave.data == DOWNLINK:
+                        endereco_base = remetente
+                        rele_no.sendto(dados, no_real)
+                    elif endereco_base is not None:
+                        rele_base.sendto(dados, endereco_base)
+                    if len(dados) == TAMANHO_PACOTE:
+                        f.write(REGISTRO_CAPTURA.pack(time.time(), chave.data, dados))
+                        total += 1
+        except KeyboardInterrupt:
+            pass
+    print(f"\n{total} quadros gravados.")
+
+
+def reproduzir(args):
+    """Reenvia os uplinks da captura para a base, preservando o intervalo entre eles (÷ velocidade)."""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    # A base reconhece o nó pelo endereço de origem configurado em nivel1.nos
+    sock.bind((args.origem_ip, args.origem_porta))
+    base = (args.base_ip, args.base_porta)
+    inicio_captura = inicio = None
+    enviados = 0
+    for instante, sentido, quadro in ler_captura(args.arquivo):
+        if sentido != UPLINK:
+            continue
+        if inicio_captura is None:
+            inicio_captura, inicio = instante, time.monotonic()
+        if args.velocidade > 0:
+            espera = (instante - inicio_captura) / args.velocidade - (time.monotonic() - inicio)
+            if espera > 0:
+                time.sleep(espera)
+        sock.sendto(quadro, base)
+        enviados += 1
+    decorrido = time.monotonic() - inicio if inicio is not None else 0.0
+    print(f"{enviados} uplinks reproduzidos em {decorrido:.2f}s ({enviados / max(decorrido, 1e-9):.1f}/s).")
+
+
+# --- Latência até o armazenamento ---
+def medir_latencia(registro, caminho_binario):
+    """
+    Casa os uplinks registrados pela frota (--registro) com o armazenamento
+    binário do nivel4, que guarda (no, seq_up) de cada pacote recebido.
+    Devolve None sem nenhum uplink armazenado.
+    """
+    import armazenamento_binario as binario
+    enviados = {}
+    with open(registro, 'rb') as f:
+        for instante, id_no, seq_up in REGISTRO_ENVIO.iter_unpack(f.read()):
+            enviados[(id_no, seq_up)] = instante
+    c = binario.colunas(binario.LeitorBinario(caminho_binario).fatia(0))
+    atrasos = sorted(ts / 1000 - enviados[(no, seq)]
+                     for ts, no, seq in zip(c['timestamp_ms'], c['no'], c['seq_up']) if (no, seq) in enviados)
+    if not atrasos:
+        return None
+    p = lambda q: atrasos[min(len(atrasos) - 1, int(q * len(atrasos)))] * 1000
+    return {'armazenados': len(atrasos), 'enviados': len(enviados),
+            'perda_pct': 100 * (1 - len(atrasos) / len(enviados)),
+            'p50_ms': p(0.5), 'p95_ms': p(0.95), 'p99_ms': p(0.99), 'max_ms': atrasos[-1] * 1000}
+
+
+def latencia(args):
+    resultado = medir_latencia(args.registro, args.binario)
+    if resultado is None:
+        print("Nenhum uplink registrado foi encontrado no armazenamento binário.")
+        return
+    print(f"{resultado['armazenados']}/{resultado['enviados']} uplinks armazenados "
+          f"({resultado['perda_pct']:.2f}% não encontrados)")
+    # O armazenamento guarda o instante com resolução de 1 ms
+    print(f"latência até o registro (±1 ms): p50 {resultado['p50_ms']:.2f} ms | p95 {resultado['p95_ms']:.2f} ms | "
+          f"p99 {resultado['p99_ms']:.2f} ms | máx {resultado['max_ms']:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulador de nós sensores TwinSEN e captura/reprodução de tráfego.")
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    p = sub.add_parser('frota', help="emula N nós virtuais")
+    p.add_argument('--nos', type=int, default=4)
+    p.add_argument('--id-inicial', type=int, default=1)
+    p.add_argument('--ip', default='127.0.0.1')
+    p.add_argument('--porta-inicial', type=int, default=9100)
+    p.add_argument('--base-ip', default='127.0.0.1', help="destino dos uplinks espontâneos")
+    p.add_argument('--base-porta', type=int, default=8888)
+    p.add_argument('--taxa', type=float, default=0.0, help="uplinks espontâneos por segundo por nó (0 = só responde)")
+    p.add_argument('--luminosidade', default='senoide:500:300:60')
+    p.add_argument('--fases-aleatorias', action='store_true', help="defasa a forma de onda de cada nó")
+    p.add_argument('--rssi', type=float, default=-60.0, help="RSSI médio de downlink (dBm)")
+    p.add_argument('--sombreamento', type=float, default=2.0, help="desvio padrão do RSSI (dB)")
+    p.add_argument('--perda', type=float, default=0.0, help="probabilidade de não responder")
+    p.add_argument('--duplicacao', type=float, default=0.0, help="probabilidade de enviar o uplink duas vezes")
+    p.add_argument('--atraso-ms', type=float, default=0.0, help="atraso da resposta")
+    p.add_argument('--jitter-ms', type=float, default=0.0)
+    p.add_argument('--duracao', type=float, default=0.0, help="segundos (0 = até Ctrl+C)")
+    p.add_argument('--relatorio-s', type=float, default=10.0)
+    p.add_argument('--registro', help="grava (instante, nó, seq_up) de cada uplink para o comando 'latencia'")
+    p.add_argument('--imprimir-config', action='store_true')
+
+    p = sub.add_parser('gravar', help="relé que grava o tráfego entre a base e um nó real")
+    p.add_argument('arquivo')
+    p.add_argument('--escuta-ip', default='0.0.0.0')
+    p.add_argument('--escuta-porta', type=int, default=8888)
+    p.add_argument('--no-ip', required=True)
+    p.add_argument('--no-porta', type=int, default=8888)
+
+    p = sub.add_parser('reproduzir', help="reenvia os uplinks de uma captura para a base")
+    p.add_argument('arquivo')
+    p.add_argument('--base-ip', default='127.0.0.1')
+    p.add_argument('--base-porta', type=int, default=8888)
+    p.add_argument('--velocidade', type=float, default=1.0, help="1 = tempo real, 10 = 10x, 0 = sem espera")
+    p.add_argument('--origem-ip', default='127.0.0.1', help="endereço de origem dos uplinks (o 'ip' do nó em nivel1.nos)")
+    p.add_argument('--origem-porta', type=int, default=0,
+                   help="porta de origem (a 'porta' do nó); 0 = efêmera, aceita só com nivel3.religar_por_id")
+
+    p = sub.add_parser('latencia', help="latência dos uplinks da frota até o armazenamento binário")
+    p.add_argument('registro')
+    p.add_argument('--binario', default=os.path.abspath(os.path.join(dir_atual, '..', 'nivel4', 'dados_brutos.bin')))
+
+    args = parser.parse_args()
+    instalar_encerramento_gracioso()
+    if args.comando == 'frota':
+        if args.imprimir_config:
+            imprimir_config(args)
+        frota = Frota(args)
+        try:
+            frota.executar(args.duracao)
+        except KeyboardInterrupt:
+            print()
+            frota.relatorio()
+        finally:
+            frota.fechar()
+    elif args.comando == 'gravar':
+        gravar(args)
+    elif args.comando == 'reproduzir':
+        reproduzir(args)
+    else:
+        latencia(args)
+
+
+if __name__ == '__main__':
+    main()
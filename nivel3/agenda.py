@@ -0,0 +1,99 @@
+# nivel3/agenda.py - Agenda de downlinks por prazo (heap), com fases e taxa adaptativa
+#
+# Cada nó tem um prazo absoluto (time.monotonic) para o próximo downlink. O
+# loop do gateway dorme no select exatamente até o menor prazo da heap ou até
+# chegar um datagrama. O prazo seguinte é o anterior + intervalo (e não
+# "agora" + intervalo), então a cadência não acumula o atraso do loop. A fase
+# inicial de cada nó é espalhada dentro do intervalo pela sequência da razão
+# áurea sobre o ID, para que uma frota com o mesmo intervalo não envie em
+# rajadas sincronizadas. Com nivel3.taxa_adaptativa, o nó é consultado mais
+# rápido enquanto a luminosidade está perto do limiar crítico.
+
+import heapq
+import time
+
+RAZAO_AUREA = 0.6180339887498949
+
+
+def fase(id_no, intervalo):
+    """Deslocamento inicial do nó dentro do intervalo, bem espalhado para IDs consecutivos."""
+    return (id_no * RAZAO_AUREA) % 1.0 * intervalo
+
+
+class AgendaDownlinks:
+    """
+    Heap de (prazo, id do nó). Reagendar um nó só empilha o novo prazo; as
+    entradas antigas são descartadas ao chegarem ao topo.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._prazos = {}   # id do nó -> prazo vigente
+
+    def __len__(self):
+        return len(self._prazos)
+
+    def agendar(self, id_no, prazo):
+        self._prazos[id_no] = prazo
+        heapq.heappush(self._heap, (prazo, id_no))
+
+    def antecipar(self, id_no, prazo):
+        """Traz o próximo downlink do nó para 'prazo' se ele for antes do prazo vigente."""
+        if prazo < self._prazos.get(id_no, float('inf')):
+            self.agendar(id_no, prazo)
+
+    def sincronizar(self, registro, agora=None):
+        """Agenda os nós novos na sua fase, encurta prazos além do intervalo atual e esquece os removidos."""
+        agora = time.monotonic() if agora is None else agora
+        ids = set()
+        for no in registro:
+            ids.add(no.id)
+            if no.id not in self._prazos:
+                self.agendar(no.id, agora + fase(no.id, no.intervalo_efetivo))
+            else:
+                self.antecipar(no.id, agora + no.intervalo_efetivo)
+        for id_no in [id_no for id_no in self._prazos if id_no not in ids]:
+            del self._prazos[id_no]
+
+    def proximo_prazo(self):
+        """Menor prazo vigente (time.monotonic), ou None com a agenda vazia."""
+        heap = self._heap
+        while heap:
+            prazo, id_no = heap[0]
+            if self._prazos.get(id_no) == prazo:
+                return prazo
+            heapq.heappop(heap)
+        return None
+
+    def vencidos(self, agora):
+        """Retira e devolve [(id do nó, prazo)] vencidos até 'agora'; cada um deve ser reagendado."""
+        vencidos = []
+        while True:
+            prazo = self.proximo_prazo()
+            if prazo is None or prazo > agora:
+                return vencidos
+            _prazo, id_no = heapq.heappop(self._heap)
+            del self._prazos[id_no]
+            vencidos.append((id_no, prazo))
+
+    def reagendar(self, no, prazo_anterior, agora):
+        """
+        Próximo prazo = anterior + intervalo. Se o loop ficou mais de um
+        intervalo atrasado, recomeça de 'agora' em vez de disparar uma rajada.
+        """
+        proximo = prazo_anterior + no.intervalo_efetivo
+        if proximo <= agora:
+            proximo = agora + no.intervalo_efetivo
+        self.agendar(no.id, proximo)
+
+
+def fator_taxa(luminosidade, limiar_critico, config_taxa):
+    """
+    Fator do intervalo do nó (1.0 = taxa normal): 'fator' enquanto a
+    luminosidade estiver a até 'margem' do limiar crítico (nivel3.taxa_adaptativa).
+    """
+    if not config_taxa or not config_taxa.get('ligada', False) or limiar_critico is None:
+        return 1.0
+    if abs(luminosidade - limiar_critico) <= float(config_taxa.get('margem', 50)):
+        return float(config_taxa.get('fator', 0.25))
+    return 1.0
@@ -1,169 +1,538 @@
 # base.py - Versão Híbrida (Lógica Síncrona + Execução Não-Bloqueante)
 
 import socket
+import sys
+import threading
 import time
 import os
-import yaml
-import csv
-import tempfile
 from datetime import datetime
-import select  # Importamos o select
+import selectors
 
-# --- As funções auxiliares (carregar_configuracoes, etc.) são as mesmas da sua versão funcional ---
-def carregar_configuracoes(caminho_config):
-    try:
-        with open(caminho_config, "r") as f: return yaml.safe_load(f)
-    except: return None
+from nos import RegistroNos
+from agenda import AgendaDownlinks, fator_taxa
+from protocolo import TAMANHO_PACOTE, RSSI_DBM, CodificadorDownlink, decodificar_uplink, bits_atuadores
 
-def registrar_log_rede(caminho_log, timestamp, rssi, status):
-    file_exists = os.path.isfile(caminho_log)
-    try:
-        with open(caminho_log, mode='a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            if not file_exists: writer.writerow(["Timestamp", "RSSI_Downlink", "Status"])
-            writer.writerow([timestamp, rssi, status])
-    except IOError: pass
-
-def registrar_log_aplicacao(caminho_log, timestamp, luminosidade):
-    file_exists = os.path.isfile(caminho_log)
-    try:
-        with open(caminho_log, mode='a', newline='', encoding='utf-8') as f:
-            writer = csv.writer(f)
-            if not file_exists: writer.writerow(["Timestamp", "Luminosidade"])
-            writer.writerow([timestamp, luminosidade])
-    except IOError: pass
-
-def salvar_yaml_seguro(caminho, dados):
-    dir_name = os.path.dirname(caminho)
+# --- Configuração de Caminhos ---
+dir_atual = os.path.dirname(__file__) if '__file__' in locals() else os.getcwd()
+caminho_nivel4 = os.path.abspath(os.path.join(dir_atual, '..', 'nivel4'))
+caminho_config_yaml = os.path.join(caminho_nivel4, 'configuracoes.yaml')
+
+INTERVALO_STATUS_FROTA = 30.0  # segundos
+TIMEOUT_RESPOSTA_PADRAO = 2.0  # segundos sem resposta até o downlink contar como perdido
+ESPERA_MAXIMA = 1.0            # segundos: teto do select (releitura da configuração e 'parar')
+LOTE_RECEPCAO = 64             # datagramas lidos por despertar antes de voltar à agenda
+RCVBUF_PADRAO_KB = 1024        # SO_RCVBUF pedido ao sistema (nivel3.recepcao.rcvbuf_kb)
+INTERVALO_DESCARTES = 5.0      # segundos entre leituras dos descartes do kernel
+
+# Módulos compartilhados entre os níveis ficam no nivel4
+if caminho_nivel4 not in sys.path: sys.path.insert(0, caminho_nivel4)
+from configuracao import obter_configuracao
+from registro import criar_escritor, instalar_encerramento_gracioso, parametros_buffer
+from particoes import politica_rotacao
+from telemetria import caminhos_dados, formato, FORMATO_BINARIO
+from armazenamento_binario import EscritorBinario
+from estado import PublicadorEstado
+from metricas import obter_metricas
+from perfil import obter_perfilador
+import barramento
+import canal_comandos
+from comandos import GerenciadorComandos
+from compressao import CompressaoRegistro, ligada as compressao_ligada
+from recepcao import (CAPACIDADE_FILA_PADRAO, EstagioRegistro, MonitorDescartes, PoolRecepcao,
+                      configurar_rcvbuf, receber_lote)
+
+# --- Métricas (expostas pelo nivel6 em /metrics) ---
+# O rótulo 'no' é sempre o ID de um nó configurado (ou 'desconhecido'), nunca o
+# endereço ou o ID declarado por um remetente: as séries ficam limitadas à frota
+NO_DESCONHECIDO = 'desconhecido'
+metricas = obter_metricas()
+PACOTES_RECEBIDOS = metricas.contador('twsn_pacotes_recebidos_total', 'Pacotes de uplink aceitos', ('no',))
+PACOTES_DESCARTADOS = metricas.contador('twsn_pacotes_descartados_total',
+                                        'Pacotes de uplink descartados (tamanho errado ou remetente desconhecido)',
+                                        ('no', 'motivo'))
+DOWNLINKS_ENVIADOS = metricas.contador('twsn_downlinks_enviados_total', 'Quadros de downlink enviados', ('no',))
+ERROS_ENVIO = metricas.contador('twsn_downlinks_erros_total', 'Falhas no envio de quadros de downlink', ('no',))
+TEMPO_PACOTE = metricas.histograma('twsn_processamento_pacote_segundos',
+                                   'Do recvfrom ao pacote entregue ao estágio de registro (decodificação e casamento)')
+RTT = metricas.histograma('twsn_rtt_segundos', 'Tempo de ida e volta downlink -> uplink (eco do contador)', ('no',))
+TIMEOUTS = metricas.contador('twsn_timeouts_total', 'Downlinks sem resposta dentro do timeout', ('no',))
+DUPLICADOS = metricas.contador('twsn_duplicados_total', 'Respostas repetidas ao mesmo downlink', ('no',))
+COMANDOS_ENTREGUES = metricas.contador('twsn_comandos_nos_total', 'Resultado da entrega de comandos por nó alvo',
+                                       ('resultado',))
+LATENCIA_COMANDO = metricas.histograma('twsn_comando_confirmacao_segundos',
+                                       'Do recebimento do comando ao eco do nó que o confirmou')
+
+# --- Funções auxiliares ---
+
+# Status: Sucesso, Atrasado (resposta depois do timeout), Timeout (sem
+# resposta) e Duplicado. Campos desconhecidos ficam vazios.
+CABECALHO_REDE = ["Timestamp", "RSSI_Downlink", "Status", "No", "RSSI_Uplink", "RTT_ms", "Seq_Down"]
+CABECALHO_APLICACAO = ["Timestamp", "Luminosidade", "No"]
+
+# As linhas vão para escritores persistentes (nivel4/registro.py), que mantêm
+# o arquivo aberto e gravam em grupo, em vez de abrir/fechar a cada pacote.
+def linha_log_rede(timestamp, rssi, status, id_no, rssi_ul=None, rtt=None, seq_down=0):
+    return [timestamp, rssi, status, id_no, "" if rssi_ul is None else f"{rssi_ul:.1f}",
+            "" if rtt is None else f"{rtt * 1000:.2f}", seq_down]
+
+def registrar_log_rede(escritor, timestamp, rssi, status, id_no, rssi_ul=None, rtt=None, seq_down=0):
+    escritor.escrever(linha_log_rede(timestamp, rssi, status, id_no, rssi_ul, rtt, seq_down))
+
+def registrar_log_aplicacao(escritor, timestamp, luminosidade, id_no):
+    escritor.escrever([timestamp, luminosidade, id_no])
+
+def criar_escritores(config):
+    """Escritores de dados brutos conforme 'nivel4.formato' (csv ou binario)."""
+    config_nivel4 = config.get('nivel4', {})
+    caminhos = caminhos_dados(config)
+    if formato(config) == FORMATO_BINARIO:
+        return {'binario': EscritorBinario(caminhos['binario'], rotacao=politica_rotacao(config_nivel4),
+                                          **parametros_buffer(config_nivel4))}
+    return {'rede': criar_escritor(caminhos['rede'], CABECALHO_REDE, config_nivel4),
+            'aplicacao': criar_escritor(caminhos['aplicacao'], CABECALHO_APLICACAO, config_nivel4)}
+
+# As funções de registro rodam no estágio de registro (nivel3/recepcao.py), em
+# outra thread: recebem só valores, nunca o objeto do nó, que o loop continua alterando
+def registrar_amostra(escritores, agora, id_no, seq_up, rssi_dl, luminosidade, bits, status='Sucesso',
+                      rssi_ul=None, rtt=None, seq_down=0, compressao=None):
+    """Registra um pacote recebido em ambos os fluxos (rede e aplicação), passando pela compressão se houver."""
+    # Modo unificado (init.py): análise e dashboard recebem a amostra em memória
+    if barramento.ativo() is not None:
+        timestamp_ms = int(agora * 1000)
+        barramento.ativo().publicar('rede', (timestamp_ms, round(rssi_dl, 2), status, id_no, _ou_nan(rssi_ul),
+                                             float('nan') if rtt is None else round(rtt * 1000, 2)))
+        barramento.ativo().publicar('aplicacao', (timestamp_ms, float(luminosidade), id_no))
+    if 'binario' in escritores:
+        # Registro fixo: sem formatação de timestamp e de floats no caminho crítico
+        args = (agora * 1000, id_no, rssi_dl, luminosidade, bits, seq_down, seq_up, status, rssi_ul, rtt)
+        if compressao is None:
+            escritores['binario'].registrar(*args)
+            return
+        # Um registro binário serve aos dois fluxos: é gravado se algum deles o liberar
+        registro = [False, args]
+        itens = (compressao.filtrar('rede', id_no, agora * 1000, rssi_dl, registro) if status == 'Sucesso'
+                 else [registro])
+        gravar_itens(escritores, 'binario',
+                     itens + compressao.filtrar('aplicacao', id_no, agora * 1000, float(luminosidade), registro))
+        return
+    timestamp_recebido = datetime.fromtimestamp(agora).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    if compressao is None:
+        registrar_log_rede(escritores['rede'], timestamp_recebido, f"{rssi_dl:.2f}", status, id_no, rssi_ul, rtt,
+                           seq_down)
+        registrar_log_aplicacao(escritores['aplicacao'], timestamp_recebido, luminosidade, id_no)
+        return
+    linha = linha_log_rede(timestamp_recebido, f"{rssi_dl:.2f}", status, id_no, rssi_ul, rtt, seq_down)
+    gravar_itens(escritores, 'rede', compressao.filtrar('rede', id_no, agora * 1000, rssi_dl, linha)
+                 if status == 'Sucesso' else [linha])
+    gravar_itens(escritores, 'aplicacao', compressao.filtrar('aplicacao', id_no, agora * 1000, float(luminosidade),
+                                                             [timestamp_recebido, luminosidade, id_no]))
+
+def gravar_itens(escritores, fluxo, itens):
+    """Grava o que a compressão liberou: linhas CSV do fluxo ou registros binários [gravado, args], uma vez cada."""
+    if 'binario' in escritores:
+        for registro in sorted(itens, key=lambda registro: registro[1][0]):
+            if not registro[0]:
+                registro[0] = True
+                escritores['binario'].registrar(*registro[1])
+        return
+    for linha in itens:
+        escritores[fluxo].escrever(linha)
+
+def gravar_pendentes(escritores, pendentes):
+    """Grava os pontos guardados pelos compressores ([(fluxo, item)]) ao reconfigurar ou encerrar."""
+    for fluxo in ('rede', 'aplicacao'):
+        gravar_itens(escritores, fluxo, [item for f, item in pendentes if f == fluxo])
+
+def reconfigurar_compressao(escritores, compressao, config):
+    gravar_pendentes(escritores, compressao.configurar(config))
+    if compressao_ligada(config, configurados=True) and not compressao_ligada(config):
+        print("Aviso: nivel3.compressao ignorada enquanto nivel3.taxa_adaptativa estiver ligada.")
+
+def registrar_evento_rede(escritores, agora, id_no, status, seq_down, rssi_dl=None, rssi_ul=None):
+    """Registra só no fluxo de rede um evento sem medição (Timeout ou Duplicado)."""
+    if barramento.ativo() is not None:
+        barramento.ativo().publicar('rede', (int(agora * 1000), _ou_nan(rssi_dl), status, id_no, _ou_nan(rssi_ul),
+                                             float('nan')))
+    if 'binario' in escritores:
+        escritores['binario'].registrar(agora * 1000, id_no, _ou_nan(rssi_dl), 0, 0, seq_down, 0, status, rssi_ul)
+        return
+    timestamp = datetime.fromtimestamp(agora).strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
+    registrar_log_rede(escritores['rede'], timestamp, "" if rssi_dl is None else f"{rssi_dl:.2f}", status, id_no,
+                       rssi_ul, None, seq_down)
+
+def registrar_recepcao(escritores, estado_vivo, agora, id_no, seq_up, rssi_dl, luminosidade, bits, status,
+                       rssi_ul, rtt, seq_down, pacotes_recebidos, pacotes_enviados, compressao=None):
+    """Dados brutos e estado ao vivo de um pacote com medição (um só item na fila do estágio)."""
+    registrar_amostra(escritores, agora, id_no, seq_up, rssi_dl, luminosidade, bits, status, rssi_ul, rtt, seq_down,
+                      compressao)
+    # Estado ao vivo vai para o segmento compartilhado (nivel4/estado.py), não
+    # para o configuracoes.yaml, que só muda quando o operador altera a configuração
+    estado_vivo.publicar(id_no, luminosidade, rssi_dl, bits, seq_up, pacotes_recebidos, pacotes_enviados, agora * 1000)
+
+def _ou_nan(valor):
+    return float('nan') if valor is None else valor
+
+def expirar_downlinks(estagio, escritores, registro, agora, timeout):
+    """Registra um Timeout para cada downlink que ficou sem resposta por mais de 'timeout' segundos."""
+    for no in registro:
+        for seq_down, _instante in no.enlace.expirar(agora, timeout):
+            TIMEOUTS.rotulos(no.id).inc()
+            estagio.enviar(registrar_evento_rede, escritores, agora, no.id, 'Timeout', seq_down)
+
+# O layout do quadro de 52 bytes está declarado em protocolo.py; o downlink é
+# montado sempre no mesmo buffer (enviado antes da próxima montagem)
+codificador_downlink = CodificadorDownlink()
+
+def montar_pacote_downlink(no, limiares=None):
+    """Monta o pacote de 52 bytes endereçado ao nó; sem limiares, o firmware mantém os atuais (0)."""
+    # De 1 a 255: o eco 0 é reservado para firmware sem eco e uplinks espontâneos
+    no.pkt_down_counter = no.pkt_down_counter % 255 + 1
+    limiar_atencao, limiar_critico = limiares or (0, 0)
+    return codificador_downlink.codificar(no.id, no.pkt_down_counter, limiar_atencao, limiar_critico)
+
+def enviar_downlink(udp_socket, no):
+    """Envia um downlink ao nó; leva os limiares enquanto o nó não confirmou os atuais."""
+    limiares = no.limiares_a_enviar()
     try:
-        with tempfile.NamedTemporaryFile('w', dir=dir_name, delete=False, encoding="utf-8") as tmp:
-            yaml.dump(dados, tmp, default_flow_style=False, sort_keys=False)
-            temp_name = tmp.name
-        os.replace(temp_name, caminho)
-    except: pass
+        udp_socket.sendto(montar_pacote_downlink(no, limiares), no.endereco)
+        no.enlace.registrar_envio(no.pkt_down_counter, time.time(), limiares)
+        no.pacotes_enviados += 1
+        DOWNLINKS_ENVIADOS.rotulos(no.id).inc()
+    except OSError as e:
+        ERROS_ENVIO.rotulos(no.id).inc()
+        print(f"Erro ao enviar para o nó {no.id}: {e}")
+
+def ajustar_taxa(no, config, agenda):
+    """Taxa adaptativa: antecipa o próximo downlink do nó quando a luminosidade se aproxima do limiar crítico."""
+    config_taxa = config['nivel3'].get('taxa_adaptativa')
+    limiar_critico = no.limiares_alvo[1] if no.limiares_alvo else None
+    fator = fator_taxa(no.estado['luminosidade'], limiar_critico, config_taxa)
+    if fator == no.fator_taxa:
+        return
+    no.fator_taxa = fator
+    no.intervalo_minimo = float((config_taxa or {}).get('intervalo_minimo_s', 0.0))
+    if no.ultimo_envio is not None:
+        agenda.antecipar(no.id, no.ultimo_envio + no.intervalo_efetivo)
 
-def atualizar_status_yaml(caminho_yaml, novos_estados):
+# --- Comandos do dashboard (nivel4/canal_comandos.py) ---
+def tratar_comando(mensagem, remetente, canal, comandos, registro, udp_socket):
+    """Limiares: transmite já aos nós alvo e responde 'aceito'. Consulta: responde o estado do comando."""
+    id_comando = mensagem.get('id')
+    if mensagem.get('tipo') == 'consulta':
+        canal_comandos.responder(canal, remetente, comandos.consultar(id_comando) or
+                                 {'id': id_comando, 'estado': 'desconhecido'})
+        return
+    if mensagem.get('tipo') != 'limiares':
+        canal_comandos.responder(canal, remetente, {'id': id_comando, 'estado': 'erro',
+                                                    'erro': f"tipo de comando desconhecido: {mensagem.get('tipo')}"})
+        return
     try:
-        with open(caminho_yaml, 'r') as f:
-            config_data = yaml.safe_load(f) or {}
-        if 'nivel6' not in config_data: config_data['nivel6'] = {}
-        config_data['nivel6']['led_verde'] = novos_estados.get('led_verde', config_data['nivel6'].get('led_verde'))
-        config_data['nivel6']['led_amarelo'] = novos_estados.get('led_amarelo', config_data['nivel6'].get('led_amarelo'))
-        config_data['nivel6']['led_vermelho'] = novos_estados.get('led_vermelho', config_data['nivel6'].get('led_vermelho'))
-        config_data['nivel6']['buzzer'] = novos_estados.get('buzzer', config_data['nivel6'].get('buzzer'))
-        if 'luminosidade' in novos_estados: config_data['nivel6']['luminosidade_atual'] = novos_estados['luminosidade']
-        config_data['nivel6']['ultima_atualizacao'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        salvar_yaml_seguro(caminho_yaml, config_data)
-    except: pass
+        limiares = (int(mensagem['limiar_atencao']), int(mensagem['limiar_critico']))
+        ids_alvo = None if mensagem.get('nos') is None else [int(id_no) for id_no in mensagem['nos']]
+    except (KeyError, TypeError, ValueError) as e:
+        canal_comandos.responder(canal, remetente, {'id': id_comando, 'estado': 'erro', 'erro': f"comando inválido: {e}"})
+        return
+    comando, nos = comandos.criar(id_comando, limiares, ids_alvo, registro, remetente)
+    agora = time.monotonic()
+    for no in nos:
+        # Reenvia mesmo que o nó já tenha confirmado estes valores (o firmware pode ter reiniciado)
+        no.limiares_alvo = limiares
+        no.limiares_confirmados = None
+        enviar_downlink(udp_socket, no)
+        comandos.transmitido(comando, no.id, agora)
+    print(f"Comando {id_comando}: limiares {limiares[0]}/{limiares[1]} para "
+          f"{'todos os nós' if ids_alvo is None else ids_alvo}.")
+    canal_comandos.responder(canal, remetente, comando.resumo(canal_comandos.ACEITO))
 
-# --- Configuração de Caminhos ---
-dir_atual = os.path.dirname(__file__) if '__file__' in locals() else os.getcwd()
-caminho_nivel4 = os.path.abspath(os.path.join(dir_atual, '..', 'nivel4')) 
-caminho_config_yaml = os.path.join(caminho_nivel4, 'configuracoes.yaml')
-caminho_log_rede_csv = os.path.join(caminho_nivel4, 'dados_brutos_rede.csv')
-caminho_log_aplicacao_csv = os.path.join(caminho_nivel4, 'dados_brutos_aplicacao.csv')
+def acompanhar_comandos(comandos, registro, udp_socket, canal):
+    """Repete os quadros sem eco no prazo e responde aos comandos concluídos."""
+    agora = time.monotonic()
+    for comando, id_no in comandos.vencidos(agora):
+        no = registro.por_id(id_no)
+        if no is not None:
+            enviar_downlink(udp_socket, no)
+            comandos.transmitido(comando, id_no, agora)
+    for comando in comandos.retirar_concluidos():
+        for alvo in comando.alvos.values():
+            COMANDOS_ENTREGUES.rotulos(alvo['estado']).inc()
+            if alvo['latencia_ms'] is not None:
+                LATENCIA_COMANDO.observar(alvo['latencia_ms'] / 1000)
+        resumo = comando.resumo(canal_comandos.CONCLUIDO)
+        print(f"Comando {comando.id}: " + ", ".join(f"nó {id_no} {alvo['estado']}" for id_no, alvo in resumo['nos'].items()))
+        canal_comandos.responder(canal, comando.remetente, resumo)
 
-def main():
-    config_inicial = carregar_configuracoes(caminho_config_yaml)
+def processar_pacote(registro, estagio, estado_vivo, escritores, Pacote_RX, cliente, compressao=None):
+    """
+    Identifica o nó de origem, atualiza seu status e entrega o registro dos
+    dados brutos ao estágio de registro. Retorna o nó quando o pacote trouxe
+    uma medição. 'Pacote_RX' pode ser uma memoryview do buffer de recepção.
+    'compressao' (CompressaoRegistro) só é usada na thread do estágio.
+    """
+    if len(Pacote_RX) != TAMANHO_PACOTE:
+        registro.descartados += 1
+        no = registro.por_endereco(cliente)
+        PACOTES_DESCARTADOS.rotulos(no.id if no is not None else NO_DESCONHECIDO, 'tamanho').inc()
+        return
+    pacote = decodificar_uplink(Pacote_RX)
+    no = registro.identificar(cliente, pacote.origem)
+    if no is None:
+        PACOTES_DESCARTADOS.rotulos(NO_DESCONHECIDO, 'desconhecido').inc()
+        print(f"Pacote de remetente desconhecido {cliente[0]}:{cliente[1]} (ID {pacote.origem}) descartado.")
+        return
+
+    agora = time.time()
+    rssi_dl = RSSI_DBM[pacote.rssi_dl]
+    # Byte 0 zerado: o firmware via UDP não mede o RSSI de uplink (só rádios Radiuino)
+    rssi_ul = RSSI_DBM[pacote.rssi_ul] if pacote.rssi_ul else None
+    # O eco do contador de downlink casa a resposta com o pedido
+    status, rtt = no.enlace.casar(pacote.seq_down, agora)
+    if status == 'Duplicado':
+        DUPLICADOS.rotulos(no.id).inc()
+        estagio.enviar(registrar_evento_rede, escritores, agora, no.id, status, pacote.seq_down, rssi_dl, rssi_ul)
+        return
+    if rtt is not None:
+        RTT.rotulos(no.id).observar(rtt)
+    # O eco de um quadro que levava limiares confirma que o nó os aplicou
+    carga = no.enlace.carga(pacote.seq_down) if pacote.seq_down else None
+    if carga is not None:
+        no.limiares_confirmados = carga
+    elif no.ultimo_seq_up is not None and 0 < no.ultimo_seq_up - pacote.seq_up < 0x8000:
+        # Contador de uplink voltou: o firmware reiniciou com os limiares padrão
+        no.limiares_confirmados = None
+    luminosidade = pacote.luminosidade
+    print(f"[{datetime.fromtimestamp(agora).strftime('%H:%M:%S.%f')[:-3]}] Nó {no.id} sincronizado! Luminosidade: {luminosidade}"
+          + (f" | RTT {rtt * 1000:.1f} ms" if rtt is not None else "") + (" (atrasado)" if status == 'Atrasado' else ""))
+
+    no.pacotes_recebidos += 1
+    PACOTES_RECEBIDOS.rotulos(no.id).inc()
+    no.ultimo_contato = agora
+    no.ultimo_seq_up = pacote.seq_up
+
+    # Atualiza o status; os logs (marcados com o nó) e o estado ao vivo vão para o estágio de registro
+    bits = bits_atuadores(pacote)
+    no.estado = {
+        'led_verde': bool(pacote.led_verde), 'led_amarelo': bool(pacote.led_amarelo),
+        'led_vermelho': bool(pacote.led_vermelho), 'buzzer': bool(pacote.buzzer),
+        'luminosidade': luminosidade
+    }
+    estagio.enviar(registrar_recepcao, escritores, estado_vivo, agora, no.id, no.ultimo_seq_up, rssi_dl, luminosidade,
+                   bits, status, rssi_ul, rtt, pacote.seq_down, no.pacotes_recebidos, no.pacotes_enviados, compressao)
+    return no
+
+def imprimir_status_frota(registro):
+    agora = time.time()
+    online = sum(1 for no in registro if no.online(agora))
+    timeouts = sum(no.enlace.timeouts for no in registro)
+    duplicados = sum(no.enlace.duplicados for no in registro)
+    print(f"Frota: {online}/{len(registro)} nós online, {registro.descartados} pacotes descartados, "
+          f"{timeouts} timeouts, {duplicados} duplicados.")
+
+def imprimir_compressao(compressao):
+    razoes = {fluxo: razao for fluxo, razao in compressao.razoes().items() if razao is not None}
+    if razoes and compressao_ligada(compressao.config):
+        print("Compressão: " + ", ".join(f"{fluxo} {razao:.1f}:1" for fluxo, razao in razoes.items()))
+
+def config_recepcao(config):
+    return (config or {}).get('nivel3', {}).get('recepcao') or {}
+
+def main(parar=None):
+    """Loop do gateway; 'parar' (threading.Event) encerra o loop quando roda em uma thread do init.py."""
+    config_compartilhada = obter_configuracao(caminho_config_yaml)
+    config_inicial = config_compartilhada.obter()
     if not config_inicial: return
 
-    current_ip = config_inicial['nivel1']['ip']
     current_port = config_inicial['nivel1']['porta']
     HOST_LOCAL = ''
-    
+
+    instalar_encerramento_gracioso()
+    escritores = criar_escritores(config_inicial)
+
+    estado_vivo = PublicadorEstado(caminhos_dados(config_inicial)['estado'])
+    # Logs e estado ao vivo em outra thread: o disco nunca atrasa a recepção
+    estagio = EstagioRegistro(escritores, config_recepcao(config_inicial).get('fila_registro', CAPACIDADE_FILA_PADRAO))
+    # Compressão dos dados brutos (nivel3.compressao): só o estágio de registro mexe nos compressores
+    compressao = CompressaoRegistro(config_inicial)
+    metricas.iniciar_exportacao(caminhos_dados(config_inicial)['dir'], 'nivel3')
+    perfilador = obter_perfilador()
+    perfilador.iniciar(config_compartilhada, 'nivel3')
+    registro = RegistroNos()
+    agenda = AgendaDownlinks()
+    comandos = GerenciadorComandos()
+
+    # O registro só é reconstruído quando a definição da frota muda; o dashboard
+    # (nivel6) exibe o nó principal
+    def sincronizar_frota(config):
+        estagio.controlar(reconfigurar_compressao, escritores, compressao, config)
+        registro.sincronizar(config)
+        agenda.sincronizar(registro)
+        estado_vivo.definir_principal(registro.principal.id if registro.principal else None)
+    sincronizar_frota(config_inicial)
+    # Os callbacks podem disparar em outra thread (modo unificado): a frota é
+    # sincronizada no próprio loop
+    frota_alterada = threading.Event()
+    config_compartilhada.registrar_callback('nivel1.*', lambda _config, _alteradas: frota_alterada.set())
+    config_compartilhada.registrar_callback('nivel3.intervalo_medicoes', lambda _config, _alteradas: frota_alterada.set())
+    config_compartilhada.registrar_callback('nivel6.limiar_*', lambda _config, _alteradas: frota_alterada.set())
+    config_compartilhada.registrar_callback('nivel3.compressao*', lambda _config, _alteradas: frota_alterada.set())
+    config_compartilhada.registrar_callback('nivel3.taxa_adaptativa*', lambda _config, _alteradas: frota_alterada.set())
+
     udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-    # Importante: Não definimos mais um timeout global no socket
-    # udp_socket.settimeout(2.0) 
     try:
         udp_socket.bind((HOST_LOCAL, current_port))
     except OSError as e:
         print(f"Erro ao fazer bind na porta {current_port}: {e}.")
+        estagio.encerrar()
+        return
+    udp_socket.setblocking(False)
+    rcvbuf_kb = config_recepcao(config_inicial).get('rcvbuf_kb', RCVBUF_PADRAO_KB)
+    print(f"SO_RCVBUF efetivo: {configurar_rcvbuf(udp_socket, rcvbuf_kb)} bytes")
+    pool = PoolRecepcao(LOTE_RECEPCAO)
+    monitor_descartes = MonitorDescartes()
+    ultima_verificacao_descartes = time.monotonic()
+
+    endereco_comandos = canal_comandos.endereco_canal(config_inicial, caminhos_dados(config_inicial)['comandos'])
+    try:
+        canal = canal_comandos.abrir_servidor(endereco_comandos)
+    except OSError as e:
+        print(f"Erro ao abrir o canal de comandos {endereco_comandos}: {e}.")
+        udp_socket.close()
+        estagio.encerrar()
         return
 
+    # Um único loop orientado a eventos atende todos os nós pelo mesmo socket
+    # e os comandos do dashboard pelo canal local
+    seletor = selectors.DefaultSelector()
+    seletor.register(udp_socket, selectors.EVENT_READ, 'udp')
+    seletor.register(canal, selectors.EVENT_READ, 'comandos')
+
     print(f"Servidor UDP escutando na porta {current_port}")
-    print(f"Monitorando e configurando o Nó Sensor em {current_ip}")
+    for no in registro:
+        print(f"Monitorando e configurando o Nó Sensor {no.id} em {no.ip}:{no.porta}")
     print("Pressione Ctrl+C para encerrar.")
 
-    pkt_down_counter = 0
-    last_comm_time = 0
+    ultimo_status = time.time()
 
     try:
-        while True:
+        while parar is None or not parar.is_set():
+            perfilador.ciclo()
             current_time = time.time()
-            config = carregar_configuracoes(caminho_config_yaml)
+            # Leitura em cache: o YAML só é relido quando o arquivo muda
+            config = config_compartilhada.obter()
             if not config or not config.get('nivel3', {}).get('ligado', False):
-                time.sleep(5)
+                for escritor in escritores.values(): escritor.descarregar()
+                if parar is not None: parar.wait(5)
+                else: time.sleep(5)
                 continue
-            
-            intervalo = config['nivel3']['intervalo_medicoes']
+            if frota_alterada.is_set():
+                frota_alterada.clear()
+                sincronizar_frota(config)
 
-            # Mantém a lógica de reconfiguração dinâmica que já funcionava
-            new_ip = config['nivel1']['ip']
+            # Mantém a lógica de reconfiguração dinâmica da porta de escuta
             new_port = config['nivel1']['porta']
             if new_port != current_port:
+                novo_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                 try:
-                    udp_socket.close()
-                    udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                    udp_socket.bind((HOST_LOCAL, new_port))
-                    current_port = new_port
+                    novo_socket.bind((HOST_LOCAL, new_port))
                 except OSError as e:
-                    time.sleep(intervalo)
+                    novo_socket.close()
+                    print(f"Erro ao fazer bind na porta {new_port}: {e}.")
+                    time.sleep(1)
                     continue
-            current_ip = new_ip
-            ENDERECO_SENSOR = (current_ip, current_port)
-            
-            # Controla o envio de pacotes para não inundar a rede
-            if current_time - last_comm_time > intervalo:
-                last_comm_time = current_time
-                
-                # --- Preparação e Envio do Pacote (igual à sua versão) ---
-                PacoteTX = [0] * 52
-                pkt_down_counter = (pkt_down_counter + 1) % 256
-                PacoteTX[12] = pkt_down_counter
-                PacoteTX[8] = 1; PacoteTX[10] = 0 
-                try:
-                    limiar_atencao = int(config['nivel6']['limiar_atencao'])
-                    limiar_critico = int(config['nivel6']['limiar_critico'])
-                    PacoteTX[16] = limiar_atencao // 256; PacoteTX[17] = limiar_atencao % 256
-                    PacoteTX[18] = limiar_critico // 256; PacoteTX[19] = limiar_critico % 256
-                except: pass
-                
-                udp_socket.sendto(bytes(PacoteTX), ENDERECO_SENSOR)
-
-            # ======================= A MUDANÇA ESTÁ AQUI =======================
-            # Usamos 'select' para verificar se há dados para ler, sem bloquear o script.
-            # O timeout de 1 segundo define o tempo máximo que o select espera.
-            ready_to_read, _, _ = select.select([udp_socket], [], [], 1.0)
-            
-            if ready_to_read:
-                # Se houver dados, nós os lemos e processamos
-                Pacote_RX, cliente = udp_socket.recvfrom(1024)
-                if len(Pacote_RX) == 52:
-                    timestamp_recebido = datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]
-                    luminosidade = Pacote_RX[17] * 256 + Pacote_RX[18]
-                    print(f"[{timestamp_recebido}] Sincronizado! Luminosidade: {luminosidade}")
-                    
-                    # Salva logs e atualiza YAML
-                    rssi_dl = ((Pacote_RX[2] - 256) / 2.0) - 74 if Pacote_RX[2] > 128 else (Pacote_RX[2] / 2.0) - 74
-                    registrar_log_rede(caminho_log_rede_csv, timestamp_recebido, f"{rssi_dl:.2f}", "Sucesso")
-                    registrar_log_aplicacao(caminho_log_aplicacao_csv, timestamp_recebido, luminosidade)
-                    novos_estados = {
-                        'led_verde': bool(Pacote_RX[34]), 'led_amarelo': bool(Pacote_RX[37]),
-                        'led_vermelho': bool(Pacote_RX[40]), 'buzzer': bool(Pacote_RX[43]),
-                        'luminosidade': luminosidade
-                    }
-                    atualizar_status_yaml(caminho_config_yaml, novos_estados)
-            # Se 'ready_to_read' for falso, o loop simplesmente continua, sem travar.
-            # ====================================================================
-
-            # Pequeno sleep para evitar uso de 100% da CPU
-            time.sleep(0.05)
+                seletor.unregister(udp_socket)
+                udp_socket.close()
+                udp_socket = novo_socket
+                udp_socket.setblocking(False)
+                configurar_rcvbuf(udp_socket, rcvbuf_kb)
+                seletor.register(udp_socket, selectors.EVENT_READ, 'udp')
+                current_port = new_port
+            novo_rcvbuf_kb = config_recepcao(config).get('rcvbuf_kb', RCVBUF_PADRAO_KB)
+            if novo_rcvbuf_kb != rcvbuf_kb:
+                rcvbuf_kb = novo_rcvbuf_kb
+                print(f"SO_RCVBUF efetivo: {configurar_rcvbuf(udp_socket, rcvbuf_kb)} bytes")
+
+            # Envia os downlinks vencidos; cada nó volta à agenda no prazo anterior + intervalo
+            agora_monotonico = time.monotonic()
+            for id_no, prazo in agenda.vencidos(agora_monotonico):
+                no = registro.por_id(id_no)
+                if no is None:
+                    continue
+                no.ultimo_envio = agora_monotonico
+                enviar_downlink(udp_socket, no)
+                agenda.reagendar(no, prazo, agora_monotonico)
+
+            # Dorme até o primeiro prazo: próximo downlink, repetição de comando ou
+            # próximo timeout de resposta, a menos que chegue um datagrama ou um
+            # comando (as descargas dos logs são feitas pelo estágio de registro)
+            timeout_resposta = float(config['nivel3'].get('timeout_resposta_s', TIMEOUT_RESPOSTA_PADRAO))
+            agora_monotonico = time.monotonic()
+            prazos = [agenda.proximo_prazo(), comandos.proximo_prazo()]
+            espera = min((prazo - agora_monotonico for prazo in prazos if prazo is not None), default=ESPERA_MAXIMA)
+            agora = time.time()
+            for no in registro:
+                vencimento = no.enlace.proximo_vencimento(timeout_resposta)
+                if vencimento is not None:
+                    espera = min(espera, vencimento - agora)
+            eventos = seletor.select(min(max(espera, 0.0), ESPERA_MAXIMA))
+            if any(chave.data == 'comandos' for chave, _eventos in eventos):
+                while True:
+                    try:
+                        dados, remetente = canal.recvfrom(canal_comandos.TAMANHO_MAXIMO)
+                    except (BlockingIOError, ConnectionResetError):
+                        break
+                    mensagem = canal_comandos.decodificar(dados)
+                    if mensagem is not None:
+                        tratar_comando(mensagem, remetente, canal, comandos, registro, udp_socket)
+            if any(chave.data == 'udp' for chave, _eventos in eventos):
+                # Esvazia o socket nos buffers do pool antes de decodificar: uma
+                # rajada da frota sai do buffer do kernel de uma vez
+                lote = receber_lote(udp_socket, pool)
+                for Pacote_RX, cliente in lote:
+                    inicio = time.perf_counter()
+                    no = processar_pacote(registro, estagio, estado_vivo, escritores, Pacote_RX, cliente, compressao)
+                    TEMPO_PACOTE.observar(time.perf_counter() - inicio)
+                    if no is not None:
+                        ajustar_taxa(no, config, agenda)
+                        if comandos.ativos:
+                            comandos.confirmar(no, time.monotonic())
+                if lote:
+                    estagio.ocupacao()
+
+            # Confirmações recebidas acima e repetições vencidas dos comandos
+            comandos.configurar(config['nivel3'].get('comandos'))
+            acompanhar_comandos(comandos, registro, udp_socket, canal)
+
+            expirar_downlinks(estagio, escritores, registro, time.time(), timeout_resposta)
+
+            agora_monotonico = time.monotonic()
+            if agora_monotonico - ultima_verificacao_descartes >= INTERVALO_DESCARTES:
+                ultima_verificacao_descartes = agora_monotonico
+                novos = monitor_descartes.verificar(udp_socket)
+                if novos:
+                    print(f"Aviso: o kernel descartou {novos} datagramas (buffer de recepção cheio); "
+                          f"aumente nivel3.recepcao.rcvbuf_kb.")
+
+            if current_time - ultimo_status >= INTERVALO_STATUS_FROTA:
+                ultimo_status = current_time
+                imprimir_status_frota(registro)
+                imprimir_compressao(compressao)
+                if monitor_descartes.total or estagio.descartados:
+                    print(f"Recepção: {monitor_descartes.total} descartes no kernel, "
+                          f"{estagio.descartados} registros descartados com a fila cheia.")
 
     except KeyboardInterrupt:
         print("\nExecução interrompida.")
     finally:
+        perfilador.encerrar_trecho()
+        # Só os escritores do gateway: no modo unificado a análise continua com os seus
+        estagio.encerrar()
+        # Estágio parado: os pontos guardados pelos compressores vão para o disco antes de fechar
+        gravar_pendentes(escritores, compressao.pendentes())
+        for escritor in escritores.values(): escritor.fechar()
+        estado_vivo.fechar()
+        seletor.close()
         udp_socket.close()
-        print("Socket fechado.")
+        canal_comandos.fechar_servidor(canal, endereco_comandos)
+        print("Logs descarregados e socket fechado.")
 
 if __name__ == "__main__":
     main()
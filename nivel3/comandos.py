@@ -0,0 +1,128 @@
+# nivel3/comandos.py - Comandos do dashboard em andamento no gateway (entrega e confirmação)
+#
+# Um comando de limiares vai a um nó, a um grupo ou a toda a frota. Para cada
+# nó alvo o gateway transmite um downlink fora da agenda e espera o eco do
+# contador (nivel3/nos.py) de um quadro que levava aqueles limiares; sem eco
+# dentro de 'timeout_s' o quadro é repetido, até 'tentativas' vezes. O estado
+# de cada nó é pendente, confirmado, sem_confirmacao, substituido (um comando
+# mais novo para o mesmo nó) ou desconhecido (ID fora da frota). Os downlinks periódicos continuam levando os limiares até a
+# confirmação, então um nó que esgotou as tentativas ainda os recebe depois.
+
+import time
+from collections import OrderedDict
+
+from canal_comandos import CONCLUIDO
+
+PENDENTE = 'pendente'
+CONFIRMADO = 'confirmado'
+SEM_CONFIRMACAO = 'sem_confirmacao'
+SUBSTITUIDO = 'substituido'
+DESCONHECIDO = 'desconhecido'
+
+TIMEOUT_PADRAO_S = 0.3
+TENTATIVAS_PADRAO = 3
+HISTORICO_COMANDOS = 64   # comandos concluídos mantidos para consulta
+
+
+class Comando:
+    def __init__(self, id_comando, limiares, remetente):
+        self.id = id_comando
+        self.limiares = limiares
+        self.remetente = remetente
+        self.criado = time.monotonic()
+        self.alvos = {}   # id do nó -> {'estado', 'tentativas', 'prazo', 'latencia_ms'}
+
+    @property
+    def concluido(self):
+        return all(alvo['estado'] != PENDENTE for alvo in self.alvos.values())
+
+    def resumo(self, estado):
+        return {'id': self.id, 'estado': estado,
+                'limiar_atencao': self.limiares[0], 'limiar_critico': self.limiares[1],
+                'nos': {str(id_no): {'estado': alvo['estado'], 'tentativas': alvo['tentativas'],
+                                     'latencia_ms': alvo['latencia_ms']}
+                        for id_no, alvo in self.alvos.items()}}
+
+
+class GerenciadorComandos:
+    """Comandos ativos (esperando confirmação) e os últimos concluídos."""
+
+    def __init__(self, timeout_s=TIMEOUT_PADRAO_S, tentativas=TENTATIVAS_PADRAO):
+        self.timeout_s = timeout_s
+        self.tentativas = tentativas
+        self.ativos = OrderedDict()
+        self.concluidos = OrderedDict()
+
+    def configurar(self, config_comandos):
+        config_comandos = config_comandos or {}
+        self.timeout_s = float(config_comandos.get('timeout_s', TIMEOUT_PADRAO_S))
+        self.tentativas = max(1, int(config_comandos.get('tentativas', TENTATIVAS_PADRAO)))
+
+    def criar(self, id_comando, limiares, ids_alvo, registro, remetente):
+        """Registra o comando; 'ids_alvo' None = toda a frota. Devolve o comando e os nós a transmitir."""
+        comando = Comando(id_comando, limiares, remetente)
+        nos = []
+        for id_no in (ids_alvo if ids_alvo is not None else [no.id for no in registro]):
+            no = registro.por_id(id_no)
+            if no is None:
+                comando.alvos[id_no] = {'estado': DESCONHECIDO, 'tentativas': 0, 'prazo': None, 'latencia_ms': None}
+                continue
+            comando.alvos[id_no] = {'estado': PENDENTE, 'tentativas': 0, 'prazo': None, 'latencia_ms': None}
+            nos.append(no)
+            for anterior in self.ativos.values():
+                alvo = anterior.alvos.get(id_no)
+                if alvo is not None and alvo['estado'] == PENDENTE:
+                    alvo['estado'] = SUBSTITUIDO
+        self.ativos[id_comando] = comando
+        return comando, nos
+
+    def transmitido(self, comando, id_no, agora):
+        alvo = comando.alvos[id_no]
+        alvo['tentativas'] += 1
+        alvo['prazo'] = agora + self.timeout_s
+
+    def confirmar(self, no, agora):
+        """O nó confirmou os limiares em no.limiares_confirmados: atualiza os comandos pendentes para ele."""
+        confirmados = []
+        for comando in self.ativos.values():
+            alvo = comando.alvos.get(no.id)
+            if alvo is not None and alvo['estado'] == PENDENTE and comando.limiares == no.limiares_confirmados:
+                alvo['estado'] = CONFIRMADO
+                alvo['latencia_ms'] = round((agora - comando.criado) * 1000, 2)
+                confirmados.append(comando)
+        return confirmados
+
+    def vencidos(self, agora):
+        """[(comando, id do nó)] sem eco até o prazo e com tentativas restantes; os esgotados viram sem_confirmacao."""
+        repetir = []
+        for comando in self.ativos.values():
+            for id_no, alvo in comando.alvos.items():
+                if alvo['estado'] != PENDENTE or alvo['prazo'] is None or alvo['prazo'] > agora:
+                    continue
+                if alvo['tentativas'] < self.tentativas:
+                    repetir.append((comando, id_no))
+                else:
+                    alvo['estado'] = SEM_CONFIRMACAO
+        return repetir
+
+    def proximo_prazo(self):
+        prazos = [alvo['prazo'] for comando in self.ativos.values() for alvo in comando.alvos.values()
+                  if alvo['estado'] == PENDENTE and alvo['prazo'] is not None]
+        return min(prazos, default=None)
+
+    def retirar_concluidos(self):
+        """Move os comandos concluídos para o histórico e os devolve (para a resposta final)."""
+        concluidos = [comando for comando in self.ativos.values() if comando.concluido]
+        for comando in concluidos:
+            del self.ativos[comando.id]
+            self.concluidos[comando.id] = comando
+            while len(self.concluidos) > HISTORICO_COMANDOS:
+                self.concluidos.popitem(last=False)
+        return concluidos
+
+    def consultar(self, id_comando):
+        if id_comando in self.ativos:
+            return self.ativos[id_comando].resumo('em_andamento')
+        if id_comando in self.concluidos:
+            return self.concluidos[id_comando].resumo(CONCLUIDO)
+        return None
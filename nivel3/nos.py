@@ -0,0 +1,244 @@
+# nivel3/nos.py - Registro da frota de nós sensores atendidos pela base
+
+import time
+from collections import OrderedDict
+
+# Situação de cada downlink enviado, até ser esquecido
+PENDENTE, RESPONDIDO, EXPIRADO = 0, 1, 2
+
+# Downlinks são lembrados por este múltiplo do timeout (respostas atrasadas e duplicadas)
+MEMORIA_ENVIOS = 4
+
+# Silêncio do endereço atual antes de um remetente novo poder assumir o ID (nivel3.religar_apos_s)
+RELIGAR_APOS_S_PADRAO = 30.0
+
+
+class EnlaceNo:
+    """
+    Casa as respostas de um nó com os downlinks pelo eco do contador (byte 12).
+    Cada envio fica pendente até a resposta (RTT) ou até o timeout; uma
+    segunda resposta ao mesmo envio é um duplicado e uma resposta depois do
+    timeout chega como atrasada. A 'carga' de um envio (os limiares que ele
+    levava) é devolvida por carga(seq_down) para confirmar a entrega.
+    """
+
+    def __init__(self):
+        self.enviados = OrderedDict()   # seq_down -> [instante do envio, situação, carga], em ordem de envio
+        self.timeouts = 0
+        self.duplicados = 0
+        self.atrasados = 0
+
+    def registrar_envio(self, seq_down, agora, carga=None):
+        self.enviados.pop(seq_down, None)
+        self.enviados[seq_down] = [agora, PENDENTE, carga]
+
+    def carga(self, seq_down):
+        envio = self.enviados.get(seq_down)
+        return envio[2] if envio is not None else None
+
+    def casar(self, seq_down, agora):
+        """(status, RTT em segundos ou None) da resposta que ecoou 'seq_down'."""
+        if seq_down == 0:
+            # Firmware sem eco ou uplink espontâneo: atende o pedido pendente mais antigo, sem RTT
+            for envio in self.enviados.values():
+                if envio[1] == PENDENTE:
+                    envio[1] = RESPONDIDO
+                    break
+            return 'Sucesso', None
+        envio = self.enviados.get(seq_down)
+        if envio is None:
+            # Pedido anterior ao início da base ou já esquecido
+            return 'Sucesso', None
+        instante, situacao, _carga = envio
+        if situacao == RESPONDIDO:
+            self.duplicados += 1
+            return 'Duplicado', None
+        envio[1] = RESPONDIDO
+        if situacao == EXPIRADO:
+            self.atrasados += 1
+            return 'Atrasado', agora - instante
+        return 'Sucesso', agora - instante
+
+    def expirar(self, agora, timeout):
+        """Marca como expirados os envios sem resposta há mais de 'timeout'; devolve [(seq_down, instante)]."""
+        expirados = []
+        for seq_down, envio in self.enviados.items():
+            if agora - envio[0] < timeout:
+                break
+            if envio[1] == PENDENTE:
+                envio[1] = EXPIRADO
+                expirados.append((seq_down, envio[0]))
+        self.timeouts += len(expirados)
+        while self.enviados and agora - next(iter(self.enviados.values()))[0] > timeout * MEMORIA_ENVIOS:
+            self.enviados.popitem(last=False)
+        return expirados
+
+    def proximo_vencimento(self, timeout):
+        """Instante (time.time) em que o envio pendente mais antigo expira, ou None."""
+        for instante, situacao, _carga in self.enviados.values():
+            if situacao == PENDENTE:
+                return instante + timeout
+        return None
+
+
+class NoSensor:
+    """Estado de um nó sensor: agenda de downlink, contadores de sequência e status."""
+
+    def __init__(self, id_no, ip, porta, intervalo, nome=None):
+        self.id = id_no
+        self.ip = ip
+        self.porta = porta
+        self.intervalo = intervalo
+        self.nome = nome or f"no{id_no}"
+
+        # Agenda (agenda.py) e contadores de sequência (por nó, não mais globais)
+        self.pkt_down_counter = 0
+        self.ultimo_envio = None      # time.monotonic do último downlink
+        self.fator_taxa = 1.0         # < 1 acelera a consulta perto de um limiar
+        self.intervalo_minimo = 0.0
+        self.ultimo_seq_up = None
+        self.enlace = EnlaceNo()
+
+        # Limiares (atenção, crítico) que o nó deve ter e os últimos que ele confirmou
+        # pelo eco; os downlinks só levam limiares enquanto os dois diferem
+        self.limiares_alvo = None
+        self.limiares_confirmados = None
+
+        # Status
+        self.pacotes_enviados = 0
+        self.pacotes_recebidos = 0
+        self.ultimo_contato = None
+        self.estado = {}
+
+    @property
+    def endereco(self):
+        return (self.ip, self.porta)
+
+    @property
+    def intervalo_efetivo(self):
+        """Intervalo entre downlinks com a taxa adaptativa aplicada."""
+        return max(self.intervalo * self.fator_taxa, self.intervalo_minimo)
+
+    def limiares_a_enviar(self):
+        """Limiares do próximo downlink, ou None (o quadro leva 0: o firmware mantém os atuais)."""
+        if self.limiares_alvo is None or self.limiares_alvo == self.limiares_confirmados:
+            return None
+        return self.limiares_alvo
+
+    def online(self, agora=None, tolerancia=3):
+        """Considera o nó online se respondeu dentro de 'tolerancia' intervalos."""
+        if self.ultimo_contato is None:
+            return False
+        agora = agora if agora is not None else time.time()
+        return agora - self.ultimo_contato <= max(self.intervalo * tolerancia, 2.0)
+
+    def __repr__(self):
+        return f"NoSensor(id={self.id}, endereco={self.ip}:{self.porta})"
+
+
+def limiares_configurados(secao):
+    """(limiar_atencao, limiar_critico) de uma seção da configuração, ou None se ausentes ou inválidos."""
+    try:
+        return int(secao['limiar_atencao']), int(secao['limiar_critico'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+class RegistroNos:
+    """
+    Registro dos nós definidos em 'nivel1.nos' do configuracoes.yaml, indexado
+    pelo endereço de origem (ip, porta) e pelo ID do nó (byte 10 do uplink).
+    """
+
+    def __init__(self):
+        self._por_id = {}
+        self._por_endereco = {}
+        self.descartados = 0
+        self.religacoes_recusadas = 0
+        self.religar_por_id = False
+        self.religar_apos_s = RELIGAR_APOS_S_PADRAO
+
+    def sincronizar(self, config):
+        """
+        (Re)constrói o registro a partir da configuração. Nós que continuam
+        configurados preservam contadores, agenda e status.
+        """
+        nivel1 = config.get('nivel1', {})
+        porta_padrao = int(nivel1.get('porta', 8888))
+        nivel3 = config.get('nivel3', {})
+        intervalo_padrao = float(nivel3.get('intervalo_medicoes', 1.0))
+        self.religar_por_id = bool(nivel3.get('religar_por_id', False))
+        self.religar_apos_s = float(nivel3.get('religar_apos_s', RELIGAR_APOS_S_PADRAO))
+        limiares_padrao = limiares_configurados(config.get('nivel6', {}))
+
+        definicoes = nivel1.get('nos')
+        if not definicoes:
+            # Compatibilidade: configuração antiga com um único 'nivel1.ip'
+            definicoes = [{'id': 1, 'ip': nivel1.get('ip')}] if nivel1.get('ip') else []
+
+        novos = {}
+        for definicao in definicoes:
+            try:
+                id_no = int(definicao['id'])
+                ip = str(definicao['ip'])
+            except (KeyError, TypeError, ValueError):
+                print(f"Aviso: definição de nó inválida ignorada: {definicao}")
+                continue
+            porta = int(definicao.get('porta', porta_padrao))
+            intervalo = float(definicao.get('intervalo_medicoes', intervalo_padrao))
+
+            no = self._por_id.get(id_no)
+            if no is None:
+                no = NoSensor(id_no, ip, porta, intervalo, definicao.get('nome'))
+            else:
+                no.ip, no.porta, no.intervalo = ip, porta, intervalo
+                no.nome = definicao.get('nome') or no.nome
+            # Limiares próprios do nó (comando a um grupo) ou os globais do nivel6
+            no.limiares_alvo = limiares_configurados(definicao) or limiares_padrao
+            novos[id_no] = no
+
+        self._por_id = novos
+        self._por_endereco = {no.endereco: no for no in novos.values()}
+
+    def identificar(self, cliente, id_origem, agora=None):
+        """
+        Localiza o nó que enviou o datagrama pelo endereço de origem. Com
+        nivel3.religar_por_id, um remetente novo assume o nó pelo ID (mudou de
+        IP) se o endereço atual estiver em silêncio há religar_apos_s; sem isso
+        qualquer placa que declare o mesmo ID tomaria o lugar do nó. Retorna
+        None para remetentes desconhecidos e religações recusadas.
+        """
+        no = self._por_endereco.get(cliente)
+        if no is not None:
+            return no
+        no = self._por_id.get(id_origem)
+        if no is not None and self.religar_por_id:
+            agora = time.time() if agora is None else agora
+            if no.ultimo_contato is not None and agora - no.ultimo_contato < self.religar_apos_s:
+                self.religacoes_recusadas += 1
+                self.descartados += 1
+                return None
+            print(f"Nó {no.id} mudou de endereço: {no.ip}:{no.porta} -> {cliente[0]}:{cliente[1]}")
+            self._por_endereco.pop(no.endereco, None)
+            no.ip, no.porta = cliente
+            self._por_endereco[no.endereco] = no
+            return no
+        self.descartados += 1
+        return None
+
+    def por_id(self, id_no):
+        return self._por_id.get(id_no)
+
+    def por_endereco(self, cliente):
+        return self._por_endereco.get(cliente)
+
+    @property
+    def principal(self):
+        """Primeiro nó configurado; é o nó exibido no dashboard do nivel6."""
+        return next(iter(self._por_id.values()), None)
+
+    def __iter__(self):
+        return iter(list(self._por_id.values()))
+
+    def __len__(self):
+        return len(self._por_id)
@@ -0,0 +1,239 @@
+# nivel3/protocolo.py - Codec do quadro UDP de 52 bytes trocado com os nós sensores
+#
+# O layout do quadro é declarado uma única vez (CAMPOS_UPLINK/CAMPOS_DOWNLINK,
+# espelhando as camadas _1_Phy.ino ... _5_App.ino do firmware) e compilado
+# para um struct.Struct e, se o NumPy estiver disponível, para um dtype
+# estruturado com os mesmos deslocamentos:
+#
+#   byte   uplink (nó -> base)            downlink (base -> nó)
+#   0      RSSI_ul          (Phy)
+#   1      LQI_ul           (Phy)
+#   2      RSSI_dl codificado (Phy)
+#   3      LQI_dl           (Phy)
+#   4-5    contador MAC     (Mac)
+#   8      destino          (Net)         destino (ID do nó)
+#   10     origem = ID do nó (Net)        origem (0 = base)
+#   12     eco do contador de downlink (Transp)  contador de downlink (Transp)
+#   14-15  contador de uplink (Transp)
+#   16-17                                 limiar de atenção (App)
+#   17-18  luminosidade     (App)
+#   18-19                                 limiar crítico (App)
+#   34/37/40/43  LED verde/amarelo/vermelho, buzzer (App)
+#
+# Inteiros de 2 bytes são big-endian (MSB primeiro), como no firmware. O
+# contador de downlink vai de 1 a 255; um eco 0 vem de um firmware antigo (sem
+# eco) ou de um uplink espontâneo.
+
+import os
+import struct
+import sys
+from collections import namedtuple
+
+try:
+    import numpy as np
+except ImportError:  # a decodificação em lote cai para struct sem o NumPy
+    np = None
+
+caminho_nivel4 = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nivel4'))
+if caminho_nivel4 not in sys.path: sys.path.insert(0, caminho_nivel4)
+from armazenamento_binario import empacotar_bits
+
+TAMANHO_PACOTE = 52
+
+# (nome, deslocamento, formato struct)
+CAMPOS_UPLINK = (
+    ('rssi_ul', 0, 'B'),
+    ('lqi_ul', 1, 'B'),
+    ('rssi_dl', 2, 'B'),
+    ('lqi_dl', 3, 'B'),
+    ('contador_mac', 4, 'H'),
+    ('destino', 8, 'B'),
+    ('origem', 10, 'B'),
+    ('seq_down', 12, 'B'),
+    ('seq_up', 14, 'H'),
+    ('luminosidade', 17, 'H'),
+    ('led_verde', 34, 'B'),
+    ('led_amarelo', 37, 'B'),
+    ('led_vermelho', 40, 'B'),
+    ('buzzer', 43, 'B'),
+)
+
+CAMPOS_DOWNLINK = (
+    ('destino', 8, 'B'),
+    ('origem', 10, 'B'),
+    ('seq_down', 12, 'B'),
+    ('limiar_atencao', 16, 'H'),
+    ('limiar_critico', 18, 'H'),
+)
+
+
+def _compilar(campos):
+    """Formato struct big-endian do quadro inteiro, com bytes de preenchimento entre os campos."""
+    formato, posicao = '>', 0
+    for _nome, deslocamento, tipo in sorted(campos, key=lambda c: c[1]):
+        if deslocamento < posicao:
+            raise ValueError(f"Campos sobrepostos no deslocamento {deslocamento}.")
+        if deslocamento > posicao:
+            formato += f'{deslocamento - posicao}x'
+        formato += tipo
+        posicao = deslocamento + struct.calcsize('>' + tipo)
+    if posicao < TAMANHO_PACOTE:
+        formato += f'{TAMANHO_PACOTE - posicao}x'
+    return struct.Struct(formato)
+
+
+def _dtype(campos):
+    if np is None:
+        return None
+    return np.dtype({
+        'names': [nome for nome, _d, _t in campos],
+        'formats': ['u1' if tipo == 'B' else '>u2' for _n, _d, tipo in campos],
+        'offsets': [deslocamento for _n, deslocamento, _t in campos],
+        'itemsize': TAMANHO_PACOTE,
+    })
+
+
+ESTRUTURA_UPLINK = _compilar(CAMPOS_UPLINK)
+ESTRUTURA_DOWNLINK = _compilar(CAMPOS_DOWNLINK)
+# struct devolve os campos em ordem de deslocamento
+Uplink = namedtuple('Uplink', [nome for nome, _d, _t in sorted(CAMPOS_UPLINK, key=lambda c: c[1])])
+_nova_tupla = tuple.__new__   # mais rápido que Uplink._make no caminho crítico
+DTYPE_UPLINK = _dtype(CAMPOS_UPLINK)
+DTYPE_DOWNLINK = _dtype(CAMPOS_DOWNLINK)
+
+
+# --- RSSI ---
+def rssi_dbm(codigo):
+    """Converte o RSSI codificado pelo firmware (Phy_dBm_to_Radiuino) para dBm."""
+    return ((codigo - 256) / 2.0) - 74 if codigo > 128 else (codigo / 2.0) - 74
+
+
+def rssi_codigo(dbm):
+    """Inverso de rssi_dbm (usado pelo simulador de nós)."""
+    if dbm > -10.5:
+        return 127
+    dbm = max(dbm, -137.5)
+    codigo = int((dbm + 74) * 2)
+    return codigo + 256 if dbm < -74 else codigo
+
+
+# Tabela de conversão: um índice em vez de aritmética por pacote
+RSSI_DBM = tuple(rssi_dbm(codigo) for codigo in range(256))
+
+
+# --- Uplink ---
+def decodificar_uplink(dados):
+    """Decodifica um quadro de uplink (bytes, bytearray ou memoryview) em um Uplink."""
+    return _nova_tupla(Uplink, ESTRUTURA_UPLINK.unpack_from(dados))
+
+
+def bits_atuadores(pacote):
+    """Estado dos atuadores no formato de bits do armazenamento binário."""
+    return empacotar_bits(pacote.led_verde, pacote.led_amarelo, pacote.led_vermelho, pacote.buzzer)
+
+
+def decodificar_lote(dados):
+    """
+    Decodifica vários quadros de uplink concatenados (N * 52 bytes). Com NumPy
+    devolve um array estruturado que é uma visão sem cópia de 'dados'; sem
+    NumPy, uma lista de Uplink. O RSSI em dBm sai de rssi_dbm_lote.
+    """
+    quantidade = len(dados) // TAMANHO_PACOTE
+    visao = memoryview(dados)[:quantidade * TAMANHO_PACOTE]
+    if np is not None:
+        return np.frombuffer(visao, dtype=DTYPE_UPLINK, count=quantidade)
+    return [Uplink._make(campos) for campos in ESTRUTURA_UPLINK.iter_unpack(visao)]
+
+
+def rssi_dbm_lote(codigos):
+    """Versão vetorizada de rssi_dbm para a coluna 'rssi_dl' de decodificar_lote."""
+    if np is not None:
+        return np.asarray(RSSI_DBM)[np.asarray(codigos, dtype=np.intp)]
+    return [RSSI_DBM[codigo] for codigo in codigos]
+
+
+# --- Downlink ---
+class CodificadorDownlink:
+    """
+    Monta quadros de downlink em um buffer pré-alocado. O buffer é reutilizado
+    a cada chamada: o quadro deve ser enviado antes da próxima codificação.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray(TAMANHO_PACOTE)
+
+    def codificar(self, destino, seq_down, limiar_atencao=0, limiar_critico=0, origem=0):
+        # Campos fora de CAMPOS_DOWNLINK continuam zerados (o buffer nunca é escrito fora deles)
+        ESTRUTURA_DOWNLINK.pack_into(self.buffer, 0, destino % 256, origem % 256, seq_down % 256,
+                                     limiar_atencao & 0xFFFF, limiar_critico & 0xFFFF)
+        return self.buffer
+
+
+def codificar_uplink(origem, seq_up, luminosidade, rssi_dl=0, led_verde=0, led_amarelo=0,
+                     led_vermelho=0, buzzer=0, seq_down=0, destino=0, contador_mac=0, rssi_ul=0, buffer=None):
+    """Monta um quadro de uplink como o firmware (usado pelo simulador e pelos testes de carga)."""
+    valores = {'rssi_ul': rssi_ul % 256, 'lqi_ul': 0, 'rssi_dl': rssi_dl % 256, 'lqi_dl': 0,
+               'contador_mac': contador_mac & 0xFFFF, 'destino': destino % 256, 'origem': origem % 256,
+               'seq_down': seq_down % 256, 'seq_up': seq_up & 0xFFFF, 'luminosidade': luminosidade & 0xFFFF,
+               'led_verde': led_verde, 'led_amarelo': led_amarelo, 'led_vermelho': led_vermelho, 'buzzer': buzzer}
+    buffer = buffer if buffer is not None else bytearray(TAMANHO_PACOTE)
+    ESTRUTURA_UPLINK.pack_into(buffer, 0, *(valores[nome] for nome in Uplink._fields))
+    return buffer
+
+
+# --- Comparação com o código por índices que existia no base.py ---
+def _decodificar_por_indices(Pacote_RX):
+    luminosidade = Pacote_RX[17] * 256 + Pacote_RX[18]
+    rssi_dl = ((Pacote_RX[2] - 256) / 2.0) - 74 if Pacote_RX[2] > 128 else (Pacote_RX[2] / 2.0) - 74
+    estado = (bool(Pacote_RX[34]), bool(Pacote_RX[37]), bool(Pacote_RX[40]), bool(Pacote_RX[43]))
+    return Pacote_RX[10], luminosidade, rssi_dl, Pacote_RX[14] * 256 + Pacote_RX[15], estado
+
+
+def _codificar_por_indices(id_no, contador, limiar_atencao, limiar_critico):
+    PacoteTX = [0] * 52
+    PacoteTX[12] = contador
+    PacoteTX[8] = id_no % 256; PacoteTX[10] = 0
+    PacoteTX[16] = limiar_atencao // 256; PacoteTX[17] = limiar_atencao % 256
+    PacoteTX[18] = limiar_critico // 256; PacoteTX[19] = limiar_critico % 256
+    return bytes(PacoteTX)
+
+
+def benchmark(quantidade=200000):
+    """Pacotes por segundo: código por índices x codec (struct) x lote (NumPy)."""
+    import time
+    quadros = [bytes(codificar_uplink(1 + i % 8, i, i % 1024, rssi_dl=i % 256, led_verde=i & 1))
+               for i in range(1024)]
+    resultados = {}
+
+    def medir(nome, funcao):
+        inicio = time.perf_counter()
+        funcao()
+        resultados[nome] = quantidade / (time.perf_counter() - inicio)
+
+    def indices():
+        for i in range(quantidade):
+            _decodificar_por_indices(quadros[i & 1023])
+
+    def codec():
+        for i in range(quantidade):
+            p = decodificar_uplink(quadros[i & 1023])
+            RSSI_DBM[p.rssi_dl]
+
+    medir('uplink_indices', indices)
+    medir('uplink_codec', codec)
+    if np is not None:
+        lote = b''.join(quadros) * (quantidade // 1024)
+        def lote_numpy():
+            registros = decodificar_lote(lote)
+            rssi_dbm_lote(registros['rssi_dl'])
+        medir('uplink_lote_numpy', lote_numpy)
+
+    codificador = CodificadorDownlink()
+    medir('downlink_indices', lambda: [_codificar_por_indices(i % 8, i % 256, 500, 200) for i in range(quantidade)])
+    medir('downlink_codec', lambda: [codificador.codificar(i % 8, i % 256, 500, 200) for i in range(quantidade)])
+    return resultados
+
+
+if __name__ == '__main__':
+    for nome, taxa in benchmark().items():
+        print(f"{nome:20s} {taxa / 1e6:8.3f} M pacotes/s")
@@ -0,0 +1,202 @@
+# nivel3/recepcao.py - Recepção UDP em rajadas sem alocação por datagrama e estágio de registro desacoplado
+#
+# A cada despertar do select, receber_lote() esvazia o socket com
+# recvfrom_into() em buffers pré-alocados (PoolRecepcao): a rajada inteira sai
+# do buffer do kernel antes de qualquer decodificação, e nenhum objeto bytes é
+# criado por datagrama (o quadro é decodificado direto da memoryview). O
+# SO_RCVBUF é configurável (nivel3.recepcao.rcvbuf_kb) e, no Linux, os
+# descartes do kernel por buffer cheio são lidos de /proc/net/udp (coluna
+# 'drops' do socket). O registro dos dados brutos e o estado ao vivo rodam em
+# uma thread (EstagioRegistro) alimentada por uma fila limitada: uma descarga
+# lenta em disco nunca atrasa a recepção; com a fila cheia, o registro é
+# descartado e contado em vez de bloquear o loop.
+
+import os
+import queue
+import socket
+import threading
+import time
+
+import barramento
+from metricas import obter_metricas
+
+TAMANHO_DATAGRAMA = 1024       # bytes por buffer; um quadro válido tem 52
+CAPACIDADE_FILA_PADRAO = 8192  # registros pendentes no estágio de registro
+
+_metricas = obter_metricas()
+DESCARTES_KERNEL = _metricas.contador('twsn_udp_descartes_kernel_total',
+                                      'Datagramas descartados pelo kernel (buffer de recepção cheio)')
+DESCARTES_FILA = _metricas.contador('twsn_fila_registro_descartes_total',
+                                    'Registros descartados com a fila do estágio de registro cheia')
+OCUPACAO_FILA = _metricas.medidor('twsn_fila_registro_ocupacao', 'Registros esperando o estágio de registro')
+RCVBUF = _metricas.medidor('twsn_udp_rcvbuf_bytes', 'SO_RCVBUF efetivo do socket de uplink')
+
+
+# --- Socket ---
+def configurar_rcvbuf(sock, rcvbuf_kb):
+    """Aplica nivel3.recepcao.rcvbuf_kb (None mantém o padrão do sistema) e devolve o tamanho efetivo."""
+    if rcvbuf_kb:
+        pedido = int(float(rcvbuf_kb) * 1024)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, pedido)
+        except OSError as e:
+            print(f"Aviso: SO_RCVBUF de {pedido} bytes recusado: {e}")
+    efetivo = sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)
+    # O Linux dobra o valor pedido (espaço de controle) e o limita a net.core.rmem_max
+    if rcvbuf_kb and efetivo < int(float(rcvbuf_kb) * 1024):
+        print(f"Aviso: SO_RCVBUF limitado a {efetivo} bytes pelo sistema (net.core.rmem_max).")
+    RCVBUF.definir(efetivo)
+    return efetivo
+
+
+def descartes_kernel(sock):
+    """Total de datagramas descartados pelo kernel para o socket, ou None fora do Linux."""
+    try:
+        inode = str(os.fstat(sock.fileno()).st_ino)
+    except OSError:
+        return None
+    for tabela in ('/proc/net/udp', '/proc/net/udp6'):
+        try:
+            with open(tabela) as f:
+                next(f, None)
+                for linha in f:
+                    # sl local rem st tx:rx tr:when retrnsmt uid timeout inode ref pointer drops
+                    campos = linha.split()
+                    if len(campos) > 12 and campos[9] == inode:
+                        return int(campos[12])
+        except (OSError, ValueError):
+            continue
+    return None
+
+
+class MonitorDescartes:
+    """Acompanha o contador de descartes do kernel e acumula os novos na métrica."""
+
+    def __init__(self):
+        self._anterior = None
+        self.total = 0
+
+    def verificar(self, sock):
+        """Descartes novos desde a última verificação (0 sem /proc ou depois de trocar de socket)."""
+        atual = descartes_kernel(sock)
+        if atual is None:
+            self._anterior = None
+            return 0
+        novos = atual - self._anterior if self._anterior is not None and atual >= self._anterior else 0
+        self._anterior = atual
+        if novos:
+            self.total += novos
+            DESCARTES_KERNEL.inc(novos)
+        return novos
+
+
+# --- Recepção ---
+class PoolRecepcao:
+    """Buffers de recepção reutilizados a cada lote (um por datagrama do lote)."""
+
+    def __init__(self, quantidade, tamanho=TAMANHO_DATAGRAMA):
+        self._buffers = [bytearray(tamanho) for _ in range(max(1, int(quantidade)))]
+        self.visoes = [memoryview(buffer) for buffer in self._buffers]
+
+    def __len__(self):
+        return len(self.visoes)
+
+
+def receber_lote(sock, pool):
+    """
+    Lê até len(pool) datagramas pendentes sem bloquear. Devolve
+    [(memoryview do datagrama, remetente)], válidas até a próxima chamada.
+    """
+    recebidos = []
+    for visao in pool.visoes:
+        while True:
+            try:
+                tamanho, remetente = sock.recvfrom_into(visao)
+            except BlockingIOError:
+                return recebidos
+            except ConnectionResetError:
+                # ICMP de porta inalcançável de um envio anterior (Windows): tenta de novo
+                continue
+            recebidos.append((visao[:tamanho], remetente))
+            break
+    return recebidos
+
+
+# --- Estágio de registro ---
+_FIM = object()
+
+
+class EstagioRegistro:
+    """
+    Thread única que executa, na ordem de chegada, as funções de registro
+    enfileiradas pelo loop do gateway e as descargas por tempo dos escritores.
+    """
+
+    def __init__(self, escritores, capacidade=CAPACIDADE_FILA_PADRAO):
+        self.escritores = escritores
+        self.fila = queue.Queue(max(1, int(capacidade)))
+        self.descartados = 0
+        self._thread = threading.Thread(target=self._executar, name='registro', daemon=True)
+        self._thread.start()
+
+    def enviar(self, funcao, *args):
+        """Enfileira funcao(*args) sem bloquear; com a fila cheia, descarta e devolve False."""
+        try:
+            self.fila.put_nowait((funcao, args))
+            return True
+        except queue.Full:
+            self.descartados += 1
+            DESCARTES_FILA.inc()
+            return False
+
+    def controlar(self, funcao, *args):
+        """
+        Enfileira funcao(*args) esperando vaga se a fila estiver cheia: mensagens
+        de controle (reconfiguração) não podem ser descartadas como as amostras.
+        """
+        self.fila.put((funcao, args))
+
+    def _executar(self):
+        publicou = False
+        while True:
+            prazos = [escritor.proximo_prazo() for escritor in self.escritores.values()]
+            prazo = min((p for p in prazos if p is not None), default=None)
+            try:
+                item = self.fila.get(timeout=None if prazo is None else max(0.0, prazo - time.monotonic()))
+            except queue.Empty:
+                item = None
+            if item is _FIM:
+                return
+            if item is not None:
+                funcao, args = item
+                try:
+                    funcao(*args)
+                    publicou = True
+                except Exception as e:
+                    print(f"Erro no estágio de registro: {e}")
+            # Fim da rajada: descargas vencidas e aviso aos assinantes do modo unificado
+            if self.fila.empty():
+                OCUPACAO_FILA.definir(0)
+                agora = time.monotonic()
+                for escritor in self.escritores.values():
+                    try:
+                        escritor.talvez_descarregar(agora)
+                    except Exception as e:
+                        # Uma descarga com erro não pode parar a thread: a fila deixaria de ser consumida
+                        print(f"Erro na descarga de '{escritor.caminho}': {e}")
+                if publicou and barramento.ativo() is not None:
+                    try:
+                        barramento.ativo().notificar()
+                    except Exception as e:
+                        print(f"Erro ao notificar os assinantes: {e}")
+                publicou = False
+
+    def ocupacao(self):
+        ocupacao = self.fila.qsize()
+        OCUPACAO_FILA.definir(ocupacao)
+        return ocupacao
+
+    def encerrar(self, espera_s=5.0):
+        """Processa o que já está na fila e encerra a thread (os escritores são fechados por quem os criou)."""
+        self.fila.put(_FIM)
+        self._thread.join(espera_s)
@@ -0,0 +1,363 @@
+# nivel4/agregados.py - Agregados em várias resoluções (1 s, 1 min, 15 min, 1 h, 1 dia) com retenção por nível
+#
+# O nivel5 acumula cada amostra bruta de um fluxo ('rede': RSSI de downlink dos
+# sucessos, 'aplicacao': luminosidade) em baldes de tempo. Cada balde guarda
+# contagem, soma, mínimo, máximo e o último valor (com o seu instante). Só o
+# nível mais fino recebe amostras: quando um balde fecha, ele é gravado e
+# somado ao balde aberto do nível seguinte, e assim por diante. Por isso cada
+# resolução deve ser múltipla da anterior; os baldes são alinhados à época
+# (dias em UTC).
+#
+# Cada fluxo tem um arquivo 'agregados_<fluxo>.bin' de tamanho fixo, mapeado
+# em memória: o cabeçalho, a tabela de níveis, os baldes abertos (estado do
+# escritor, para continuar após um reinício) e um anel de baldes por nível. O
+# balde que começa em t fica na posição (t // resolução) % posições, então a
+# retenção de cada nível é o tamanho do seu anel e não há limpeza a fazer;
+# um balde antigo é reconhecido pelo início gravado. A cada persistir(), os
+# baldes abertos também vão para o anel já somados aos abertos dos níveis mais
+# finos, para que o dashboard veja o período corrente em todos os níveis.
+#
+# O nivel6 escolhe o nível pelo intervalo pedido (consultar): o mais fino que
+# ainda retém o início do intervalo sem exceder alguns baldes por ponto. O custo da consulta
+# depende do número de pontos, não da quantidade de dados brutos guardados.
+
+import math
+import mmap
+import os
+import struct
+import threading
+
+from metricas import obter_metricas
+
+MAGICO = b'TWSNAGR1'
+VERSAO = 1
+CABECALHO = struct.Struct('<8sHHqQ36x')   # mágico, versão, níveis, último timestamp, persistências
+NIVEL = struct.Struct('<qqq')             # resolução (ms), posições do anel, deslocamento do anel
+BALDE = struct.Struct('<qqIdddd')         # início, instante do último, contagem, soma, mín, máx, último
+TAMANHO_CABECALHO = CABECALHO.size        # 64
+
+FLUXOS = ('rede', 'aplicacao')
+
+# (resolução em segundos, retenção em dias)
+NIVEIS_PADRAO = ((1, 1), (60, 7), (900, 30), (3600, 365), (86400, 3650))
+
+# Um nível serve se tiver até BALDES_POR_PONTO * pontos baldes no intervalo;
+# os vizinhos são então somados até 'pontos'. Assim o gráfico não fica com bem
+# menos pontos que o pedido só porque o nível seguinte é 60x mais grosso.
+BALDES_POR_PONTO = 8
+
+# Posições do balde: [início, instante do último, contagem, soma, mín, máx, último]
+INICIO, TS_ULTIMO, CONTAGEM, SOMA, MINIMO, MAXIMO, ULTIMO = range(7)
+
+AMOSTRAS = obter_metricas().contador('twsn_agregados_amostras_total',
+                                     'Amostras recebidas pelos agregados (aceita, atrasada ou repetida)',
+                                     ('fluxo', 'resultado'))
+
+
+def nome_nivel(resolucao_ms):
+    """Nome curto da resolução: 1s, 1min, 15min, 1h, 1d..."""
+    for unidade, ms in (('d', 86400000), ('h', 3600000), ('min', 60000), ('s', 1000)):
+        if resolucao_ms % ms == 0:
+            return f"{resolucao_ms // ms}{unidade}"
+    return f"{resolucao_ms}ms"
+
+
+def niveis_configurados(config_agregados):
+    """[(resolução_ms, posições)] de nivel5.agregados.niveis, validados (cada um múltiplo do anterior)."""
+    definidos = (config_agregados or {}).get('niveis') or [
+        {'resolucao_s': r, 'retencao_dias': d} for r, d in NIVEIS_PADRAO]
+    niveis = []
+    for definicao in definidos:
+        resolucao_ms = int(round(float(definicao['resolucao_s']) * 1000))
+        retencao_ms = float(definicao.get('retencao_dias', 1)) * 86400000
+        if resolucao_ms <= 0 or retencao_ms < resolucao_ms:
+            raise ValueError(f"nivel5.agregados: nível {definicao} com resolução ou retenção inválida.")
+        if niveis and resolucao_ms % niveis[-1][0]:
+            raise ValueError(f"nivel5.agregados: a resolução {definicao['resolucao_s']} s não é múltipla da anterior.")
+        niveis.append((resolucao_ms, int(math.ceil(retencao_ms / resolucao_ms))))
+    return niveis
+
+
+def caminho_agregados(dir_dados, fluxo):
+    return os.path.join(dir_dados, f'agregados_{fluxo}.bin')
+
+
+# --- Baldes ---
+def _novo(inicio):
+    return [inicio, 0, 0, 0.0, math.inf, -math.inf, math.nan]
+
+
+def _somar(balde, ts, valor):
+    balde[CONTAGEM] += 1
+    balde[SOMA] += valor
+    if valor < balde[MINIMO]: balde[MINIMO] = valor
+    if valor > balde[MAXIMO]: balde[MAXIMO] = valor
+    if ts >= balde[TS_ULTIMO]:
+        balde[TS_ULTIMO], balde[ULTIMO] = ts, valor
+
+
+def _juntar(balde, outro):
+    if not outro[CONTAGEM]:
+        return
+    balde[CONTAGEM] += outro[CONTAGEM]
+    balde[SOMA] += outro[SOMA]
+    balde[MINIMO] = min(balde[MINIMO], outro[MINIMO])
+    balde[MAXIMO] = max(balde[MAXIMO], outro[MAXIMO])
+    if outro[TS_ULTIMO] >= balde[TS_ULTIMO]:
+        balde[TS_ULTIMO], balde[ULTIMO] = outro[TS_ULTIMO], outro[ULTIMO]
+
+
+# --- Arquivo ---
+def _ler_niveis(mapa):
+    """[(resolução_ms, posições, deslocamento)] e o cabeçalho, ou None se o arquivo não é de agregados."""
+    if len(mapa) < TAMANHO_CABECALHO:
+        return None
+    magico, versao, quantidade, ultimo_ts, persistencias = CABECALHO.unpack_from(mapa, 0)
+    if magico != MAGICO or versao != VERSAO:
+        return None
+    niveis = [NIVEL.unpack_from(mapa, TAMANHO_CABECALHO + k * NIVEL.size) for k in range(quantidade)]
+    return niveis, ultimo_ts, persistencias
+
+
+def _layout(niveis):
+    """Tamanho do arquivo e [(resolução, posições, deslocamento)] para os níveis pedidos."""
+    inicio_abertos = TAMANHO_CABECALHO + len(niveis) * NIVEL.size
+    deslocamento = inicio_abertos + len(niveis) * BALDE.size
+    layout = []
+    for resolucao_ms, posicoes in niveis:
+        layout.append((resolucao_ms, posicoes, deslocamento))
+        deslocamento += posicoes * BALDE.size
+    return deslocamento, inicio_abertos, layout
+
+
+class EscritorAgregados:
+    """
+    Agregados de um fluxo, mantidos pelo nivel5. adicionar() recebe as
+    amostras em ordem de chegada; persistir() publica os baldes abertos.
+    """
+
+    def __init__(self, caminho, niveis, fluxo=''):
+        self.caminho = caminho
+        self.fluxo = fluxo
+        tamanho, self._inicio_abertos, self.niveis = _layout(niveis)
+        self._amostras = {resultado: AMOSTRAS.rotulos(fluxo, resultado)
+                          for resultado in ('aceita', 'atrasada', 'repetida')}
+        self._abrir(tamanho)
+
+    def _abrir(self, tamanho):
+        existente = None
+        if os.path.isfile(self.caminho):
+            with open(self.caminho, 'rb') as f:
+                existente = _ler_niveis(f.read(TAMANHO_CABECALHO + len(self.niveis) * NIVEL.size))
+            if existente is None or existente[0] != self.niveis or os.path.getsize(self.caminho) != tamanho:
+                base, ext = os.path.splitext(self.caminho)
+                os.replace(self.caminho, f"{base}.legado{ext}")
+                print(f"Níveis de agregação alterados: '{self.caminho}' movido para '{base}.legado{ext}'.")
+                existente = None
+        self._arquivo = open(self.caminho, 'r+b' if existente else 'w+b')
+        if existente is None:
+            # Arquivo esparso: os anéis só ocupam disco quando recebem baldes
+            self._arquivo.truncate(tamanho)
+        self._mapa = mmap.mmap(self._arquivo.fileno(), tamanho)
+        if existente is None:
+            for k, nivel in enumerate(self.niveis):
+                NIVEL.pack_into(self._mapa, TAMANHO_CABECALHO + k * NIVEL.size, *nivel)
+            self.ultimo_ts, self._persistencias = -1, 0
+            self._ultimo_reinicio = -1
+            self.abertos = [None] * len(self.niveis)
+            self._gravar_cabecalho()
+            return
+        _niveis, self.ultimo_ts, self._persistencias = existente
+        # Baldes abertos da execução anterior: as amostras até ultimo_ts já foram contadas
+        self.abertos = []
+        for k in range(len(self.niveis)):
+            balde = list(BALDE.unpack_from(self._mapa, self._inicio_abertos + k * BALDE.size))
+            self.abertos.append(balde if balde[CONTAGEM] or balde[INICIO] else None)
+        self._ultimo_reinicio = self.ultimo_ts
+
+    def _gravar_cabecalho(self):
+        CABECALHO.pack_into(self._mapa, 0, MAGICO, VERSAO, len(self.niveis), self.ultimo_ts, self._persistencias)
+
+    def _posicao(self, k, inicio):
+        resolucao_ms, posicoes, deslocamento = self.niveis[k]
+        return deslocamento + (inicio // resolucao_ms) % posicoes * BALDE.size
+
+    def _gravar_balde(self, k, balde):
+        if balde[CONTAGEM]:
+            BALDE.pack_into(self._mapa, self._posicao(k, balde[INICIO]), *balde)
+
+    def _corrigir_balde(self, k, ts, valor):
+        """Amostra atrasada em um balde já fechado do nível k: soma direto no anel (se ainda estiver retido)."""
+        resolucao_ms = self.niveis[k][0]
+        inicio = ts - ts % resolucao_ms
+        posicao = self._posicao(k, inicio)
+        balde = list(BALDE.unpack_from(self._mapa, posicao))
+        if balde[INICIO] > inicio and balde[CONTAGEM]:
+            return   # já sobrescrito por um balde mais novo: fora da retenção
+        if balde[INICIO] != inicio or not balde[CONTAGEM]:
+            balde = _novo(inicio)
+        _somar(balde, ts, valor)
+        BALDE.pack_into(self._mapa, posicao, *balde)
+
+    # --- Escrita ---
+    def _avancar(self, ts):
+        """Fecha os baldes que terminam antes de 'ts', do mais fino ao mais grosso, e abre os que o contêm."""
+        for k, (resolucao_ms, _posicoes, _desl) in enumerate(self.niveis):
+            balde = self.abertos[k]
+            if balde is not None and ts < balde[INICIO] + resolucao_ms:
+                return
+            if balde is not None:
+                self._gravar_balde(k, balde)
+                if k + 1 < len(self.niveis):
+                    if self.abertos[k + 1] is None:
+                        self.abertos[k + 1] = _novo(balde[INICIO] - balde[INICIO] % self.niveis[k + 1][0])
+                    _juntar(self.abertos[k + 1], balde)
+            self.abertos[k] = _novo(ts - ts % resolucao_ms)
+
+    def adicionar(self, ts, valor):
+        ts, valor = int(ts), float(valor)
+        if math.isnan(valor):
+            return
+        if self._ultimo_reinicio >= 0:
+            if ts <= self._ultimo_reinicio:
+                # Amostras relidas da cauda após um reinício já estão nos agregados
+                self._amostras['repetida'].inc()
+                return
+            self._ultimo_reinicio = -1   # a releitura acabou: atrasadas voltam a ser aceitas
+        if ts >= self.ultimo_ts:
+            self._avancar(ts)
+            _somar(self.abertos[0], ts, valor)
+            self.ultimo_ts = ts
+            self._amostras['aceita'].inc()
+            return
+        # Fora de ordem: entra no nível mais fino cujo balde aberto ainda a contém;
+        # nos níveis mais finos, o balde já fechado é corrigido no anel
+        self._amostras['atrasada'].inc()
+        for k, balde in enumerate(self.abertos):
+            if balde is None:
+                # Nível ainda sem balde aberto: abre o que conterá o aberto mais fino.
+                # Corrigir o anel aqui perderia a amostra quando esse balde fechasse.
+                fino = self.abertos[k - 1][INICIO]
+                balde = self.abertos[k] = _novo(fino - fino % self.niveis[k][0])
+            if balde[INICIO] <= ts:
+                _somar(balde, ts, valor)
+                return
+            self._corrigir_balde(k, ts, valor)
+
+    def persistir(self):
+        """Publica os baldes abertos (somados aos abertos mais finos) e o estado do escritor."""
+        efetivo = None
+        for k, balde in enumerate(self.abertos):
+            if balde is None:
+                continue
+            BALDE.pack_into(self._mapa, self._inicio_abertos + k * BALDE.size, *balde)
+            publicado = list(balde)
+            if efetivo is not None:
+                _juntar(publicado, efetivo)
+            self._gravar_balde(k, publicado)
+            efetivo = publicado
+        self._persistencias += 1
+        self._gravar_cabecalho()
+
+    def fechar(self):
+        if self._mapa is None:
+            return
+        self.persistir()
+        self._mapa.flush()
+        self._mapa.close()
+        self._arquivo.close()
+        self._mapa = None
+
+
+def escritores_configurados(config, dir_dados):
+    """{fluxo: EscritorAgregados} de nivel5.agregados, ou {} se desligado."""
+    config_agregados = (config or {}).get('nivel5', {}).get('agregados') or {}
+    if not config_agregados.get('ligado', False):
+        return {}
+    niveis = niveis_configurados(config_agregados)
+    return {fluxo: EscritorAgregados(caminho_agregados(dir_dados, fluxo), niveis, fluxo) for fluxo in FLUXOS}
+
+
+# --- Leitura (nivel6) ---
+class LeitorAgregados:
+    """Lê os anéis de um arquivo de agregados escrito por outro processo."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._mapa = None
+        self._inode = None
+        self._lock = threading.Lock()
+
+    def _mapear(self):
+        st = os.stat(self.caminho)
+        if self._mapa is not None and st.st_ino == self._inode and len(self._mapa) == st.st_size:
+            return
+        if self._mapa is not None:
+            self._mapa.close()
+            self._mapa = None
+        with open(self.caminho, 'rb') as f:
+            self._mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._inode = st.st_ino
+
+    def versao(self):
+        """(último timestamp, persistências): muda a cada persistir() do escritor."""
+        with self._lock:
+            self._mapear()
+            lido = _ler_niveis(self._mapa)
+            return None if lido is None else lido[1:]
+
+    def _baldes(self, nivel, inicio, fim, ultimo_ts):
+        resolucao_ms, posicoes, deslocamento = nivel
+        # Só os índices ainda retidos no anel (e até o balde mais recente)
+        ultimo = min(fim, ultimo_ts) // resolucao_ms
+        primeiro = max(inicio // resolucao_ms, ultimo_ts // resolucao_ms - posicoes + 1)
+        baldes = []
+        for indice in range(primeiro, ultimo + 1):
+            balde = BALDE.unpack_from(self._mapa, deslocamento + indice % posicoes * BALDE.size)
+            if balde[INICIO] == indice * resolucao_ms and balde[CONTAGEM]:
+                baldes.append(balde)
+        return baldes
+
+    def consultar(self, inicio, fim, pontos):
+        """
+        Baldes do intervalo no nível escolhido: o mais fino com até
+        BALDES_POR_PONTO * 'pontos' baldes entre os que ainda retêm o início do
+        intervalo (sem nenhum, o de maior retenção). Baldes vizinhos são somados
+        até sobrarem no máximo 'pontos'.
+        """
+        with self._lock:
+            self._mapear()
+            lido = _ler_niveis(self._mapa)
+            if lido is None:
+                raise ValueError(f"'{self.caminho}' não é um arquivo de agregados.")
+            niveis, ultimo_ts, _persistencias = lido
+            retidos = [n for n in niveis if ultimo_ts - ultimo_ts % n[0] - (n[1] - 1) * n[0] <= inicio]
+            cabem = [n for n in retidos if (fim - inicio) // n[0] + 1 <= pontos * BALDES_POR_PONTO]
+            if cabem:
+                nivel = cabem[0]
+            elif retidos:
+                nivel = retidos[-1]
+            else:
+                nivel = max(niveis, key=lambda n: n[0] * n[1])
+            baldes = self._baldes(nivel, inicio, fim, ultimo_ts)
+        if len(baldes) > pontos:
+            grupo = math.ceil(len(baldes) / pontos)
+            somados = []
+            for i in range(0, len(baldes), grupo):
+                balde = list(baldes[i])
+                for outro in baldes[i + 1:i + grupo]:
+                    _juntar(balde, outro)
+                somados.append(balde)
+            baldes = somados
+        return {'nivel': nome_nivel(nivel[0]), 'resolucao_ms': nivel[0],
+                'timestamps': [b[INICIO] for b in baldes],
+                'valores': [b[SOMA] / b[CONTAGEM] for b in baldes],
+                'minimos': [b[MINIMO] for b in baldes], 'maximos': [b[MAXIMO] for b in baldes],
+                'ultimos': [b[ULTIMO] for b in baldes], 'contagens': [b[CONTAGEM] for b in baldes],
+                'amostras': sum(b[CONTAGEM] for b in baldes)}
+
+    def fechar(self):
+        with self._lock:
+            if self._mapa is not None:
+                self._mapa.close()
+                self._mapa = None
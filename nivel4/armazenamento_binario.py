@@ -0,0 +1,343 @@
+# nivel4/armazenamento_binario.py - Armazenamento binário de registros fixos da telemetria
+#
+# Alternativa opcional aos CSVs de dados brutos (nivel4.formato: binario).
+# O arquivo é append-only: um cabeçalho de 64 bytes seguido de registros de
+# 24 bytes, um por pacote recebido, com rede e aplicação juntos:
+#
+#   deslocamento  campo           tipo
+#   0             timestamp_ms    int64   (epoch em milissegundos)
+#   8             no              uint16  (ID do nó)
+#   10            rssi            float32 (RSSI de downlink em dBm)
+#   14            luminosidade    uint16
+#   16            bits            uint8   (bit0 LED verde, bit1 amarelo, bit2 vermelho, bit3 buzzer)
+#   17            seq_down        uint8   (contador de downlink, byte 12)
+#   18            seq_up          uint16  (contador de uplink, bytes 14-15)
+#   20            status          uint8   (índice em STATUS)
+#   21            rssi_ul         int8    (RSSI de uplink em dBm; 0 = desconhecido)
+#   22            rtt_dms         uint16  (tempo de ida e volta em décimos de ms; 0 = desconhecido)
+#
+# Os bytes 21-23 eram reservados (zerados): arquivos antigos são lidos com
+# rssi_ul e RTT desconhecidos. Timeouts e duplicados também viram registros
+# (status sem medição) para o cálculo de perdas; o fluxo 'aplicacao' só
+# considera os registros de medicoes().
+#
+# Os leitores mapeiam o arquivo em memória (mmap): localizar as últimas N
+# amostras é O(1) e, com NumPy, o resultado é uma visão sem cópia do arquivo.
+
+import csv
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:  # o leitor cai para struct quando o NumPy não está instalado
+    np = None
+
+import particoes
+from registro import EscritorEmGrupo
+
+MAGICO = b'TWSNBIN1'
+VERSAO = 1
+CABECALHO = struct.Struct('<8sHHq44x')   # mágico, versão, tamanho do registro, criado_ms
+REGISTRO = struct.Struct('<qHfHBBHBbH')
+TAMANHO_CABECALHO = CABECALHO.size      # 64
+TAMANHO_REGISTRO = REGISTRO.size        # 24
+
+CAMPOS = ('timestamp_ms', 'no', 'rssi', 'luminosidade', 'bits', 'seq_down', 'seq_up', 'status', 'rssi_ul', 'rtt_dms')
+STATUS = ('Sucesso', 'Timeout', 'Duplicado', 'Sem_Resposta', 'Atrasado')
+# Status cujos registros trazem uma medição (luminosidade e atuadores)
+STATUS_MEDICAO = (STATUS.index('Sucesso'), STATUS.index('Atrasado'))
+
+BIT_LED_VERDE, BIT_LED_AMARELO, BIT_LED_VERMELHO, BIT_BUZZER = 1, 2, 4, 8
+
+if np is not None:
+    DTYPE = np.dtype({
+        'names': list(CAMPOS),
+        'formats': ['<i8', '<u2', '<f4', '<u2', 'u1', 'u1', '<u2', 'u1', 'i1', '<u2'],
+        'offsets': [0, 8, 10, 14, 16, 17, 18, 20, 21, 22],
+        'itemsize': TAMANHO_REGISTRO,
+    })
+else:
+    DTYPE = None
+
+
+def empacotar_bits(led_verde, led_amarelo, led_vermelho, buzzer):
+    return ((BIT_LED_VERDE if led_verde else 0) | (BIT_LED_AMARELO if led_amarelo else 0)
+            | (BIT_LED_VERMELHO if led_vermelho else 0) | (BIT_BUZZER if buzzer else 0))
+
+
+def codigo_status(status):
+    try:
+        return STATUS.index(status)
+    except ValueError:
+        return STATUS.index('Sem_Resposta')
+
+
+def codigo_rtt(rtt_s):
+    """RTT em segundos -> décimos de ms (1..65535); None -> 0 (desconhecido)."""
+    if rtt_s is None:
+        return 0
+    return max(1, min(65535, int(round(rtt_s * 10000))))
+
+
+def codigo_rssi_ul(rssi_ul):
+    """RSSI de uplink em dBm -> int8; None -> 0 (desconhecido)."""
+    if rssi_ul is None:
+        return 0
+    return max(-128, min(-1, int(round(rssi_ul))))
+
+
+def rtt_ms(codigos):
+    """Coluna 'rtt_dms' -> RTT em ms (NaN quando desconhecido)."""
+    if np is not None and isinstance(codigos, np.ndarray):
+        return np.where(codigos == 0, np.nan, codigos / 10.0)
+    return [float('nan') if codigo == 0 else codigo / 10.0 for codigo in codigos]
+
+
+def rssi_ul_dbm(codigos):
+    """Coluna 'rssi_ul' -> dBm (NaN quando desconhecido)."""
+    if np is not None and isinstance(codigos, np.ndarray):
+        return np.where(codigos == 0, np.nan, codigos.astype('f8'))
+    return [float('nan') if codigo == 0 else float(codigo) for codigo in codigos]
+
+
+# --- Escrita ---
+class EscritorBinario(EscritorEmGrupo):
+    """Escritor append-only de registros fixos, com o mesmo buffer em grupo dos CSVs."""
+
+    def _preparar_arquivo(self):
+        if os.path.isfile(self.caminho) and os.path.getsize(self.caminho) >= TAMANHO_CABECALHO:
+            with open(self.caminho, 'rb') as f:
+                validar_cabecalho(f.read(TAMANHO_CABECALHO), self.caminho)
+            # Descarta um registro parcial deixado por uma queda no meio da gravação
+            excesso = (os.path.getsize(self.caminho) - TAMANHO_CABECALHO) % TAMANHO_REGISTRO
+            if excesso:
+                os.truncate(self.caminho, os.path.getsize(self.caminho) - excesso)
+            return b''
+        if os.path.isfile(self.caminho):
+            os.truncate(self.caminho, 0)
+        return CABECALHO.pack(MAGICO, VERSAO, TAMANHO_REGISTRO, int(time.time() * 1000))
+
+    def _serializar(self, registros):
+        dados = bytearray(TAMANHO_REGISTRO * len(registros))
+        for i, registro in enumerate(registros):
+            REGISTRO.pack_into(dados, i * TAMANHO_REGISTRO, *registro)
+        return dados
+
+    def registrar(self, timestamp_ms, id_no, rssi, luminosidade, bits, seq_down=0, seq_up=0, status='Sucesso',
+                  rssi_ul=None, rtt_s=None):
+        self.escrever((int(timestamp_ms), int(id_no), float(rssi), int(luminosidade), int(bits),
+                       int(seq_down) % 256, int(seq_up) % 65536, codigo_status(status),
+                       codigo_rssi_ul(rssi_ul), codigo_rtt(rtt_s)))
+
+
+def validar_cabecalho(dados, caminho=''):
+    if len(dados) < TAMANHO_CABECALHO:
+        raise ValueError(f"Arquivo binário '{caminho}' sem cabeçalho completo.")
+    magico, versao, tamanho, _criado = CABECALHO.unpack_from(dados)
+    if magico != MAGICO or versao != VERSAO or tamanho != TAMANHO_REGISTRO:
+        raise ValueError(f"Arquivo '{caminho}' não é um armazenamento binário TwinSEN compatível.")
+
+
+# --- Leitura ---
+class LeitorBinario:
+    """
+    Leitor por mmap. O mapeamento é refeito apenas quando o arquivo cresce além
+    do trecho já mapeado; registros parciais no final são ignorados.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._mm = None
+        self._tamanho_mapeado = 0
+        self._inode = None
+
+    def _mapear(self):
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Arquivo não encontrado: {self.caminho}")
+        if self._mm is not None and st.st_ino == self._inode and st.st_size <= self._tamanho_mapeado:
+            return
+        if st.st_size < TAMANHO_CABECALHO:
+            self._mm, self._tamanho_mapeado, self._inode = None, 0, st.st_ino
+            return
+        with open(self.caminho, 'rb') as f:
+            # O mmap antigo não é fechado explicitamente: visões NumPy já entregues
+            # continuam válidas até serem coletadas.
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        validar_cabecalho(mm[:TAMANHO_CABECALHO], self.caminho)
+        self._mm, self._tamanho_mapeado, self._inode = mm, len(mm), st.st_ino
+
+    @property
+    def inode(self):
+        return self._inode
+
+    def __len__(self):
+        self._mapear()
+        if self._mm is None:
+            return 0
+        return (self._tamanho_mapeado - TAMANHO_CABECALHO) // TAMANHO_REGISTRO
+
+    def fatia(self, inicio, fim=None):
+        """
+        Registros [inicio, fim). Com NumPy devolve um array estruturado que é
+        uma visão sem cópia do mmap; sem NumPy, uma lista de tuplas.
+        """
+        total = len(self)
+        fim = total if fim is None else max(0, min(fim, total))
+        inicio = max(0, min(inicio, fim))
+        quantidade = fim - inicio
+        deslocamento = TAMANHO_CABECALHO + inicio * TAMANHO_REGISTRO
+        if np is not None:
+            if self._mm is None or quantidade == 0:
+                return np.empty(0, dtype=DTYPE)
+            return np.frombuffer(self._mm, dtype=DTYPE, count=quantidade, offset=deslocamento)
+        if self._mm is None or quantidade == 0:
+            return []
+        visao = memoryview(self._mm)[deslocamento:deslocamento + quantidade * TAMANHO_REGISTRO]
+        return list(REGISTRO.iter_unpack(visao))
+
+    def ultimas(self, n):
+        """Últimas n amostras, localizadas em O(1) pelo tamanho do arquivo."""
+        total = len(self)
+        return self.fatia(max(0, total - n), total)
+
+
+def decodificar(dados):
+    """Registros contidos em 'dados' (múltiplo de TAMANHO_REGISTRO), no mesmo formato de fatia()."""
+    dados = memoryview(dados)[:len(dados) - len(dados) % TAMANHO_REGISTRO]
+    if np is not None:
+        return np.frombuffer(dados, dtype=DTYPE)
+    return list(REGISTRO.iter_unpack(dados))
+
+
+def concatenar(anteriores, registros):
+    if not len(anteriores):
+        return registros
+    if np is not None:
+        return np.concatenate([anteriores, registros])
+    return list(anteriores) + list(registros)
+
+
+# --- Partições fechadas (rotação) ---
+def ultimos_registros_particoes(caminho, n):
+    """Últimos n registros das partições fechadas do arquivo vivo 'caminho', em ordem cronológica."""
+    registros = decodificar(b'')
+    for arquivo, _fim in reversed(particoes.particoes(caminho)):
+        faltam = n - len(registros)
+        if faltam <= 0:
+            break
+        try:
+            dados = particoes.cauda_bytes(arquivo, faltam * TAMANHO_REGISTRO, TAMANHO_CABECALHO)
+        except (OSError, EOFError):
+            continue
+        registros = concatenar(decodificar(dados[len(dados) % TAMANHO_REGISTRO:]), registros)
+    return registros
+
+
+def registros_particao_recente(caminho, inicio):
+    """Registros a partir do índice 'inicio' da partição fechada mais recente (o arquivo que acabou de rotacionar)."""
+    for _tentativa in range(2):
+        lista = particoes.particoes(caminho)
+        if not lista:
+            break
+        try:
+            with particoes.abrir(lista[-1][0]) as f:
+                f.seek(TAMANHO_CABECALHO + inicio * TAMANHO_REGISTRO)
+                return decodificar(f.read())
+        except FileNotFoundError:
+            continue   # compactada entre a listagem e a abertura: lista de novo
+    return decodificar(b'')
+
+
+def medicoes(registros):
+    """Só os registros que trazem uma medição (sem timeouts e duplicados), no mesmo formato de fatia()."""
+    if np is not None and isinstance(registros, np.ndarray):
+        return registros[np.isin(registros['status'], STATUS_MEDICAO)]
+    return [r for r in registros if r[7] in STATUS_MEDICAO]
+
+
+def colunas(registros):
+    """Converte o resultado de LeitorBinario.fatia em um dicionário coluna -> sequência."""
+    if np is not None and isinstance(registros, np.ndarray):
+        return {campo: registros[campo] for campo in CAMPOS}
+    return {campo: [r[i] for r in registros] for i, campo in enumerate(CAMPOS)}
+
+
+# --- Conversão dos CSVs existentes ---
+def _ler_csv(caminho):
+    if not os.path.isfile(caminho):
+        return
+    with open(caminho, 'r', encoding='utf-8', newline='') as f:
+        leitor = csv.reader(f)
+        cabecalho = next(leitor, None)
+        if not cabecalho:
+            return
+        indice = {nome: i for i, nome in enumerate(cabecalho)}
+        for linha in leitor:
+            try:
+                ts = int(datetime.fromisoformat(linha[indice['Timestamp']]).timestamp() * 1000)
+            except (ValueError, IndexError, KeyError):
+                continue
+            no = int(linha[indice['No']]) if 'No' in indice and len(linha) > indice['No'] else 1
+            yield ts, no, linha, indice
+
+
+def converter_csv(caminho_rede, caminho_aplicacao, destino):
+    """
+    Junta dados_brutos_rede.csv e dados_brutos_aplicacao.csv (mesmo timestamp e
+    nó para cada pacote) em um arquivo binário. Os dois arquivos são lidos em
+    paralelo, em fluxo, sem carregar o histórico em memória.
+    """
+    escritor = EscritorBinario(destino, max_linhas=4096, max_atraso_s=3600)
+    rede, aplicacao = _ler_csv(caminho_rede), _ler_csv(caminho_aplicacao)
+    r, a = next(rede, None), next(aplicacao, None)
+    total = 0
+    while r is not None or a is not None:
+        if r is not None and a is not None and (r[0], r[1]) == (a[0], a[1]):
+            registro_rede, registro_app = r, a
+            r, a = next(rede, None), next(aplicacao, None)
+        elif a is None or (r is not None and r[0] <= a[0]):
+            registro_rede, registro_app = r, None
+            r = next(rede, None)
+        else:
+            registro_rede, registro_app = None, a
+            a = next(aplicacao, None)
+
+        ts, no = (registro_rede or registro_app)[:2]
+        rssi, status, luminosidade = float('nan'), 'Sucesso', 0
+        if registro_rede is not None:
+            _ts, _no, linha, indice = registro_rede
+            try:
+                rssi = float(linha[indice['RSSI_Downlink']])
+            except (ValueError, IndexError, KeyError):
+                pass
+            status = linha[indice['Status']] if 'Status' in indice and len(linha) > indice['Status'] else status
+        if registro_app is not None:
+            _ts, _no, linha, indice = registro_app
+            try:
+                luminosidade = int(float(linha[indice['Luminosidade']]))
+            except (ValueError, IndexError, KeyError):
+                pass
+        escritor.registrar(ts, no, rssi, luminosidade, 0, status=status)
+        total += 1
+    escritor.fechar()
+    return total
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Converte os CSVs de dados brutos para o formato binário.")
+    dir_nivel4 = os.path.dirname(os.path.abspath(__file__))
+    parser.add_argument('--rede', default=os.path.join(dir_nivel4, 'dados_brutos_rede.csv'))
+    parser.add_argument('--aplicacao', default=os.path.join(dir_nivel4, 'dados_brutos_aplicacao.csv'))
+    parser.add_argument('--destino', default=os.path.join(dir_nivel4, 'dados_brutos.bin'))
+    args = parser.parse_args()
+    if os.path.exists(args.destino):
+        parser.error(f"'{args.destino}' já existe; remova-o ou escolha outro destino.")
+    convertidos = converter_csv(args.rede, args.aplicacao, args.destino)
+    print(f"{convertidos} registros gravados em '{args.destino}'.")
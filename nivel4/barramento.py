@@ -0,0 +1,111 @@
+# nivel4/barramento.py - Entrega em memória das amostras no modo unificado do init.py
+#
+# Quando gateway, análise e dashboard rodam no mesmo processo, o gateway
+# publica cada amostra aqui além de gravá-la no nivel4. Os consumidores
+# recebem as amostras por uma fila em memória com a mesma interface dos
+# seguidores de arquivo (novas_amostras/fechar), então o nivel5 e o nivel6 não
+# precisam verificar os arquivos em disco. criar_seguidor (telemetria.py) usa o
+# barramento instalado automaticamente; nos processos separados nada muda.
+
+import threading
+from collections import deque
+
+CAPACIDADE_PADRAO = 10000
+
+_ativo = None
+
+
+class AssinaturaFluxo:
+    """Fila de um consumidor para um fluxo ('rede' ou 'aplicacao'); amostras como tuplas de COLUNAS[fluxo]."""
+
+    em_memoria = True
+
+    def __init__(self, barramento, fluxo, iniciais, capacidade):
+        self.barramento = barramento
+        self.fluxo = fluxo
+        self._fila = deque(iniciais, maxlen=capacidade)
+        self._lock = threading.Lock()
+        self.descartadas = 0
+
+    def entregar(self, amostra):
+        with self._lock:
+            if len(self._fila) == self._fila.maxlen:
+                # Consumidor parado: as mais antigas são descartadas, como no limite de atraso dos seguidores
+                self.descartadas += 1
+            self._fila.append(amostra)
+
+    def novas_amostras(self):
+        with self._lock:
+            amostras = list(self._fila)
+            self._fila.clear()
+        return amostras
+
+    def fechar(self):
+        self.barramento.cancelar(self)
+
+
+class Barramento:
+    """Publicação das amostras do gateway para os consumidores do mesmo processo."""
+
+    def __init__(self, capacidade=CAPACIDADE_PADRAO):
+        self.capacidade = capacidade
+        self._recentes = {'rede': deque(maxlen=capacidade), 'aplicacao': deque(maxlen=capacidade)}
+        self._assinaturas = {'rede': [], 'aplicacao': []}
+        self._callbacks = []
+        self._lock = threading.Lock()
+        self.publicadas = 0
+
+    def carregar_historico(self, fonte, colunas_fluxos):
+        """
+        Preenche as amostras recentes a partir do disco (fonte de
+        telemetria.abrir_fonte, colunas em telemetria.COLUNAS), antes de o
+        gateway começar a publicar.
+        """
+        for fluxo in self._recentes:
+            try:
+                colunas = fonte.ultimas(fluxo, self.capacidade)
+            except (FileNotFoundError, ValueError):
+                continue
+            amostras = zip(*(colunas[nome] for nome in colunas_fluxos[fluxo]))
+            self._recentes[fluxo].extend(tuple(a.item() if hasattr(a, 'item') else a for a in amostra)
+                                         for amostra in amostras)
+
+    def publicar(self, fluxo, amostra):
+        with self._lock:
+            self._recentes[fluxo].append(amostra)
+            assinaturas = list(self._assinaturas[fluxo])
+            self.publicadas += 1
+        for assinatura in assinaturas:
+            assinatura.entregar(amostra)
+
+    def notificar(self):
+        """Avisa os interessados (ex.: o difusor SSE) depois de um lote de publicações."""
+        for callback in self._callbacks:
+            callback()
+
+    def ao_publicar(self, callback):
+        self._callbacks.append(callback)
+
+    def assinar(self, fluxo, amostras_iniciais=0):
+        """Nova fila do fluxo, começando pelas últimas 'amostras_iniciais' amostras."""
+        with self._lock:
+            recentes = list(self._recentes[fluxo])
+            iniciais = recentes[-amostras_iniciais:] if amostras_iniciais > 0 else []
+            assinatura = AssinaturaFluxo(self, fluxo, iniciais, self.capacidade)
+            self._assinaturas[fluxo].append(assinatura)
+        return assinatura
+
+    def cancelar(self, assinatura):
+        with self._lock:
+            if assinatura in self._assinaturas[assinatura.fluxo]:
+                self._assinaturas[assinatura.fluxo].remove(assinatura)
+
+
+def instalar(barramento):
+    """Torna 'barramento' o barramento do processo (usado por criar_seguidor e pelo gateway)."""
+    global _ativo
+    _ativo = barramento
+
+
+def ativo():
+    return _ativo
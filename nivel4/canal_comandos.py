@@ -0,0 +1,147 @@
+# nivel4/canal_comandos.py - Canal de comandos local entre o dashboard e o gateway
+#
+# O nivel6 envia comandos (ex.: novos limiares) direto ao loop do gateway por
+# um socket Unix de datagramas em 'nivel4/comandos.sock', em vez de esperar o
+# gateway notar a mudança no configuracoes.yaml. Cada mensagem é um objeto
+# JSON em um datagrama. O gateway responde ao endereço do remetente: primeiro
+# 'aceito' (com os nós alvo) e, quando todos confirmam ou esgotam as
+# tentativas, o resultado final. Sem AF_UNIX (Windows), o canal usa UDP em
+# 127.0.0.1 na porta 'nivel3.comandos.porta'.
+
+import itertools
+import json
+import os
+import socket
+import tempfile
+import time
+
+PORTA_PADRAO = 8899
+TAMANHO_MAXIMO = 65507
+
+ACEITO = 'aceito'
+CONCLUIDO = 'concluido'
+
+_contador_clientes = itertools.count()
+
+
+def _unix():
+    return hasattr(socket, 'AF_UNIX')
+
+
+def endereco_canal(config, caminho_socket):
+    """Endereço do canal: o caminho do socket Unix ou (127.0.0.1, porta) sem AF_UNIX."""
+    if _unix():
+        return caminho_socket
+    porta = int((config or {}).get('nivel3', {}).get('comandos', {}).get('porta', PORTA_PADRAO))
+    return ('127.0.0.1', porta)
+
+
+def codificar(mensagem):
+    return json.dumps(mensagem, separators=(',', ':')).encode('utf-8')
+
+
+def decodificar(dados):
+    try:
+        mensagem = json.loads(dados.decode('utf-8'))
+    except (UnicodeDecodeError, ValueError):
+        return None
+    return mensagem if isinstance(mensagem, dict) else None
+
+
+# --- Lado do gateway ---
+def abrir_servidor(endereco):
+    """Socket não bloqueante do gateway. Um socket Unix deixado por uma execução anterior é removido."""
+    if isinstance(endereco, str):
+        try:
+            os.unlink(endereco)
+        except FileNotFoundError:
+            pass
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    else:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind(endereco)
+    sock.setblocking(False)
+    return sock
+
+
+def responder(sock, remetente, mensagem):
+    """Resposta ao cliente; um cliente que já desistiu de esperar é ignorado."""
+    if not remetente:
+        return
+    try:
+        sock.sendto(codificar(mensagem), remetente)
+    except OSError:
+        pass
+
+
+def fechar_servidor(sock, endereco):
+    sock.close()
+    if isinstance(endereco, str):
+        try:
+            os.unlink(endereco)
+        except OSError:
+            pass
+
+
+# --- Lado do dashboard ---
+class ClienteComandos:
+    """
+    Envia um comando e espera as respostas do gateway. Cada chamada usa um
+    socket próprio (as requisições do Flask rodam em threads).
+    """
+
+    def __init__(self, endereco):
+        self.endereco = endereco
+
+    def _abrir(self):
+        if isinstance(self.endereco, str):
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            caminho = os.path.join(tempfile.gettempdir(), f'twsn-cmd-{os.getpid()}-{next(_contador_clientes)}.sock')
+            try:
+                os.unlink(caminho)
+            except FileNotFoundError:
+                pass
+            sock.bind(caminho)
+            return sock, caminho
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.bind(('127.0.0.1', 0))
+        return sock, None
+
+    def enviar(self, mensagem, espera_s=2.0, espera_aceite_s=0.25):
+        """
+        Envia 'mensagem' e devolve a última resposta recebida: a final
+        ('concluido') se chegou dentro de 'espera_s', senão a de 'aceito'. None se
+        o gateway não respondeu em 'espera_aceite_s' (parado ou desligado).
+        """
+        sock, caminho = self._abrir()
+        try:
+            try:
+                sock.sendto(codificar(mensagem), self.endereco)
+            except (FileNotFoundError, ConnectionRefusedError, OSError):
+                return None
+            resposta = None
+            limite = time.monotonic() + espera_aceite_s
+            while True:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    return resposta
+                sock.settimeout(restante)
+                try:
+                    dados = sock.recv(TAMANHO_MAXIMO)
+                except (socket.timeout, OSError):
+                    return resposta
+                recebida = decodificar(dados)
+                if recebida is None or recebida.get('id') != mensagem.get('id'):
+                    continue
+                resposta = recebida
+                if resposta.get('estado') != ACEITO:
+                    return resposta
+                # Aceito: espera o resultado final até o limite total
+                limite = time.monotonic() + espera_s
+        finally:
+            sock.close()
+            if caminho:
+                try:
+                    os.unlink(caminho)
+                except OSError:
+                    pass
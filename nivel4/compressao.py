@@ -0,0 +1,293 @@
+# nivel4/compressao.py - Compressão das séries brutas no registro do gateway e reconstrução nos leitores
+#
+# Com nós medindo a cada 0,7 s, a maior parte das linhas dos dados brutos
+# repete o valor anterior. O estágio de registro do gateway passa cada série
+# (um fluxo de um nó) por um compressor e só grava as amostras necessárias:
+#
+#   banda_morta      grava quando o valor sai de +-desvio do último gravado
+#                    (reconstrução em degrau);
+#   porta_giratoria  swinging door: grava os extremos dos segmentos de reta
+#                    que passam a até 'desvio' de todas as amostras omitidas
+#                    (reconstrução linear). O ponto guardado só é gravado
+#                    quando chega a amostra seguinte do mesmo nó, então pode
+#                    sair até um intervalo fora de ordem em relação aos
+#                    outros nós;
+#   silencio_max_s   heartbeat (em qualquer modo): uma amostra é gravada pelo
+#                    menos a cada 'silencio_max_s', mesmo sem variação.
+#
+# A configuração fica em nivel3.compressao.<fluxo> e pode ser sobrescrita por
+# nó em nivel1.nos[].compressao.<fluxo>. No fluxo 'rede' só as linhas de
+# sucesso são comprimidas (timeouts, duplicados e atrasados sempre vão para o
+# disco). Os leitores (SeguidorReconstruido, em telemetria.criar_seguidor)
+# recriam as amostras omitidas no intervalo de medição do nó, em degrau ou
+# lineares: como o heartbeat limita o silêncio de uma série comprimida, uma
+# lacuna maior é uma falha do enlace e não é preenchida. O nivel5/reprocessar.py
+# aplica as mesmas regras, vetorizadas, antes de recalcular as janelas. No modo unificado o
+# barramento em memória recebe todas as amostras; só o disco é comprimido.
+#
+# A reconstrução depende do intervalo nominal do nó. Com nivel3.taxa_adaptativa
+# ligada o intervalo real muda (o nó é consultado mais rápido perto do limiar
+# crítico), e a contagem de amostras recriadas sairia errada. Por isso a
+# compressão fica desligada enquanto a taxa adaptativa estiver ligada, e os
+# leitores também deixam de reconstruir. Lacunas de dados gravados antes, com
+# compressão, não são preenchidas.
+
+import math
+
+from metricas import obter_metricas
+
+NENHUMA = 'nenhuma'
+BANDA_MORTA = 'banda_morta'
+PORTA_GIRATORIA = 'porta_giratoria'
+MODOS = (NENHUMA, BANDA_MORTA, PORTA_GIRATORIA)
+
+FLUXOS = ('rede', 'aplicacao')
+INTERVALO_PADRAO_S = 0.7
+LIMITE_RECONSTRUCAO = 10000   # amostras recriadas por lacuna sem heartbeat configurado
+
+_metricas = obter_metricas()
+AMOSTRAS = _metricas.contador('twsn_compressao_amostras_total',
+                              'Amostras que passaram pelos compressores (recebida) e que foram gravadas',
+                              ('fluxo', 'resultado'))
+RAZAO = _metricas.medidor('twsn_compressao_razao', 'Amostras recebidas por amostra gravada', ('fluxo',))
+
+
+# --- Configuração ---
+def taxa_adaptativa(config):
+    """True com nivel3.taxa_adaptativa ligada: o intervalo real dos nós deixa de ser o nominal."""
+    return bool(((config or {}).get('nivel3', {}).get('taxa_adaptativa') or {}).get('ligada', False))
+
+
+def parametros(config, fluxo, id_no=None, configurados=False):
+    """
+    {'modo', 'desvio', 'silencio_max_s'} do fluxo para o nó (a definição do nó
+    sobrescreve a da frota). Com a taxa adaptativa ligada o modo é 'nenhuma',
+    a menos que 'configurados' peça os parâmetros como estão no YAML.
+    """
+    config = config or {}
+    resultado = {'modo': NENHUMA, 'desvio': 0.0, 'silencio_max_s': None}
+    resultado.update(((config.get('nivel3', {}).get('compressao') or {}).get(fluxo)) or {})
+    if id_no is not None:
+        for definicao in config.get('nivel1', {}).get('nos') or []:
+            if int(definicao.get('id', -1)) == int(id_no):
+                resultado.update(((definicao.get('compressao') or {}).get(fluxo)) or {})
+    if resultado['modo'] not in MODOS:
+        raise ValueError(f"Compressão '{resultado['modo']}' inválida em {fluxo}. Use um de {', '.join(MODOS)}.")
+    if not configurados and taxa_adaptativa(config):
+        resultado['modo'] = NENHUMA
+    resultado['desvio'] = float(resultado.get('desvio') or 0.0)
+    silencio = resultado.get('silencio_max_s')
+    resultado['silencio_max_s'] = float(silencio) if silencio else None
+    return resultado
+
+
+def intervalo_no(config, id_no):
+    """Intervalo nominal de medição do nó (None: da frota), em segundos (nivel1.nos[].intervalo_medicoes ou nivel3)."""
+    config = config or {}
+    intervalo = config.get('nivel3', {}).get('intervalo_medicoes', INTERVALO_PADRAO_S)
+    for definicao in config.get('nivel1', {}).get('nos') or []:
+        if id_no is not None and int(definicao.get('id', -1)) == int(id_no):
+            intervalo = definicao.get('intervalo_medicoes', intervalo)
+    return float(intervalo)
+
+
+def lacuna_maxima(p, intervalo_ms):
+    """Maior lacuna (ms) entre duas amostras gravadas que ainda é preenchida; além dela, falha do enlace."""
+    return (p['silencio_max_s'] * 1000 + 2 * intervalo_ms if p['silencio_max_s']
+            else (LIMITE_RECONSTRUCAO + 1) * intervalo_ms)
+
+
+def ligada(config, configurados=False):
+    """True se algum fluxo, da frota ou de algum nó, tem compressão (ou a tem no YAML, com 'configurados')."""
+    config = config or {}
+    nos = [None] + [definicao.get('id') for definicao in config.get('nivel1', {}).get('nos') or []]
+    return any(parametros(config, fluxo, id_no, configurados)['modo'] != NENHUMA for fluxo in FLUXOS for id_no in nos)
+
+
+# --- Compressores ---
+class Compressor:
+    """Decide quais amostras de uma série são gravadas. 'item' é o que o escritor recebe (linha ou registro)."""
+
+    def __init__(self, modo=NENHUMA, desvio=0.0, silencio_max_s=None):
+        self.modo = modo
+        self.desvio = float(desvio)
+        self.silencio_ms = silencio_max_s * 1000 if silencio_max_s else math.inf
+        self._arquivado = None    # (ts, valor) do último ponto gravado
+        self._guardado = None     # (ts, valor, item) ainda não gravado (porta giratória)
+        self._superior = math.inf
+        self._inferior = -math.inf
+
+    def amostra(self, ts, valor, item):
+        """Itens a gravar agora (0, 1 ou 2, em ordem) para a amostra nova."""
+        if self.modo == NENHUMA or valor is None or math.isnan(valor):
+            return [item]
+        arquivado = self._arquivado
+        if arquivado is None or ts - arquivado[0] >= self.silencio_ms:
+            # Primeira amostra ou heartbeat: grava o ponto guardado e a amostra
+            saida = [self._guardado[2]] if self._guardado is not None else []
+            saida.append(item)
+            self._arquivar(ts, valor)
+            return saida
+        if self.modo == BANDA_MORTA:
+            if abs(valor - arquivado[1]) > self.desvio:
+                self._arquivar(ts, valor)
+                return [item]
+            return []
+        # Porta giratória: a porta fecha quando nenhuma reta a partir do ponto
+        # arquivado passa a até 'desvio' de todas as amostras desde então
+        dt = max(ts - arquivado[0], 1)
+        superior = min(self._superior, (valor + self.desvio - arquivado[1]) / dt)
+        inferior = max(self._inferior, (valor - self.desvio - arquivado[1]) / dt)
+        if inferior <= superior or self._guardado is None:
+            self._superior, self._inferior = superior, inferior
+            self._guardado = (ts, valor, item)
+            return []
+        ts_g, valor_g, item_g = self._guardado
+        self._arquivado = (ts_g, valor_g)
+        dt = max(ts - ts_g, 1)
+        self._superior = (valor + self.desvio - valor_g) / dt
+        self._inferior = (valor - self.desvio - valor_g) / dt
+        self._guardado = (ts, valor, item)
+        return [item_g]
+
+    def _arquivar(self, ts, valor):
+        self._arquivado = (ts, valor)
+        self._guardado = None
+        self._superior, self._inferior = math.inf, -math.inf
+
+    def pendentes(self):
+        """Ponto guardado ainda não gravado (no encerramento ou ao reconfigurar)."""
+        if self._guardado is None:
+            return []
+        ts, valor, item = self._guardado
+        self._arquivar(ts, valor)
+        return [item]
+
+
+class CompressaoRegistro:
+    """Compressores por (fluxo, nó) do estágio de registro, com as contagens para a razão de compressão."""
+
+    def __init__(self, config=None):
+        self.config = config
+        self._compressores = {}
+        self.recebidas = {fluxo: 0 for fluxo in FLUXOS}
+        self.gravadas = {fluxo: 0 for fluxo in FLUXOS}
+        self._recebidas = {fluxo: AMOSTRAS.rotulos(fluxo, 'recebida') for fluxo in FLUXOS}
+        self._gravadas = {fluxo: AMOSTRAS.rotulos(fluxo, 'gravada') for fluxo in FLUXOS}
+
+    def configurar(self, config):
+        """Nova configuração: os pontos guardados pelos compressores antigos são devolvidos para gravação."""
+        pendentes = self.pendentes()
+        self.config = config
+        self._compressores = {}
+        return pendentes
+
+    def filtrar(self, fluxo, id_no, ts, valor, item):
+        chave = (fluxo, id_no)
+        compressor = self._compressores.get(chave)
+        if compressor is None:
+            compressor = self._compressores[chave] = Compressor(**parametros(self.config, fluxo, id_no))
+        itens = compressor.amostra(ts, valor, item)
+        self.recebidas[fluxo] += 1
+        self._recebidas[fluxo].inc()
+        self._contar_gravadas(fluxo, len(itens))
+        return itens
+
+    def _contar_gravadas(self, fluxo, quantidade):
+        if quantidade:
+            self.gravadas[fluxo] += quantidade
+            self._gravadas[fluxo].inc(quantidade)
+
+    def pendentes(self):
+        """[(fluxo, item)] guardados por todos os compressores."""
+        pendentes = [(fluxo, item) for (fluxo, _id_no), compressor in self._compressores.items()
+                     for item in compressor.pendentes()]
+        for fluxo, _item in pendentes:
+            self._contar_gravadas(fluxo, 1)
+        return pendentes
+
+    def razoes(self):
+        """Amostras recebidas por amostra gravada, por fluxo (None sem amostras)."""
+        razoes = {}
+        for fluxo in FLUXOS:
+            razoes[fluxo] = self.recebidas[fluxo] / self.gravadas[fluxo] if self.gravadas[fluxo] else None
+            if razoes[fluxo] is not None:
+                RAZAO.rotulos(fluxo).definir(razoes[fluxo])
+        return razoes
+
+
+# --- Reconstrução nos leitores ---
+class SeguidorReconstruido:
+    """
+    Envolve um seguidor de telemetria e recria, entre duas amostras gravadas
+    de um nó, as amostras suprimidas pela compressão: no intervalo nominal do
+    nó, com o valor anterior (banda_morta) ou interpolado (porta_giratoria).
+    No fluxo 'rede' as recriadas são sucessos sem RSSI de uplink nem RTT, e os
+    timeouts e atrasados gravados na lacuna ocupam o lugar de uma medição.
+    """
+
+    def __init__(self, seguidor, fluxo, obter_config):
+        self.seguidor = seguidor
+        self.fluxo = fluxo
+        self.obter_config = obter_config
+        self._config = None
+        self._ultimas = {}     # nó -> última amostra gravada que entra na série
+        self._ocupados = {}    # nó -> timeouts desde então
+        self._series = {}      # nó -> (modo, intervalo_ms, lacuna máxima em ms)
+
+    def __getattr__(self, nome):
+        return getattr(self.seguidor, nome)
+
+    def _serie(self, id_no):
+        config = self.obter_config()
+        if config is not self._config:
+            # Configuração recarregada: modos e intervalos são relidos
+            self._config, self._series = config, {}
+        if id_no not in self._series:
+            p = parametros(config, self.fluxo, id_no)
+            intervalo_ms = intervalo_no(config, id_no) * 1000
+            self._series[id_no] = (p['modo'], intervalo_ms, lacuna_maxima(p, intervalo_ms))
+        return self._series[id_no]
+
+    def novas_amostras(self):
+        saida = []
+        for amostra in self.seguidor.novas_amostras():
+            id_no = int(amostra[3] if self.fluxo == 'rede' else amostra[2])
+            if self.fluxo == 'rede' and amostra[2] != 'Sucesso':
+                if amostra[2] in ('Timeout', 'Atrasado'):
+                    self._ocupados[id_no] = self._ocupados.get(id_no, 0) + 1
+                saida.append(amostra)
+                continue
+            modo, intervalo_ms, lacuna = self._serie(id_no)
+            anterior = self._ultimas.get(id_no)
+            if modo != NENHUMA and anterior is not None:
+                saida.extend(self._recriar(anterior, amostra, id_no, modo, intervalo_ms, lacuna))
+            self._ultimas[id_no] = amostra
+            self._ocupados[id_no] = 0
+            saida.append(amostra)
+        return saida
+
+    def _recriar(self, anterior, amostra, id_no, modo, intervalo_ms, lacuna):
+        # float(): no formato binário os valores vêm como inteiros sem sinal do numpy
+        t0, v0, t1, v1 = int(anterior[0]), float(anterior[1]), int(amostra[0]), float(amostra[1])
+        if t1 - t0 > lacuna or t1 <= t0:
+            return []   # falha do enlace (sem heartbeat) ou fora de ordem: nada a recriar
+        faltantes = int(round((t1 - t0) / intervalo_ms)) - 1 - self._ocupados.get(id_no, 0)
+        if faltantes <= 0:
+            return []
+        passo = (t1 - t0) / (faltantes + 1)
+        recriadas = []
+        for k in range(1, faltantes + 1):
+            ts = int(t0 + k * passo)
+            valor = v0 if modo == BANDA_MORTA or math.isnan(v1) else v0 + (v1 - v0) * k / (faltantes + 1)
+            if self.fluxo == 'rede':
+                recriadas.append((ts, valor, 'Sucesso', id_no, math.nan, math.nan))
+            else:
+                recriadas.append((ts, valor, id_no))
+        return recriadas
+
+
+def interpolacao(config, fluxo, id_no=None):
+    """Como desenhar a série gravada: 'degrau', 'linear' ou None sem compressão."""
+    modo = parametros(config, fluxo, id_no)['modo']
+    return {BANDA_MORTA: 'degrau', PORTA_GIRATORIA: 'linear'}.get(modo)
@@ -0,0 +1,288 @@
+# nivel4/configuracao.py - Carregador de configuração compartilhado por todos os níveis
+#
+# Mantém o configuracoes.yaml já interpretado em memória e só o relê quando o
+# arquivo muda (mtime, inode ou tamanho, ou evento do inotify no Linux).
+# Cada leitura devolve um "retrato" imutável da configuração, e os chamadores
+# podem registrar callbacks para seções específicas (ex.: 'nivel1.porta',
+# 'nivel6.limiar_*').
+
+import ctypes
+import ctypes.util
+import fnmatch
+import os
+import struct
+import sys
+import tempfile
+import threading
+import time
+from types import MappingProxyType
+
+import yaml
+
+from metricas import Cronometro, obter_metricas
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+CAMINHO_PADRAO = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'configuracoes.yaml')
+
+# Intervalo mínimo entre verificações de mudança no arquivo (segundos)
+INTERVALO_VERIFICACAO = 0.2
+
+TEMPO_LEITURA = obter_metricas().histograma('twsn_config_leitura_segundos', 'Leitura e interpretação do configuracoes.yaml')
+TEMPO_ESCRITA = obter_metricas().histograma('twsn_config_escrita_segundos',
+                                            'Leitura-modificação-escrita atômica do configuracoes.yaml')
+
+
+# --- Funções auxiliares ---
+def salvar_yaml_seguro(caminho, dados):
+    """Escreve o YAML de forma atômica (arquivo temporário + os.replace)."""
+    dir_name = os.path.dirname(caminho)
+    with tempfile.NamedTemporaryFile('w', dir=dir_name, delete=False, encoding="utf-8") as tmp:
+        yaml.dump(dados, tmp, default_flow_style=False, sort_keys=False)
+        temp_name = tmp.name
+    os.replace(temp_name, caminho)
+
+
+def congelar(valor):
+    """Converte dicionários e listas em estruturas somente leitura."""
+    if isinstance(valor, dict):
+        return MappingProxyType({k: congelar(v) for k, v in valor.items()})
+    if isinstance(valor, (list, tuple)):
+        return tuple(congelar(v) for v in valor)
+    return valor
+
+
+def descongelar(valor):
+    """Cópia mutável (dict/list) de um retrato, por exemplo para salvar em YAML."""
+    if isinstance(valor, MappingProxyType) or isinstance(valor, dict):
+        return {k: descongelar(v) for k, v in valor.items()}
+    if isinstance(valor, tuple):
+        return [descongelar(v) for v in valor]
+    return valor
+
+
+def _achatar(dados, prefixo=''):
+    """{'nivel1': {'porta': 1}} -> {'nivel1.porta': 1}. Listas são tratadas como folhas."""
+    itens = {}
+    for chave, valor in (dados or {}).items():
+        caminho = f"{prefixo}{chave}"
+        if isinstance(valor, (dict, MappingProxyType)) and valor:
+            itens.update(_achatar(valor, caminho + '.'))
+        else:
+            itens[caminho] = valor
+    return itens
+
+
+def chaves_alteradas(antigo, novo):
+    """Caminhos pontuados que mudaram entre dois retratos, incluindo as seções pai."""
+    plano_antigo, plano_novo = _achatar(antigo), _achatar(novo)
+    alteradas = set()
+    for chave in plano_antigo.keys() | plano_novo.keys():
+        if plano_antigo.get(chave, _AUSENTE) != plano_novo.get(chave, _AUSENTE):
+            partes = chave.split('.')
+            for i in range(1, len(partes) + 1):
+                alteradas.add('.'.join(partes[:i]))
+    return alteradas
+
+
+_AUSENTE = object()
+
+
+# --- Observador via inotify (opcional, apenas Linux) ---
+class _Inotify:
+    """Observa o diretório do arquivo; o os.replace dos escritores troca o inode."""
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_Q_OVERFLOW = 0x00004000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    def __init__(self, caminho):
+        self.nome = os.path.basename(caminho).encode()
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falhou")
+        mascara = self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_CREATE | self.IN_DELETE
+        diretorio = os.path.dirname(caminho).encode()
+        if libc.inotify_add_watch(self.fd, diretorio, mascara) < 0:
+            os.close(self.fd)
+            raise OSError(ctypes.get_errno(), "inotify_add_watch falhou")
+
+    def houve_mudanca(self):
+        """Consome os eventos pendentes; True se algum se refere ao arquivo."""
+        mudou = False
+        while True:
+            try:
+                dados = os.read(self.fd, 4096)
+            except BlockingIOError:
+                return mudou
+            deslocamento = 0
+            while deslocamento + 16 <= len(dados):
+                _wd, mascara, _cookie, tamanho = struct.unpack_from('iIII', dados, deslocamento)
+                nome = dados[deslocamento + 16:deslocamento + 16 + tamanho].rstrip(b'\0')
+                if nome == self.nome or mascara & self.IN_Q_OVERFLOW:
+                    mudou = True
+                deslocamento += 16 + tamanho
+
+    def fechar(self):
+        os.close(self.fd)
+
+
+# --- Carregador ---
+class ConfiguracaoCompartilhada:
+    """
+    Cache do configuracoes.yaml. 'obter()' custa, no caso comum, uma leitura do
+    relógio; o arquivo só é reinterpretado quando muda de fato.
+    """
+
+    def __init__(self, caminho=CAMINHO_PADRAO, intervalo_verificacao=INTERVALO_VERIFICACAO, usar_inotify=True):
+        self.caminho = os.path.abspath(caminho)
+        self.intervalo_verificacao = intervalo_verificacao
+        self._retrato = None
+        self._assinatura = None
+        self._proxima_verificacao = 0.0
+        self._callbacks = []
+        self._lock = threading.RLock()
+        self.recargas = 0
+
+        self._inotify = None
+        if usar_inotify and sys.platform.startswith('linux'):
+            try:
+                self._inotify = _Inotify(self.caminho)
+            except (OSError, AttributeError, TypeError):
+                self._inotify = None
+
+    # --- Leitura ---
+    def obter(self):
+        """Retrato imutável mais recente, ou None se o arquivo nunca pôde ser lido."""
+        agora = time.monotonic()
+        if agora >= self._proxima_verificacao:
+            self._proxima_verificacao = agora + self.intervalo_verificacao
+            self._verificar()
+        return self._retrato
+
+    def _assinatura_atual(self):
+        try:
+            st = os.stat(self.caminho)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_ino, st.st_size)
+
+    def _verificar(self):
+        if self._inotify is not None and self._retrato is not None:
+            if not self._inotify.houve_mudanca():
+                return
+        assinatura = self._assinatura_atual()
+        if assinatura is not None and assinatura != self._assinatura:
+            self.recarregar(assinatura)
+
+    def recarregar(self, assinatura=None):
+        """Relê o arquivo imediatamente. Mantém o último retrato válido em caso de erro."""
+        with self._lock:
+            assinatura = assinatura or self._assinatura_atual()
+            try:
+                with Cronometro(TEMPO_LEITURA), open(self.caminho, 'r', encoding='utf-8') as f:
+                    dados = yaml.safe_load(f) or {}
+            except FileNotFoundError:
+                print(f"ERRO: Arquivo de configuração não encontrado em '{self.caminho}'. Verifique o caminho.")
+                return self._retrato
+            except yaml.YAMLError as e:
+                print(f"ERRO: Formato inválido no arquivo YAML: {e}")
+                return self._retrato
+
+            return self._instalar(dados, assinatura)
+
+    def _instalar(self, dados, assinatura):
+        with self._lock:
+            antigo, novo = self._retrato, congelar(dados)
+            self._retrato, self._assinatura = novo, assinatura
+            self.recargas += 1
+        self._notificar(antigo, novo)
+        return novo
+
+    # --- Callbacks ---
+    def registrar_callback(self, padrao, funcao):
+        """
+        Chama 'funcao(retrato, alteradas)' quando alguma chave que casa com o
+        padrão muda. O padrão é um caminho pontuado com curingas do fnmatch,
+        por exemplo 'nivel1.porta', 'nivel6.limiar_*' ou 'nivel3'.
+        """
+        self._callbacks.append((padrao, funcao))
+
+    def _notificar(self, antigo, novo):
+        if antigo is None or not self._callbacks:
+            return
+        alteradas = chaves_alteradas(antigo, novo)
+        if not alteradas:
+            return
+        for padrao, funcao in list(self._callbacks):
+            relevantes = {c for c in alteradas if fnmatch.fnmatchcase(c, padrao)}
+            if relevantes:
+                try:
+                    funcao(novo, relevantes)
+                except Exception as e:
+                    print(f"Erro no callback de configuração '{padrao}': {e}")
+
+    # --- Escrita ---
+    def atualizar(self, modificar):
+        """
+        Leitura-modificação-escrita atômica do YAML: 'modificar(dados)' recebe um
+        dicionário mutável. Um lock de arquivo serializa escritores de processos
+        diferentes (base, análise e webapp).
+        """
+        with self._lock, _TravaArquivo(self.caminho + '.lock'), Cronometro(TEMPO_ESCRITA):
+            try:
+                with open(self.caminho, 'r', encoding='utf-8') as f:
+                    dados = yaml.safe_load(f) or {}
+            except FileNotFoundError:
+                dados = {}
+            modificar(dados)
+            salvar_yaml_seguro(self.caminho, dados)
+            # O processo que escreve já conhece o conteúdo: não precisa reinterpretar
+            return self._instalar(dados, self._assinatura_atual())
+
+    def fechar(self):
+        if self._inotify is not None:
+            self._inotify.fechar()
+            self._inotify = None
+
+
+class _TravaArquivo:
+    """Lock exclusivo entre processos via fcntl.flock (sem efeito no Windows)."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._f = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self._f = open(self.caminho, 'a')
+            fcntl.flock(self._f, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._f is not None:
+            fcntl.flock(self._f, fcntl.LOCK_UN)
+            self._f.close()
+            self._f = None
+
+
+# --- Instâncias compartilhadas por processo ---
+_instancias = {}
+_instancias_lock = threading.Lock()
+
+
+def obter_configuracao(caminho=CAMINHO_PADRAO):
+    """Instância única de ConfiguracaoCompartilhada por arquivo neste processo."""
+    caminho = os.path.abspath(caminho)
+    with _instancias_lock:
+        if caminho not in _instancias:
+            _instancias[caminho] = ConfiguracaoCompartilhada(caminho)
+        return _instancias[caminho]
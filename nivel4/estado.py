@@ -0,0 +1,177 @@
+# nivel4/estado.py - Canal de estado ao vivo dos nós (segmento mmap com seqlock)
+#
+# O estado dos atuadores e a última luminosidade de cada nó mudam a cada
+# pacote e não pertencem ao configuracoes.yaml. O gateway (nivel3) publica
+# esse estado em um arquivo pequeno de tamanho fixo, mapeado em memória, e o
+# nivel6 lê direto do mapeamento, sem parsing nem chamadas ao gateway.
+#
+#   cabeçalho (64 bytes): mágico, versão, nº de slots, tamanho do slot, nó principal
+#   slots (32 bytes cada, indexados pelo ID do nó 0..255):
+#     0   seq                uint32  (seqlock: ímpar = escrita em andamento)
+#     4   no                 uint16
+#     6   luminosidade       uint16
+#     8   rssi               float32
+#     12  bits               uint8   (mesmos bits do armazenamento binário)
+#     13  valido             uint8
+#     14  seq_up             uint16
+#     16  atualizado_ms      int64
+#     24  pacotes_recebidos  uint32
+#     28  pacotes_enviados   uint32
+#
+# Há um único escritor (o gateway). O leitor relê o seq antes e depois de
+# copiar o slot e repete a leitura se ele mudou ou estava ímpar.
+
+import mmap
+import os
+import struct
+import time
+from datetime import datetime
+
+from armazenamento_binario import BIT_LED_VERDE, BIT_LED_AMARELO, BIT_LED_VERMELHO, BIT_BUZZER
+
+MAGICO = b'TWSNEST1'
+VERSAO = 1
+CABECALHO = struct.Struct('<8sHHHH48x')   # mágico, versão, slots, tamanho do slot, principal
+SEQ = struct.Struct('<I')
+DADOS = struct.Struct('<HHfBBHqII')
+TAMANHO_SLOT = SEQ.size + DADOS.size      # 32
+NUM_SLOTS = 256
+TAMANHO_ARQUIVO = CABECALHO.size + NUM_SLOTS * TAMANHO_SLOT
+SEM_PRINCIPAL = 0xFFFF
+
+TENTATIVAS_LEITURA = 64
+
+
+def _deslocamento(id_no):
+    if not 0 <= id_no < NUM_SLOTS:
+        raise ValueError(f"ID de nó {id_no} fora do intervalo 0..{NUM_SLOTS - 1}.")
+    return CABECALHO.size + id_no * TAMANHO_SLOT
+
+
+def _cabecalho_valido(dados):
+    magico, versao, slots, tamanho, _principal = CABECALHO.unpack_from(dados)
+    return magico == MAGICO and versao == VERSAO and slots == NUM_SLOTS and tamanho == TAMANHO_SLOT
+
+
+class PublicadorEstado:
+    """Lado do gateway: cria (ou reaproveita) o segmento e publica o estado de cada nó."""
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        fd = os.open(caminho, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            novo = os.fstat(fd).st_size != TAMANHO_ARQUIVO
+            if not novo:
+                novo = not _cabecalho_valido(os.pread(fd, CABECALHO.size, 0))
+            if novo:
+                # Reutiliza o mesmo inode: leitores já mapeados continuam válidos
+                os.ftruncate(fd, 0)
+                os.ftruncate(fd, TAMANHO_ARQUIVO)
+            self._mm = mmap.mmap(fd, TAMANHO_ARQUIVO)
+        finally:
+            os.close(fd)
+        if novo:
+            CABECALHO.pack_into(self._mm, 0, MAGICO, VERSAO, NUM_SLOTS, TAMANHO_SLOT, SEM_PRINCIPAL)
+
+    def definir_principal(self, id_no):
+        """Nó exibido pelo dashboard (o primeiro de 'nivel1.nos')."""
+        CABECALHO.pack_into(self._mm, 0, MAGICO, VERSAO, NUM_SLOTS, TAMANHO_SLOT,
+                            SEM_PRINCIPAL if id_no is None else id_no)
+
+    def publicar(self, id_no, luminosidade, rssi, bits, seq_up=0, pacotes_recebidos=0,
+                 pacotes_enviados=0, timestamp_ms=None):
+        posicao = _deslocamento(id_no)
+        if timestamp_ms is None:
+            timestamp_ms = time.time() * 1000
+        seq = SEQ.unpack_from(self._mm, posicao)[0]
+        SEQ.pack_into(self._mm, posicao, (seq + 1) & 0xFFFFFFFF)
+        DADOS.pack_into(self._mm, posicao + SEQ.size, id_no, int(luminosidade) & 0xFFFF, float(rssi),
+                        int(bits), 1, int(seq_up or 0) & 0xFFFF, int(timestamp_ms),
+                        int(pacotes_recebidos) & 0xFFFFFFFF, int(pacotes_enviados) & 0xFFFFFFFF)
+        SEQ.pack_into(self._mm, posicao, (seq + 2) & 0xFFFFFFFF)
+
+    def fechar(self):
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+
+
+class LeitorEstado:
+    """
+    Lado dos leitores (nivel6): mapeia o segmento em modo leitura. Se o
+    arquivo ainda não existe, as leituras retornam None até o gateway criá-lo.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._mm = None
+        self._inode = None
+
+    def _mapear(self):
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            self._mm = None
+            return False
+        if self._mm is not None and st.st_ino == self._inode:
+            return True
+        if st.st_size != TAMANHO_ARQUIVO:
+            return False
+        with open(self.caminho, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), TAMANHO_ARQUIVO, access=mmap.ACCESS_READ)
+        if not _cabecalho_valido(mm):
+            mm.close()
+            return False
+        self._mm, self._inode = mm, st.st_ino
+        return True
+
+    def principal(self):
+        if not self._mapear():
+            return None
+        principal = CABECALHO.unpack_from(self._mm, 0)[4]
+        return None if principal == SEM_PRINCIPAL else principal
+
+    def ler(self, id_no=None):
+        """Estado do nó (ou do nó principal) como dicionário; None se ainda não publicado."""
+        if id_no is None:
+            id_no = self.principal()
+            if id_no is None:
+                return None
+        if not self._mapear():
+            return None
+        posicao = _deslocamento(id_no)
+        for _ in range(TENTATIVAS_LEITURA):
+            antes = SEQ.unpack_from(self._mm, posicao)[0]
+            if antes & 1:
+                continue
+            dados = DADOS.unpack_from(self._mm, posicao + SEQ.size)
+            if SEQ.unpack_from(self._mm, posicao)[0] == antes:
+                break
+        else:
+            return None
+        no, luminosidade, rssi, bits, valido, seq_up, atualizado_ms, recebidos, enviados = dados
+        if not valido:
+            return None
+        return {
+            'no': no, 'luminosidade': luminosidade, 'rssi': rssi, 'bits': bits, 'seq_up': seq_up,
+            'atualizado_ms': atualizado_ms, 'pacotes_recebidos': recebidos, 'pacotes_enviados': enviados,
+        }
+
+    def todos(self):
+        """Estado de todos os nós já publicados."""
+        if not self._mapear():
+            return []
+        return [estado for estado in (self.ler(i) for i in range(NUM_SLOTS)) if estado is not None]
+
+
+def para_dashboard(estado):
+    """Campos no formato usado pelo dashboard (antes gravados em 'nivel6' no YAML)."""
+    if estado is None:
+        return {}
+    bits = estado['bits']
+    return {
+        'led_verde': bool(bits & BIT_LED_VERDE), 'led_amarelo': bool(bits & BIT_LED_AMARELO),
+        'led_vermelho': bool(bits & BIT_LED_VERMELHO), 'buzzer': bool(bits & BIT_BUZZER),
+        'luminosidade_atual': estado['luminosidade'],
+        'ultima_atualizacao': datetime.fromtimestamp(estado['atualizado_ms'] / 1000).strftime('%Y-%m-%d %H:%M:%S'),
+    }
@@ -0,0 +1,614 @@
+# nivel4/historico.py - Consultas por intervalo de tempo com índice esparso e redução de pontos
+#
+# Para os CSVs, um IndiceTemporal guarda uma entrada a cada ~BLOCO_INDICE bytes
+# do arquivo: timestamp da primeira linha do bloco, deslocamento em bytes,
+# número de amostras e mínimo/máximo (com seus instantes) da coluna de valor,
+# para a série e para cada nó que aparece no bloco.
+# O índice é construído de forma incremental (só os bytes novos são varridos)
+# e persistido ao lado do arquivo ('<arquivo>.idx'), então localizar um
+# intervalo é uma busca binária. Intervalos curtos são lidos e reduzidos por
+# mín/máx ou LTTB; intervalos longos usam direto os mín/máx dos blocos, de modo
+# que o custo da consulta depende do número de pontos pedido, não do número de
+# amostras no intervalo. No formato binário a busca é feita direto nos
+# registros fixos. Com a rotação ligada (particoes.py), a consulta percorre as
+# partições fechadas que cobrem o intervalo e o arquivo vivo, como um só fluxo;
+# partições compactadas são lidas descompactando em fluxo; uma partição que não
+# pode ser lida (corrompida ou apagada pela retenção no meio da leitura) é
+# pulada e listada em 'ignoradas'. Para os fluxos
+# brutos da frota, quando o nivel5 mantém agregados (agregados.py), a consulta
+# usa o nível de resolução adequado ao intervalo em vez das amostras. Séries
+# brutas gravadas com compressão indicam como interpolar entre os pontos.
+
+import lzma
+import math
+import os
+import struct
+import threading
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+
+import agregados
+import armazenamento_binario as binario
+import compressao
+import particoes
+from telemetria import caminhos_dados, formato, FORMATO_BINARIO
+
+BLOCO_INDICE = 8 * 1024
+TAMANHO_LEITURA = 1024 * 1024
+MAGICO_INDICE = b'TWSNIDX2'
+CABECALHO_INDICE = struct.Struct('<8sQQ')      # mágico, inode do CSV, fim do último bloco fechado
+ENTRADA_INDICE = struct.Struct('<qqIdqdqH')    # ts, deslocamento, amostras, mín, ts do mín, máx, ts do máx, nós
+ENTRADA_NO = struct.Struct('<iIdqdq')          # nó, amostras, mín, ts do mín, máx, ts do máx (uma por nó do bloco)
+
+# fluxo -> (chave em caminhos_dados, coluna de valor, filtro (coluna, valor aceito))
+FLUXOS = {
+    'aplicacao': ('aplicacao', 'Luminosidade', None),
+    'rede': ('rede', 'RSSI_Downlink', ('Status', 'Sucesso')),
+    'stats_aplicacao': ('stats_aplicacao', 'Luminosidade_Media', None),
+    # Uma linha agregada por ciclo ('Todos') e uma por nó (estatísticas de enlace)
+    'stats_rede': ('stats_rede', 'RSSI_Downlink_Media', ('No', 'Todos')),
+}
+
+# Acima disto, o LTTB recebe os pontos já pré-reduzidos por mín/máx
+LIMITE_LTTB = 20
+
+# Amostras gravadas com atraso (buffer dos escritores) podem cair em uma
+# partição fechada um pouco depois do seu timestamp
+FOLGA_PARTICAO_MS = 60 * 1000
+
+# Falhas de leitura de uma partição (truncada, corrompida ou removida durante a consulta)
+ERROS_LEITURA = (OSError, EOFError, zlib.error, lzma.LZMAError)
+
+
+# --- Timestamps ---
+def _iso_ms(texto):
+    return int(datetime.fromisoformat(texto).timestamp() * 1000)
+
+
+def _estatisticas_ms(texto):
+    return int(datetime.strptime(texto, '%d-%m-%Y %H:%M:%S').timestamp() * 1000)
+
+
+def detectar_conversor(texto):
+    """Conversor de timestamp para epoch-ms: ISO (dados brutos) ou dd-mm-aaaa (estatísticas)."""
+    for conversor in (_iso_ms, _estatisticas_ms):
+        try:
+            conversor(texto)
+            return conversor
+        except ValueError:
+            continue
+    return None
+
+
+# --- Redução de pontos ---
+def reduzir_minmax(ts, vs, pontos):
+    """Divide o intervalo em pontos/2 faixas de tempo iguais e mantém o mínimo e o máximo de cada uma."""
+    n = len(ts)
+    if n <= pontos:
+        return list(ts), list(vs)
+    grupos = max(1, pontos // 2)
+    t0, t1 = ts[0], ts[-1]
+    largura = (t1 - t0) / grupos or 1
+    if binario.np is not None and isinstance(vs, binario.np.ndarray):
+        np = binario.np
+        limites = np.searchsorted(ts, t0 + largura * np.arange(1, grupos), side='left')
+        saida_t, saida_v = [], []
+        for fatia_v, fatia_t in zip(np.split(vs, limites), np.split(ts, limites)):
+            if len(fatia_v):
+                a, b = int(fatia_v.argmin()), int(fatia_v.argmax())
+                for k in sorted({a, b}):
+                    saida_t.append(int(fatia_t[k])); saida_v.append(float(fatia_v[k]))
+        return saida_t, saida_v
+    minimos, maximos = {}, {}
+    for i in range(n):
+        g = min(grupos - 1, int((ts[i] - t0) / largura))
+        if g not in minimos or vs[i] < vs[minimos[g]]: minimos[g] = i
+        if g not in maximos or vs[i] > vs[maximos[g]]: maximos[g] = i
+    indices = sorted(set(minimos.values()) | set(maximos.values()))
+    return [ts[i] for i in indices], [vs[i] for i in indices]
+
+
+def reduzir_lttb(ts, vs, pontos):
+    """Largest-Triangle-Three-Buckets: preserva a forma visual da série com 'pontos' pontos."""
+    if len(ts) > LIMITE_LTTB * pontos:
+        ts, vs = reduzir_minmax(ts, vs, LIMITE_LTTB * pontos)
+    ts, vs = list(ts), list(vs)
+    n = len(ts)
+    if n <= pontos or pontos < 3:
+        return ts, vs
+    saida_t, saida_v = [ts[0]], [vs[0]]
+    tamanho = (n - 2) / (pontos - 2)
+    a = 0
+    for i in range(pontos - 2):
+        inicio, fim = int(i * tamanho) + 1, int((i + 1) * tamanho) + 1
+        prox_inicio, prox_fim = fim, min(int((i + 2) * tamanho) + 1, n)
+        # média do próximo balde (o último balde usa o último ponto)
+        if prox_inicio >= prox_fim:
+            media_t, media_v = ts[-1], vs[-1]
+        else:
+            media_t = sum(ts[prox_inicio:prox_fim]) / (prox_fim - prox_inicio)
+            media_v = sum(vs[prox_inicio:prox_fim]) / (prox_fim - prox_inicio)
+        melhor, maior_area = inicio, -1.0
+        for j in range(inicio, fim):
+            area = abs((ts[a] - media_t) * (vs[j] - vs[a]) - (ts[a] - ts[j]) * (media_v - vs[a]))
+            if area > maior_area:
+                melhor, maior_area = j, area
+        saida_t.append(ts[melhor]); saida_v.append(vs[melhor])
+        a = melhor
+    saida_t.append(ts[-1]); saida_v.append(vs[-1])
+    return saida_t, saida_v
+
+
+def reduzir(ts, vs, pontos, metodo):
+    return reduzir_lttb(ts, vs, pontos) if metodo == 'lttb' else reduzir_minmax(ts, vs, pontos)
+
+
+# --- Índice esparso dos CSVs ---
+class IndiceTemporal:
+    """Índice timestamp -> deslocamento de um CSV append-only, com mín/máx por bloco (e por nó no bloco)."""
+
+    def __init__(self, caminho, coluna, filtro=None, persistir=True):
+        self.caminho = caminho
+        self.coluna = coluna
+        self.filtro = filtro
+        self.caminho_indice = caminho + '.idx' if persistir else None
+        self._lock = threading.Lock()
+        self._zerar()
+
+    def _zerar(self):
+        self.ts, self.off, self.amostras = array('q'), array('q'), array('l')
+        self.vmin, self.tmin, self.vmax, self.tmax = array('d'), array('q'), array('d'), array('q')
+        self.por_no = []          # {nó: [amostras, mín, ts do mín, máx, ts do máx]} de cada bloco
+        self._inode = None
+        self._varrido = None      # posição após a última linha completa processada
+        self._fechado = None      # início do bloco aberto (os anteriores estão no .idx)
+        self._colunas = None
+        self._conversor = None
+        self._completo = False    # partição compactada já varrida até o fim
+
+    # --- Persistência ---
+    def _carregar(self, inode):
+        if not self.caminho_indice or not os.path.isfile(self.caminho_indice):
+            return
+        try:
+            with open(self.caminho_indice, 'rb') as f:
+                magico, inode_idx, fechado = CABECALHO_INDICE.unpack(f.read(CABECALHO_INDICE.size))
+                if magico != MAGICO_INDICE or inode_idx != inode:
+                    return
+                dados = f.read()
+        except (OSError, struct.error):
+            return
+        posicao = 0
+        while posicao + ENTRADA_INDICE.size <= len(dados):
+            *entrada, nos = ENTRADA_INDICE.unpack_from(dados, posicao)
+            fim = posicao + ENTRADA_INDICE.size + nos * ENTRADA_NO.size
+            if fim > len(dados):
+                break
+            por_no = {e[0]: list(e[1:]) for e in ENTRADA_NO.iter_unpack(dados[posicao + ENTRADA_INDICE.size:fim])}
+            self._anexar(*entrada, por_no=por_no)
+            posicao = fim
+        if self.ts:
+            self._fechado = self._varrido = fechado
+
+    def _persistir_bloco(self, k, fim_bloco):
+        if not self.caminho_indice:
+            return
+        try:
+            novo = not os.path.isfile(self.caminho_indice) or k == 0
+            with open(self.caminho_indice, 'wb' if novo else 'r+b') as f:
+                if novo:
+                    f.write(CABECALHO_INDICE.pack(MAGICO_INDICE, self._inode, fim_bloco))
+                f.seek(0, os.SEEK_END)
+                f.write(ENTRADA_INDICE.pack(self.ts[k], self.off[k], self.amostras[k], self.vmin[k],
+                                            self.tmin[k], self.vmax[k], self.tmax[k], len(self.por_no[k])))
+                f.write(b''.join(ENTRADA_NO.pack(no, *e) for no, e in self.por_no[k].items()))
+                f.seek(0)
+                f.write(CABECALHO_INDICE.pack(MAGICO_INDICE, self._inode, fim_bloco))
+        except OSError:
+            self.caminho_indice = None   # diretório sem permissão de escrita: índice só em memória
+
+    # --- Construção incremental ---
+    def _anexar(self, ts, off, amostras=0, vmin=math.inf, tmin=0, vmax=-math.inf, tmax=0, por_no=None):
+        self.ts.append(ts); self.off.append(off); self.amostras.append(amostras)
+        self.vmin.append(vmin); self.tmin.append(tmin); self.vmax.append(vmax); self.tmax.append(tmax)
+        self.por_no.append({} if por_no is None else por_no)
+
+    def _ler_cabecalho(self):
+        with particoes.abrir(self.caminho) as f:
+            linha = f.readline()
+            primeira = f.readline()
+        if not linha.endswith(b'\n'):
+            return None
+        self._colunas = {nome: i for i, nome in enumerate(linha.decode('utf-8').strip().split(','))}
+        if primeira.endswith(b'\n') and 'Timestamp' in self._colunas:
+            # O formato do timestamp é o mesmo em todo o arquivo: detectado uma vez
+            campos = primeira.decode('utf-8', 'replace').strip().split(',')
+            if self._colunas['Timestamp'] < len(campos):
+                self._conversor = detectar_conversor(campos[self._colunas['Timestamp']])
+        return len(linha)
+
+    def atualizar(self):
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Arquivo não encontrado: {self.caminho}")
+        # Partição compactada: imutável, e st_size não é o tamanho do conteúdo
+        fechada = particoes.comprimido(self.caminho)
+        if st.st_ino != self._inode or (not fechada and self._varrido is not None and st.st_size < self._varrido):
+            # Arquivo novo, rotacionado ou truncado: recomeça (reaproveitando o .idx se for do mesmo inode)
+            self._zerar()
+            self._inode = st.st_ino
+        if self._colunas is None:
+            inicio = self._ler_cabecalho()
+            if inicio is None:
+                return
+            self._varrido = self._fechado = inicio
+            self._carregar(st.st_ino)
+        if not fechada and st.st_size > self._varrido:
+            self._varrer()
+        elif fechada and not self._completo:
+            self._varrer()
+            if self.ts and self.off[-1] >= self._fechado:
+                # Nada mais será acrescentado: o último bloco também vai para o .idx
+                self._persistir_bloco(len(self.ts) - 1, self._varrido)
+                self._fechado = self._varrido
+            self._completo = True
+
+    def _varrer(self):
+        i_ts = self._colunas.get('Timestamp')
+        i_valor = self._colunas.get(self.coluna)
+        i_filtro = self._colunas.get(self.filtro[0]) if self.filtro else None
+        aceito = self.filtro[1].encode() if self.filtro else None
+        i_no = self._colunas.get('No')
+        # Por nó, o filtro da linha agregada não vale (ver _ler_trecho)
+        i_filtro_no = None if self.filtro and self.filtro[0] == 'No' else i_filtro
+        if i_ts is None:
+            return
+        with particoes.abrir(self.caminho) as f:
+            f.seek(self._varrido)
+            posicao, resto = self._varrido, b''
+            while True:
+                dados = f.read(TAMANHO_LEITURA)
+                if not dados:
+                    break
+                # Só linhas completas; o resto (linha sendo gravada) fica para a próxima
+                dados = resto + dados
+                fim = dados.rfind(b'\n') + 1
+                for linha in dados[:fim].split(b'\n')[:-1]:
+                    self._processar(linha, posicao, i_ts, i_valor, i_filtro, aceito, i_no, i_filtro_no)
+                    posicao += len(linha) + 1
+                resto = dados[fim:]
+        self._varrido = posicao
+
+    def _processar(self, linha, posicao, i_ts, i_valor, i_filtro, aceito, i_no=None, i_filtro_no=None):
+        campos = linha.rstrip(b'\r').split(b',')
+        try:
+            texto = campos[i_ts].decode('ascii')
+            if self._conversor is None:
+                self._conversor = detectar_conversor(texto)
+            ts = self._conversor(texto)
+        except (IndexError, ValueError, TypeError, UnicodeDecodeError):
+            return
+        k = len(self.ts) - 1
+        if k < 0 or self.off[k] < self._fechado:
+            self._anexar(ts, posicao); k += 1
+        elif posicao - self.off[k] >= BLOCO_INDICE:
+            self._persistir_bloco(k, posicao)
+            self._fechado = posicao
+            self._anexar(ts, posicao); k += 1
+        if i_valor is None:
+            return
+        try:
+            valor = float(campos[i_valor])
+        except (IndexError, ValueError):
+            return
+        if math.isnan(valor):
+            return
+        if i_filtro is None or (i_filtro < len(campos) and campos[i_filtro] == aceito):
+            self.amostras[k] += 1
+            if valor < self.vmin[k]: self.vmin[k], self.tmin[k] = valor, ts
+            if valor > self.vmax[k]: self.vmax[k], self.tmax[k] = valor, ts
+        if i_filtro_no is not None and (i_filtro_no >= len(campos) or campos[i_filtro_no] != aceito):
+            return
+        try:
+            no = int(campos[i_no]) if i_no is not None else 1
+        except (IndexError, ValueError):
+            return
+        e = self.por_no[k].get(no)
+        if e is None:
+            self.por_no[k][no] = [1, valor, ts, valor, ts]
+            return
+        e[0] += 1
+        if valor < e[1]: e[1], e[2] = valor, ts
+        if valor > e[3]: e[3], e[4] = valor, ts
+
+    # --- Leitura ---
+    def _ler_trecho(self, inicio_byte, fim_byte, inicio, fim, no=None):
+        """Amostras (ts, valor) entre dois deslocamentos, restritas a [inicio, fim] e ao nó."""
+        i_ts, i_valor = self._colunas['Timestamp'], self._colunas.get(self.coluna)
+        i_filtro = self._colunas.get(self.filtro[0]) if self.filtro else None
+        aceito = self.filtro[1].encode() if self.filtro else None
+        if no is not None and self.filtro and self.filtro[0] == 'No':
+            i_filtro = None   # o nó pedido substitui o filtro da linha agregada (estatísticas de rede)
+        i_no = self._colunas.get('No')
+        ts_saida, vs_saida = [], []
+        if i_valor is None:
+            return ts_saida, vs_saida
+        with particoes.abrir(self.caminho) as f:
+            f.seek(inicio_byte)
+            dados = f.read(fim_byte - inicio_byte)
+        for linha in dados.split(b'\n'):
+            campos = linha.rstrip(b'\r').split(b',')
+            try:
+                ts = self._conversor(campos[i_ts].decode('ascii'))
+                if ts < inicio or ts > fim:
+                    continue
+                if i_filtro is not None and campos[i_filtro] != aceito:
+                    continue
+                if no is not None and (int(campos[i_no]) if i_no is not None else 1) != no:
+                    continue
+                valor = float(campos[i_valor])
+            except (IndexError, ValueError, TypeError, UnicodeDecodeError):
+                continue
+            ts_saida.append(ts); vs_saida.append(valor)
+        return ts_saida, vs_saida
+
+    def consultar(self, inicio, fim, pontos, metodo='minmax', no=None):
+        with self._lock:
+            self.atualizar()
+            if not self.ts or self._conversor is None:
+                return {'timestamps': [], 'valores': [], 'amostras': 0, 'agregado': False}
+            i = max(0, bisect_right(self.ts, inicio) - 1)
+            j = bisect_right(self.ts, fim)
+            limites = list(self.off[i:j]) + [self.off[j] if j < len(self.off) else self._varrido]
+            blocos = j - i
+            if blocos <= 0:
+                return {'timestamps': [], 'valores': [], 'amostras': 0, 'agregado': False}
+
+            if blocos <= max(2, pontos // 2):
+                ts, vs = self._ler_trecho(limites[0], limites[-1], inicio, fim, no)
+                ts_red, vs_red = reduzir(ts, vs, pontos, metodo)
+                return {'timestamps': ts_red, 'valores': vs_red, 'amostras': len(ts), 'agregado': False}
+
+            # Intervalo longo: mín/máx dos blocos (do nó, se pedido); só os dois blocos das pontas são lidos
+            agregados = []
+            for k in range(i, j):
+                if k in (i, j - 1):
+                    ts, vs = self._ler_trecho(limites[k - i], limites[k - i + 1], inicio, fim, no)
+                    if vs:
+                        a, b = vs.index(min(vs)), vs.index(max(vs))
+                        agregados.append((len(vs), vs[a], ts[a], vs[b], ts[b]))
+                elif no is not None:
+                    if no in self.por_no[k]:
+                        agregados.append(tuple(self.por_no[k][no]))
+                elif self.amostras[k]:
+                    agregados.append((self.amostras[k], self.vmin[k], self.tmin[k], self.vmax[k], self.tmax[k]))
+            grupos = max(1, pontos // 2)
+            ts_saida, vs_saida, total = [], [], 0
+            for g in range(grupos):
+                parte = agregados[g * len(agregados) // grupos:(g + 1) * len(agregados) // grupos]
+                if not parte:
+                    continue
+                menor = min(parte, key=lambda e: e[1])
+                maior = max(parte, key=lambda e: e[3])
+                total += sum(e[0] for e in parte)
+                for t, v in sorted({(menor[2], menor[1]), (maior[4], maior[3])}):
+                    ts_saida.append(t); vs_saida.append(v)
+            return {'timestamps': ts_saida, 'valores': vs_saida, 'amostras': total, 'agregado': True}
+
+
+# --- Formato binário ---
+class _ColunaTempo:
+    """Sequência de timestamps do arquivo binário para o bisect (sem NumPy)."""
+
+    def __init__(self, leitor, total):
+        self.leitor, self.total = leitor, total
+
+    def __len__(self):
+        return self.total
+
+    def __getitem__(self, i):
+        return self.leitor.fatia(i, i + 1)[0][0]
+
+
+def _intervalo_binario(leitor, inicio, fim):
+    """Registros com timestamp em [inicio, fim] de um arquivo binário mapeado (busca binária)."""
+    total = len(leitor)
+    if binario.np is not None:
+        tempos = leitor.fatia(0, total)['timestamp_ms']
+        a, b = int(binario.np.searchsorted(tempos, inicio, 'left')), int(binario.np.searchsorted(tempos, fim, 'right'))
+    else:
+        tempos = _ColunaTempo(leitor, total)
+        a, b = bisect_left(tempos, inicio), bisect_right(tempos, fim)
+    return leitor.fatia(a, b)
+
+
+def _intervalo_binario_comprimido(arquivo, inicio, fim):
+    """Registros com timestamp em [inicio, fim] de uma partição compactada, descompactando em fluxo."""
+    selecionados = binario.decodificar(b'')
+    with particoes.abrir(arquivo) as f:
+        f.read(binario.TAMANHO_CABECALHO)
+        resto = b''
+        while True:
+            dados = f.read(binario.TAMANHO_REGISTRO * 65536)
+            if not dados:
+                break
+            dados = resto + dados
+            corte = len(dados) - len(dados) % binario.TAMANHO_REGISTRO
+            registros, resto = binario.decodificar(dados[:corte]), dados[corte:]
+            if binario.np is not None:
+                tempos = registros['timestamp_ms']
+                trecho = registros[(tempos >= inicio) & (tempos <= fim)].copy()
+                passou = len(tempos) and tempos[-1] > fim
+            else:
+                trecho = [r for r in registros if inicio <= r[0] <= fim]
+                passou = registros and registros[-1][0] > fim
+            selecionados = binario.concatenar(selecionados, trecho)
+            if passou:
+                break
+    return selecionados
+
+
+def _serie_binaria(registros, fluxo, no=None):
+    """
+    (timestamps, valores) do fluxo nos registros e do nó pedido: na rede só os
+    pacotes de sucesso, na aplicação só os registros com medição.
+    """
+    c = binario.colunas(registros)
+    ts, vs = c['timestamp_ms'], c['rssi'] if fluxo == 'rede' else c['luminosidade']
+    aceitos = (binario.STATUS.index('Sucesso'),) if fluxo == 'rede' else binario.STATUS_MEDICAO
+    if binario.np is not None:
+        mascara = binario.np.isin(c['status'], aceitos)
+        if no is not None:
+            mascara &= c['no'] == no
+        return ts[mascara], vs[mascara].astype('f8')
+    manter = [k for k in range(len(ts)) if c['status'][k] in aceitos and (no is None or c['no'][k] == no)]
+    return [ts[k] for k in manter], [float(vs[k]) for k in manter]
+
+
+def consultar_binario(arquivos, fluxo, inicio, fim, pontos, metodo='minmax', no=None):
+    """Série do fluxo nos arquivos binários (partições em ordem e o arquivo vivo)."""
+    ts, vs, ignoradas = [], [], []
+    for arquivo in arquivos:
+        try:
+            if particoes.comprimido(arquivo):
+                registros = _intervalo_binario_comprimido(arquivo, inicio, fim)
+            else:
+                with _lock:
+                    if arquivo not in _leitores:
+                        _leitores[arquivo] = binario.LeitorBinario(arquivo)
+                    leitor = _leitores[arquivo]
+                registros = _intervalo_binario(leitor, inicio, fim)
+        except ERROS_LEITURA as e:
+            ignoradas.append(_ignorar(arquivo, e, _leitores))
+            continue
+        ts_arquivo, vs_arquivo = _serie_binaria(registros, fluxo, no)
+        if binario.np is not None:
+            ts = binario.np.concatenate([ts, ts_arquivo]) if len(ts) else ts_arquivo
+            vs = binario.np.concatenate([vs, vs_arquivo]) if len(vs) else vs_arquivo
+        else:
+            ts += ts_arquivo; vs += vs_arquivo
+    ts_red, vs_red = reduzir(ts, vs, pontos, metodo)
+    return {'timestamps': [int(t) for t in ts_red], 'valores': [float(v) for v in vs_red],
+            'amostras': len(ts), 'agregado': False, 'ignoradas': ignoradas}
+
+
+# --- Agregados ---
+_leitores_agregados = {}
+
+
+def leitor_agregados(config, fluxo):
+    """LeitorAgregados do fluxo bruto, ou None se o nivel5 não mantém agregados para ele."""
+    if fluxo not in agregados.FLUXOS:
+        return None
+    caminho = agregados.caminho_agregados(caminhos_dados(config)['dir'], fluxo)
+    if not os.path.isfile(caminho):
+        return None
+    with _lock:
+        if caminho not in _leitores_agregados:
+            _leitores_agregados[caminho] = agregados.LeitorAgregados(caminho)
+        return _leitores_agregados[caminho]
+
+
+def versao_agregados(config, fluxo):
+    """Muda a cada publicação dos agregados do fluxo (para o cache de respostas do nivel6)."""
+    leitor = leitor_agregados(config, fluxo)
+    return None if leitor is None else leitor.versao()
+
+
+# --- Ponto de entrada ---
+_indices = {}
+_leitores = {}
+_lock = threading.Lock()
+
+
+def arquivo_fluxo(config, fluxo):
+    """Arquivo consultado para o fluxo (o binário substitui os CSVs brutos quando configurado)."""
+    if fluxo not in FLUXOS:
+        raise ValueError(f"Fluxo desconhecido: '{fluxo}'. Use um de {', '.join(FLUXOS)}.")
+    if fluxo in ('aplicacao', 'rede') and formato(config) == FORMATO_BINARIO:
+        return caminhos_dados(config)['binario']
+    return caminhos_dados(config)[FLUXOS[fluxo][0]]
+
+
+def arquivos_intervalo(caminho, inicio, fim):
+    """Partições fechadas (e o arquivo vivo) que podem ter amostras em [inicio, fim], em ordem."""
+    arquivos, fechamento_anterior = [], None
+    for arquivo, fechamento in particoes.particoes(caminho):
+        fechamento_ms = fechamento * 1000
+        if fechamento_ms + FOLGA_PARTICAO_MS >= inicio and (
+                fechamento_anterior is None or fechamento_anterior - FOLGA_PARTICAO_MS <= fim):
+            arquivos.append(arquivo)
+        fechamento_anterior = fechamento_ms
+    if os.path.exists(caminho) and (fechamento_anterior is None or fechamento_anterior - FOLGA_PARTICAO_MS <= fim):
+        arquivos.append(caminho)
+    return arquivos
+
+
+def _ignorar(arquivo, erro, cache):
+    """Registra uma partição que não pôde ser lida; o índice/leitor dela é refeito na próxima consulta."""
+    print(f"Histórico: '{arquivo}' ignorado na consulta ({type(erro).__name__}: {erro}).")
+    with _lock:
+        cache.pop(arquivo, None)
+    return os.path.basename(arquivo)
+
+
+def _descartar_removidos():
+    # Partições apagadas pela retenção (ou compactadas) não precisam mais de índice/leitor
+    for cache in (_indices, _leitores):
+        for arquivo in [a for a in cache if not os.path.exists(a)]:
+            del cache[arquivo]
+
+
+def consultar(config, fluxo, inicio, fim, pontos=1000, metodo='minmax', no=None):
+    """
+    Série (timestamps em epoch-ms, valores) do fluxo entre inicio e fim
+    (epoch-ms), reduzida para no máximo 'pontos' pontos. Para a frota, os
+    agregados respondem quando o intervalo tem mais amostras que 'pontos'; com
+    poucas amostras, as próprias amostras são mais fiéis e baratas de ler.
+    """
+    caminho = arquivo_fluxo(config, fluxo)
+    pontos = max(3, int(pontos))
+    leitor = leitor_agregados(config, fluxo) if no is None else None
+    if leitor is not None:
+        serie = leitor.consultar(inicio, fim, pontos)
+        if serie['amostras'] > pontos:
+            serie['agregado'] = True
+            return serie
+    arquivos = arquivos_intervalo(caminho, inicio, fim)
+    if not os.path.exists(caminho) and not arquivos:
+        raise FileNotFoundError(f"Arquivo não encontrado: {caminho}")
+    with _lock:
+        _descartar_removidos()
+    if fluxo in ('aplicacao', 'rede') and formato(config) == FORMATO_BINARIO:
+        return _com_interpolacao(config, fluxo, no, consultar_binario(arquivos, fluxo, inicio, fim, pontos, metodo, no))
+
+    series, ignoradas = [], []
+    for arquivo in arquivos:
+        with _lock:
+            if arquivo not in _indices:
+                _indices[arquivo] = IndiceTemporal(arquivo, *FLUXOS[fluxo][1:])
+            indice = _indices[arquivo]
+        try:
+            series.append(indice.consultar(inicio, fim, pontos, metodo, no))
+        except ERROS_LEITURA as e:
+            ignoradas.append(_ignorar(arquivo, e, _indices))
+    if len(series) == 1:
+        return _com_interpolacao(config, fluxo, no, dict(series[0], ignoradas=ignoradas))
+    ts = [t for serie in series for t in serie['timestamps']]
+    vs = [v for serie in series for v in serie['valores']]
+    ts, vs = reduzir(ts, vs, pontos, metodo)
+    return _com_interpolacao(config, fluxo, no, {
+        'timestamps': ts, 'valores': vs, 'amostras': sum(serie['amostras'] for serie in series),
+        'agregado': any(serie['agregado'] for serie in series), 'ignoradas': ignoradas})
+
+
+def _com_interpolacao(config, fluxo, no, serie):
+    # Amostras gravadas com compressão (compressao.py): o gráfico liga os pontos
+    # em degrau (banda morta) ou em reta (porta giratória). Os agregados já são
+    # calculados sobre as amostras reconstruídas pelo nivel5
+    if fluxo in compressao.FLUXOS:
+        serie['interpolacao'] = compressao.interpolacao(config, fluxo, no)
+    return serie
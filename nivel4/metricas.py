@@ -0,0 +1,250 @@
+# nivel4/metricas.py - Contadores e histogramas de latência compartilhados pelos níveis
+#
+# Cada processo tem um registro único (obter_metricas) com famílias de
+# métricas declaradas no carregamento dos módulos. No caminho crítico uma
+# observação custa uma busca em tupla ordenada (bisect) e três somas sob um
+# lock, então a instrumentação fica sempre ligada. Uma thread publica o retrato
+# do registro a cada segundo em 'metricas_<processo>.json' no diretório do
+# nivel4 (arquivo temporário + os.replace); o nivel6 junta os retratos dos
+# outros processos ao seu próprio registro e os serve em /metrics no formato
+# texto do Prometheus, com o rótulo 'processo'.
+
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+
+# Limites (segundos) dos baldes: de 50 µs (um pacote) a 10 s (um ciclo lento)
+LIMITES_PADRAO = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                  0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+INTERVALO_EXPORTACAO_S = 1.0
+RETRATO_VENCIDO_S = 30.0     # retratos de processos parados há mais que isto são ignorados
+
+CONTADOR = 'counter'
+MEDIDOR = 'gauge'
+HISTOGRAMA = 'histogram'
+
+
+class _Serie:
+    __slots__ = ('valor', '_lock')
+
+    def __init__(self):
+        self.valor = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.valor += n
+
+    def definir(self, valor):
+        self.valor = valor
+
+    def retrato(self):
+        return {'valor': self.valor}
+
+
+class _SerieHistograma:
+    __slots__ = ('limites', 'contagens', 'soma', 'total', '_lock')
+
+    def __init__(self, limites):
+        self.limites = limites
+        self.contagens = [0] * (len(limites) + 1)   # o último balde é o +Inf
+        self.soma = 0.0
+        self.total = 0
+        self._lock = threading.Lock()
+
+    def observar(self, valor):
+        i = bisect_left(self.limites, valor)
+        with self._lock:
+            self.contagens[i] += 1
+            self.soma += valor
+            self.total += 1
+
+    def retrato(self):
+        with self._lock:
+            return {'contagens': list(self.contagens), 'soma': self.soma, 'total': self.total}
+
+
+class Familia:
+    """
+    Métrica com nome, ajuda e nomes de rótulo. rotulos(*valores) devolve a
+    série daqueles valores (guarde-a para o caminho crítico); sem rótulos, a
+    família repassa inc/definir/observar para a série única.
+    """
+
+    def __init__(self, nome, ajuda, tipo, nomes_rotulos=(), limites=LIMITES_PADRAO):
+        self.nome = nome
+        self.ajuda = ajuda
+        self.tipo = tipo
+        self.nomes_rotulos = tuple(nomes_rotulos)
+        self.limites = tuple(limites)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def rotulos(self, *valores):
+        serie = self._series.get(valores)
+        if serie is None:
+            with self._lock:
+                serie = self._series.get(valores)
+                if serie is None:
+                    serie = _SerieHistograma(self.limites) if self.tipo == HISTOGRAMA else _Serie()
+                    self._series[valores] = serie
+        return serie
+
+    def inc(self, n=1):
+        self.rotulos().inc(n)
+
+    def definir(self, valor):
+        self.rotulos().definir(valor)
+
+    def observar(self, valor):
+        self.rotulos().observar(valor)
+
+    def retrato(self):
+        with self._lock:
+            series = list(self._series.items())
+        return {'nome': self.nome, 'ajuda': self.ajuda, 'tipo': self.tipo, 'rotulos': list(self.nomes_rotulos),
+                'limites': list(self.limites) if self.tipo == HISTOGRAMA else None,
+                'series': [dict(serie.retrato(), valores=[str(v) for v in valores]) for valores, serie in series]}
+
+
+class Cronometro:
+    """Mede um trecho com perf_counter e observa a duração no histograma: 'with Cronometro(h):'."""
+
+    __slots__ = ('serie', '_inicio')
+
+    def __init__(self, serie):
+        self.serie = serie
+
+    def __enter__(self):
+        self._inicio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.serie.observar(time.perf_counter() - self._inicio)
+
+
+class RegistroMetricas:
+    """Todas as famílias de métricas deste processo."""
+
+    def __init__(self):
+        self._familias = {}
+        self._lock = threading.Lock()
+        self._exportacao = None
+        self.processo = None      # nome usado na exportação (rótulo 'processo')
+
+    def _familia(self, nome, ajuda, tipo, nomes_rotulos, limites=LIMITES_PADRAO):
+        with self._lock:
+            if nome not in self._familias:
+                self._familias[nome] = Familia(nome, ajuda, tipo, nomes_rotulos, limites)
+            return self._familias[nome]
+
+    def contador(self, nome, ajuda, nomes_rotulos=()):
+        return self._familia(nome, ajuda, CONTADOR, nomes_rotulos)
+
+    def medidor(self, nome, ajuda, nomes_rotulos=()):
+        return self._familia(nome, ajuda, MEDIDOR, nomes_rotulos)
+
+    def histograma(self, nome, ajuda, nomes_rotulos=(), limites=LIMITES_PADRAO):
+        return self._familia(nome, ajuda, HISTOGRAMA, nomes_rotulos, limites)
+
+    def retrato(self, processo=''):
+        with self._lock:
+            familias = list(self._familias.values())
+        return {'processo': processo, 'pid': os.getpid(), 'atualizado': time.time(),
+                'familias': [familia.retrato() for familia in familias]}
+
+    # --- Exportação para os outros processos ---
+    def publicar(self, caminho, processo):
+        diretorio = os.path.dirname(caminho)
+        with tempfile.NamedTemporaryFile('w', dir=diretorio, delete=False, encoding='utf-8', suffix='.tmp') as tmp:
+            json.dump(self.retrato(processo), tmp)
+        os.replace(tmp.name, caminho)
+
+    def iniciar_exportacao(self, diretorio, processo, intervalo_s=INTERVALO_EXPORTACAO_S):
+        """Publica o retrato periodicamente em 'metricas_<processo>.json' (uma vez por processo)."""
+        with self._lock:
+            if self._exportacao is not None:
+                return
+            self.processo = processo
+            caminho = os.path.join(diretorio, f'metricas_{processo}.json')
+            self._exportacao = threading.Thread(target=self._exportar, args=(caminho, processo, intervalo_s),
+                                                name='metricas', daemon=True)
+            self._exportacao.start()
+
+    def _exportar(self, caminho, processo, intervalo_s):
+        while True:
+            try:
+                self.publicar(caminho, processo)
+            except OSError as e:
+                print(f"Métricas: não foi possível publicar '{caminho}': {e}")
+            time.sleep(intervalo_s)
+
+
+_registro = RegistroMetricas()
+
+
+def obter_metricas():
+    """Registro único de métricas deste processo."""
+    return _registro
+
+
+# --- Leitura e formato Prometheus ---
+def ler_publicadas(diretorio):
+    """Retratos publicados por outros processos ainda ativos (o deste processo é lido da memória)."""
+    retratos = []
+    for caminho in glob.glob(os.path.join(diretorio, 'metricas_*.json')):
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                retrato = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if retrato.get('pid') == os.getpid() or time.time() - retrato.get('atualizado', 0) > RETRATO_VENCIDO_S:
+            continue
+        retratos.append(retrato)
+    return retratos
+
+
+def _escapar(valor):
+    return str(valor).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _rotulos(nomes, valores, extra=()):
+    pares = list(zip(nomes, valores)) + list(extra)
+    return '{' + ','.join(f'{n}="{_escapar(v)}"' for n, v in pares) + '}' if pares else ''
+
+
+def _numero(valor):
+    if valor == float('inf'):
+        return '+Inf'
+    return repr(float(valor)) if isinstance(valor, float) else str(valor)
+
+
+def formatar_prometheus(retratos):
+    """Texto de exposição do Prometheus (versão 0.0.4) com as famílias de todos os retratos."""
+    familias = {}
+    for retrato in retratos:
+        for familia in retrato['familias']:
+            familias.setdefault(familia['nome'], []).append((retrato['processo'], familia))
+    linhas = []
+    for nome in sorted(familias):
+        _processo, primeira = familias[nome][0]
+        linhas.append(f"# HELP {nome} {primeira['ajuda']}")
+        linhas.append(f"# TYPE {nome} {primeira['tipo']}")
+        for processo, familia in familias[nome]:
+            extra = (('processo', processo),)
+            for serie in familia['series']:
+                if familia['tipo'] != HISTOGRAMA:
+                    linhas.append(f"{nome}{_rotulos(familia['rotulos'], serie['valores'], extra)} {_numero(serie['valor'])}")
+                    continue
+                acumulado = 0
+                for limite, contagem in zip(familia['limites'] + [float('inf')], serie['contagens']):
+                    acumulado += contagem
+                    le = (('le', _numero(limite)),)
+                    linhas.append(f"{nome}_bucket{_rotulos(familia['rotulos'], serie['valores'], extra + le)} {acumulado}")
+                linhas.append(f"{nome}_sum{_rotulos(familia['rotulos'], serie['valores'], extra)} {_numero(serie['soma'])}")
+                linhas.append(f"{nome}_count{_rotulos(familia['rotulos'], serie['valores'], extra)} {serie['total']}")
+    return '\n'.join(linhas) + '\n'
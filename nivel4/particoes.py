@@ -0,0 +1,282 @@
+# nivel4/particoes.py - Rotação dos arquivos do nivel4 em partições compactadas
+#
+# Os escritores (registro.py) fecham o arquivo vivo por dia ou por tamanho
+# (nivel4.rotacao) e o renomeiam para '<nome>.<AAAAMMDDTHHMMSS><ext>', com o
+# instante do fechamento. Uma thread em segundo plano compacta a partição
+# fechada (nivel4.compressao: gzip ou lzma) e aplica a retenção
+# (nivel4.retencao_dias / retencao_mb; 0 guarda tudo). Os leitores enxergam um único fluxo
+# lógico: particoes(caminho) lista as partições em ordem, abrir() lê qualquer
+# uma delas (compactada ou não) e cauda_linhas()/cauda_bytes() completam a
+# cauda do arquivo vivo com o final da partição anterior.
+
+import gzip
+import lzma
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from datetime import date, datetime
+
+ROTACAO_NENHUMA = 'nenhuma'
+ROTACAO_DIARIA = 'diaria'
+ROTACAO_TAMANHO = 'tamanho'
+
+SEM_COMPRESSAO = 'nenhuma'
+COMPRESSOES = {'gzip': ('.gz', gzip.open), 'lzma': ('.xz', lzma.open)}
+
+FORMATO_CARIMBO = '%Y%m%dT%H%M%S'
+TAMANHO_BLOCO = 1024 * 1024
+LIMITE_CACHE_CAUDAS = 16
+
+
+class PoliticaRotacao:
+    """Quando fechar o arquivo vivo e o que fazer com as partições fechadas."""
+
+    def __init__(self, particao=ROTACAO_NENHUMA, tamanho_max_mb=64, compressao='gzip',
+                 retencao_dias=None, retencao_mb=None):
+        if particao not in (ROTACAO_NENHUMA, ROTACAO_DIARIA, ROTACAO_TAMANHO):
+            raise ValueError(f"nivel4.rotacao inválida: '{particao}'. Use diaria, tamanho ou nenhuma.")
+        if compressao not in COMPRESSOES and compressao != SEM_COMPRESSAO:
+            raise ValueError(f"nivel4.compressao inválida: '{compressao}'. Use gzip, lzma ou nenhuma.")
+        self.particao = particao
+        self.tamanho_max = int(float(tamanho_max_mb) * 1024 * 1024)
+        self.compressao = compressao
+        self.retencao_dias = retencao_dias
+        self.retencao_mb = retencao_mb
+
+    def vencida(self, dia_particao, tamanho):
+        """True se a partição aberta (iniciada em dia_particao, com 'tamanho' bytes) deve ser fechada."""
+        if self.particao == ROTACAO_DIARIA:
+            return dia_particao != date.today()
+        if self.particao == ROTACAO_TAMANHO:
+            return tamanho >= self.tamanho_max
+        return False
+
+
+def politica_rotacao(config_nivel4=None):
+    """PoliticaRotacao definida na seção 'nivel4' da configuração (None se a rotação está desligada)."""
+    config_nivel4 = config_nivel4 or {}
+    particao = config_nivel4.get('rotacao', ROTACAO_NENHUMA)
+    if particao == ROTACAO_NENHUMA:
+        return None
+    return PoliticaRotacao(particao, config_nivel4.get('rotacao_tamanho_mb', 64),
+                           config_nivel4.get('compressao', 'gzip'),
+                           config_nivel4.get('retencao_dias'), config_nivel4.get('retencao_mb'))
+
+
+# --- Nomes das partições ---
+def _padrao(caminho):
+    base, ext = os.path.splitext(os.path.basename(caminho))
+    sufixos = '|'.join(re.escape(s) for s, _abrir in COMPRESSOES.values())
+    return re.compile(rf'^{re.escape(base)}\.(\d{{8}}T\d{{6}})(?:-(\d+))?{re.escape(ext)}({sufixos})?$')
+
+
+def comprimido(caminho):
+    return any(caminho.endswith(sufixo) for sufixo, _abrir in COMPRESSOES.values())
+
+
+def nome_particao(caminho, instante=None):
+    """Caminho livre para a partição fechada em 'instante' (epoch em segundos)."""
+    base, ext = os.path.splitext(caminho)
+    carimbo = datetime.fromtimestamp(instante if instante is not None else time.time()).strftime(FORMATO_CARIMBO)
+    destino, n = f"{base}.{carimbo}{ext}", 0
+    while any(os.path.exists(destino + s) for s in ('',) + tuple(s for s, _a in COMPRESSOES.values())):
+        n += 1
+        destino = f"{base}.{carimbo}-{n}{ext}"
+    return destino
+
+
+def particoes(caminho):
+    """
+    Partições fechadas do arquivo vivo 'caminho', da mais antiga para a mais
+    recente, como (arquivo, instante de fechamento em epoch-s). Enquanto uma
+    partição está sendo compactada, a versão sem compressão é a listada.
+    """
+    diretorio = os.path.dirname(caminho) or '.'
+    padrao = _padrao(caminho)
+    encontradas = {}
+    try:
+        nomes = os.listdir(diretorio)
+    except FileNotFoundError:
+        return []
+    for nome in nomes:
+        m = padrao.match(nome)
+        if not m:
+            continue
+        chave = (m.group(1), int(m.group(2) or 0))
+        if chave not in encontradas or not m.group(3):
+            encontradas[chave] = os.path.join(diretorio, nome)
+    return [(encontradas[chave], datetime.strptime(chave[0], FORMATO_CARIMBO).timestamp())
+            for chave in sorted(encontradas)]
+
+
+def abrir(caminho):
+    """Abre uma partição (ou o arquivo vivo) para leitura binária, descompactando se preciso."""
+    for sufixo, abrir_comprimido in COMPRESSOES.values():
+        if caminho.endswith(sufixo):
+            return abrir_comprimido(caminho, 'rb')
+    return open(caminho, 'rb')
+
+
+# --- Caudas das partições (imutáveis, então cacheadas) ---
+_caudas = {}
+_lock_caudas = threading.Lock()
+
+
+def _cacheado(chave, calcular):
+    with _lock_caudas:
+        if chave in _caudas:
+            return _caudas[chave]
+    valor = calcular()
+    with _lock_caudas:
+        if len(_caudas) >= LIMITE_CACHE_CAUDAS:
+            _caudas.clear()
+        _caudas[chave] = valor
+    return valor
+
+
+def cauda_linhas(caminho, n, cabecalho=None):
+    """
+    Últimas n linhas (bytes, sem '\\n') das partições fechadas, da mais antiga
+    para a mais recente. Com 'cabecalho', para na primeira partição cujo
+    cabeçalho é diferente (formato antigo).
+    """
+    linhas = []
+    for arquivo, _fim in reversed(particoes(caminho)):
+        if len(linhas) >= n:
+            break
+        try:
+            st = os.stat(arquivo)
+            cab, trecho = _cacheado(('linhas', arquivo, st.st_mtime_ns, n), lambda: _ler_cauda_linhas(arquivo, n))
+        except (OSError, EOFError, lzma.LZMAError):
+            continue
+        if cabecalho is not None and cab != cabecalho:
+            break
+        linhas[:0] = trecho[-(n - len(linhas)):]
+    return linhas
+
+
+def _ler_cauda_linhas(arquivo, n):
+    with abrir(arquivo) as f:
+        cabecalho = f.readline().decode('utf-8').strip()
+        ultimas = deque((linha.rstrip(b'\r\n') for linha in f if linha.endswith(b'\n')), maxlen=n)
+    return cabecalho, [linha for linha in ultimas if linha]
+
+
+def cauda_bytes(arquivo, quantidade, inicio_dados=0):
+    """Últimos 'quantidade' bytes (após 'inicio_dados') de uma partição, compactada ou não."""
+    st = os.stat(arquivo)
+    return _cacheado(('bytes', arquivo, st.st_mtime_ns, quantidade, inicio_dados),
+                     lambda: _ler_cauda_bytes(arquivo, quantidade, inicio_dados))
+
+
+def _ler_cauda_bytes(arquivo, quantidade, inicio_dados):
+    if not comprimido(arquivo):
+        with open(arquivo, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(inicio_dados, f.tell() - quantidade))
+            return f.read()
+    blocos, total = deque(), 0
+    with abrir(arquivo) as f:
+        f.read(inicio_dados)
+        while True:
+            bloco = f.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            blocos.append(bloco)
+            total += len(bloco)
+            while blocos and total - len(blocos[0]) >= quantidade:
+                total -= len(blocos.popleft())
+    dados = b''.join(blocos)
+    return dados[-quantidade:] if quantidade else b''
+
+
+# --- Compactação e retenção em segundo plano ---
+def comprimir(arquivo, compressao):
+    """Compacta a partição (escrevendo em .tmp e renomeando) e remove o original e seu índice."""
+    sufixo, abrir_comprimido = COMPRESSOES[compressao]
+    destino = arquivo + sufixo
+    with open(arquivo, 'rb') as origem, abrir_comprimido(destino + '.tmp', 'wb') as saida:
+        while True:
+            bloco = origem.read(TAMANHO_BLOCO)
+            if not bloco:
+                break
+            saida.write(bloco)
+    os.replace(destino + '.tmp', destino)
+    for resto in (arquivo, arquivo + '.idx'):
+        try:
+            os.remove(resto)
+        except FileNotFoundError:
+            pass
+    return destino
+
+
+def aplicar_retencao(caminho, politica):
+    """Remove as partições mais antigas que retencao_dias ou além de retencao_mb no total."""
+    if not politica.retencao_dias and not politica.retencao_mb:
+        return []
+    lista = particoes(caminho)
+    removidas = []
+    limite_idade = time.time() - float(politica.retencao_dias) * 86400 if politica.retencao_dias else None
+    tamanhos = [os.path.getsize(arquivo) for arquivo, _fim in lista]
+    total = sum(tamanhos)
+    limite_tamanho = float(politica.retencao_mb) * 1024 * 1024 if politica.retencao_mb else None
+    for (arquivo, fim), tamanho in zip(lista, tamanhos):
+        if (limite_idade is not None and fim < limite_idade) or (limite_tamanho is not None and total > limite_tamanho):
+            for resto in (arquivo, arquivo + '.idx'):
+                try:
+                    os.remove(resto)
+                except FileNotFoundError:
+                    pass
+            total -= tamanho
+            removidas.append(arquivo)
+    return removidas
+
+
+class Compactador:
+    """Thread única que compacta as partições fechadas e aplica a retenção, fora do caminho de gravação."""
+
+    def __init__(self):
+        self._fila = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def agendar(self, caminho, politica):
+        """Processa as partições pendentes do arquivo vivo 'caminho' (inclui sobras de execuções anteriores)."""
+        self._fila.put((caminho, politica))
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='compactador', daemon=True)
+                self._thread.start()
+
+    def _executar(self):
+        while True:
+            caminho, politica = self._fila.get()
+            try:
+                self._processar(caminho, politica)
+            except Exception as e:
+                print(f"Compactador: erro nas partições de '{caminho}': {e}")
+            finally:
+                self._fila.task_done()
+
+    def _processar(self, caminho, politica):
+        diretorio = os.path.dirname(caminho) or '.'
+        padrao = _padrao(caminho)
+        for nome in os.listdir(diretorio):
+            # Compactação interrompida por uma queda: o original ainda existe
+            if nome.endswith('.tmp') and padrao.match(nome[:-4]):
+                os.remove(os.path.join(diretorio, nome))
+        if politica.compressao != SEM_COMPRESSAO:
+            for arquivo, _fim in particoes(caminho):
+                if not comprimido(arquivo):
+                    comprimir(arquivo, politica.compressao)
+        for arquivo in aplicar_retencao(caminho, politica):
+            print(f"Retenção: partição '{os.path.basename(arquivo)}' removida.")
+
+    def aguardar(self):
+        self._fila.join()
+
+
+compactador = Compactador()
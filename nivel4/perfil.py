@@ -0,0 +1,340 @@
+# nivel4/perfil.py - Perfil de CPU e memória embutido em cada nível
+#
+# Cada processo tem um Perfilador (obter_perfilador), iniciado pelo base.py,
+# pelo analise.py e pelo app.py (no modo unificado, pelo init.py). A seção
+# 'perfil' do configuracoes.yaml (ou TWSN_PERFIL, definida por init.py
+# --perfil) liga o perfil contínuo:
+#
+#   amostragem  uma thread lê as pilhas de todas as threads a cada
+#               'intervalo_amostragem_ms' (tempo de parede: uma thread parada
+#               no select também aparece) e grava a cada 'periodo_s' um
+#               arquivo .folded (uma pilha por linha com a contagem, o formato
+#               do flamegraph.pl e do speedscope). O custo fica na thread do
+#               perfil, não no caminho dos pacotes;
+#   cprofile    perfil determinístico das threads que chamam ciclo() (loops
+#               do gateway e da análise) ou iniciar/encerrar_trecho()
+#               (requisições do dashboard), gravado em .pstats. Bem mais
+#               caro: para investigar um trecho já localizado.
+#
+# Com 'memoria', o tracemalloc fica ligado e cada período grava os maiores
+# alocadores e o crescimento desde o retrato anterior. Os arquivos vão para
+# '<diretorio_logs>/perfis', mantendo os 'max_arquivos' mais recentes de cada
+# tipo. Um perfil sob demanda (amostragem por 'duracao_sob_demanda_s', mesmo
+# com o perfil contínuo desligado) é pedido com SIGUSR2 ao processo ou pelo
+# dashboard (POST /api/perfil), que cria 'perfis/pedido_<processo>'.
+
+import cProfile
+import glob
+import os
+import pstats
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from datetime import datetime
+
+from metricas import obter_metricas
+from telemetria import caminhos_dados
+
+AMOSTRAGEM = 'amostragem'
+CPROFILE = 'cprofile'
+MODOS = (AMOSTRAGEM, CPROFILE)
+VARIAVEL_AMBIENTE = 'TWSN_PERFIL'   # modo forçado pelo init.py --perfil
+
+INTERVALO_AMOSTRAGEM_PADRAO_MS = 10
+PERIODO_PADRAO_S = 60
+MAX_ARQUIVOS_PADRAO = 20
+DURACAO_SOB_DEMANDA_PADRAO_S = 30
+QUADROS_MEMORIA_PADRAO = 1          # quadros guardados por alocação no tracemalloc
+PROFUNDIDADE_MAXIMA = 64
+LINHAS_MEMORIA = 30
+INTERVALO_VERIFICACAO_S = 1.0       # configuração e pedidos sob demanda
+INTERVALO_CPROFILE_S = 1.0          # ciclo() entrega o acumulado da thread neste ritmo
+
+TEMPO_AMOSTRA = obter_metricas().histograma('twsn_perfil_amostra_segundos',
+                                            'Leitura das pilhas de todas as threads pelo perfil por amostragem')
+
+
+# --- Configuração ---
+def parametros(config):
+    """Seção 'perfil' com os padrões; TWSN_PERFIL liga o perfil no modo indicado."""
+    secao = dict((config or {}).get('perfil') or {})
+    forcado = os.environ.get(VARIAVEL_AMBIENTE)
+    if forcado:
+        secao.update(ligado=True, modo=forcado)
+    modo = secao.get('modo') or AMOSTRAGEM
+    if modo not in MODOS:
+        raise ValueError(f"Perfil '{modo}' inválido. Use um de {', '.join(MODOS)}.")
+    return {'ligado': bool(secao.get('ligado', False)), 'modo': modo,
+            'intervalo_s': float(secao.get('intervalo_amostragem_ms', INTERVALO_AMOSTRAGEM_PADRAO_MS)) / 1000,
+            'periodo_s': float(secao.get('periodo_s', PERIODO_PADRAO_S)),
+            'memoria': bool(secao.get('memoria', False)),
+            'quadros_memoria': int(secao.get('quadros_memoria', QUADROS_MEMORIA_PADRAO)),
+            'max_arquivos': int(secao.get('max_arquivos', MAX_ARQUIVOS_PADRAO)),
+            'duracao_sob_demanda_s': float(secao.get('duracao_sob_demanda_s', DURACAO_SOB_DEMANDA_PADRAO_S))}
+
+
+def pedir_perfil(config, processo):
+    """Pede um perfil sob demanda ao processo (nivel3, nivel5, nivel6 ou unificado) criando o arquivo de pedido."""
+    diretorio = caminhos_dados(config)['perfis']
+    os.makedirs(diretorio, exist_ok=True)
+    caminho = os.path.join(diretorio, f'pedido_{processo}')
+    with open(caminho, 'w') as f:
+        f.write(str(time.time()))
+    return caminho
+
+
+# --- Amostragem ---
+class _Rotulos:
+    """'funcao (arquivo:linha)' por objeto de código, montado uma vez só."""
+
+    def __init__(self):
+        self._cache = {}
+
+    def __call__(self, codigo):
+        rotulo = self._cache.get(codigo)
+        if rotulo is None:
+            rotulo = self._cache[codigo] = (f"{codigo.co_name} ({os.path.basename(codigo.co_filename)}:"
+                                            f"{codigo.co_firstlineno})")
+        return rotulo
+
+
+def amostrar_pilhas(contagens, rotulos, ignorar=None):
+    """Soma 1 em contagens['thread;raiz;...;folha'] para a pilha atual de cada thread."""
+    nomes = {thread.ident: thread.name for thread in threading.enumerate()}
+    for ident, quadro in sys._current_frames().items():
+        if ident == ignorar:
+            continue
+        pilha = []
+        while quadro is not None and len(pilha) < PROFUNDIDADE_MAXIMA:
+            pilha.append(rotulos(quadro.f_code))
+            quadro = quadro.f_back
+        pilha.append(nomes.get(ident, str(ident)))
+        pilha.reverse()
+        contagens[';'.join(pilha)] += 1
+
+
+class Perfilador:
+    """Perfil contínuo e sob demanda de um processo; a thread 'perfil' faz a amostragem e grava os arquivos."""
+
+    def __init__(self):
+        self.processo = None
+        self.parametros = parametros(None)
+        self._configuracao = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._pedido = threading.Event()
+        self._local = threading.local()
+        self._cprofile = False          # leitura sem lock no caminho do ciclo()
+        self._stats = None              # pstats.Stats acumulado pelas threads
+        self._memoria_anterior = None
+        self._mtime_pedido = False      # False: arquivo de pedido ainda não verificado
+        self._diretorio = None
+
+    def iniciar(self, configuracao, processo):
+        """Inicia a thread do perfil (uma vez por processo); 'configuracao' é a ConfiguracaoCompartilhada."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self.processo = processo
+            self._configuracao = configuracao
+            self._thread = threading.Thread(target=self._executar, name='perfil', daemon=True)
+            self._thread.start()
+        if hasattr(signal, 'SIGUSR2'):
+            try:
+                signal.signal(signal.SIGUSR2, lambda _signum, _frame: self._pedido.set())
+            except ValueError:
+                # signal.signal só pode ser chamado na thread principal
+                pass
+
+    def sob_demanda(self):
+        """Pede um perfil por amostragem de 'duracao_sob_demanda_s' (gravado em 'sob_demanda_<processo>_*')."""
+        self._pedido.set()
+
+    # --- cProfile nas threads dos níveis ---
+    def ciclo(self):
+        """Chamado a cada volta do loop de um nível: no modo cprofile, perfila esta thread."""
+        if not self._cprofile and getattr(self._local, 'perfil', None) is None:
+            return
+        perfil = getattr(self._local, 'perfil', None)
+        if perfil is not None and (not self._cprofile or time.monotonic() - self._local.inicio >= INTERVALO_CPROFILE_S):
+            self.encerrar_trecho()
+            perfil = None
+        if perfil is None and self._cprofile:
+            self.iniciar_trecho()
+
+    def iniciar_trecho(self):
+        """Liga o cProfile nesta thread (modo cprofile), até encerrar_trecho()."""
+        if not self._cprofile or getattr(self._local, 'perfil', None) is not None:
+            return
+        perfil = cProfile.Profile()
+        try:
+            perfil.enable()
+        except ValueError:
+            # Python 3.12+: um só perfil determinístico ativo por vez no processo
+            return
+        self._local.perfil, self._local.inicio = perfil, time.monotonic()
+
+    def encerrar_trecho(self):
+        perfil = getattr(self._local, 'perfil', None)
+        if perfil is None:
+            return
+        perfil.disable()
+        self._local.perfil = None
+        stats = pstats.Stats(perfil)
+        with self._lock:
+            if self._stats is None:
+                self._stats = stats
+            else:
+                self._stats.add(stats)
+
+    # --- Thread do perfil ---
+    def _executar(self):
+        contagens = Counter()
+        rotulos = _Rotulos()
+        proprio = threading.get_ident()
+        inicio_periodo = time.monotonic()
+        proxima_verificacao = 0.0
+        while True:
+            agora = time.monotonic()
+            if agora >= proxima_verificacao:
+                proxima_verificacao = agora + INTERVALO_VERIFICACAO_S
+                self._reconfigurar()
+                self._verificar_pedido()
+            p = self.parametros
+            if self._pedido.is_set():
+                self._pedido.clear()
+                self._perfil_sob_demanda(rotulos, proprio)
+                continue
+            if not p['ligado']:
+                contagens.clear()
+                inicio_periodo = time.monotonic()
+                time.sleep(INTERVALO_VERIFICACAO_S)
+                continue
+            if p['modo'] == AMOSTRAGEM:
+                inicio = time.perf_counter()
+                amostrar_pilhas(contagens, rotulos, proprio)
+                TEMPO_AMOSTRA.observar(time.perf_counter() - inicio)
+                time.sleep(p['intervalo_s'])
+            else:
+                time.sleep(INTERVALO_VERIFICACAO_S)
+            if time.monotonic() - inicio_periodo >= p['periodo_s']:
+                inicio_periodo = time.monotonic()
+                self._gravar_periodo(contagens)
+                contagens = Counter()
+
+    def _reconfigurar(self):
+        config = self._configuracao.obter() if self._configuracao is not None else None
+        if not config:
+            return
+        try:
+            novos = parametros(config)
+        except (ValueError, TypeError) as e:
+            print(f"Perfil: configuração inválida ({e}); mantendo a anterior.")
+            return
+        self._diretorio = caminhos_dados(config)['perfis']
+        if novos != self.parametros:
+            print(f"Perfil ({self.processo}): " + (f"{novos['modo']}" + (" + memória" if novos['memoria'] else "")
+                                                   if novos['ligado'] else "desligado") + ".")
+        memoria = novos['ligado'] and novos['memoria']
+        if memoria and not tracemalloc.is_tracing():
+            tracemalloc.start(novos['quadros_memoria'])
+            self._memoria_anterior = None
+        elif not memoria and tracemalloc.is_tracing():
+            tracemalloc.stop()
+            self._memoria_anterior = None
+        self.parametros = novos
+        self._cprofile = novos['ligado'] and novos['modo'] == CPROFILE
+
+    def _verificar_pedido(self):
+        if self._diretorio is None:
+            return
+        try:
+            mtime = os.stat(os.path.join(self._diretorio, f'pedido_{self.processo}')).st_mtime_ns
+        except OSError:
+            mtime = None
+        # Um pedido antigo, de antes deste processo iniciar, não dispara o perfil
+        if self._mtime_pedido is not False and mtime is not None and mtime != self._mtime_pedido:
+            self._pedido.set()
+        self._mtime_pedido = mtime
+
+    def _perfil_sob_demanda(self, rotulos, proprio):
+        p = self.parametros
+        print(f"Perfil ({self.processo}): perfil sob demanda por {p['duracao_sob_demanda_s']:.0f}s...")
+        contagens = Counter()
+        fim = time.monotonic() + p['duracao_sob_demanda_s']
+        while time.monotonic() < fim:
+            inicio = time.perf_counter()
+            amostrar_pilhas(contagens, rotulos, proprio)
+            TEMPO_AMOSTRA.observar(time.perf_counter() - inicio)
+            time.sleep(p['intervalo_s'])
+        caminho = self._gravar_folded(contagens, 'sob_demanda')
+        if tracemalloc.is_tracing():
+            self._gravar_memoria()
+        print(f"Perfil ({self.processo}): gravado em '{caminho}'.")
+
+    # --- Arquivos ---
+    def _caminho(self, tipo, extensao):
+        os.makedirs(self._diretorio, exist_ok=True)
+        carimbo = datetime.now().strftime('%Y%m%d-%H%M%S')
+        return os.path.join(self._diretorio, f'{tipo}_{self.processo}_{carimbo}.{extensao}')
+
+    def _rotacionar(self, tipo, extensao):
+        arquivos = sorted(glob.glob(os.path.join(self._diretorio, f'{tipo}_{self.processo}_*.{extensao}')))
+        for antigo in arquivos[:max(0, len(arquivos) - self.parametros['max_arquivos'])]:
+            try:
+                os.remove(antigo)
+            except OSError:
+                pass
+
+    def _gravar_folded(self, contagens, tipo):
+        caminho = self._caminho(tipo, 'folded')
+        with open(caminho, 'w', encoding='utf-8') as f:
+            for pilha, contagem in contagens.most_common():
+                f.write(f"{pilha} {contagem}\n")
+        self._rotacionar(tipo, 'folded')
+        return caminho
+
+    def _gravar_periodo(self, contagens):
+        if self._diretorio is None:
+            return
+        try:
+            if self.parametros['modo'] == AMOSTRAGEM:
+                if contagens:
+                    self._gravar_folded(contagens, 'perfil')
+            else:
+                with self._lock:
+                    stats, self._stats = self._stats, None
+                if stats is not None:
+                    stats.dump_stats(self._caminho('perfil', 'pstats'))
+                    self._rotacionar('perfil', 'pstats')
+            if tracemalloc.is_tracing():
+                self._gravar_memoria()
+        except OSError as e:
+            print(f"Perfil: não foi possível gravar em '{self._diretorio}': {e}")
+
+    def _gravar_memoria(self):
+        retrato = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>')))
+        atual, pico = tracemalloc.get_traced_memory()
+        with open(self._caminho('memoria', 'txt'), 'w', encoding='utf-8') as f:
+            f.write(f"# {self.processo}: {atual / 1024:.0f} KiB rastreados (pico {pico / 1024:.0f} KiB)\n")
+            f.write("# Maiores alocadores\n")
+            for estatistica in retrato.statistics('lineno')[:LINHAS_MEMORIA]:
+                f.write(f"{estatistica}\n")
+            if self._memoria_anterior is not None:
+                f.write("# Crescimento desde o retrato anterior\n")
+                for diferenca in retrato.compare_to(self._memoria_anterior, 'lineno')[:LINHAS_MEMORIA]:
+                    f.write(f"{diferenca}\n")
+        self._memoria_anterior = retrato
+        self._rotacionar('memoria', 'txt')
+
+
+_perfilador = Perfilador()
+
+
+def obter_perfilador():
+    """Perfilador único deste processo."""
+    return _perfilador
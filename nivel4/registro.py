@@ -0,0 +1,294 @@
+# nivel4/registro.py - Escritores persistentes com gravação em grupo
+#
+# Mantêm o arquivo aberto e acumulam os registros em memória, descarregando-os
+# no disco quando o buffer atinge 'max_linhas' ou quando o registro mais antigo
+# completa 'max_atraso_s'. Cada descarga é um único write() em um descritor
+# O_APPEND contendo apenas registros completos, então os leitores do nivel5 e
+# do nivel6 nunca enxergam uma linha pela metade. Com uma PoliticaRotacao
+# (particoes.py), o arquivo é fechado por dia ou tamanho antes da descarga que
+# ultrapassaria o limite, e a partição fechada é compactada em segundo plano.
+# Se a gravação falha (disco cheio, erro de E/S), o lote volta para o início do
+# buffer e é tentado de novo no próximo prazo ou no fechamento; acima de
+# 'max_retidos' registros, os mais antigos são descartados (e contados).
+
+import atexit
+import csv
+import io
+import os
+import signal
+import threading
+import time
+import weakref
+from datetime import date
+
+from metricas import obter_metricas
+from particoes import compactador, nome_particao, politica_rotacao
+
+# Políticas de fsync
+FSYNC_NUNCA = 'nunca'            # deixa o kernel decidir (padrão)
+FSYNC_SEMPRE = 'sempre'          # fsync após cada descarga
+FSYNC_INTERVALO = 'intervalo'    # no máximo um fsync a cada 'fsync_intervalo_s'
+
+_escritores = weakref.WeakSet()
+
+_metricas = obter_metricas()
+TEMPO_GRAVACAO = _metricas.histograma('twsn_gravacao_segundos',
+                                      'Duração de cada descarga em disco (serialização e write)', ('arquivo',))
+REGISTROS_GRAVADOS = _metricas.contador('twsn_registros_gravados_total', 'Registros gravados em disco', ('arquivo',))
+REGISTROS_PERDIDOS = _metricas.contador('twsn_registros_perdidos_total',
+                                        'Registros descartados após falhas de gravação (buffer de retenção cheio)',
+                                        ('arquivo',))
+
+
+class EscritorEmGrupo:
+    """
+    Base dos escritores com buffer: acumula registros completos em memória e os
+    grava com um único write() em um descritor O_APPEND. As subclasses definem
+    como o arquivo é preparado (_preparar_arquivo) e como um registro é
+    serializado (_serializar).
+    """
+
+    def __init__(self, caminho, max_linhas=256, max_atraso_s=1.0,
+                 fsync=FSYNC_NUNCA, fsync_intervalo_s=5.0, rotacao=None, max_retidos=100000):
+        self.caminho = caminho
+        self.rotacao = rotacao
+        self.max_linhas = max(1, int(max_linhas))
+        self.max_retidos = max(self.max_linhas, int(max_retidos))
+        self.max_atraso_s = float(max_atraso_s)
+        self.fsync = fsync
+        self.fsync_intervalo_s = float(fsync_intervalo_s)
+
+        self._fd = None
+        self._pendentes = []
+        self._prazo = None
+        self._falhou = False      # última descarga falhou: só o prazo dispara a próxima tentativa
+        self._ultimo_fsync = 0.0
+        self._tamanho = 0
+        self._inicio_dados = 0
+        self._dia_particao = None
+        self._lock = threading.Lock()
+        self._tempo_gravacao = TEMPO_GRAVACAO.rotulos(os.path.basename(caminho))
+        self._registros_gravados = REGISTROS_GRAVADOS.rotulos(os.path.basename(caminho))
+        self._registros_perdidos = REGISTROS_PERDIDOS.rotulos(os.path.basename(caminho))
+        _escritores.add(self)
+        if rotacao is not None:
+            # Partições deixadas sem compactar por uma execução anterior
+            compactador.agendar(caminho, rotacao)
+
+    # --- Ganchos das subclasses ---
+    def _preparar_arquivo(self):
+        """Chamado antes de abrir o arquivo; retorna os bytes iniciais (cabeçalho) se ele for novo."""
+        return b''
+
+    def _serializar(self, registros):
+        raise NotImplementedError
+
+    # --- Abertura ---
+    def _abrir(self):
+        inicial = self._preparar_arquivo()
+        self._fd = os.open(self.caminho, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        st = os.fstat(self._fd)
+        # Um arquivo que já tinha dados pertence ao dia da última gravação
+        self._tamanho = st.st_size
+        self._dia_particao = date.fromtimestamp(st.st_mtime) if st.st_size and not inicial else date.today()
+        if inicial:
+            self._gravar(inicial)
+        self._inicio_dados = self._tamanho if inicial else 0
+
+    def _rotacionar(self):
+        """Fecha a partição atual, renomeia-a com o instante do fechamento e abre um arquivo novo."""
+        self._fechar_fd()
+        destino = nome_particao(self.caminho)
+        os.replace(self.caminho, destino)
+        if os.path.exists(self.caminho + '.idx'):
+            # O índice temporal (historico.py) continua válido para a partição
+            os.replace(self.caminho + '.idx', destino + '.idx')
+        print(f"Rotação: '{os.path.basename(self.caminho)}' fechado como '{os.path.basename(destino)}'.")
+        compactador.agendar(self.caminho, self.rotacao)
+        self._abrir()
+
+    # --- Escrita ---
+    def escrever(self, registro):
+        """Acrescenta um registro ao buffer; descarrega se o limite de tamanho foi atingido."""
+        with self._lock:
+            self._pendentes.append(registro)
+            if self._prazo is None:
+                self._prazo = time.monotonic() + self.max_atraso_s
+            if self._falhou:
+                self._limitar_retidos(avisar=False)
+            elif len(self._pendentes) >= self.max_linhas:
+                self._descarregar()
+
+    def talvez_descarregar(self, agora=None):
+        """Descarrega se o registro mais antigo do buffer já esperou 'max_atraso_s'."""
+        prazo = self._prazo
+        if prazo is not None and (agora if agora is not None else time.monotonic()) >= prazo:
+            with self._lock:
+                self._descarregar()
+
+    def proximo_prazo(self):
+        """Instante (time.monotonic) da próxima descarga por tempo, ou None se o buffer está vazio."""
+        return self._prazo
+
+    def descarregar(self):
+        with self._lock:
+            self._descarregar()
+
+    def _descarregar(self):
+        if not self._pendentes:
+            return
+        registros, self._pendentes = self._pendentes, []
+        self._prazo = None
+        inicio = time.perf_counter()
+        antes = None
+        try:
+            if self._fd is None:
+                self._abrir()
+            dados = self._serializar(registros)
+            if (self.rotacao is not None and self._tamanho > self._inicio_dados
+                    and self.rotacao.vencida(self._dia_particao, self._tamanho + len(dados))):
+                self._rotacionar()
+            antes = self._tamanho
+            self._gravar(dados)
+        except OSError as e:
+            print(f"Erro ao gravar '{self.caminho}': {e} ({len(registros)} registros retidos para nova tentativa)")
+            self._reter(registros, antes)
+            return
+        self._falhou = False
+        self._tempo_gravacao.observar(time.perf_counter() - inicio)
+        self._registros_gravados.inc(len(registros))
+        agora = time.monotonic()
+        if self.fsync == FSYNC_SEMPRE or (self.fsync == FSYNC_INTERVALO
+                                          and agora - self._ultimo_fsync >= self.fsync_intervalo_s):
+            try:
+                os.fsync(self._fd)
+                self._ultimo_fsync = agora
+            except OSError as e:
+                # Os dados já foram entregues ao kernel: regravá-los duplicaria as linhas
+                print(f"Erro no fsync de '{self.caminho}': {e}")
+                self._fechar_fd()
+
+    def _reter(self, registros, antes):
+        """Devolve um lote que não foi gravado ao início do buffer e agenda a nova tentativa."""
+        if antes is not None and self._tamanho > antes:
+            # Escrita parcial: desfaz, para que a nova tentativa não deixe uma linha cortada
+            try:
+                os.ftruncate(self._fd, antes)
+            except OSError:
+                pass
+        self._fechar_fd()
+        self._pendentes = registros + self._pendentes
+        self._limitar_retidos()
+        self._falhou = True
+        self._prazo = time.monotonic() + self.max_atraso_s
+
+    def _limitar_retidos(self, avisar=True):
+        excesso = len(self._pendentes) - self.max_retidos
+        if excesso > 0:
+            del self._pendentes[:excesso]
+            self._registros_perdidos.inc(excesso)
+            if avisar: print(f"'{self.caminho}': {excesso} registros antigos descartados (buffer de retenção cheio).")
+
+    def _gravar(self, dados):
+        visao = memoryview(dados)
+        while visao:
+            escritos = os.write(self._fd, visao)
+            visao = visao[escritos:]
+            self._tamanho += escritos
+
+    # --- Encerramento ---
+    def _fechar_fd(self):
+        if self._fd is not None:
+            try:
+                os.close(self._fd)
+            except OSError:
+                pass
+            self._fd = None
+
+    def fechar(self):
+        """Descarrega o buffer, aplica fsync e fecha o arquivo."""
+        with self._lock:
+            self._descarregar()
+            if self._pendentes:
+                # Última tentativa falhou: o que sobrou no buffer não chega ao disco
+                self._registros_perdidos.inc(len(self._pendentes))
+                print(f"'{self.caminho}' fechado com {len(self._pendentes)} registros não gravados.")
+                self._pendentes, self._prazo = [], None
+            if self._fd is not None and self.fsync != FSYNC_NUNCA:
+                try:
+                    os.fsync(self._fd)
+                except OSError:
+                    pass
+            self._fechar_fd()
+
+
+class EscritorCSV(EscritorEmGrupo):
+    """Escritor de um arquivo CSV com cabeçalho fixo e buffer de linhas."""
+
+    def __init__(self, caminho, cabecalho, **kwargs):
+        super().__init__(caminho, **kwargs)
+        self.cabecalho = list(cabecalho)
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+
+    def _preparar_arquivo(self):
+        """Migra arquivos com cabeçalho antigo e devolve o cabeçalho se o arquivo for novo."""
+        linha_cabecalho = (",".join(self.cabecalho) + "\r\n").encode('utf-8')
+        if os.path.isfile(self.caminho):
+            with open(self.caminho, 'r', encoding='utf-8') as f:
+                primeira_linha = f.readline().strip()
+            if primeira_linha == ",".join(self.cabecalho):
+                return b''
+            if not primeira_linha:
+                return linha_cabecalho if os.path.getsize(self.caminho) == 0 else b''
+            base, ext = os.path.splitext(self.caminho)
+            os.replace(self.caminho, f"{base}.legado{ext}")
+            print(f"Formato antigo detectado em '{self.caminho}'. Arquivo movido para '{base}.legado{ext}'.")
+        return linha_cabecalho
+
+    def _serializar(self, linhas):
+        self._writer.writerows(linhas)
+        dados = self._buffer.getvalue().encode('utf-8')
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return dados
+
+
+def parametros_buffer(config_nivel4=None):
+    """Limites de buffer e política de fsync definidos na seção 'nivel4' da configuração."""
+    config_nivel4 = config_nivel4 or {}
+    return {
+        'max_linhas': config_nivel4.get('buffer_linhas', 256),
+        'max_atraso_s': config_nivel4.get('buffer_atraso_s', 1.0),
+        'fsync': config_nivel4.get('fsync', FSYNC_NUNCA),
+        'fsync_intervalo_s': config_nivel4.get('fsync_intervalo_s', 5.0),
+        'max_retidos': config_nivel4.get('buffer_retidos', 100000),
+    }
+
+
+def criar_escritor(caminho, cabecalho, config_nivel4=None):
+    """Cria um EscritorCSV com os limites e a rotação definidos na seção 'nivel4' da configuração."""
+    return EscritorCSV(caminho, cabecalho, rotacao=politica_rotacao(config_nivel4), **parametros_buffer(config_nivel4))
+
+
+def fechar_todos():
+    """Descarrega e fecha todos os escritores abertos neste processo."""
+    for escritor in list(_escritores):
+        escritor.fechar()
+
+
+def instalar_encerramento_gracioso():
+    """
+    Converte o SIGTERM (enviado pelo terminate() do init.py) em KeyboardInterrupt,
+    para que os blocos 'finally' e o atexit descarreguem os buffers.
+    """
+    def _ao_receber_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    try:
+        signal.signal(signal.SIGTERM, _ao_receber_sigterm)
+    except ValueError:
+        # signal.signal só pode ser chamado na thread principal
+        pass
+
+
+atexit.register(fechar_todos)
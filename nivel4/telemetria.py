@@ -0,0 +1,320 @@
+# nivel4/telemetria.py - Leitura dos dados brutos independente do formato de armazenamento
+#
+# O nivel5 e o nivel6 pedem "as últimas N amostras" de um fluxo ('rede' ou
+# 'aplicacao') sem saber se o gateway grava CSV ou o formato binário
+# (nivel4.formato). O resultado é sempre um dicionário coluna -> sequência com
+# os mesmos nomes de coluna dos CSVs; 'Timestamp' vem em epoch-ms. Com a
+# rotação ligada (particoes.py), as caudas continuam na partição anterior
+# quando o arquivo vivo ainda tem menos de N amostras.
+
+import csv
+import os
+from datetime import datetime
+
+import armazenamento_binario as binario
+import barramento
+import particoes
+from compressao import SeguidorReconstruido
+
+DIR_NIVEL4 = os.path.dirname(os.path.abspath(__file__))
+DIR_RAIZ = os.path.dirname(DIR_NIVEL4)
+
+FORMATO_CSV = 'csv'
+FORMATO_BINARIO = 'binario'
+
+COLUNAS = {
+    'rede': ('Timestamp', 'RSSI_Downlink', 'Status', 'No', 'RSSI_Uplink', 'RTT_ms'),
+    'aplicacao': ('Timestamp', 'Luminosidade', 'No'),
+}
+
+TAMANHO_BLOCO = 64 * 1024
+
+# Se o atraso acumulado passar deste limite (ex.: análise pausada por muito
+# tempo), o seguidor volta para a cauda em vez de processar todo o backlog.
+LIMITE_ATRASO_BYTES = 8 * 1024 * 1024
+
+
+def caminhos_dados(config):
+    """Caminhos absolutos dos arquivos do nivel4 definidos na configuração."""
+    nivel4_config = (config or {}).get('nivel4', {})
+    dir_dados = os.path.abspath(os.path.join(DIR_RAIZ, nivel4_config.get('diretorio_logs', 'nivel4')))
+    return {
+        'dir': dir_dados,
+        'rede': os.path.join(dir_dados, nivel4_config.get('nome_arquivo_rede', 'dados_brutos_rede.csv')),
+        'aplicacao': os.path.join(dir_dados, nivel4_config.get('nome_arquivo_aplicacao', 'dados_brutos_aplicacao.csv')),
+        'stats_rede': os.path.join(dir_dados, nivel4_config.get('nome_arquivo_stats_rede', 'estatisticas_rede.csv')),
+        'stats_aplicacao': os.path.join(dir_dados, nivel4_config.get('nome_arquivo_stats_aplicacao', 'estatisticas_aplicacao.csv')),
+        'binario': os.path.join(dir_dados, nivel4_config.get('nome_arquivo_binario', 'dados_brutos.bin')),
+        'estado': os.path.join(dir_dados, nivel4_config.get('nome_arquivo_estado', 'estado_vivo.shm')),
+        'comandos': os.path.join(dir_dados, nivel4_config.get('nome_arquivo_comandos', 'comandos.sock')),
+        'perfis': os.path.join(dir_dados, 'perfis'),
+    }
+
+
+def formato(config):
+    return (config or {}).get('nivel4', {}).get('formato', FORMATO_CSV)
+
+
+def ler_cauda(f, n):
+    """
+    Cabeçalho, últimas n linhas completas (bytes) e a posição logo após a última
+    delas, lendo um arquivo binário aberto de trás para frente em blocos: o
+    custo depende de n, não do tamanho do arquivo.
+    """
+    f.seek(0)
+    cabecalho = f.readline().decode('utf-8').strip()
+    inicio_dados = f.tell()
+    f.seek(0, os.SEEK_END)
+    posicao = f.tell()
+    if posicao <= inicio_dados:
+        return cabecalho, [], inicio_dados
+    blocos, quebras = [], 0
+    while posicao > inicio_dados and quebras <= n:
+        tamanho = min(TAMANHO_BLOCO, posicao - inicio_dados)
+        posicao -= tamanho
+        f.seek(posicao)
+        bloco = f.read(tamanho)
+        blocos.append(bloco)
+        quebras += bloco.count(b'\n')
+    dados = b''.join(reversed(blocos))
+    # Tudo depois do último '\n' é uma linha ainda incompleta
+    fim = dados.rfind(b'\n') + 1
+    linhas = dados[:fim].split(b'\n')
+    linhas.pop()
+    if posicao > inicio_dados:
+        # A primeira linha do trecho lido pode estar cortada
+        linhas = linhas[1:]
+    linhas = [linha.rstrip(b'\r') for linha in linhas[-n:] if linha] if n > 0 else []
+    return cabecalho, linhas, posicao + fim
+
+
+def ler_cauda_linhas(caminho, n):
+    """Cabeçalho e últimas n linhas completas de um arquivo texto e, se faltarem, das partições anteriores."""
+    with open(caminho, 'rb') as f:
+        cabecalho, linhas, _fim = ler_cauda(f, n)
+    if len(linhas) < n:
+        linhas = particoes.cauda_linhas(caminho, n - len(linhas), cabecalho) + linhas
+    return cabecalho, [linha.decode('utf-8') for linha in linhas]
+
+
+def _epoch_ms(texto):
+    return int(datetime.fromisoformat(texto).timestamp() * 1000)
+
+
+def _opcional(campos, indice, nome):
+    """Valor numérico da coluna, ou NaN se ela está vazia (ex.: RSSI de um timeout) ou não existe (CSV antigo)."""
+    i = indice.get(nome)
+    if i is None or i >= len(campos) or campos[i] == '':
+        return float('nan')
+    return float(campos[i])
+
+
+class FonteCSV:
+    """Dados brutos em dados_brutos_rede.csv e dados_brutos_aplicacao.csv."""
+
+    def __init__(self, caminhos):
+        self.caminhos = caminhos
+
+    def ultimas(self, fluxo, n):
+        nomes = COLUNAS[fluxo]
+        cabecalho, linhas = ler_cauda_linhas(self.caminhos[fluxo], n)
+        indice = {nome: i for i, nome in enumerate(cabecalho.split(','))}
+        resultado = {nome: [] for nome in nomes}
+        for linha in csv.reader(linhas):
+            try:
+                valores = {'Timestamp': _epoch_ms(linha[indice['Timestamp']])}
+                if fluxo == 'rede':
+                    valores['RSSI_Downlink'] = _opcional(linha, indice, 'RSSI_Downlink')
+                    valores['Status'] = linha[indice['Status']]
+                    valores['RSSI_Uplink'] = _opcional(linha, indice, 'RSSI_Uplink')
+                    valores['RTT_ms'] = _opcional(linha, indice, 'RTT_ms')
+                else:
+                    valores['Luminosidade'] = float(linha[indice['Luminosidade']])
+                valores['No'] = int(linha[indice['No']]) if 'No' in indice else 1
+            except (ValueError, IndexError, KeyError):
+                continue
+            for nome in nomes:
+                resultado[nome].append(valores[nome])
+        return resultado
+
+
+class FonteBinaria:
+    """Dados brutos no arquivo binário de registros fixos (mmap)."""
+
+    def __init__(self, caminhos):
+        self.caminhos = caminhos
+        self.leitor = binario.LeitorBinario(caminhos['binario'])
+
+    def ultimas(self, fluxo, n):
+        registros = self.leitor.ultimas(n)
+        if len(registros) < n:
+            registros = binario.concatenar(
+                binario.ultimos_registros_particoes(self.caminhos['binario'], n - len(registros)), registros)
+        c = binario.colunas(registros)
+        if fluxo == 'rede':
+            if binario.np is not None:
+                status = binario.np.asarray(binario.STATUS)[c['status']]
+            else:
+                status = [binario.STATUS[codigo] for codigo in c['status']]
+            return {'Timestamp': c['timestamp_ms'], 'RSSI_Downlink': c['rssi'], 'Status': status, 'No': c['no'],
+                    'RSSI_Uplink': binario.rssi_ul_dbm(c['rssi_ul']), 'RTT_ms': binario.rtt_ms(c['rtt_dms'])}
+        c = binario.colunas(binario.medicoes(registros))
+        return {'Timestamp': c['timestamp_ms'], 'Luminosidade': c['luminosidade'], 'No': c['no']}
+
+
+# --- Seguidores de arquivo (leitura incremental) ---
+# Acompanham um arquivo bruto pela posição (byte no CSV, índice de registro no
+# binário) e entregam apenas as amostras gravadas desde a última chamada, como
+# tuplas na ordem de COLUNAS[fluxo].
+def converter_linha(campos, indice, fluxo):
+    """Linha CSV (lista de campos) -> tupla na ordem de COLUNAS[fluxo]."""
+    ts = _epoch_ms(campos[indice['Timestamp']])
+    no = int(campos[indice['No']]) if 'No' in indice else 1
+    if fluxo == 'rede':
+        return (ts, _opcional(campos, indice, 'RSSI_Downlink'), campos[indice['Status']], no,
+                _opcional(campos, indice, 'RSSI_Uplink'), _opcional(campos, indice, 'RTT_ms'))
+    return ts, float(campos[indice['Luminosidade']]), no
+
+
+class SeguidorCSV:
+    """
+    Acompanha um CSV de dados brutos pela posição em bytes. Detecta troca de
+    arquivo (inode diferente) ou truncamento e recomeça do início do novo arquivo.
+    """
+
+    def __init__(self, caminho, fluxo, amostras_iniciais):
+        self.caminho = caminho
+        self.fluxo = fluxo
+        self.amostras_iniciais = amostras_iniciais
+        self._f = None
+        self._inode = None
+        self._posicao = 0
+        self._indice = None
+
+    def _abrir(self, da_cauda):
+        """Abre o arquivo; com da_cauda=True devolve as últimas linhas para preencher a janela."""
+        if self._f is not None:
+            self._f.close()
+        self._f = open(self.caminho, 'rb')
+        self._inode = os.fstat(self._f.fileno()).st_ino
+        if da_cauda:
+            cabecalho, linhas, self._posicao = ler_cauda(self._f, self.amostras_iniciais)
+            if len(linhas) < self.amostras_iniciais:
+                linhas = particoes.cauda_linhas(self.caminho, self.amostras_iniciais - len(linhas), cabecalho) + linhas
+        else:
+            cabecalho, linhas = self._f.readline().decode('utf-8').strip(), []
+            self._posicao = self._f.tell()
+        self._indice = {nome: i for i, nome in enumerate(cabecalho.split(','))}
+        return self._converter(linhas)
+
+    def _converter(self, linhas):
+        amostras = []
+        for linha in linhas:
+            try:
+                amostras.append(converter_linha(linha.decode('utf-8').rstrip('\r').split(','), self._indice, self.fluxo))
+            except (ValueError, IndexError, KeyError):
+                continue
+        return amostras
+
+    def _ler_ate(self, tamanho):
+        """Lê do descritor aberto até 'tamanho', parando na última linha completa."""
+        if tamanho <= self._posicao:
+            return []
+        self._f.seek(self._posicao)
+        dados = self._f.read(tamanho - self._posicao)
+        fim = dados.rfind(b'\n') + 1
+        self._posicao += fim
+        return self._converter(dados[:fim].split(b'\n')[:-1])
+
+    def novas_amostras(self):
+        """Amostras gravadas desde a última chamada (apenas linhas completas)."""
+        try:
+            st = os.stat(self.caminho)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Arquivo não encontrado: {self.caminho}")
+        if self._f is None:
+            return self._abrir(da_cauda=True)
+        if st.st_ino != self._inode:
+            # Arquivo rotacionado: termina o antigo (o descritor continua válido)
+            # e passa a ler o novo desde o começo
+            restantes = self._ler_ate(os.fstat(self._f.fileno()).st_size)
+            return restantes + self._abrir(da_cauda=False) + self._ler_ate(os.fstat(self._f.fileno()).st_size)
+        if st.st_size < self._posicao:
+            # Arquivo truncado no lugar
+            return self._abrir(da_cauda=False) + self._ler_ate(st.st_size)
+        if st.st_size - self._posicao > LIMITE_ATRASO_BYTES:
+            return self._abrir(da_cauda=True)
+        return self._ler_ate(st.st_size)
+
+    def fechar(self):
+        if self._f is not None:
+            self._f.close()
+            self._f = None
+
+
+class SeguidorBinario:
+    """Acompanha o arquivo binário pelo índice do registro (sem parsing de texto)."""
+
+    def __init__(self, caminho, fluxo, amostras_iniciais):
+        self.caminho = caminho
+        self.fluxo = fluxo
+        self.amostras_iniciais = amostras_iniciais
+        self.leitor = binario.LeitorBinario(caminho)
+        self._posicao = None
+        self._inode = None
+
+    def novas_amostras(self):
+        total = len(self.leitor)
+        inode = self.leitor.inode
+        if self._posicao is None:
+            registros = self.leitor.ultimas(self.amostras_iniciais)
+            if len(registros) < self.amostras_iniciais:
+                registros = binario.concatenar(binario.ultimos_registros_particoes(
+                    self.caminho, self.amostras_iniciais - len(registros)), registros)
+        elif inode != self._inode and self._inode is not None:
+            # Arquivo rotacionado: o resto da partição fechada e depois o arquivo novo
+            registros = binario.concatenar(binario.registros_particao_recente(self.caminho, self._posicao),
+                                           self.leitor.fatia(0, total))
+        elif total < self._posicao:
+            registros = self.leitor.fatia(0, total)
+        else:
+            registros = self.leitor.fatia(self._posicao, total)
+        self._posicao, self._inode = total, inode
+        if self.fluxo == 'rede':
+            c = binario.colunas(registros)
+            status = [binario.STATUS[codigo] for codigo in c['status']]
+            return list(zip(c['timestamp_ms'], c['rssi'], status, c['no'],
+                            binario.rssi_ul_dbm(c['rssi_ul']), binario.rtt_ms(c['rtt_dms'])))
+        c = binario.colunas(binario.medicoes(registros))
+        return list(zip(c['timestamp_ms'], c['luminosidade'], c['no']))
+
+    def fechar(self):
+        pass
+
+
+def criar_seguidor(caminho, fluxo, amostras_iniciais, binario=False, obter_config=None):
+    """
+    Seguidor do arquivo bruto: SeguidorBinario se binario=True, senão
+    SeguidorCSV. No modo unificado, uma fila do barramento em memória. Com
+    'obter_config', as amostras suprimidas pela compressão do gateway
+    (compressao.py) são recriadas.
+    """
+    if barramento.ativo() is not None:
+        return barramento.ativo().assinar(fluxo, amostras_iniciais)
+    classe = SeguidorBinario if binario else SeguidorCSV
+    seguidor = classe(caminho, fluxo, amostras_iniciais)
+    if obter_config is not None:
+        return SeguidorReconstruido(seguidor, fluxo, obter_config)
+    return seguidor
+
+
+_fontes = {}
+
+
+def abrir_fonte(config):
+    """Fonte de telemetria (CSV ou binária) conforme 'nivel4.formato'; reaproveitada entre chamadas."""
+    caminhos = caminhos_dados(config)
+    chave = (formato(config), caminhos['rede'], caminhos['aplicacao'], caminhos['binario'])
+    if chave not in _fontes:
+        _fontes[chave] = FonteBinaria(caminhos) if chave[0] == FORMATO_BINARIO else FonteCSV(caminhos)
+    return _fontes[chave]
@@ -1,194 +1,231 @@
-# nivel5/analise.py - Versão com Escrita Segura preparada
+# nivel5/analise.py - Análise incremental em fluxo (sem pandas)
 
+import math
 import os
+import sys
 import time
 from datetime import datetime
-import yaml
-import pandas as pd
-from collections import deque
-import io
-import tempfile
 
 # --- Configuração de Caminhos ---
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), '..', 'nivel4', 'configuracoes.yaml')
-
-def salvar_yaml_seguro(caminho, dados):
-    """Escreve o YAML de forma atômica para evitar corrupção."""
-    dir_name = os.path.dirname(caminho)
-    try:
-        with tempfile.NamedTemporaryFile('w', dir=dir_name, delete=False, encoding="utf-8") as tmp:
-            yaml.dump(dados, tmp, default_flow_style=False, sort_keys=False)
-            temp_name = tmp.name
-        os.replace(temp_name, caminho)
-    except Exception as e:
-        print(f"Erro ao salvar o YAML de forma segura: {e}")
+NIVEL4_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nivel4'))
+CONFIG_PATH = os.path.join(NIVEL4_PATH, 'configuracoes.yaml')
+
+# Módulos compartilhados entre os níveis ficam no nivel4
+if NIVEL4_PATH not in sys.path: sys.path.insert(0, NIVEL4_PATH)
+from configuracao import obter_configuracao
+from registro import EscritorCSV, instalar_encerramento_gracioso
+from particoes import politica_rotacao
+from telemetria import caminhos_dados, formato, FORMATO_BINARIO
+from janelas import JanelaDeslizante, FluxoAnalisado, QualidadeEnlace, criar_seguidor
+from metricas import Cronometro, obter_metricas
+from perfil import obter_perfilador
+from agregados import escritores_configurados
+
+# Uma linha da frota ('No' = Todos) e uma por nó com eventos novos, a cada ciclo
+CABECALHO_STATS_REDE = ['Timestamp', 'RSSI_Downlink_Media', 'RSSI_Downlink_Min', 'RSSI_Downlink_Max',
+                        'RSSI_Downlink_Desvio', 'RSSI_Downlink_EWMA', 'No', 'RSSI_Uplink_Media', 'PER',
+                        'RTT_p50_ms', 'RTT_p95_ms', 'RTT_p99_ms', 'Vazao_pps', 'Timeouts', 'Duplicados']
+CABECALHO_STATS_APLICACAO = ['Timestamp', 'Luminosidade_Media', 'Luminosidade_Min', 'Luminosidade_Max',
+                             'Luminosidade_Desvio', 'Luminosidade_EWMA']
+
+TEMPO_CICLO = obter_metricas().histograma('twsn_ciclo_analise_segundos',
+                                          'Ciclo de análise: leitura das amostras novas e gravação das estatísticas')
 
 
 def carregar_configuracoes():
-    """Lê e retorna as configurações do arquivo YAML."""
-    try:
-        with open(CONFIG_PATH, 'r') as f:
-            return yaml.safe_load(f) or {}
-    except FileNotFoundError:
-        print(f"ERRO: Arquivo de configuração não encontrado em '{CONFIG_PATH}'. Verifique o caminho.")
-        return None
-    except yaml.YAMLError as e:
-        print(f"ERRO: Formato inválido no arquivo YAML: {e}")
-        return None
+    """Retorna o retrato atual (em cache) das configurações do arquivo YAML."""
+    return obter_configuracao(CONFIG_PATH).obter()
 
 
-def read_last_lines_as_dataframe(file_path, num_lines_to_read):
+class MotorAnalise:
     """
-    Lê as últimas 'num_lines_to_read' linhas de um arquivo CSV e as carrega
-    em um DataFrame do Pandas de forma eficiente.
+    Estado persistente da análise: um seguidor e uma janela deslizante por
+    fluxo. A cada ciclo só as amostras novas dos arquivos brutos são lidas.
     """
-    try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            header = f.readline().strip()
-            if num_lines_to_read <= 0:
-                num_lines_to_read = 1 
-            last_n_lines = deque(f, num_lines_to_read)
-        
-        if not last_n_lines:
-            return pd.DataFrame(columns=header.split(','))
-
-        csv_in_memory = header + "\n" + "\n".join(last_n_lines)
-        return pd.read_csv(io.StringIO(csv_in_memory))
-    
-    except FileNotFoundError:
-        raise FileNotFoundError(f"Arquivo não encontrado: {file_path}")
-    except Exception as e:
-        print(f"Aviso: Não foi possível processar {file_path}. Erro: {e}")
-        return pd.DataFrame()
 
+    def __init__(self, config):
+        nivel5_config = config.get('nivel5', {})
+        caminhos = caminhos_dados(config)
+        binario = formato(config) == FORMATO_BINARIO
 
-def analisar_e_registrar(config):
+        self.path_rede_bruto = caminhos['binario'] if binario else caminhos['rede']
+        self.path_app_bruto = caminhos['binario'] if binario else caminhos['aplicacao']
+        janela_rede = int(nivel5_config.get('janela_rede', 10))
+        janela_app = int(nivel5_config.get('janela_aplicacao', 10))
+        janela_enlace = int(nivel5_config.get('janela_enlace', 100))
+        alfa = float(nivel5_config.get('alfa_ewma', 0.3))
+
+        # Agregados em várias resoluções das mesmas amostras (nivel5.agregados)
+        self.agregados = escritores_configurados(config, caminhos['dir'])
+
+        # Qualidade do enlace da frota e de cada nó, sobre todos os eventos de rede
+        self.enlace = QualidadeEnlace(janela_enlace, janela_rede, alfa)
+        self.enlace_nos = {}
+        self.nos_atualizados = set()
+        novo_enlace = lambda: QualidadeEnlace(janela_enlace, janela_rede, alfa)
+
+        def observar_enlace(amostra):
+            self.enlace.adicionar(amostra)
+            no = amostra[3]
+            if no not in self.enlace_nos:
+                self.enlace_nos[no] = novo_enlace()
+            self.enlace_nos[no].adicionar(amostra)
+            self.nos_atualizados.add(no)
+
+        # A janela de rede só considera pacotes com sucesso; a cauda inicial é
+        # maior para compensar as linhas filtradas (como o antigo multiplicador 3x)
+        # e cobre a janela de enlace
+        self.rede = FluxoAnalisado(
+            criar_seguidor(self.path_rede_bruto, 'rede', max(janela_rede * 3, janela_enlace), binario,
+                           carregar_configuracoes),
+            JanelaDeslizante(janela_rede, alfa),
+            filtro=lambda amostra: amostra[2] == 'Sucesso', observador=observar_enlace,
+            agregados=self.agregados.get('rede'))
+        self.aplicacao = FluxoAnalisado(
+            criar_seguidor(self.path_app_bruto, 'aplicacao', janela_app, binario, carregar_configuracoes),
+            JanelaDeslizante(janela_app, alfa), agregados=self.agregados.get('aplicacao'))
+
+        rotacao = politica_rotacao(config.get('nivel4', {}))
+        self.escritor_rede = EscritorCSV(caminhos['stats_rede'], CABECALHO_STATS_REDE, max_linhas=1, rotacao=rotacao)
+        self.escritor_app = EscritorCSV(caminhos['stats_aplicacao'], CABECALHO_STATS_APLICACAO, max_linhas=1,
+                                        rotacao=rotacao)
+
+    def fechar(self):
+        for fluxo in (self.rede, self.aplicacao):
+            fluxo.seguidor.fechar()
+        self.escritor_rede.fechar()
+        self.escritor_app.fechar()
+        for agregados in self.agregados.values():
+            agregados.fechar()
+
+
+def _linha_estatisticas(janela):
+    return [datetime.now().strftime('%d-%m-%Y %H:%M:%S'),
+            f"{janela.media:.2f}", f"{janela.minimo:.2f}", f"{janela.maximo:.2f}",
+            f"{janela.desvio:.2f}", f"{janela.ewma:.2f}"]
+
+
+def _formatar(valor, casas=2):
+    return "" if valor is None or math.isnan(valor) else f"{valor:.{casas}f}"
+
+
+def _linha_enlace(janela_rssi, enlace, no):
+    """Linha de estatisticas_rede.csv: RSSI de downlink da janela, seguido da qualidade do enlace."""
+    if len(janela_rssi):
+        linha = _linha_estatisticas(janela_rssi)
+    else:
+        linha = [datetime.now().strftime('%d-%m-%Y %H:%M:%S'), "", "", "", "", ""]
+    resumo = enlace.resumo()
+    rssi_ul = enlace.rssi_ul.media if len(enlace.rssi_ul) else None
+    return linha + [no, _formatar(rssi_ul), _formatar(resumo['per'], 4), _formatar(resumo['rtt_p50']),
+                    _formatar(resumo['rtt_p95']), _formatar(resumo['rtt_p99']), _formatar(resumo['vazao'], 3),
+                    resumo['timeouts'], resumo['duplicados']]
+
+
+def analisar_e_registrar(motor):
     """
-    Função principal otimizada para ler apenas as caudas dos arquivos de dados brutos,
-    com acesso seguro às configurações e tratamento de casos extremos.
+    Consome as amostras novas de cada fluxo e grava as estatísticas da janela.
+    O custo por ciclo é proporcional ao número de amostras novas, não à janela.
     """
     print(f"[{datetime.now().strftime('%H:%M:%S')}] Executando análise...")
 
-    # --- Leitura Segura das Configurações ---
-    nivel4_config = config.get('nivel4', {})
-    nivel5_config = config.get('nivel5', {})
-
-    try:
-        dir_logs_name = nivel4_config.get('diretorio_logs', 'nivel4')
-        dir_dados = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', dir_logs_name))
-        
-        path_rede_bruto = os.path.join(dir_dados, nivel4_config.get('nome_arquivo_rede', 'dados_brutos_rede.csv'))
-        path_app_bruto = os.path.join(dir_dados, nivel4_config.get('nome_arquivo_aplicacao', 'dados_brutos_aplicacao.csv'))
-        path_rede_stats = os.path.join(dir_dados, nivel4_config.get('nome_arquivo_stats_rede', 'estatisticas_rede.csv'))
-        path_app_stats = os.path.join(dir_dados, nivel4_config.get('nome_arquivo_stats_aplicacao', 'estatisticas_aplicacao.csv'))
-
-        janela_rede = int(nivel5_config.get('janela_rede', 10))
-        janela_app = int(nivel5_config.get('janela_aplicacao', 10))
-    
-    except (ValueError, TypeError) as e:
-        print(f"ERRO CRÍTICO: Configuração de janela ou caminho inválida no YAML. Erro: {e}")
-        return
-    # --- Fim Leitura Segura ---
-
     # --- 1. Análise dos Dados de Rede ---
     try:
-        buffer_multiplier = 3 
-        linhas_a_ler_rede = janela_rede * buffer_multiplier
-        df_rede = read_last_lines_as_dataframe(path_rede_bruto, linhas_a_ler_rede)
-
-        if not df_rede.empty:
-            df_rede_ok = df_rede[df_rede['Status'] == 'Sucesso'].copy()
-            df_janela_rede = df_rede_ok.tail(janela_rede).copy()
-
-            if not df_janela_rede.empty:
-                df_janela_rede['RSSI_Downlink'] = pd.to_numeric(df_janela_rede['RSSI_Downlink'], errors='coerce')
-                df_janela_rede.dropna(subset=['RSSI_Downlink'], inplace=True) 
-
-                if not df_janela_rede.empty:
-                    stats_rede = {
-                        'Timestamp': datetime.now().strftime('%d-%m-%Y %H:%M:%S'),
-                        'RSSI_Downlink_Media': df_janela_rede['RSSI_Downlink'].mean(),
-                        'RSSI_Downlink_Min': df_janela_rede['RSSI_Downlink'].min(),
-                        'RSSI_Downlink_Max': df_janela_rede['RSSI_Downlink'].max(),
-                    }
-                    file_exists = os.path.exists(path_rede_stats)
-                    with open(path_rede_stats, 'a', newline='') as f:
-                        writer = pd.DataFrame([stats_rede])
-                        writer.to_csv(f, sep=',', header=not file_exists, index=False, float_format='%.2f')
-                    print("  - Estatísticas de rede salvas.")
-
+        motor.rede.atualizar()
+        if len(motor.rede.janela) or motor.nos_atualizados:
+            motor.escritor_rede.escrever(_linha_enlace(motor.rede.janela, motor.enlace, 'Todos'))
+            for no in sorted(motor.nos_atualizados):
+                enlace = motor.enlace_nos[no]
+                motor.escritor_rede.escrever(_linha_enlace(enlace.rssi_dl, enlace, no))
+            motor.nos_atualizados.clear()
+            print("  - Estatísticas de rede salvas.")
     except FileNotFoundError:
-        print(f"  - Aviso: Arquivo de dados brutos da rede '{path_rede_bruto}' ainda não existe.")
+        print(f"  - Aviso: Arquivo de dados brutos da rede '{motor.path_rede_bruto}' ainda não existe.")
     except Exception as e:
         print(f"  - ERRO inesperado ao analisar dados da rede: {e}")
 
     # --- 2. Análise dos Dados de Aplicação ---
     try:
-        buffer_multiplier_app = 3
-        linhas_a_ler_app = janela_app * buffer_multiplier_app
-        df_app = read_last_lines_as_dataframe(path_app_bruto, linhas_a_ler_app)
-        
-        if not df_app.empty:
-            df_janela_app = df_app.tail(janela_app).copy()
-
-            if not df_janela_app.empty:
-                df_janela_app['Luminosidade'] = pd.to_numeric(df_janela_app['Luminosidade'], errors='coerce')
-                df_janela_app.dropna(subset=['Luminosidade'], inplace=True)
-
-                if not df_janela_app.empty:
-                    if (df_janela_app['Luminosidade'] == 0).all():
-                        stats_app = {
-                            'Timestamp': datetime.now().strftime('%d-%m-%Y %H:%M:%S'),
-                            'Luminosidade_Media': 0.0,
-                            'Luminosidade_Min': 0.0,
-                            'Luminosidade_Max': 0.0,
-                        }
-                    else:
-                        stats_app = {
-                            'Timestamp': datetime.now().strftime('%d-%m-%Y %H:%M:%S'),
-                            'Luminosidade_Media': df_janela_app['Luminosidade'].mean(),
-                            'Luminosidade_Min': df_janela_app['Luminosidade'].min(),
-                            'Luminosidade_Max': df_janela_app['Luminosidade'].max(),
-                        }
-                    
-                    file_exists = os.path.exists(path_app_stats)
-                    with open(path_app_stats, 'a', newline='') as f:
-                        writer = pd.DataFrame([stats_app])
-                        writer.to_csv(f, sep=',', header=not file_exists, index=False, float_format='%.2f')
-                    print("  - Estatísticas de aplicação salvas.")
-
+        motor.aplicacao.atualizar()
+        if len(motor.aplicacao.janela):
+            motor.escritor_app.escrever(_linha_estatisticas(motor.aplicacao.janela))
+            print("  - Estatísticas de aplicação salvas.")
     except FileNotFoundError:
-        print(f"  - Aviso: Arquivo de dados brutos da aplicação '{path_app_bruto}' ainda não existe.")
+        print(f"  - Aviso: Arquivo de dados brutos da aplicação '{motor.path_app_bruto}' ainda não existe.")
     except Exception as e:
         print(f"  - ERRO inesperado ao analisar dados da aplicação: {e}")
 
+    # --- 3. Agregados: publica os baldes abertos para o dashboard ---
+    for agregados in motor.agregados.values():
+        agregados.persistir()
+
+
+def main(parar=None):
+    """Função principal que executa o loop de análise ('parar' encerra o loop no modo unificado do init.py)."""
+    instalar_encerramento_gracioso()
+    config_compartilhada = obter_configuracao(CONFIG_PATH)
+    perfilador = obter_perfilador()
+    perfilador.iniciar(config_compartilhada, 'nivel5')
+    motor = None
+    alteradas_pendentes = set()
+
+    # Mudanças de formato, arquivos ou janelas exigem um novo motor. O callback
+    # pode disparar em outra thread (modo unificado): o motor é trocado no loop
+    def invalidar_motor(_config, alteradas):
+        alteradas_pendentes.update(alteradas)
+    config_compartilhada.registrar_callback('nivel4.*', invalidar_motor)
+    config_compartilhada.registrar_callback('nivel5.janela_*', invalidar_motor)
+    config_compartilhada.registrar_callback('nivel5.alfa_ewma', invalidar_motor)
+    config_compartilhada.registrar_callback('nivel5.agregados*', invalidar_motor)
 
-def main():
-    """Função principal que executa o loop de análise."""
-    while True:
-        config = carregar_configuracoes()
-        if config and config.get('nivel5', {}).get('ativado', False):
-            try:
-                analisar_e_registrar(config)
-                intervalo = config.get('nivel5', {}).get('intervalo_analise_s', 10)
-            except Exception as e:
-                print(f"ERRO fatal não esperado na função analisar_e_registrar: {e}")
-                intervalo = 10 
-        else:
-            if config is None:
-                print("Análise pausada: não foi possível carregar o arquivo de configuração.", end="\r")
+    try:
+        while parar is None or not parar.is_set():
+            config = config_compartilhada.obter()
+            if alteradas_pendentes:
+                alteradas = set(alteradas_pendentes)
+                alteradas_pendentes.difference_update(alteradas)
+                if motor is not None:
+                    print(f"Configuração alterada ({', '.join(sorted(alteradas))}); reiniciando janelas.")
+                    motor.fechar()
+                    motor = None
+            if config and config.get('nivel5', {}).get('ativado', False):
+                try:
+                    if motor is None:
+                        motor = MotorAnalise(config)
+                        obter_metricas().iniciar_exportacao(caminhos_dados(config)['dir'], 'nivel5')
+                    # No modo cprofile, só o ciclo de análise é perfilado (não a espera)
+                    perfilador.iniciar_trecho()
+                    try:
+                        with Cronometro(TEMPO_CICLO):
+                            analisar_e_registrar(motor)
+                    finally:
+                        perfilador.encerrar_trecho()
+                    intervalo = config.get('nivel5', {}).get('intervalo_analise_s', 10)
+                except (ValueError, TypeError) as e:
+                    print(f"ERRO CRÍTICO: Configuração de janela ou caminho inválida no YAML. Erro: {e}")
+                    intervalo = 10
+                except Exception as e:
+                    print(f"ERRO fatal não esperado na função analisar_e_registrar: {e}")
+                    intervalo = 10
             else:
-                print("Análise pausada via arquivo de configuração (ativado: False).", end="\r")
-            intervalo = 5
-        
-        try:
-            time.sleep(float(intervalo))
-        except ValueError:
-            print(f"ERRO: Intervalo de análise '{intervalo}' não é um número válido. Usando padrão 10s.")
-            time.sleep(10)
-        except KeyboardInterrupt:
-            print("\nScript de análise encerrado pelo usuário.")
-            break
+                if config is None:
+                    print("Análise pausada: não foi possível carregar o arquivo de configuração.", end="\r")
+                else:
+                    print("Análise pausada via arquivo de configuração (ativado: False).", end="\r")
+                intervalo = 5
+
+            try:
+                intervalo = float(intervalo)
+            except ValueError:
+                print(f"ERRO: Intervalo de análise '{intervalo}' não é um número válido. Usando padrão 10s.")
+                intervalo = 10
+            if parar is not None: parar.wait(intervalo)
+            else: time.sleep(intervalo)
+    except KeyboardInterrupt:
+        print("\nScript de análise encerrado pelo usuário.")
+    finally:
+        if motor is not None:
+            motor.fechar()
 
 if __name__ == "__main__":
     main()
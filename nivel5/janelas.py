@@ -0,0 +1,176 @@
+# nivel5/janelas.py - Motor de análise incremental (janelas deslizantes em fluxo)
+#
+# Em vez de reler a cauda dos arquivos brutos a cada ciclo, os "seguidores"
+# (nivel4/telemetria.py) acompanham os arquivos pela posição e entregam apenas
+# as amostras novas. Cada amostra atualiza a janela em O(1): soma e variância
+# deslizantes (Welford), mínimo/máximo por deques monotônicos e média móvel
+# exponencial (EWMA). Nada aqui depende do pandas. QualidadeEnlace acompanha
+# os eventos do fluxo de rede de um nó (sucessos, timeouts, duplicados) para a
+# taxa de perda, os percentis de RTT e a vazão.
+
+import math
+from collections import Counter, deque
+
+# Os seguidores ficam no nivel4: o cache do nivel6 também os usa
+from telemetria import criar_seguidor  # noqa: F401 (reexportado para o analise.py)
+
+
+class JanelaDeslizante:
+    """Estatísticas das últimas 'tamanho' amostras, atualizadas em O(1) por amostra."""
+
+    def __init__(self, tamanho, alfa_ewma=0.3):
+        self.tamanho = max(1, int(tamanho))
+        self.alfa_ewma = float(alfa_ewma)
+        self._valores = deque()
+        self._minimos = deque()   # (indice, valor) com valores crescentes
+        self._maximos = deque()   # (indice, valor) com valores decrescentes
+        self._indice = 0
+        self._media = 0.0
+        self._m2 = 0.0
+        self.ewma = None
+
+    def __len__(self):
+        return len(self._valores)
+
+    def adicionar(self, x):
+        x = float(x)
+        if math.isnan(x):
+            return
+        indice = self._indice
+        self._indice += 1
+
+        # Média e soma dos quadrados dos desvios (Welford deslizante)
+        self._valores.append(x)
+        if len(self._valores) > self.tamanho:
+            y = self._valores.popleft()
+            n = len(self._valores)
+            media_antiga = self._media
+            self._media += (x - y) / n
+            self._m2 += (x - y) * (x - self._media + y - media_antiga)
+        else:
+            n = len(self._valores)
+            delta = x - self._media
+            self._media += delta / n
+            self._m2 += delta * (x - self._media)
+
+        # Deques monotônicos: a frente é sempre o mínimo/máximo da janela
+        while self._minimos and self._minimos[-1][1] >= x:
+            self._minimos.pop()
+        self._minimos.append((indice, x))
+        while self._maximos and self._maximos[-1][1] <= x:
+            self._maximos.pop()
+        self._maximos.append((indice, x))
+        limite = indice - self.tamanho
+        if self._minimos[0][0] <= limite:
+            self._minimos.popleft()
+        if self._maximos[0][0] <= limite:
+            self._maximos.popleft()
+
+        self.ewma = x if self.ewma is None else self.alfa_ewma * x + (1 - self.alfa_ewma) * self.ewma
+
+    @property
+    def media(self):
+        return self._media
+
+    @property
+    def minimo(self):
+        return self._minimos[0][1]
+
+    @property
+    def maximo(self):
+        return self._maximos[0][1]
+
+    @property
+    def variancia(self):
+        n = len(self._valores)
+        return max(self._m2, 0.0) / (n - 1) if n > 1 else 0.0
+
+    @property
+    def desvio(self):
+        return math.sqrt(self.variancia)
+
+
+# --- Qualidade do enlace ---
+STATUS_RESPOSTA = ('Sucesso', 'Atrasado')
+
+
+def percentil(ordenados, q):
+    """Percentil q (0..1) por posto mais próximo de uma lista já ordenada (NaN se vazia)."""
+    if not ordenados:
+        return float('nan')
+    return ordenados[min(len(ordenados) - 1, int(q * len(ordenados)))]
+
+
+class QualidadeEnlace:
+    """
+    Últimos 'tamanho' eventos de rede de um nó (ou da frota): PER, percentis de
+    RTT, vazão de respostas e janelas de RSSI de downlink e de uplink. A
+    amostra segue telemetria.COLUNAS['rede'].
+    """
+
+    def __init__(self, tamanho=100, janela_rssi=10, alfa_ewma=0.3):
+        self.eventos = deque(maxlen=max(1, int(tamanho)))   # (timestamp_ms, status, rtt_ms)
+        self.rssi_dl = JanelaDeslizante(janela_rssi, alfa_ewma)
+        self.rssi_ul = JanelaDeslizante(janela_rssi, alfa_ewma)
+
+    def adicionar(self, amostra):
+        ts, rssi_dl, status, _no, rssi_ul, rtt_ms = amostra[:6]
+        self.eventos.append((ts, status, float(rtt_ms)))
+        if status in STATUS_RESPOSTA:
+            self.rssi_dl.adicionar(rssi_dl)
+            self.rssi_ul.adicionar(rssi_ul)
+
+    def resumo(self):
+        """
+        PER = timeouts / (sucessos + timeouts): uma resposta atrasada já contou
+        como timeout. Vazão em respostas por segundo no intervalo da janela.
+        """
+        contagem = Counter(status for _ts, status, _rtt in self.eventos)
+        pedidos = contagem['Sucesso'] + contagem['Timeout']
+        respostas = sum(contagem[status] for status in STATUS_RESPOSTA)
+        rtts = sorted(rtt for _ts, _status, rtt in self.eventos if not math.isnan(rtt))
+        duracao_s = (self.eventos[-1][0] - self.eventos[0][0]) / 1000 if len(self.eventos) > 1 else 0.0
+        return {
+            'per': contagem['Timeout'] / pedidos if pedidos else float('nan'),
+            'rtt_p50': percentil(rtts, 0.50), 'rtt_p95': percentil(rtts, 0.95), 'rtt_p99': percentil(rtts, 0.99),
+            'vazao': respostas / duracao_s if duracao_s > 0 else float('nan'),
+            'timeouts': contagem['Timeout'], 'duplicados': contagem['Duplicado'],
+        }
+
+
+# --- Fluxo analisado ---
+class FluxoAnalisado:
+    """
+    Liga um seguidor a uma janela, filtrando as amostras que entram na
+    estatística. O valor analisado é o segundo campo da amostra
+    (RSSI_Downlink ou Luminosidade, ver telemetria.COLUNAS). O 'observador'
+    recebe todas as amostras, antes do filtro; os 'agregados'
+    (nivel4/agregados.py) recebem as que passam pelo filtro.
+    """
+
+    def __init__(self, seguidor, janela, filtro=None, observador=None, agregados=None):
+        self.seguidor = seguidor
+        self.janela = janela
+        self.filtro = filtro
+        self.observador = observador
+        self.agregados = agregados
+        self.indice_valor = 1
+        self.amostras_consumidas = 0
+        self.ultimo_timestamp_ms = None
+
+    def atualizar(self):
+        """Consome as amostras novas; retorna quantas entraram na janela."""
+        entraram = 0
+        for amostra in self.seguidor.novas_amostras():
+            self.amostras_consumidas += 1
+            self.ultimo_timestamp_ms = amostra[0]
+            if self.observador is not None:
+                self.observador(amostra)
+            if self.filtro is not None and not self.filtro(amostra):
+                continue
+            self.janela.adicionar(amostra[self.indice_valor])
+            if self.agregados is not None:
+                self.agregados.adicionar(amostra[0], amostra[self.indice_valor])
+            entraram += 1
+        return entraram
+
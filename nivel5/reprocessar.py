@@ -0,0 +1,713 @@
+# nivel5/reprocessar.py - Reanálise de todo o histórico bruto (backfill das estatísticas)
+#
+# O analise.py só calcula as janelas daqui para frente. Este comando relê o
+# histórico inteiro (partições fechadas, compactadas ou não, e o arquivo vivo)
+# e regrava estatisticas_rede.csv e estatisticas_aplicacao.csv com as janelas
+# e o alfa atuais do configuracoes.yaml. Uso:
+#
+#   python reprocessar.py [--processos N] [--trecho-mb 64] [--fluxo rede|aplicacao|ambos] [--saida DIR]
+#
+# O trabalho é dividido em trechos (cada partição, e os arquivos grandes em
+# faixas de bytes alinhadas em linhas ou registros) e roda em duas fases num
+# pool de processos:
+#   1. cada trecho é decodificado em colunas NumPy (gravadas em .npy
+#      temporários) e devolve a sua "cauda": as últimas C amostras da frota e
+#      de cada nó em cada filtro usado pelas janelas (C cobre a maior janela e
+#      o aquecimento da EWMA);
+#   2. cada trecho recebe como contexto a cauda acumulada dos trechos
+#      anteriores e calcula as estatísticas com operações vetorizadas. Assim as
+#      janelas que atravessam a fronteira entre trechos saem iguais às de uma
+#      passada única.
+# Cada parte sai ordenada por (ciclo, linha do ciclo) e guarda essas chaves;
+# partes que se sobrepõem (um ciclo dividido entre dois trechos, ou amostras
+# fora de ordem) são intercaladas pelas chaves ao juntar, então a saída não
+# depende do tamanho dos trechos.
+# Como no analise.py, o ciclo é 'nivel5.intervalo_analise_s': uma linha por
+# ciclo (no fim do ciclo, com a janela até a última amostra dele) para a frota
+# e para cada nó com eventos no ciclo; ciclos sem amostras não geram linhas.
+# A EWMA começa na primeira amostra do histórico.
+#
+# Com nivel3.compressao ligada, as amostras omitidas no registro são recriadas
+# antes das janelas, com as regras do SeguidorReconstruido (o mesmo que o
+# analise.py lê): dentro de cada trecho na fase 1 e, entre um trecho e o
+# seguinte, num passo sequencial que completa o início do trecho seguinte.
+#
+# A saída é gravada em um arquivo temporário e trocada com os.replace. Pare o
+# analise.py antes (nivel5.ativado: false): ele mantém o arquivo aberto. As
+# partições fechadas das estatísticas antigas vão para 'substituidas_<data>/'.
+# Requer NumPy.
+
+import argparse
+import heapq
+import math
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# --- Configuração de Caminhos ---
+NIVEL4_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'nivel4'))
+CONFIG_PATH = os.path.join(NIVEL4_PATH, 'configuracoes.yaml')
+
+if NIVEL4_PATH not in sys.path: sys.path.insert(0, NIVEL4_PATH)
+from configuracao import obter_configuracao
+from telemetria import caminhos_dados, converter_linha, formato, FORMATO_BINARIO
+import armazenamento_binario as binario
+import compressao
+import particoes
+
+# Mesmos cabeçalhos e regras do analise.py (não importado: ele carrega o loop de análise)
+CABECALHO_STATS_REDE = ['Timestamp', 'RSSI_Downlink_Media', 'RSSI_Downlink_Min', 'RSSI_Downlink_Max',
+                        'RSSI_Downlink_Desvio', 'RSSI_Downlink_EWMA', 'No', 'RSSI_Uplink_Media', 'PER',
+                        'RTT_p50_ms', 'RTT_p95_ms', 'RTT_p99_ms', 'Vazao_pps', 'Timeouts', 'Duplicados']
+CABECALHO_STATS_APLICACAO = ['Timestamp', 'Luminosidade_Media', 'Luminosidade_Min', 'Luminosidade_Max',
+                             'Luminosidade_Desvio', 'Luminosidade_EWMA']
+
+SUCESSO, TIMEOUT, DUPLICADO, SEM_RESPOSTA, ATRASADO = (binario.STATUS.index(s) for s in
+                                                       ('Sucesso', 'Timeout', 'Duplicado', 'Sem_Resposta', 'Atrasado'))
+CODIGOS_STATUS = {status: codigo for codigo, status in enumerate(binario.STATUS)}
+
+TRECHO_PADRAO_MB = 64
+BLOCO_LINHAS = 65536       # linhas calculadas por vez (matrizes linhas x janela)
+PRECISAO_EWMA = 1e-9       # peso máximo das amostras fora do aquecimento da EWMA
+
+COLUNAS_TRECHO = {
+    'rede': (('ts', 'i8'), ('no', 'i4'), ('status', 'u1'), ('rssi', 'f8'), ('rssi_ul', 'f8'), ('rtt', 'f8')),
+    'aplicacao': (('ts', 'i8'), ('no', 'i4'), ('valor', 'f8')),
+}
+
+
+# --- Janelas vetorizadas ---
+def ewma(x, alfa):
+    """EWMA recursiva (como JanelaDeslizante, começando no primeiro valor) por blocos de somas acumuladas."""
+    y = np.empty(len(x))
+    beta = 1.0 - alfa
+    if not len(x) or beta <= 0:
+        y[:] = x
+        return y
+    # Dentro do bloco, y_i = beta^(i+1)*y_anterior + alfa*beta^i*soma(x_j/beta^j); o bloco é
+    # curto o bastante para beta^-j não estourar
+    bloco = max(1, min(256, int(200 / -math.log10(beta)))) if beta < 1 else len(x)
+    anterior = x[0]
+    for inicio in range(0, len(x), bloco):
+        trecho = x[inicio:inicio + bloco]
+        potencias = beta ** np.arange(len(trecho))
+        y[inicio:inicio + len(trecho)] = beta * potencias * anterior + alfa * potencias * np.cumsum(trecho / potencias)
+        anterior = y[inicio + len(trecho) - 1]
+    return y
+
+
+def aquecimento_ewma(alfa):
+    """Amostras anteriores necessárias para a EWMA sair igual à de uma passada única."""
+    beta = 1.0 - alfa
+    if beta <= 0:
+        return 1
+    return int(math.ceil(math.log(PRECISAO_EWMA) / math.log(beta)))
+
+
+def janelas(valores, posicoes, tamanho):
+    """Matriz len(posicoes) x tamanho com os valores até cada posição (NaN antes do início)."""
+    if not len(valores):
+        return np.full((len(posicoes), tamanho), np.nan)
+    indices = posicoes[:, None] - np.arange(tamanho - 1, -1, -1)
+    return np.where(indices >= 0, valores[np.maximum(indices, 0)], np.nan)
+
+
+def estatisticas(matriz):
+    """Média, mínimo, máximo e desvio (amostral) de cada linha, ignorando NaN; linhas vazias viram NaN."""
+    n = np.sum(~np.isnan(matriz), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.nansum(matriz, axis=1) / n
+        desvio = np.sqrt(np.nansum((matriz - media[:, None]) ** 2, axis=1) / (n - 1))
+    desvio = np.where(n > 1, desvio, np.where(n == 1, 0.0, np.nan))
+    return media, np.fmin.reduce(matriz, axis=1), np.fmax.reduce(matriz, axis=1), desvio
+
+
+def percentis(matriz, quantis):
+    """Percentil por posto mais próximo (janelas.percentil) de cada linha, ignorando NaN."""
+    ordenada = np.sort(matriz, axis=1)   # NaN ficam no fim
+    n = np.sum(~np.isnan(matriz), axis=1)
+    resultado = []
+    for q in quantis:
+        posicao = np.maximum(np.minimum(n - 1, (q * n).astype(np.int64)), 0)
+        valor = np.take_along_axis(ordenada, posicao[:, None], axis=1)[:, 0]
+        resultado.append(np.where(n > 0, valor, np.nan))
+    return resultado
+
+
+def _contagem(mascara, fins, tamanho):
+    """Quantos True há na janela de 'tamanho' eventos que termina em cada índice de 'fins'."""
+    acumulado = np.concatenate(([0], np.cumsum(mascara)))
+    return acumulado[fins + 1] - acumulado[np.maximum(fins - tamanho + 1, 0)]
+
+
+def _serie_filtrada(valores, mascara, fins):
+    """Valores que passam no filtro e, para cada índice em 'fins', a posição do último deles até ali (-1 se nenhum)."""
+    return valores[mascara], np.cumsum(mascara)[fins] - 1
+
+
+# --- Estatísticas de um grupo de eventos (frota ou um nó) ---
+def linhas_rede(ev, fins, filtro_rssi, parametros):
+    """
+    Colunas de estatisticas_rede.csv (sem Timestamp e No) para as janelas que
+    terminam em cada índice de 'fins'. 'filtro_rssi' escolhe os eventos da
+    janela de RSSI de downlink (Sucesso para a frota, respostas para um nó).
+    """
+    janela_rssi, janela_enlace, alfa = parametros['janela_rede'], parametros['janela_enlace'], parametros['alfa']
+    resposta = (ev['status'] == SUCESSO) | (ev['status'] == ATRASADO)
+    rssi, pos_rssi = _serie_filtrada(ev['rssi'], filtro_rssi(ev['status']), fins)
+    ewma_rssi = ewma(rssi, alfa)
+    valido_ul = resposta & ~np.isnan(ev['rssi_ul'])
+    rssi_ul, pos_ul = _serie_filtrada(ev['rssi_ul'], valido_ul, fins)
+
+    colunas = {nome: [] for nome in ('media', 'min', 'max', 'desvio', 'ewma', 'rssi_ul', 'p50', 'p95', 'p99')}
+    for inicio in range(0, len(fins), BLOCO_LINHAS):
+        bloco = slice(inicio, inicio + BLOCO_LINHAS)
+        media, minimo, maximo, desvio = estatisticas(janelas(rssi, pos_rssi[bloco], janela_rssi))
+        for nome, valores in zip(('media', 'min', 'max', 'desvio'), (media, minimo, maximo, desvio)):
+            colunas[nome].append(valores)
+        colunas['ewma'].append(janelas(ewma_rssi, pos_rssi[bloco], 1)[:, 0])
+        colunas['rssi_ul'].append(estatisticas(janelas(rssi_ul, pos_ul[bloco], janela_rssi))[0])
+        for nome, valores in zip(('p50', 'p95', 'p99'),
+                                 percentis(janelas(ev['rtt'], fins[bloco], janela_enlace), (0.50, 0.95, 0.99))):
+            colunas[nome].append(valores)
+    colunas = {nome: np.concatenate(partes) if partes else np.empty(0) for nome, partes in colunas.items()}
+
+    sucessos = _contagem(ev['status'] == SUCESSO, fins, janela_enlace)
+    timeouts = _contagem(ev['status'] == TIMEOUT, fins, janela_enlace)
+    duplicados = _contagem(ev['status'] == DUPLICADO, fins, janela_enlace)
+    respostas = _contagem(resposta, fins, janela_enlace)
+    duracao_s = (ev['ts'][fins] - ev['ts'][np.maximum(fins - janela_enlace + 1, 0)]) / 1000
+    with np.errstate(invalid='ignore', divide='ignore'):
+        per = np.where(sucessos + timeouts > 0, timeouts / (sucessos + timeouts), np.nan)
+        vazao = np.where(duracao_s > 0, respostas / duracao_s, np.nan)
+    return [colunas['media'], colunas['min'], colunas['max'], colunas['desvio'], colunas['ewma'],
+            colunas['rssi_ul'], per, colunas['p50'], colunas['p95'], colunas['p99'], vazao, timeouts, duplicados]
+
+
+def linhas_aplicacao(ev, fins, parametros):
+    janela, alfa = parametros['janela_aplicacao'], parametros['alfa']
+    media, minimo, maximo, desvio = [np.concatenate(partes) for partes in zip(*(
+        estatisticas(janelas(ev['valor'], fins[i:i + BLOCO_LINHAS], janela)) for i in range(0, len(fins), BLOCO_LINHAS)
+    ))] if len(fins) else [np.empty(0)] * 4
+    return [media, minimo, maximo, desvio, ewma(ev['valor'], alfa)[fins]]
+
+
+def fins_de_ciclo(ts, inicio, ts_seguinte, passo_ms):
+    """Índices (>= inicio) do último evento de cada ciclo; 'ts_seguinte' é o próximo evento após o trecho."""
+    ciclo = -(-ts // passo_ms)   # teto: o ciclo termina no primeiro múltiplo de passo >= ts
+    seguinte = np.empty_like(ciclo)
+    seguinte[:-1] = ciclo[1:]
+    if len(ciclo):
+        seguinte[-1] = -1 if ts_seguinte is None else -(-ts_seguinte // passo_ms)
+    fins = np.nonzero(ciclo != seguinte)[0]
+    fins = fins[fins >= inicio]
+    return fins, ciclo[fins] * passo_ms
+
+
+# --- Reconstrução das amostras omitidas pela compressão ---
+def series_compressao(config, fluxo):
+    """
+    {nó: (modo, intervalo_ms, lacuna_ms)} com a frota em None, ou None se o
+    fluxo não tem compressão (tuplas simples: vão para os processos do pool).
+    """
+    if not compressao.ligada(config):
+        return None
+    series = {}
+    for id_no in [None] + [definicao.get('id') for definicao in config.get('nivel1', {}).get('nos') or []]:
+        p = compressao.parametros(config, fluxo, id_no)
+        intervalo_ms = compressao.intervalo_no(config, id_no) * 1000
+        series[None if id_no is None else int(id_no)] = (p['modo'], intervalo_ms, compressao.lacuna_maxima(p, intervalo_ms))
+    if all(modo == compressao.NENHUMA for modo, _intervalo, _lacuna in series.values()):
+        return None
+    return series
+
+
+def recriar(t0, v0, t1, v1, ocupados, serie):
+    """
+    Amostras recriadas entre pares de amostras gravadas consecutivas de um nó
+    (arrays alinhados), com as contas de SeguidorReconstruido._recriar.
+    Devolve (par de cada recriada, ts, valor), em ordem.
+    """
+    modo, intervalo_ms, lacuna = serie
+    dt = t1 - t0
+    faltantes = np.rint(dt / intervalo_ms).astype(np.int64) - 1 - ocupados
+    faltantes = np.where((dt > lacuna) | (dt <= 0) | (modo == compressao.NENHUMA), 0, np.maximum(faltantes, 0))
+    par = np.repeat(np.arange(len(t0)), faltantes)
+    k = np.arange(len(par)) - np.repeat(np.cumsum(faltantes) - faltantes, faltantes) + 1
+    divisor = faltantes[par] + 1
+    ts = (t0[par] + k * (dt[par] / divisor)).astype(np.int64)
+    if modo == compressao.BANDA_MORTA:
+        valores = v0[par]
+    else:
+        valores = np.where(np.isnan(v1[par]), v0[par], v0[par] + (v1[par] - v0[par]) * k / divisor)
+    return par, ts, valores
+
+
+def _gravadas(ev, fluxo):
+    """(amostras que entram na série, timeouts/atrasados que ocupam uma medição, valores) como no SeguidorReconstruido."""
+    if fluxo == 'rede':
+        return ev['status'] == SUCESSO, (ev['status'] == TIMEOUT) | (ev['status'] == ATRASADO), ev['rssi']
+    return np.ones(len(ev['ts']), dtype=bool), np.zeros(len(ev['ts']), dtype=bool), ev['valor']
+
+
+def _novas_linhas(fluxo, ts, no, valores):
+    """Colunas das recriadas: no fluxo 'rede', sucessos sem RSSI de uplink nem RTT."""
+    if fluxo == 'aplicacao':
+        return {'ts': ts, 'no': no, 'valor': valores}
+    nan = np.full(len(ts), np.nan)
+    return {'ts': ts, 'no': no, 'status': np.full(len(ts), SUCESSO, dtype='u1'), 'rssi': valores, 'rssi_ul': nan, 'rtt': nan}
+
+
+def inserir(ev, fluxo, posicoes, novas):
+    """Insere as linhas 'novas' antes das posições indicadas (as recriadas antecedem a gravada que fecha a lacuna)."""
+    if not len(posicoes):
+        return ev
+    return {nome: np.insert(coluna, posicoes, novas[nome].astype(coluna.dtype)) for nome, coluna in ev.items()}
+
+
+def reconstruir(ev, fluxo, series):
+    """
+    (ev com as recriadas dentro do trecho, bordas): bordas[nó] = (posição da
+    primeira gravada do nó no trecho ou -1, seu ts, seu valor, ocupados antes
+    dela, ts e valor da última gravada, ocupados depois dela), usadas para
+    preencher as lacunas que atravessam a fronteira com o trecho anterior.
+    """
+    gravada, ocupa, valores = _gravadas(ev, fluxo)
+    posicoes, partes, bordas = [], [], {}
+    for no in np.unique(ev['no']):
+        do_no = ev['no'] == no
+        indices = np.nonzero(do_no & gravada)[0]
+        ocupados = np.cumsum(ocupa & do_no)
+        if not len(indices):
+            bordas[int(no)] = (-1, 0, math.nan, int(ocupados[-1]), 0, math.nan, 0)
+            continue
+        bordas[int(no)] = (int(indices[0]), int(ev['ts'][indices[0]]), float(valores[indices[0]]), int(ocupados[indices[0]]),
+                           int(ev['ts'][indices[-1]]), float(valores[indices[-1]]), int(ocupados[-1] - ocupados[indices[-1]]))
+        par, ts, recriados = recriar(ev['ts'][indices[:-1]], valores[indices[:-1]], ev['ts'][indices[1:]], valores[indices[1:]],
+                                     ocupados[indices[1:]] - ocupados[indices[:-1]], series.get(int(no), series[None]))
+        posicoes.append(indices[1:][par])
+        partes.append(_novas_linhas(fluxo, ts, np.full(len(ts), no), recriados))
+    if not partes:
+        return ev, bordas
+    posicoes = np.concatenate(posicoes)
+    novas = {nome: np.concatenate([parte[nome] for parte in partes]) for nome in partes[0]}
+    # As posições das primeiras gravadas andam com as linhas inseridas antes delas
+    deslocamento = np.sort(posicoes)
+    bordas = {no: (b[0] + int(np.searchsorted(deslocamento, b[0], 'right')) if b[0] >= 0 else -1,) + b[1:]
+              for no, b in bordas.items()}
+    return inserir(ev, fluxo, posicoes, novas), bordas
+
+
+def lacunas_entre_trechos(resultados, fluxo, series):
+    """
+    Passo sequencial: para cada trecho, (posições, linhas) recriadas entre a
+    última gravada de cada nó nos trechos anteriores e a primeira no trecho.
+    """
+    estado = {}   # nó -> (ts, valor, ocupados) da última gravada até aqui
+    insercoes = []
+    for resultado in resultados:
+        posicoes, partes = [], []
+        for no, (indice, ts0, v0, antes, ts1, v1, depois) in sorted(resultado['bordas'].items()):
+            anterior = estado.get(no)
+            if indice < 0:
+                if anterior is not None:
+                    estado[no] = (anterior[0], anterior[1], anterior[2] + antes)
+                continue
+            if anterior is not None:
+                _par, ts, recriados = recriar(np.array([anterior[0]]), np.array([anterior[1]]), np.array([ts0]),
+                                              np.array([v0]), np.array([anterior[2] + antes]), series.get(no, series[None]))
+                posicoes.append(np.full(len(ts), indice))
+                partes.append(_novas_linhas(fluxo, ts, np.full(len(ts), no), recriados))
+            estado[no] = (ts1, v1, depois)
+        if partes and sum(len(p) for p in posicoes):
+            insercoes.append((np.concatenate(posicoes),
+                              {nome: np.concatenate([parte[nome] for parte in partes]) for nome in partes[0]}))
+        else:
+            insercoes.append(None)
+    return insercoes
+
+
+# --- Trechos ---
+def _ler_trecho(tarefa):
+    """Bytes do trecho: faixa de um arquivo sem compressão ou a partição compactada inteira."""
+    arquivo, inicio, fim = tarefa['arquivo'], tarefa['inicio'], tarefa['fim']
+    with particoes.abrir(arquivo) as f:
+        if fim is None:
+            dados = f.read()
+            return dados[inicio:]
+        f.seek(inicio)
+        return f.read(fim - inicio)
+
+
+def decodificar_trecho(tarefa):
+    """Colunas (dicionário de arrays, ver COLUNAS_TRECHO) de um trecho de dados brutos."""
+    fluxo, dados = tarefa['fluxo'], _ler_trecho(tarefa)
+    tipos = COLUNAS_TRECHO[fluxo]
+    if tarefa['binario']:
+        registros = binario.decodificar(dados)
+        if fluxo == 'aplicacao':
+            registros = binario.medicoes(registros)
+            return {'ts': registros['timestamp_ms'].astype('i8'), 'no': registros['no'].astype('i4'),
+                    'valor': registros['luminosidade'].astype('f8')}
+        return {'ts': registros['timestamp_ms'].astype('i8'), 'no': registros['no'].astype('i4'),
+                'status': registros['status'].astype('u1'), 'rssi': registros['rssi'].astype('f8'),
+                'rssi_ul': binario.rssi_ul_dbm(registros['rssi_ul']), 'rtt': binario.rtt_ms(registros['rtt_dms'])}
+    indice = {nome: i for i, nome in enumerate(tarefa['cabecalho'].split(','))}
+    linhas = []
+    for linha in dados.decode('utf-8').splitlines():
+        campos = linha.split(',')
+        try:
+            amostra = converter_linha(campos, indice, fluxo)
+        except (ValueError, IndexError, KeyError):
+            continue
+        if fluxo == 'rede':
+            ts, rssi, status, no, rssi_ul, rtt = amostra
+            amostra = (ts, no, CODIGOS_STATUS.get(status, SEM_RESPOSTA), rssi, rssi_ul, rtt)
+        else:
+            ts, valor, no = amostra
+            amostra = (ts, no, valor)
+        linhas.append(amostra)
+    matriz = np.array(linhas, dtype=[(nome, tipo) for nome, tipo in tipos]) if linhas else \
+        np.empty(0, dtype=[(nome, tipo) for nome, tipo in tipos])
+    return {nome: np.ascontiguousarray(matriz[nome]) for nome, _tipo in tipos}
+
+
+def _vazio(fluxo):
+    return {nome: np.empty(0, dtype=tipo) for nome, tipo in COLUNAS_TRECHO[fluxo]}
+
+
+def _selecionar(ev, mascara):
+    return {nome: coluna[mascara] for nome, coluna in ev.items()}
+
+
+def _juntar(a, b):
+    return {nome: np.concatenate([a[nome], b[nome]]) for nome in a}
+
+
+def filtros_cauda(fluxo):
+    if fluxo == 'aplicacao':
+        return [lambda ev: np.ones(len(ev['ts']), dtype=bool)]
+    resposta = lambda ev: (ev['status'] == SUCESSO) | (ev['status'] == ATRASADO)
+    return [lambda ev: np.ones(len(ev['ts']), dtype=bool), lambda ev: ev['status'] == SUCESSO, resposta,
+            lambda ev: resposta(ev) & ~np.isnan(ev['rssi_ul'])]
+
+
+def cauda(ev, fluxo, amostras):
+    """
+    Contexto mínimo para continuar as janelas depois de 'ev': as últimas
+    'amostras' de cada filtro, na frota e em cada nó (em ordem original).
+    """
+    manter = np.zeros(len(ev['ts']), dtype=bool)
+    nos = np.unique(ev['no'])
+    for filtro in filtros_cauda(fluxo):
+        mascara = filtro(ev)
+        manter[np.nonzero(mascara)[0][-amostras:]] = True
+        if fluxo == 'rede':
+            for no in nos:
+                manter[np.nonzero(mascara & (ev['no'] == no))[0][-amostras:]] = True
+    return _selecionar(ev, manter)
+
+
+def fase_decodificar(tarefa):
+    """Fase 1: decodifica (e reconstrói) o trecho, grava as colunas em .npy e devolve o resumo."""
+    ev, bordas = decodificar_trecho(tarefa), {}
+    if tarefa['compressao'] is not None:
+        ev, bordas = reconstruir(ev, tarefa['fluxo'], tarefa['compressao'])
+    resumo = _salvar(tarefa, ev)
+    resumo['bordas'] = bordas
+    return resumo
+
+
+def fase_completar(tarefa):
+    """Fase 1b: insere no início do trecho as recriadas das lacunas que vêm do trecho anterior."""
+    ev = {nome: np.load(os.path.join(tarefa['temporario'], f"{tarefa['chave']}_{nome}.npy"))
+          for nome, _tipo in COLUNAS_TRECHO[tarefa['fluxo']]}
+    posicoes, novas = tarefa['insercao']
+    return _salvar(tarefa, inserir(ev, tarefa['fluxo'], posicoes, novas))
+
+
+def _salvar(tarefa, ev):
+    """Grava as colunas em .npy e devolve a cauda e os primeiros instantes por nó."""
+    for nome, coluna in ev.items():
+        np.save(os.path.join(tarefa['temporario'], f"{tarefa['chave']}_{nome}.npy"), coluna)
+    primeiros = {}
+    if len(ev['no']):
+        nos, posicoes = np.unique(ev['no'], return_index=True)
+        primeiros = {int(no): int(ev['ts'][p]) for no, p in zip(nos, posicoes)}
+    return {'amostras': len(ev['ts']), 'primeiro_ts': int(ev['ts'][0]) if len(ev['ts']) else None,
+            'primeiros_no': primeiros, 'cauda': cauda(ev, tarefa['fluxo'], tarefa['contexto_amostras'])}
+
+
+def _texto(valores, casas):
+    texto = np.char.mod(f'%.{casas}f', np.nan_to_num(valores))
+    return np.where(np.isnan(valores), '', texto)
+
+
+def _carimbos(fins_ms):
+    """Timestamp do ciclo no formato do analise.py, formatado uma vez por segundo distinto."""
+    segundos, inversos = np.unique(fins_ms // 1000, return_inverse=True)
+    textos = np.array([datetime.fromtimestamp(int(s)).strftime('%d-%m-%Y %H:%M:%S') for s in segundos])
+    return textos[inversos] if len(segundos) else np.empty(0, dtype=str)
+
+
+def fase_calcular(tarefa):
+    """Fase 2: estatísticas das janelas que terminam neste trecho, com a cauda dos anteriores como contexto."""
+    fluxo, parametros = tarefa['fluxo'], tarefa['parametros']
+    trecho = {nome: np.load(os.path.join(tarefa['temporario'], f"{tarefa['chave']}_{nome}.npy"))
+              for nome, _tipo in COLUNAS_TRECHO[fluxo]}
+    contexto = tarefa['contexto']
+    ev = _juntar(contexto, trecho)
+    inicio = len(contexto['ts'])
+    passo_ms = parametros['passo_ms']
+    partes = []   # (fim do ciclo em ms, ordem na linha do ciclo, colunas de texto)
+
+    if fluxo == 'aplicacao':
+        fins, ciclos = fins_de_ciclo(ev['ts'], inicio, tarefa['seguinte'], passo_ms)
+        media, minimo, maximo, desvio, media_exp = linhas_aplicacao(ev, fins, parametros)
+        partes.append((ciclos, np.zeros(len(fins)), [_texto(v, 2) for v in (media, minimo, maximo, desvio, media_exp)]))
+    else:
+        grupos = [('Todos', -1, ev, inicio, tarefa['seguinte'], lambda status: status == SUCESSO)]
+        for no in np.unique(ev['no']):
+            mascara = ev['no'] == no
+            grupos.append((str(no), int(no), _selecionar(ev, mascara), int(np.count_nonzero(mascara[:inicio])),
+                           tarefa['seguintes_no'].get(int(no)),
+                           lambda status: (status == SUCESSO) | (status == ATRASADO)))
+        for rotulo, ordem, eventos, inicio_grupo, seguinte, filtro in grupos:
+            fins, ciclos = fins_de_ciclo(eventos['ts'], inicio_grupo, seguinte, passo_ms)
+            if not len(fins):
+                continue
+            c = linhas_rede(eventos, fins, filtro, parametros)
+            texto = [_texto(v, 2) for v in c[:5]] + [np.full(len(fins), rotulo), _texto(c[5], 2), _texto(c[6], 4)] \
+                + [_texto(v, 2) for v in c[7:10]] + [_texto(c[10], 3), c[11].astype(str), c[12].astype(str)]
+            partes.append((ciclos, np.full(len(fins), ordem), texto))
+
+    caminho = os.path.join(tarefa['temporario'], f"{tarefa['chave']}.parte.csv")
+    chaves = np.empty((0, 2), dtype=np.int64)
+    with open(caminho, 'w', encoding='utf-8', newline='') as saida:
+        if partes:
+            ciclos = np.concatenate([p[0] for p in partes])
+            ordem_linha = np.concatenate([p[1] for p in partes])
+            colunas = [np.concatenate([p[2][i] for p in partes]) for i in range(len(partes[0][2]))]
+            ordem = np.lexsort((ordem_linha, ciclos))
+            colunas = [_carimbos(ciclos)[ordem]] + [coluna[ordem] for coluna in colunas]
+            for campos in zip(*colunas):
+                saida.write(','.join(campos) + '\r\n')
+            chaves = np.column_stack((ciclos[ordem], ordem_linha[ordem])).astype(np.int64)
+    np.save(caminho + '.chaves.npy', chaves)
+    return len(chaves)
+
+
+# --- Planejamento ---
+def arquivos_historico(caminho):
+    """Partições fechadas (da mais antiga para a mais recente) seguidas do arquivo vivo."""
+    arquivos = [arquivo for arquivo, _fim in particoes.particoes(caminho)]
+    if os.path.isfile(caminho):
+        arquivos.append(caminho)
+    return arquivos
+
+
+def _cabecalho_csv(arquivo):
+    with particoes.abrir(arquivo) as f:
+        linha = f.readline()
+    return linha.decode('utf-8').strip(), len(linha)
+
+
+def dividir(arquivo, binario_, tamanho_trecho):
+    """Faixas (inicio, fim) de bytes do arquivo, alinhadas em linhas (CSV) ou registros; (inicio, None) para compactados."""
+    if binario_:
+        inicio_dados = binario.TAMANHO_CABECALHO
+    else:
+        _cabecalho, inicio_dados = _cabecalho_csv(arquivo)
+    if particoes.comprimido(arquivo):
+        return [(inicio_dados, None)]
+    tamanho = os.path.getsize(arquivo)
+    if binario_:
+        tamanho -= (tamanho - inicio_dados) % binario.TAMANHO_REGISTRO
+        passo = max(1, tamanho_trecho // binario.TAMANHO_REGISTRO) * binario.TAMANHO_REGISTRO
+        cortes = list(range(inicio_dados, tamanho, passo)) + [tamanho]
+        return list(zip(cortes[:-1], cortes[1:]))
+    cortes = [inicio_dados]
+    with open(arquivo, 'rb') as f:
+        while cortes[-1] + tamanho_trecho < tamanho:
+            f.seek(cortes[-1] + tamanho_trecho)
+            f.readline()   # avança até o início da próxima linha
+            if f.tell() >= tamanho:
+                break
+            cortes.append(f.tell())
+    # A última linha pode estar sendo escrita: o trecho final vai até a última quebra de linha
+    with open(arquivo, 'rb') as f:
+        f.seek(max(cortes[-1], tamanho - 65536))
+        final = f.read()
+    fim = tamanho - (len(final) - final.rfind(b'\n') - 1) if b'\n' in final else cortes[-1]
+    cortes.append(max(fim, cortes[-1]))
+    return list(zip(cortes[:-1], cortes[1:]))
+
+
+def planejar(config, fluxo, tamanho_trecho, temporario, parametros):
+    caminhos = caminhos_dados(config)
+    e_binario = formato(config) == FORMATO_BINARIO
+    origem = caminhos['binario'] if e_binario else caminhos[fluxo]
+    series = series_compressao(config, fluxo)
+    tarefas = []
+    for arquivo in arquivos_historico(origem):
+        cabecalho = None if e_binario else _cabecalho_csv(arquivo)[0]
+        for inicio, fim in dividir(arquivo, e_binario, tamanho_trecho):
+            tarefas.append({'fluxo': fluxo, 'arquivo': arquivo, 'inicio': inicio, 'fim': fim, 'binario': e_binario,
+                            'cabecalho': cabecalho, 'temporario': temporario, 'chave': f'{fluxo}{len(tarefas):05d}',
+                            'contexto_amostras': parametros['contexto'], 'parametros': parametros,
+                            'compressao': series})
+    return tarefas
+
+
+def encadear(tarefas, resultados, fluxo, amostras):
+    """Contexto (caudas acumuladas dos trechos anteriores) e próximos instantes de cada trecho."""
+    contexto = _vazio(fluxo)
+    for tarefa, resultado in zip(tarefas, resultados):
+        tarefa['contexto'] = contexto
+        contexto = cauda(_juntar(contexto, resultado['cauda']), fluxo, amostras)
+    seguinte, seguintes_no = None, {}
+    for tarefa, resultado in zip(reversed(tarefas), reversed(resultados)):
+        tarefa['seguinte'], tarefa['seguintes_no'] = seguinte, dict(seguintes_no)
+        if resultado['primeiro_ts'] is not None:
+            seguinte = resultado['primeiro_ts']
+        seguintes_no.update(resultado['primeiros_no'])
+
+
+def _linhas_com_chave(parte, chaves):
+    with open(parte, 'rb') as f:
+        for chave, linha in zip(map(tuple, chaves), f):
+            yield chave, linha
+
+
+def grupos_sobrepostos(chaves):
+    """Partes consecutivas cujas faixas de (ciclo, linha do ciclo) se sobrepõem, em grupos (índices)."""
+    grupos, maximo = [], None
+    for i, c in enumerate(chaves):
+        if not len(c):
+            continue
+        primeira, ultima = tuple(c[0]), tuple(c[-1])   # cada parte já está ordenada
+        if grupos and primeira < maximo:
+            grupos[-1].append(i)
+        else:
+            grupos.append([i])
+        maximo = ultima if maximo is None else max(maximo, ultima)
+    return grupos
+
+
+def juntar_partes(tmp, partes):
+    """
+    Copia as partes em ordem; as que se sobrepõem são intercaladas pelas
+    chaves (heapq.merge é estável: empates seguem a ordem dos trechos, como
+    a ordenação de uma passada única).
+    """
+    chaves = [np.load(parte + '.chaves.npy') for parte in partes]
+    for grupo in grupos_sobrepostos(chaves):
+        if len(grupo) == 1:
+            with open(partes[grupo[0]], 'rb') as f:
+                shutil.copyfileobj(f, tmp, 1024 * 1024)
+            continue
+        for _chave, linha in heapq.merge(*(_linhas_com_chave(partes[i], chaves[i]) for i in grupo),
+                                         key=lambda item: item[0]):
+            tmp.write(linha)
+
+
+def substituir(destino, cabecalho, partes, mover_particoes):
+    """Junta as partes em um temporário ao lado do destino e troca os arquivos com os.replace."""
+    diretorio = os.path.dirname(destino) or '.'
+    with tempfile.NamedTemporaryFile('wb', dir=diretorio, delete=False, suffix='.tmp') as tmp:
+        tmp.write((','.join(cabecalho) + '\r\n').encode('utf-8'))
+        juntar_partes(tmp, partes)
+        tmp.flush()
+        os.fsync(tmp.fileno())
+    if mover_particoes:
+        antigas = particoes.particoes(destino)
+        if antigas:
+            pasta = os.path.join(diretorio, f"substituidas_{datetime.now().strftime(particoes.FORMATO_CARIMBO)}")
+            os.makedirs(pasta, exist_ok=True)
+            for arquivo, _fim in antigas:
+                shutil.move(arquivo, os.path.join(pasta, os.path.basename(arquivo)))
+            print(f"  {len(antigas)} partição(ões) antigas de '{os.path.basename(destino)}' movidas para '{pasta}'.")
+    os.replace(tmp.name, destino)
+    # O índice temporal (historico.py) descrevia o arquivo antigo
+    if os.path.exists(destino + '.idx'):
+        os.remove(destino + '.idx')
+
+
+def parametros_analise(config):
+    nivel5 = config.get('nivel5', {})
+    alfa = float(nivel5.get('alfa_ewma', 0.3))
+    parametros = {'janela_rede': int(nivel5.get('janela_rede', 10)), 'janela_aplicacao': int(nivel5.get('janela_aplicacao', 10)),
+                  'janela_enlace': int(nivel5.get('janela_enlace', 100)), 'alfa': alfa,
+                  'passo_ms': max(1, int(float(nivel5.get('intervalo_analise_s', 10)) * 1000))}
+    parametros['contexto'] = max(parametros['janela_rede'], parametros['janela_aplicacao'], parametros['janela_enlace'],
+                                 aquecimento_ewma(alfa))
+    return parametros
+
+
+def reprocessar(config, fluxos, processos=None, tamanho_trecho=TRECHO_PADRAO_MB * 1024 * 1024, saida=None):
+    """Recalcula as estatísticas dos 'fluxos' sobre todo o histórico; devolve {fluxo: linhas gravadas}."""
+    parametros = parametros_analise(config)
+    caminhos = caminhos_dados(config)
+    destinos = {'rede': ('stats_rede', CABECALHO_STATS_REDE), 'aplicacao': ('stats_aplicacao', CABECALHO_STATS_APLICACAO)}
+    totais = {}
+    with tempfile.TemporaryDirectory(prefix='twsn-reprocessar-') as temporario, \
+            ProcessPoolExecutor(max_workers=processos) as pool:
+        for fluxo in fluxos:
+            inicio = time.perf_counter()
+            tarefas = planejar(config, fluxo, tamanho_trecho, temporario, parametros)
+            if not tarefas:
+                print(f"{fluxo}: nenhum dado bruto encontrado.")
+                continue
+            resultados = list(pool.map(fase_decodificar, tarefas))
+            if tarefas[0]['compressao'] is not None:
+                # Lacunas que atravessam a fronteira entre trechos: completa o início do trecho seguinte
+                insercoes = lacunas_entre_trechos(resultados, fluxo, tarefas[0]['compressao'])
+                pendentes = [i for i, insercao in enumerate(insercoes) if insercao is not None]
+                for i in pendentes:
+                    tarefas[i]['insercao'] = insercoes[i]
+                for i, resultado in zip(pendentes, pool.map(fase_completar, [tarefas[i] for i in pendentes])):
+                    resultados[i] = resultado
+            encadear(tarefas, resultados, fluxo, parametros['contexto'])
+            linhas = sum(pool.map(fase_calcular, tarefas))
+            chave, cabecalho = destinos[fluxo]
+            destino = caminhos[chave] if saida is None else os.path.join(saida, os.path.basename(caminhos[chave]))
+            substituir(destino, cabecalho, [os.path.join(temporario, f"{t['chave']}.parte.csv") for t in tarefas],
+                       mover_particoes=saida is None)
+            amostras = sum(r['amostras'] for r in resultados)
+            totais[fluxo] = linhas
+            print(f"{fluxo}: {amostras} amostras em {len(tarefas)} trecho(s) -> {linhas} linhas em '{destino}' "
+                  f"({time.perf_counter() - inicio:.1f} s).")
+    return totais
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recalcula estatisticas_*.csv sobre todo o histórico bruto.")
+    parser.add_argument('--fluxo', choices=('rede', 'aplicacao', 'ambos'), default='ambos')
+    parser.add_argument('--processos', type=int, default=None, help="processos do pool (padrão: nº de CPUs)")
+    parser.add_argument('--trecho-mb', type=float, default=TRECHO_PADRAO_MB, help="tamanho dos trechos de arquivos grandes")
+    parser.add_argument('--saida', help="diretório de saída (padrão: substitui as estatísticas do nivel4)")
+    args = parser.parse_args()
+    if np is None:
+        print("ERRO: o reprocessamento requer o NumPy (pip install numpy).")
+        sys.exit(1)
+    config = obter_configuracao(CONFIG_PATH).obter()
+    if not config:
+        print("ERRO: não foi possível carregar o arquivo de configuração.")
+        sys.exit(1)
+    if args.saida:
+        os.makedirs(args.saida, exist_ok=True)
+    fluxos = ('rede', 'aplicacao') if args.fluxo == 'ambos' else (args.fluxo,)
+    reprocessar(config, fluxos, args.processos, int(args.trecho_mb * 1024 * 1024), args.saida)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,16 +1,16 @@
 # nivel6/app.py - VERSÃO CORRIGIDA E ROBUSTA
 
 import os
-import yaml
+import sys
 import csv
 import io
-import tempfile
-from flask import Flask, render_template, request, jsonify
+import json
+import time
+import uuid
+from flask import Flask, render_template, request, jsonify, Response, g
 from markupsafe import Markup
-from collections import deque
 from datetime import datetime
 import random
-import time # <<< IMPORTANTE: Adicionado para a lógica de espera
 
 app = Flask(__name__)
 
@@ -19,9 +19,54 @@ BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 NIVEL4_PATH = os.path.join(BASE_DIR, '..', 'nivel4')
 
 YAML_PATH = os.path.join(NIVEL4_PATH, 'configuracoes.yaml')
-CSV_RAW_PATH = os.path.join(NIVEL4_PATH, 'dados_brutos_aplicacao.csv')
 CSV_STATS_PATH = os.path.join(NIVEL4_PATH, 'estatisticas_aplicacao.csv')
 
+# Linhas lidas do final de estatisticas_rede.csv para achar a última de cada nó
+LINHAS_ENLACE = 256
+# Pontos do gráfico de luminosidade quando nivel6.janela_grafico não está definido
+JANELA_GRAFICO_PADRAO = 30
+
+# Módulos compartilhados entre os níveis ficam no nivel4
+if NIVEL4_PATH not in sys.path: sys.path.insert(0, NIVEL4_PATH)
+from configuracao import obter_configuracao
+from telemetria import caminhos_dados, ler_cauda_linhas
+from estado import LeitorEstado, para_dashboard
+from transmissao import Difusor
+from cache import CacheTelemetria, CacheRespostas, assinatura_arquivo, CAPACIDADE_AMOSTRAS
+from compacto import codificar_serie, comprimir, deve_comprimir, MIMETYPE as MIMETYPE_COMPACTO
+import historico
+import barramento
+from metricas import obter_metricas, ler_publicadas, formatar_prometheus
+from canal_comandos import ClienteComandos, endereco_canal
+from perfil import obter_perfilador, pedir_perfil
+
+# Configuração em cache, compartilhada por todas as requisições deste processo
+configuracao = obter_configuracao(YAML_PATH)
+
+# Amostras recentes e respostas prontas, compartilhadas por todas as requisições
+cache_telemetria = CacheTelemetria(configuracao.obter)
+cache_respostas = CacheRespostas()
+
+# Métricas deste processo; /metrics junta as publicadas pelo nivel3 e pelo nivel5
+metricas = obter_metricas()
+TEMPO_REQUISICAO = metricas.histograma('twsn_http_requisicao_segundos',
+                                       'Tempo de resposta das rotas do dashboard (até o início do corpo)', ('rota',))
+IDADE_AMOSTRA = metricas.medidor('twsn_idade_amostra_recente_segundos',
+                                 'Idade da amostra mais recente no cache do dashboard, no momento da coleta')
+
+# Perfil deste processo (seção 'perfil'); no modo unificado o init.py já o iniciou
+perfilador = obter_perfilador()
+perfilador.iniciar(configuracao, 'nivel6')
+PROCESSOS_PERFIL = ('nivel3', 'nivel5', 'nivel6')
+
+# Estado ao vivo dos nós publicado pelo gateway (segmento mmap, sem YAML)
+_leitores_estado = {}
+def leitor_estado():
+    caminho = caminhos_dados(configuracao.obter())['estado']
+    if caminho not in _leitores_estado:
+        _leitores_estado[caminho] = LeitorEstado(caminho)
+    return _leitores_estado[caminho]
+
 # --- LÓGICA DO JOGO DA PLANTA ---
 limiar_atencao_secreto, limiar_critico_secreto = (0, 0)
 def gerar_limiares_secretos():
@@ -36,21 +81,26 @@ def gerar_limiares_secretos():
     print("--------------------")
 gerar_limiares_secretos()
 
-# --- FUNÇÕES AUXILIARES ---
-def salvar_yaml_seguro(caminho, dados):
-    dir_name = os.path.dirname(caminho)
-    try:
-        with tempfile.NamedTemporaryFile('w', dir=dir_name, delete=False, encoding="utf-8") as tmp:
-            yaml.dump(dados, tmp, default_flow_style=False, sort_keys=False)
-            temp_name = tmp.name
-        os.replace(temp_name, caminho)
-    except Exception as e:
-        print(f"Erro ao salvar o YAML de forma segura: {e}")
+@app.before_request
+def iniciar_cronometro():
+    g.inicio_requisicao = time.perf_counter()
+    perfilador.iniciar_trecho()
+
+@app.teardown_request
+def encerrar_perfil(_erro):
+    perfilador.encerrar_trecho()
 
 # <<< NOVO: Adiciona cabeçalhos para prevenir cache do navegador ---
 @app.after_request
 def add_header(response):
-    response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
+    if 'inicio_requisicao' in g:
+        rota = request.url_rule.rule if request.url_rule is not None else 'desconhecida'
+        TEMPO_REQUISICAO.rotulos(rota).observar(time.perf_counter() - g.inicio_requisicao)
+    if response.get_etag()[0] is not None:
+        # Respostas com ETag podem ser guardadas, mas o navegador revalida (If-None-Match) a cada uso
+        response.headers['Cache-Control'] = 'no-cache'
+    else:
+        response.headers['Cache-Control'] = 'no-store, no-cache, must-revalidate, post-check=0, pre-check=0, max-age=0'
     response.headers['Pragma'] = 'no-cache'
     response.headers['Expires'] = '-1'
     return response
@@ -58,12 +108,12 @@ def add_header(response):
 # --- ROTAS PRINCIPAIS E DO JOGO ---
 @app.route('/')
 def home():
-    try:
-        with open(YAML_PATH, 'r') as f:
-            config_data = yaml.safe_load(f) or {}
-        initial_data = config_data.get('nivel6', {})
-    except FileNotFoundError:
+    config_data = configuracao.obter()
+    if config_data is None:
         return "Erro: O arquivo 'configuracoes.yaml' não foi encontrado!", 404
+    initial_data = dict(config_data.get('nivel6', {}))
+    initial_data['janela_grafico'] = janela_grafico()
+    initial_data.update(para_dashboard(leitor_estado().ler()))
     try:
         svg_path = os.path.join(BASE_DIR, 'static', 'pk2.svg')
         with open(svg_path, 'r') as f:
@@ -80,79 +130,359 @@ def planta():
 def monitor():
     return render_template('monitor.html', limiar_atencao_secreto=limiar_atencao_secreto, limiar_critico_secreto=limiar_critico_secreto)
 
+# --- DADOS DOS DASHBOARDS (usados pelas APIs de polling e pelo stream) ---
+def janela_grafico(pedido=None):
+    """Pontos do gráfico: ?pontos= ou nivel6.janela_grafico, limitado à capacidade do cache."""
+    if pedido is None:
+        pedido = (configuracao.obter() or {}).get('nivel6', {}).get('janela_grafico', JANELA_GRAFICO_PADRAO)
+    return min(max(int(pedido), 1), CAPACIDADE_AMOSTRAS)
+
+def dados_luminosidade(no_filtro=None, pontos=None, desde=None):
+    """
+    Janela do gráfico ou, com 'desde' (cursor de uma resposta anterior), só as
+    amostras mais novas. 'completo' avisa que a janela deve ser trocada inteira.
+    """
+    # Amostras já convertidas, mantidas pelo cache (só os bytes novos do arquivo são lidos)
+    cache_telemetria.atualizar()
+    amostras, cursor, completo = cache_telemetria.desde(desde, janela_grafico(pontos), no_filtro)
+    timestamps, values, nos = [], [], []
+    for ts_ms, luminosidade, id_no in amostras:
+        timestamps.append(int(ts_ms))
+        values.append(float(luminosidade))
+        nos.append(int(id_no))
+    if values: latest_value = values[-1]
+    else:
+        ultima = cache_telemetria.recentes(1, no_filtro)
+        latest_value = float(ultima[0][1]) if ultima else "N/A"
+    return {'labels': [datetime.fromtimestamp(ts / 1000).strftime('%H:%M:%S') for ts in timestamps],
+            'values': values, 'latest_value': latest_value, 'timestamps': timestamps, 'nos': nos,
+            'cursor': cursor, 'desde': desde, 'completo': completo}
+
+def codificar_luminosidade(dados):
+    """Resposta de dados_luminosidade no formato binário de nivel6/compacto.py."""
+    return codificar_serie(dados['timestamps'], dados['values'], dados['nos'],
+                           dados['cursor'], dados['desde'], dados['completo'])
+
+def _escalares(secao):
+    return {chave: valor for chave, valor in secao.items() if valor is None or isinstance(valor, (str, int, float, bool))}
+
+def dados_estatisticas(no_filtro=None):
+    response_data = {}
+    # O retrato em cache mantém a última versão válida: não há mais retentativas
+    config = configuracao.obter()
+    if config is not None:
+        # Só os valores simples: seções aninhadas (ex.: nivel5.agregados) não interessam ao dashboard
+        response_data.update(_escalares(config.get('nivel6', {})))
+        response_data.update(_escalares(config.get('nivel5', {})))
+    else: response_data['error_yaml'] = "Não foi possível ler config.yaml"
+
+    # ESTA PARTE ATUALIZA O STATUS DA FIGURA (LEDS), lida do segmento de estado
+    try: response_data.update(para_dashboard(leitor_estado().ler(no_filtro)))
+    except Exception as e: response_data['error_estado'] = str(e)
+
+    try:
+        # Leitura da cauda em blocos: o custo não depende do tamanho do arquivo
+        header_str, ultimas = ler_cauda_linhas(CSV_STATS_PATH, 1)
+        header, last_line_data = next(csv.reader(io.StringIO(header_str))), next(csv.reader(io.StringIO(ultimas[0])))
+        latest_stats_raw = dict(zip(header, last_line_data))
+        for key, value in latest_stats_raw.items():
+            try: response_data[key] = float(value)
+            except (ValueError, TypeError): response_data[key] = value
+    except (FileNotFoundError, IndexError): pass
+    except Exception as e: response_data['error_csv'] = str(e)
+
+    try: response_data['enlace'] = dados_enlace(no_filtro)
+    except FileNotFoundError: response_data['enlace'] = []
+    except Exception as e: response_data['error_enlace'] = str(e)
+    return response_data
+
+def dados_enlace(no_filtro=None):
+    """Última linha de qualidade do enlace de cada nó (e da frota, 'Todos') em estatisticas_rede.csv."""
+    header_str, ultimas = ler_cauda_linhas(caminhos_dados(configuracao.obter())['stats_rede'], LINHAS_ENLACE)
+    header = next(csv.reader(io.StringIO(header_str)))
+    if 'No' not in header: return []   # arquivo anterior às estatísticas de enlace
+    por_no = {}
+    for campos in csv.reader(ultimas):
+        linha = dict(zip(header, campos))
+        if linha.get('No'): por_no[linha['No']] = linha
+    enlace = []
+    # A frota primeiro, depois os nós em ordem numérica
+    for no, linha in sorted(por_no.items(), key=lambda item: (item[0] != 'Todos', item[0].zfill(5))):
+        if no_filtro is not None and no not in ('Todos', str(no_filtro)): continue
+        convertida = {}
+        for key, value in linha.items():
+            if key == 'No' or value == '':
+                convertida[key] = value or None
+                continue
+            try: convertida[key] = float(value)
+            except ValueError: convertida[key] = value
+        enlace.append(convertida)
+    return enlace
+
+def calcular_estado_planta(luminosidade_atual):
+    if luminosidade_atual >= limiar_atencao_secreto: return 'feliz'
+    elif luminosidade_atual >= limiar_critico_secreto: return 'neutra'
+    return 'triste'
+
+# --- STREAM (SSE): um produtor compartilhado para todos os clientes ---
+def _assinatura_estado(no_filtro=None):
+    estado = leitor_estado().ler(no_filtro)
+    return None if estado is None else (estado['no'], estado['atualizado_ms'])
+
+def _assinatura_luminosidade():
+    cache_telemetria.atualizar()
+    return cache_telemetria.versao
+
+def _assinatura_estatisticas(no_filtro=None):
+    # id() do retrato muda sempre que a configuração é recarregada
+    return (assinatura_arquivo(CSV_STATS_PATH), assinatura_arquivo(caminhos_dados(configuracao.obter())['stats_rede']),
+            _assinatura_estado(no_filtro), id(configuracao.obter()))
+
+def _dados_planta():
+    estado = leitor_estado().ler()
+    if estado is None: return {'latest_value': "N/A", 'estado_planta': None}
+    return {'latest_value': estado['luminosidade'], 'estado_planta': calcular_estado_planta(estado['luminosidade'])}
+
+# O stream de luminosidade só leva as amostras novas desde o evento anterior;
+# um cliente que perdeu um evento (cursor diferente de 'desde') busca o que
+# falta em /api/luminosidade?desde=
+_cursor_stream = {'cursor': None}
+def _delta_luminosidade():
+    dados = dados_luminosidade(desde=_cursor_stream['cursor'])
+    _cursor_stream['cursor'] = dados['cursor']
+    del dados['labels']   # o cliente formata os horários a partir dos timestamps
+    return dados
+
+difusor = Difusor()
+difusor.registrar_fonte('luminosidade', _assinatura_luminosidade, _delta_luminosidade)
+difusor.registrar_fonte('estatisticas', _assinatura_estatisticas, dados_estatisticas)
+difusor.registrar_fonte('planta', _assinatura_estado, _dados_planta)
+# Modo unificado (init.py): cada lote de pacotes do gateway acorda o difusor
+if barramento.ativo() is not None: barramento.ativo().ao_publicar(difusor.acordar)
+
+def _aceita_gzip():
+    return 'gzip' in request.accept_encodings
+
+def _resposta(corpo, mimetype, comprimido):
+    resposta = Response(corpo, mimetype=mimetype)
+    resposta.vary.add('Accept-Encoding')
+    if comprimido: resposta.headers['Content-Encoding'] = 'gzip'
+    return resposta
+
+def responder_json(chave, assinatura, produzir, codificar=None, mimetype='application/json'):
+    """
+    Resposta servida do cache de respostas, com ETag e 304 para If-None-Match.
+    Corpos grandes saem com gzip (comprimido uma vez por versão) se o cliente aceita.
+    """
+    corpo, etag = cache_respostas.obter(chave, assinatura, produzir, codificar)
+    comprimido = deve_comprimir(corpo, _aceita_gzip())
+    # A versão gzip tem outros bytes: ETag próprio, para caches intermediários não trocarem as duas
+    tag = etag + '-gz' if comprimido else etag
+    if request.if_none_match.contains(tag):
+        cache_respostas.registrar_nao_modificado()
+        resposta = Response(status=304)
+        resposta.vary.add('Accept-Encoding')
+    else:
+        if comprimido: corpo = cache_respostas.comprimido(chave, etag, corpo)
+        resposta = _resposta(corpo, mimetype, comprimido)
+    resposta.set_etag(tag)
+    return resposta
+
 # --- APIS ---
+@app.route('/api/stream')
+def stream():
+    resposta = Response(difusor.fluxo_sse(difusor.assinar()), mimetype='text/event-stream')
+    resposta.headers['X-Accel-Buffering'] = 'no'
+    return resposta
+
 @app.route('/api/luminosidade')
 def get_luminosidade_data():
+    """
+    Janela do gráfico: ?no=&pontos=&desde=&formato=json|binario. Com desde=<cursor>
+    vêm só as amostras novas; formato=binario usa o bloco de nivel6/compacto.py.
+    """
     try:
-        with open(CSV_RAW_PATH, 'r', encoding='utf-8') as f:
-            last_lines = deque(f, 30)
-        labels, values, latest_value = [], [], "N/A"
-        for row in csv.reader(last_lines):
-            if len(row) >= 2 and "Timestamp" not in row[0]:
-                try:
-                    dt_object = datetime.strptime(row[0], '%Y-%m-%d %H:%M:%S.%f')
-                    labels.append(dt_object.strftime('%H:%M:%S'))
-                    values.append(float(row[1]))
-                except (ValueError, IndexError): continue
-        if values: latest_value = values[-1]
-        return jsonify({'labels': labels, 'values': values, 'latest_value': latest_value})
+        # Filtro opcional por nó (coluna 'No' dos dados brutos)
+        no_filtro = request.args.get('no', type=int)
+        pontos = janela_grafico(request.args.get('pontos', type=int))
+        desde = request.args.get('desde', type=int)
+        binario = request.args.get('formato', 'json') == 'binario'
+        codificar, mimetype = (codificar_luminosidade, MIMETYPE_COMPACTO) if binario else (None, 'application/json')
+        if desde is None:
+            # A janela completa é igual para todos os clientes: servida do cache de respostas
+            return responder_json(('luminosidade', no_filtro, pontos, binario), _assinatura_luminosidade(),
+                                  lambda: dados_luminosidade(no_filtro, pontos), codificar, mimetype)
+        # Incremental: pequeno e próprio de cada cursor, não vale guardar
+        dados = dados_luminosidade(no_filtro, pontos, desde)
+        corpo, comprimido = comprimir(codificar(dados) if binario else json.dumps(dados), _aceita_gzip())
+        return _resposta(corpo, mimetype, comprimido)
     except FileNotFoundError: return jsonify(labels=[], values=[], latest_value="N/A", error="Arquivo não encontrado"), 200
     except Exception as e: return jsonify(labels=[], values=[], latest_value="N/A", error=str(e)), 200
 
+# Comandos ao gateway pelo canal local (nivel4/canal_comandos.py)
+def cliente_comandos():
+    config = configuracao.obter()
+    return ClienteComandos(endereco_canal(config, caminhos_dados(config)['comandos']))
+
+def espera_confirmacao():
+    """Tempo que a requisição espera pelo resultado: todas as tentativas do gateway e uma folga."""
+    config_comandos = configuracao.obter().get('nivel3', {}).get('comandos', {}) or {}
+    return float(config_comandos.get('timeout_s', 0.3)) * int(config_comandos.get('tentativas', 3)) + 0.2
+
 @app.route('/update_thresholds', methods=['POST'])
 def update_thresholds():
+    """
+    Grava os limiares no YAML (para todos os nós ou para 'nos': [ids]) e os
+    envia ao gateway pelo canal de comandos; a resposta traz a entrega por nó.
+    """
     data = request.get_json()
     try:
-        with open(YAML_PATH, 'r') as f:
-            config_data = yaml.safe_load(f) or {}
-        if 'nivel6' not in config_data: config_data['nivel6'] = {}
-        config_data['nivel6']['limiar_atencao'] = int(data['limiar_atencao'])
-        config_data['nivel6']['limiar_critico'] = int(data['limiar_critico'])
-        salvar_yaml_seguro(YAML_PATH, config_data)
-        return jsonify(success=True)
+        limiar_atencao, limiar_critico = int(data['limiar_atencao']), int(data['limiar_critico'])
+        nos = None if data.get('nos') in (None, '', []) else [int(id_no) for id_no in data['nos']]
+        def aplicar(config_data):
+            if nos is None:
+                if 'nivel6' not in config_data: config_data['nivel6'] = {}
+                config_data['nivel6']['limiar_atencao'] = limiar_atencao
+                config_data['nivel6']['limiar_critico'] = limiar_critico
+            for definicao in config_data.get('nivel1', {}).get('nos') or []:
+                if nos is None:
+                    # Um comando para a frota substitui os limiares próprios dos nós
+                    definicao.pop('limiar_atencao', None); definicao.pop('limiar_critico', None)
+                elif int(definicao.get('id', -1)) in nos:
+                    definicao['limiar_atencao'] = limiar_atencao
+                    definicao['limiar_critico'] = limiar_critico
+        configuracao.atualizar(aplicar)
     except Exception as e: return jsonify(success=False, error=str(e)), 500
+    comando = {'tipo': 'limiares', 'id': uuid.uuid4().hex[:12], 'nos': nos,
+               'limiar_atencao': limiar_atencao, 'limiar_critico': limiar_critico}
+    entrega = cliente_comandos().enviar(comando, espera_confirmacao())
+    # Sem o gateway, os limiares gravados seguem no próximo downlink periódico
+    return jsonify(success=True, comando=comando['id'],
+                   entrega=entrega or {'id': comando['id'], 'estado': 'gateway_indisponivel'})
+
+@app.route('/api/comandos/<id_comando>')
+def get_comando(id_comando):
+    """Estado de entrega de um comando enviado por /update_thresholds."""
+    resposta = cliente_comandos().enviar({'tipo': 'consulta', 'id': id_comando}, espera_s=0)
+    if resposta is None: return jsonify(id=id_comando, estado='gateway_indisponivel'), 503
+    return jsonify(resposta), (404 if resposta.get('estado') == 'desconhecido' else 200)
 
-# <<< CORRIGIDO: Função de estatísticas com lógica de retentativa
 @app.route('/api/estatisticas')
 def get_estatisticas_data():
-    response_data, yaml_sucesso = {}, False
-    for _ in range(3):
-        try:
-            with open(YAML_PATH, 'r') as f:
-                config = yaml.safe_load(f) or {}
-            # ESTA PARTE ATUALIZA O STATUS DA FIGURA (LEDS)
-            response_data.update(config.get('nivel6', {}))
-            response_data.update(config.get('nivel5', {}))
-            yaml_sucesso = True
-            break
-        except FileNotFoundError: time.sleep(0.05)
-        except Exception as e:
-            response_data['error_yaml'] = str(e)
-            break
-    if not yaml_sucesso: response_data['error_yaml'] = "Não foi possível ler config.yaml"
+    no_filtro = request.args.get('no', type=int)
+    return responder_json(('estatisticas', no_filtro), _assinatura_estatisticas(no_filtro),
+                          lambda: dados_estatisticas(no_filtro))
 
+@app.route('/api/historico')
+def get_historico():
+    """
+    Série de um intervalo de tempo, reduzida no servidor: ?fluxo=&inicio=&fim=&pontos=&metodo=&no=
+    Intervalos longos da frota vêm dos agregados do nivel5, no nível escolhido pelo intervalo.
+    """
     try:
-        with open(CSV_STATS_PATH, 'r', encoding='utf-8') as f:
-            header_str, last_line_str = f.readline(), deque(f, 1)[0]
-        header, last_line_data = next(csv.reader(io.StringIO(header_str))), next(csv.reader(io.StringIO(last_line_str)))
-        latest_stats_raw = dict(zip(header, last_line_data))
-        for key, value in latest_stats_raw.items():
-            try: response_data[key] = float(value)
-            except (ValueError, TypeError): response_data[key] = value
-    except (FileNotFoundError, IndexError): pass
-    except Exception as e: response_data['error_csv'] = str(e)
+        fluxo = request.args.get('fluxo', 'aplicacao')
+        fim = _instante_ms(request.args.get('fim'))
+        if fim is None: fim = int(datetime.now().timestamp() * 1000)
+        inicio = _instante_ms(request.args.get('inicio'))
+        if inicio is None: inicio = fim - 24 * 3600 * 1000
+        if inicio > fim: raise ValueError("inicio deve ser anterior a fim.")
+        pontos = min(max(request.args.get('pontos', 1000, type=int), 3), 10000)
+        metodo = request.args.get('metodo', 'minmax')
+        no_filtro = request.args.get('no', type=int)
+        if metodo not in ('minmax', 'lttb'): raise ValueError("metodo deve ser 'minmax' ou 'lttb'.")
+        config = configuracao.obter()
+        arquivo = historico.arquivo_fluxo(config, fluxo)
+
+        def produzir():
+            serie = historico.consultar(config, fluxo, inicio, fim, pontos, metodo, no_filtro)
+            resposta = {'fluxo': fluxo, 'inicio': inicio, 'fim': fim,
+                        'metodo': 'minmax' if serie['agregado'] else metodo,
+                        'agregado': serie['agregado'], 'amostras_no_intervalo': serie['amostras'],
+                        'timestamps': serie['timestamps'], 'valores': serie['valores']}
+            if 'nivel' in serie:
+                # Nível de agregação escolhido pelo intervalo: 'valores' são as médias dos baldes
+                resposta.update(metodo='agregados', nivel=serie['nivel'], resolucao_ms=serie['resolucao_ms'],
+                                minimos=serie['minimos'], maximos=serie['maximos'], contagens=serie['contagens'])
+            if serie.get('interpolacao'):
+                # Amostras brutas comprimidas no gateway: como ligar os pontos ('degrau' ou 'linear')
+                resposta['interpolacao'] = serie['interpolacao']
+            if serie.get('ignoradas'):
+                # Partições que não puderam ser lidas (corrompidas ou removidas durante a consulta)
+                resposta['particoes_ignoradas'] = serie['ignoradas']
+            return resposta
+        # A resposta em cache vale enquanto o arquivo consultado e os agregados do fluxo não mudam
+        return responder_json(('historico', fluxo, inicio, fim, pontos, metodo, no_filtro),
+                              (assinatura_arquivo(arquivo), historico.versao_agregados(config, fluxo)), produzir)
+    except FileNotFoundError: return jsonify(timestamps=[], valores=[], error="Arquivo não encontrado"), 200
+    except ValueError as e: return jsonify(timestamps=[], valores=[], error=str(e)), 400
+    except historico.ERROS_LEITURA as e: return jsonify(timestamps=[], valores=[], error=f"Falha ao ler o histórico: {e}"), 500
+
+def _instante_ms(valor):
+    """Epoch em ms ou data ISO (ex.: 2025-01-31T12:00:00) para epoch em ms."""
+    if not valor: return None
+    try: return int(float(valor))
+    except ValueError: return int(datetime.fromisoformat(valor).timestamp() * 1000)
 
-    return jsonify(response_data)
+@app.route('/api/cache')
+def get_cache_data():
+    return jsonify(respostas=cache_respostas.contadores(), amostras=len(cache_telemetria.amostras),
+                   versao=cache_telemetria.versao, clientes_stream=difusor.clientes)
+
+@app.route('/metrics')
+def get_metricas():
+    try:
+        cache_telemetria.atualizar()
+    except FileNotFoundError:
+        pass
+    idade = cache_telemetria.idade_mais_recente()
+    if idade is not None:
+        IDADE_AMOSTRA.definir(idade)
+    diretorio = caminhos_dados(configuracao.obter())['dir']
+    retratos = [metricas.retrato(metricas.processo or 'nivel6')] + ler_publicadas(diretorio)
+    return Response(formatar_prometheus(retratos), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/perfil', methods=['GET', 'POST'])
+def perfil_sob_demanda():
+    """
+    POST ?processo=nivel3|nivel5|nivel6|todos pede um perfil sob demanda; GET
+    lista os arquivos de perfil mais recentes.
+    """
+    config = configuracao.obter()
+    diretorio = caminhos_dados(config)['perfis']
+    if request.method == 'POST':
+        processo = request.args.get('processo', 'todos')
+        if processo not in PROCESSOS_PERFIL + ('todos',):
+            return jsonify(error=f"processo deve ser um de {', '.join(PROCESSOS_PERFIL)} ou 'todos'."), 400
+        pedidos = []
+        for alvo in (PROCESSOS_PERFIL if processo == 'todos' else (processo,)):
+            # No modo unificado os três níveis são este processo
+            if alvo == 'nivel6' or perfilador.processo == 'unificado':
+                perfilador.sob_demanda()
+                alvo = perfilador.processo
+            else:
+                pedir_perfil(config, alvo)
+            pedidos.append(alvo)
+        return jsonify(pedidos=sorted(set(pedidos)), diretorio=diretorio), 202
+    try:
+        nomes = sorted(os.listdir(diretorio), key=lambda nome: os.path.getmtime(os.path.join(diretorio, nome)),
+                       reverse=True)
+    except FileNotFoundError:
+        nomes = []
+    arquivos = [{'nome': nome, 'bytes': os.path.getsize(os.path.join(diretorio, nome))}
+                for nome in nomes if not nome.startswith('pedido_')][:50]
+    return jsonify(diretorio=diretorio, arquivos=arquivos)
 
 @app.route('/api/estado_planta')
 def get_estado_planta():
     try:
         luminosidade_atual = float(request.args.get('luminosidade', "0"))
-        if luminosidade_atual >= limiar_atencao_secreto: estado = 'feliz'
-        elif luminosidade_atual >= limiar_critico_secreto: estado = 'neutra'
-        else: estado = 'triste'
-        return jsonify({'estado_planta': estado})
+        return jsonify({'estado_planta': calcular_estado_planta(luminosidade_atual)})
     except (ValueError, TypeError): return jsonify({'estado_planta': 'neutra'})
 
+def criar_servidor(host='0.0.0.0', porta=5000):
+    """Servidor WSGI com uma thread por requisição, para rodar em uma thread do init.py (serve_forever/shutdown)."""
+    from werkzeug.serving import make_server
+    return make_server(host, porta, app, threaded=True)
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
+    app.run(host='0.0.0.0', port=5000, debug=False, threaded=True)
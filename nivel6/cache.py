@@ -0,0 +1,187 @@
+# nivel6/cache.py - Cache em memória compartilhado pelas APIs do dashboard
+#
+# CacheTelemetria mantém as amostras recentes de luminosidade já convertidas,
+# alimentadas por um seguidor do arquivo bruto (posição + inode, tratando
+# rotação e truncamento): cada atualização lê só os bytes novos, qualquer que
+# seja o tamanho do arquivo. CacheRespostas guarda o corpo pronto de cada
+# resposta junto com a assinatura dos dados que o geraram; enquanto a
+# assinatura não muda, a requisição é servida da memória (e vira 304 quando o
+# navegador envia o mesmo ETag em If-None-Match).
+#
+# Cada amostra incorporada recebe um número de sequência; o cursor devolvido
+# aos clientes é o total já incorporado, e desde(cursor) entrega só as amostras
+# mais novas que ele. Quando o arquivo é trocado ou o cursor já saiu da
+# capacidade do cache, a janela é reenviada inteira (completo=True).
+
+import gzip
+import hashlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+from metricas import obter_metricas
+from telemetria import caminhos_dados, criar_seguidor, formato, FORMATO_BINARIO
+from compacto import NIVEL_GZIP
+
+CAPACIDADE_AMOSTRAS = 1000
+INTERVALO_MINIMO_S = 0.05   # sob carga, no máximo uma verificação do arquivo a cada 50 ms
+LIMITE_ENTRADAS = 512       # respostas distintas guardadas (ex.: um filtro ?no= por nó)
+
+LATENCIA_PONTA_A_PONTA = obter_metricas().histograma(
+    'twsn_latencia_ponta_a_ponta_segundos',
+    'Da recepção da amostra pelo gateway até ela chegar ao cache do dashboard')
+
+
+def assinatura_arquivo(caminho):
+    """(inode, tamanho, mtime) do arquivo, ou None se ele não existe."""
+    try:
+        st = os.stat(caminho)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+    except FileNotFoundError:
+        return None
+
+
+class CacheTelemetria:
+    """Últimas amostras do fluxo 'aplicacao' (timestamp_ms, luminosidade, nó), atualizadas incrementalmente."""
+
+    def __init__(self, obter_config, capacidade=CAPACIDADE_AMOSTRAS):
+        self.obter_config = obter_config
+        self.capacidade = capacidade
+        self.amostras = deque(maxlen=capacidade)
+        self.versao = 0
+        # Cursor dos clientes: começa no relógio (ms) para que os cursores de um
+        # processo anterior do dashboard fiquem para trás e forcem a janela completa
+        self.sequencia = int(time.time() * 1000)
+        self._inicio_sequencia = self.sequencia  # cursores anteriores são de outro arquivo
+        self._seguidor = None
+        self._chave = None
+        self._ultima_verificacao = 0.0
+        self._inicial = True
+        self._lock = threading.Lock()
+
+    def _preparar(self):
+        config = self.obter_config()
+        binario = formato(config) == FORMATO_BINARIO
+        caminho = caminhos_dados(config)['binario' if binario else 'aplicacao']
+        if (binario, caminho) != self._chave:
+            # Formato ou arquivo mudou na configuração: recomeça da cauda do novo arquivo
+            if self._seguidor is not None:
+                self._seguidor.fechar()
+            self._seguidor = criar_seguidor(caminho, 'aplicacao', self.capacidade, binario, self.obter_config)
+            self._chave = (binario, caminho)
+            self._inicial = True
+            self.amostras.clear()
+            self._inicio_sequencia = self.sequencia
+            self.versao += 1
+
+    def atualizar(self):
+        """Incorpora as amostras novas; propaga FileNotFoundError se o arquivo bruto não existe."""
+        agora = time.monotonic()
+        # Uma fila em memória (modo unificado) não custa nada para verificar
+        if agora - self._ultima_verificacao < INTERVALO_MINIMO_S and not getattr(self._seguidor, 'em_memoria', False):
+            return
+        with self._lock:
+            self._ultima_verificacao = agora
+            self._preparar()
+            novas = self._seguidor.novas_amostras()
+            if novas:
+                self.amostras.extend(novas)
+                self.sequencia += len(novas)
+                self.versao += 1
+                # A cauda inicial é histórico, não mede a latência do caminho ao vivo
+                if not self._inicial:
+                    LATENCIA_PONTA_A_PONTA.observar(max(0.0, time.time() - novas[-1][0] / 1000))
+            self._inicial = False
+
+    def idade_mais_recente(self):
+        """Segundos desde o timestamp da amostra mais recente, ou None sem amostras."""
+        with self._lock:
+            if not self.amostras:
+                return None
+            return max(0.0, time.time() - self.amostras[-1][0] / 1000)
+
+    def recentes(self, n, no=None):
+        with self._lock:
+            if no is None:
+                return list(itertools.islice(reversed(self.amostras), n))[::-1]
+            return [a for a in self.amostras if a[2] == no][-n:]
+
+    def desde(self, cursor, n, no=None):
+        """
+        (amostras, cursor, completo): as amostras mais novas que 'cursor' (no
+        máximo n) ou, se o cursor não vale mais, as n recentes com completo=True.
+        """
+        with self._lock:
+            primeiro = self.sequencia - len(self.amostras)
+            if cursor is None or not max(primeiro, self._inicio_sequencia) <= cursor <= self.sequencia:
+                completo = True
+                novas = list(self.amostras)
+            else:
+                # Só as amostras novas são percorridas, a partir do fim do deque
+                completo = False
+                novas = list(itertools.islice(reversed(self.amostras), self.sequencia - cursor))[::-1]
+            if no is not None:
+                novas = [a for a in novas if a[2] == no]
+            if len(novas) > n:
+                # Mais pontos novos que a janela: o cliente troca a janela inteira
+                novas, completo = novas[-n:], True
+            return novas, self.sequencia, completo
+
+
+class CacheRespostas:
+    """Corpos prontos (JSON ou binários) por chave, válidos enquanto a assinatura dos dados não muda."""
+
+    def __init__(self):
+        self._entradas = {}
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.nao_modificados = 0
+
+    def obter(self, chave, assinatura, produzir, codificar=None):
+        """
+        (corpo, etag) da resposta; produzir() só é chamado em caso de falha.
+        codificar(dados) -> bytes substitui o JSON (ex.: séries compactas).
+        """
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[0] == assinatura:
+                self.acertos += 1
+                return entrada[1], entrada[2]
+        corpo = json.dumps(produzir()) if codificar is None else codificar(produzir())
+        etag = hashlib.blake2b(corpo if isinstance(corpo, bytes) else corpo.encode('utf-8'), digest_size=8).hexdigest()
+        with self._lock:
+            self.falhas += 1
+            if len(self._entradas) >= LIMITE_ENTRADAS and chave not in self._entradas:
+                self._entradas.clear()
+            self._entradas[chave] = [assinatura, corpo, etag, None]
+        return corpo, etag
+
+    def comprimido(self, chave, etag, corpo):
+        """Versão gzip do corpo, comprimida uma vez por versão da resposta."""
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[2] == etag and entrada[3] is not None:
+                return entrada[3]
+        dados = gzip.compress(corpo if isinstance(corpo, bytes) else corpo.encode('utf-8'), NIVEL_GZIP, mtime=0)
+        with self._lock:
+            entrada = self._entradas.get(chave)
+            if entrada is not None and entrada[2] == etag:
+                entrada[3] = dados
+        return dados
+
+    def registrar_nao_modificado(self):
+        with self._lock:
+            self.nao_modificados += 1
+
+    def contadores(self):
+        with self._lock:
+            total = self.acertos + self.falhas
+            return {
+                'acertos': self.acertos, 'falhas': self.falhas, 'nao_modificados': self.nao_modificados,
+                'taxa_acerto': round(self.acertos / total, 4) if total else None,
+                'entradas': len(self._entradas),
+            }
@@ -0,0 +1,141 @@
+# nivel6/transmissao.py - Difusão de eventos para os dashboards (Server-Sent Events)
+#
+# Um único produtor (thread) verifica as fontes de dados e, quando algo muda,
+# serializa o evento UMA vez e o entrega a todos os clientes conectados. Cada
+# cliente tem uma fila que guarda apenas o evento mais recente de cada tipo:
+# um navegador lento recebe o estado atual assim que consegue ler, sem acumular
+# atraso nem memória no servidor (os intermediários descartados são contados).
+
+import json
+import threading
+import time
+
+INTERVALO_PRODUTOR_S = 0.2
+INTERVALO_MINIMO_S = 0.02   # avisos de acordar() em rajada viram uma única verificação
+KEEPALIVE_S = 15.0
+
+
+class Assinante:
+    """Fila de um cliente: no máximo um evento pendente por tipo (coalescência)."""
+
+    def __init__(self):
+        self._pendentes = {}
+        self._cond = threading.Condition()
+        self.ativo = True
+        self.descartados = 0
+
+    def entregar(self, evento, texto):
+        with self._cond:
+            if self._pendentes.pop(evento, None) is not None:
+                self.descartados += 1
+            self._pendentes[evento] = texto
+            self._cond.notify()
+
+    def proximos(self, timeout):
+        """Eventos pendentes (em ordem de chegada); lista vazia se o timeout expirar."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._pendentes or not self.ativo, timeout)
+            itens = list(self._pendentes.items())
+            self._pendentes.clear()
+            return itens
+
+    def encerrar(self):
+        with self._cond:
+            self.ativo = False
+            self._cond.notify()
+
+
+class Difusor:
+    """
+    Produtor compartilhado. Cada fonte é registrada com uma função de
+    assinatura (barata, ex.: os.stat do arquivo) e uma função que monta os
+    dados; os dados só são recalculados quando a assinatura muda e só são
+    difundidos quando o JSON resultante muda.
+    """
+
+    def __init__(self, intervalo_s=INTERVALO_PRODUTOR_S):
+        self.intervalo_s = intervalo_s
+        self._fontes = []
+        self._assinaturas = {}
+        self._ultimos = {}
+        self._assinantes = set()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._acordar = threading.Event()
+        self.eventos_enviados = 0
+
+    def registrar_fonte(self, evento, assinatura, produzir):
+        self._fontes.append((evento, assinatura, produzir))
+
+    def assinar(self):
+        assinante = Assinante()
+        with self._lock:
+            self._assinantes.add(assinante)
+            # O cliente novo recebe de imediato o último valor de cada evento
+            for evento, texto in self._ultimos.items():
+                assinante.entregar(evento, texto)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._executar, name='difusor-sse', daemon=True)
+                self._thread.start()
+        return assinante
+
+    def cancelar(self, assinante):
+        assinante.encerrar()
+        with self._lock:
+            self._assinantes.discard(assinante)
+
+    def acordar(self):
+        """Antecipa a próxima verificação (ex.: o gateway acabou de publicar amostras no modo unificado)."""
+        self._acordar.set()
+
+    @property
+    def clientes(self):
+        return len(self._assinantes)
+
+    def _verificar(self):
+        for evento, assinatura, produzir in self._fontes:
+            try:
+                atual = assinatura()
+            except Exception:
+                atual = None
+            if evento in self._assinaturas and self._assinaturas[evento] == atual:
+                continue
+            self._assinaturas[evento] = atual
+            try:
+                texto = json.dumps(produzir())
+            except Exception as e:
+                print(f"Difusor: erro ao produzir o evento '{evento}': {e}")
+                continue
+            if self._ultimos.get(evento) == texto:
+                continue
+            with self._lock:
+                self._ultimos[evento] = texto
+                assinantes = list(self._assinantes)
+            for assinante in assinantes:
+                assinante.entregar(evento, texto)
+            self.eventos_enviados += 1
+
+    def _executar(self):
+        # A thread termina quando não há mais clientes; assinar() a recria
+        while True:
+            with self._lock:
+                if not self._assinantes:
+                    self._thread = None
+                    return
+            self._verificar()
+            self._acordar.wait(self.intervalo_s)
+            time.sleep(INTERVALO_MINIMO_S)
+            self._acordar.clear()
+
+    def fluxo_sse(self, assinante):
+        """Gerador do corpo text/event-stream de um cliente."""
+        try:
+            yield "retry: 3000\n\n"
+            while assinante.ativo:
+                itens = assinante.proximos(KEEPALIVE_S)
+                if not itens:
+                    yield ": keepalive\n\n"
+                    continue
+                yield "".join(f"event: {evento}\ndata: {texto}\n\n" for evento, texto in itens)
+        finally:
+            self.cancelar(assinante)